@@ -3,3 +3,15 @@ from django.apps import AppConfig
 
 class BackofficeConfig(AppConfig):
     name = 'API'
+
+    def ready(self):
+        # Enregistrement des signaux
+        from . import dashboard  # noqa: F401
+        from . import categories  # noqa: F401
+        from . import rollups  # noqa: F401
+        from . import config_cache  # noqa: F401
+        from . import sync_changes  # noqa: F401
+        from . import positions  # noqa: F401
+        from . import assignments  # noqa: F401
+        from . import spatial  # noqa: F401
+        from . import livreur_stats  # noqa: F401
@@ -0,0 +1,98 @@
+"""
+Affectations clients → livreurs du jour (ClientLivreurHebdo).
+
+Pour une entreprise et une date, la carte {client: livreur} et
+{livreur: clients dans l'ordre de passage} est calculée en une requête
+(validité de période filtrée en SQL) et gardée dans le cache Django. Toute
+modification d'une affectation change la version de l'entreprise : les
+cartes précédentes ne sont plus lues.
+
+Utilisé par les ventes mobiles et le routage des commandes pour retrouver
+le livreur d'un client sans requête par vente.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .distribution_models import ClientLivreurHebdo, LivreurDistribution
+
+
+def _timeout():
+    return getattr(settings, 'ASSIGNMENT_CACHE_TIMEOUT', 6 * 3600)
+
+
+def _version_key(company_id):
+    return f'assignments:version:{company_id or "all"}'
+
+
+def _version(company_id):
+    key = _version_key(company_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate(company_id):
+    """Nouvelle version pour l'entreprise (et pour la carte toutes entreprises)"""
+    for key in {_version_key(company_id), _version_key(None)}:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def build_map(company_id, date):
+    """{'client_livreur': {client: livreur}, 'livreur_clients': {livreur: [clients]}}"""
+    configs = ClientLivreurHebdo.objects.filter(
+        ClientLivreurHebdo.validite_q(date), jour_semaine=date.isoweekday(), is_active=True,
+    )
+    if company_id:
+        configs = configs.filter(company_id=company_id)
+    client_livreur, livreur_clients = {}, {}
+    for client_id, livreur_id in configs.order_by(
+            'livreur_id', F('ordre_passage').asc(nulls_last=True), 'id').values_list('client_id', 'livreur_id'):
+        # Une affectation par client et par jour (la première si plusieurs entreprises)
+        if client_id in client_livreur:
+            continue
+        client_livreur[client_id] = livreur_id
+        livreur_clients.setdefault(livreur_id, []).append(client_id)
+    return {'client_livreur': client_livreur, 'livreur_clients': livreur_clients}
+
+
+def assignment_map(company_id=None, date=None):
+    """Carte des affectations du jour (date du jour par défaut), depuis le cache"""
+    date = date or timezone.localdate()
+    key = f'assignments:{company_id or "all"}:{_version(company_id)}:{date.isoformat()}'
+    data = cache.get(key)
+    if data is None:
+        data = build_map(company_id, date)
+        cache.set(key, data, _timeout())
+    return data
+
+
+def livreur_for_client(client, date=None):
+    """
+    Livreur affecté au client pour la date (planning hebdomadaire), à défaut
+    le premier livreur dont le client fait partie des clients assignés.
+    """
+    livreur_id = assignment_map(client.company_id, date)['client_livreur'].get(client.pk)
+    livreurs = LivreurDistribution.objects.select_related('entrepot')
+    if livreur_id is not None:
+        return livreurs.filter(pk=livreur_id).first()
+    return livreurs.filter(clients_assignes=client).first()
+
+
+@receiver(post_save, sender=ClientLivreurHebdo)
+@receiver(post_delete, sender=ClientLivreurHebdo)
+def _assignment_changed(sender, instance, **kwargs):
+    # Tout de suite, puis au commit (une lecture concurrente a pu recharger l'ancienne carte)
+    invalidate(instance.company_id)
+    transaction.on_commit(lambda: invalidate(instance.company_id))
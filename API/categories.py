@@ -0,0 +1,115 @@
+"""
+Hiérarchie des catégories.
+
+Chaque Categorie porte son chemin matérialisé (path "/1/5/12/", depth) et le
+nombre de ses produits actifs directs (nb_produits). Un sous-arbre se lit donc
+en une requête (path__startswith) et les totaux récursifs se calculent en
+mémoire par CategorieIndex, sans requête par nœud.
+
+nb_produits est tenu à jour par les signaux de Produit ci-dessous ; les
+écritures en lot appellent Categorie.recount_products.
+"""
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Categorie, Produit
+from . import previous_state
+
+
+class CategorieIndex:
+    """Catégories chargées une fois, parcourues en mémoire"""
+
+    def __init__(self, categories):
+        self.by_id = {c.pk: c for c in categories}
+        for c in self.by_id.values():
+            # parent déjà chargé : c.parent et get_full_path() sans requête
+            if c.parent_id in self.by_id:
+                c.parent = self.by_id[c.parent_id]
+        self._children = {}
+        for c in sorted(self.by_id.values(), key=lambda c: c.nom):
+            self._children.setdefault(c.parent_id, []).append(c)
+        self._counts = {}
+        self._paths = {}
+
+    @classmethod
+    def for_company(cls, company=None):
+        qs = Categorie.objects.all()
+        if company is not None:
+            qs = qs.filter(company=company)
+        return cls(qs)
+
+    def roots(self):
+        return [c for c in self._children.get(None, []) if c.is_active]
+
+    def children(self, pk, active=True):
+        return [c for c in self._children.get(pk, []) if c.is_active or not active]
+
+    def descendants(self, pk):
+        """Sous-catégories actives (récursif), comme Categorie.get_all_children"""
+        result = []
+        stack = list(reversed(self.children(pk)))
+        while stack:
+            c = stack.pop()
+            result.append(c)
+            stack.extend(reversed(self.children(c.pk)))
+        return result
+
+    def subtree_ids(self, pk):
+        return [pk] + [c.pk for c in self.descendants(pk)]
+
+    def products_count(self, pk):
+        """Produits actifs de la catégorie et de ses sous-catégories actives"""
+        if pk not in self._counts:
+            stack, order = [pk], []
+            while stack:
+                node = stack.pop()
+                order.append(node)
+                stack.extend(c.pk for c in self.children(node) if c.pk not in self._counts)
+            for node in reversed(order):
+                own = self.by_id[node].nb_produits if node in self.by_id else 0
+                self._counts[node] = own + sum(self._counts[c.pk] for c in self.children(node))
+        return self._counts[pk]
+
+    def sous_categories_count(self, pk):
+        return len(self.children(pk))
+
+    def full_path(self, pk):
+        """Noms des ancêtres chargés, lus dans le chemin matérialisé ("A > B > C")"""
+        if pk not in self._paths:
+            c = self.by_id[pk]
+            ids = [int(x) for x in c.path.strip('/').split('/') if x] or [pk]
+            self._paths[pk] = ' > '.join(self.by_id[i].nom for i in ids if i in self.by_id)
+        return self._paths[pk]
+
+    def full_paths(self):
+        return {pk: self.full_path(pk) for pk in self.by_id}
+
+
+def _adjust(categorie_id, delta):
+    if categorie_id and delta:
+        Categorie.objects.filter(pk=categorie_id).update(nb_produits=F('nb_produits') + delta)
+
+
+previous_state.track(Produit, ('categorie_id', 'is_active'))
+
+
+@receiver(post_save, sender=Produit)
+def _track_produit_categorie(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = previous_state.previous(instance, created)
+    old = (previous['categorie_id'], previous['is_active']) if previous else (None, False)
+    new = (instance.categorie_id, instance.is_active)
+    if old == new:
+        return
+    if old[1]:
+        _adjust(old[0], -1)
+    if new[1]:
+        _adjust(new[0], 1)
+
+
+@receiver(post_delete, sender=Produit)
+def _track_produit_delete(sender, instance, **kwargs):
+    if instance.is_active:
+        _adjust(instance.categorie_id, -1)
@@ -0,0 +1,128 @@
+"""
+Cache des données de référence (SystemConfig, devise par défaut, taux de
+change, chemins des catégories).
+
+Deux niveaux :
+- le cache Django (partagé entre les workers gunicorn), clés versionnées ;
+- un dictionnaire local au processus, revalidé contre la version partagée
+  au plus toutes les CONFIG_CACHE_LOCAL_TTL secondes.
+
+Chaque valeur appartient à une portée qui a sa propre version : 'global'
+pour SystemConfig, Currency et ExchangeRate (tables sans entreprise), l'id
+de l'entreprise pour ses catégories ('all' pour la carte toutes entreprises).
+Un post_save/post_delete incrémente la version de la portée concernée (tout
+de suite et au commit) : les anciennes clés ne sont plus lues, et une
+catégorie modifiée dans une entreprise ne vide pas le cache des autres. Les
+valeurs sont retournées en copie (les appelants modifient parfois
+l'instance avant de la sauvegarder).
+"""
+import threading
+import time
+from copy import deepcopy
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import SystemConfig, Currency, ExchangeRate, Categorie
+
+GLOBAL = 'global'
+
+_MISSING = object()
+_lock = threading.Lock()
+_local = {}
+
+
+def _timeout():
+    return getattr(settings, 'CONFIG_CACHE_TIMEOUT', 3600)
+
+
+def _local_ttl():
+    return getattr(settings, 'CONFIG_CACHE_LOCAL_TTL', 5)
+
+
+def company_scope(company_id):
+    """Portée des valeurs propres à une entreprise ('all' : toutes entreprises)"""
+    return str(company_id or 'all')
+
+
+def _version_key(scope):
+    return f'config_cache:version:{scope}'
+
+
+def _local_scope(scope):
+    return _local.setdefault(scope, {'version': None, 'checked': 0.0, 'values': {}})
+
+
+def _version(scope):
+    now = time.monotonic()
+    with _lock:
+        local = _local_scope(scope)
+        if local['version'] is not None and now - local['checked'] < _local_ttl():
+            return local['version']
+    key = _version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        # Clé absente (premier accès ou éviction) : valeur jamais utilisée auparavant
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    with _lock:
+        if version != local['version']:
+            local['values'] = {}
+        local['version'] = version
+        local['checked'] = now
+    return version
+
+
+def get_cached(name, loader, copy=True, scope=GLOBAL):
+    """
+    Valeur de configuration `name`, calculée par loader() en cas d'absence.
+    copy=False pour les valeurs en lecture seule (ex: table des taux).
+    scope : GLOBAL ou company_scope(company_id) pour une donnée d'entreprise.
+    """
+    version = _version(scope)
+    local = _local_scope(scope)
+    value = local['values'].get(name, _MISSING)
+    if value is _MISSING:
+        key = f'config_cache:{scope}:{name}:{version}'
+        value = cache.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            cache.set(key, value, _timeout())
+        with _lock:
+            if local['version'] == version:
+                local['values'][name] = value
+    return deepcopy(value) if copy else value
+
+
+def invalidate(*scopes):
+    """Nouvelle version partagée des portées (GLOBAL par défaut) ; leur cache local est vidé"""
+    for scope in scopes or (GLOBAL,):
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+        with _lock:
+            _local.pop(scope, None)
+
+
+@receiver(post_save, sender=SystemConfig)
+@receiver(post_delete, sender=SystemConfig)
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+@receiver(post_save, sender=Categorie)
+@receiver(post_delete, sender=Categorie)
+def config_changed(sender, instance, **kwargs):
+    if sender is Categorie:
+        scopes = {company_scope(instance.company_id), company_scope(None)}
+    else:
+        scopes = {GLOBAL}
+    # Immédiatement pour ce processus, puis au commit : un autre worker a pu
+    # recharger l'ancienne valeur sous la nouvelle version avant le commit
+    invalidate(*scopes)
+    transaction.on_commit(lambda: invalidate(*scopes))
@@ -0,0 +1,199 @@
+"""
+Compteurs matérialisés du tableau de bord (/API/prod/count/).
+
+Chaque entreprise possède une ligne DashboardSnapshot. Elle est reconstruite
+entièrement au premier accès de la journée, puis tenue à jour par les signaux
+ci-dessous : chaque sauvegarde/suppression calcule la contribution de l'objet
+aux compteurs et applique la différence avec des mises à jour F().
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Sum, F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    DashboardSnapshot, Produit, Client, Fournisseur, Achat, Vente,
+)
+from . import previous_state
+
+
+COUNTER_FIELDS = (
+    'produits_count', 'clients_count', 'fournisseurs_count', 'achats_count',
+    'ventes_count', 'ventes_aujourd_hui', 'ca_total', 'ca_mois',
+    'produits_stock_bas', 'produits_stock_critique', 'produits_rupture',
+)
+
+
+def compute_counters(company, today=None):
+    """Recalcul complet des compteurs d'une entreprise (utilisé pour la reconstruction)"""
+    today = today or timezone.localdate()
+    produits = Produit.objects.filter(company=company)
+    ventes = Vente.objects.filter(company=company, statut='completed')
+    return {
+        'produits_count': produits.filter(is_active=True).count(),
+        'clients_count': Client.objects.filter(company=company).count(),
+        'fournisseurs_count': Fournisseur.objects.filter(company=company).count(),
+        'achats_count': Achat.objects.filter(company=company).count(),
+        'ventes_count': ventes.count(),
+        'ventes_aujourd_hui': ventes.filter(date_vente__date=today).count(),
+        'ca_total': ventes.aggregate(total=Sum('total_ttc'))['total'] or 0,
+        'ca_mois': ventes.filter(
+            date_vente__date__gte=today.replace(day=1)
+        ).aggregate(total=Sum('total_ttc'))['total'] or 0,
+        'produits_stock_bas': produits.filter(quantite__lte=F('seuil_alerte')).count(),
+        'produits_stock_critique': produits.filter(quantite__lte=F('seuil_critique')).count(),
+        'produits_rupture': produits.filter(quantite__lte=0).count(),
+    }
+
+
+def rebuild_snapshot(company):
+    """Reconstruit l'instantané d'une entreprise à partir des tables sources"""
+    today = timezone.localdate()
+    defaults = compute_counters(company, today)
+    defaults['jour_reference'] = today
+    snapshot, _ = DashboardSnapshot.objects.update_or_create(company=company, defaults=defaults)
+    return snapshot
+
+
+def get_snapshot(company):
+    """
+    Retourne l'instantané de l'entreprise.
+    Il est reconstruit s'il n'existe pas encore ou s'il date d'un autre jour
+    (ventes_aujourd_hui et ca_mois dépendent de la date courante).
+    """
+    snapshot = DashboardSnapshot.objects.filter(company=company).first()
+    if snapshot is None or snapshot.jour_reference != timezone.localdate():
+        snapshot = rebuild_snapshot(company)
+    return snapshot
+
+
+def snapshot_to_dict(snapshot):
+    data = {field: getattr(snapshot, field) for field in COUNTER_FIELDS}
+    data['ca_total'] = float(data['ca_total'])
+    data['ca_mois'] = float(data['ca_mois'])
+    return data
+
+
+def apply_delta(company_id, delta):
+    """
+    Applique une variation de compteurs à l'instantané du jour.
+    Un instantané absent ou périmé n'est pas modifié : il sera reconstruit
+    à la prochaine lecture.
+    """
+    updates = {field: F(field) + value for field, value in delta.items() if value}
+    if not company_id or not updates:
+        return
+    DashboardSnapshot.objects.filter(
+        company_id=company_id, jour_reference=timezone.localdate()
+    ).update(**updates)
+
+
+def apply_stock_changes(changes):
+    """
+    Répercute des changements de quantite faits par UPDATE (sans signal, ex: StockLedger).
+    changes: couples (état précédent du produit, nouvelle quantite) ; l'état
+    contient company_id, quantite, seuils et is_active.
+    Une seule mise à jour de l'instantané par entreprise.
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    for values, new_quantite in changes:
+        after = dict(values, quantite=new_quantite)
+        for key, value in _diff(_produit_contribution(after), _produit_contribution(values)).items():
+            deltas[values['company_id']][key] += value
+    for company_id, delta in deltas.items():
+        apply_delta(company_id, delta)
+
+
+def _diff(new, old):
+    keys = set(new) | set(old)
+    return {k: new.get(k, 0) - old.get(k, 0) for k in keys}
+
+
+def _produit_contribution(values):
+    quantite = values['quantite'] or 0
+    return {
+        'produits_count': 1 if values['is_active'] else 0,
+        'produits_stock_bas': 1 if quantite <= values['seuil_alerte'] else 0,
+        'produits_stock_critique': 1 if quantite <= values['seuil_critique'] else 0,
+        'produits_rupture': 1 if quantite <= 0 else 0,
+    }
+
+
+def _vente_contribution(values):
+    if values['statut'] != 'completed':
+        return {}
+    today = timezone.localdate()
+    date_vente = values['date_vente']
+    if date_vente is not None and timezone.is_aware(date_vente):
+        date_vente = timezone.localtime(date_vente)
+    jour = date_vente.date() if date_vente is not None else None
+    total = values['total_ttc'] or Decimal('0')
+    return {
+        'ventes_count': 1,
+        'ca_total': total,
+        'ca_mois': total if jour and (jour.year, jour.month) == (today.year, today.month) else 0,
+        'ventes_aujourd_hui': 1 if jour == today else 0,
+    }
+
+
+# Modèles dont la contribution dépend de l'état de la ligne
+_TRACKED = {
+    Produit: (('company_id', 'quantite', 'seuil_alerte', 'seuil_critique', 'is_active'), _produit_contribution),
+    Vente: (('company_id', 'statut', 'date_vente', 'total_ttc'), _vente_contribution),
+}
+
+# Modèles simplement comptés
+_COUNTED = {
+    Client: 'clients_count',
+    Fournisseur: 'fournisseurs_count',
+    Achat: 'achats_count',
+}
+
+
+def _instance_values(instance, fields):
+    return {field: getattr(instance, field) for field in fields}
+
+
+for _model, (_fields, _) in _TRACKED.items():
+    previous_state.track(_model, _fields)
+
+
+@receiver(post_save, sender=Produit)
+@receiver(post_save, sender=Vente)
+def _track_state_change(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    fields, contribution = _TRACKED[sender]
+    previous = previous_state.previous(instance, created)
+    current = _instance_values(instance, fields)
+
+    if previous and previous['company_id'] != current['company_id']:
+        apply_delta(previous['company_id'], _diff({}, contribution(previous)))
+        previous = None
+    old = contribution(previous) if previous else {}
+    apply_delta(current['company_id'], _diff(contribution(current), old))
+
+
+@receiver(post_delete, sender=Produit)
+@receiver(post_delete, sender=Vente)
+def _track_state_delete(sender, instance, **kwargs):
+    fields, contribution = _TRACKED[sender]
+    apply_delta(instance.company_id, _diff({}, contribution(_instance_values(instance, fields))))
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=Fournisseur)
+@receiver(post_save, sender=Achat)
+def _track_creation(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        apply_delta(instance.company_id, {_COUNTED[sender]: 1})
+
+
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=Fournisseur)
+@receiver(post_delete, sender=Achat)
+def _track_deletion(sender, instance, **kwargs):
+    apply_delta(instance.company_id, {_COUNTED[sender]: -1})
@@ -153,16 +153,26 @@ class TourneeMobile(models.Model):
         self.save()
 
     def stats(self):
-        """Statistiques de la tournée"""
-        arrets = self.arrets.all()
-        total_arrets = arrets.count()
-        arrets_livres = arrets.filter(statut='livre').count()
-        arrets_echec = arrets.filter(statut='echec').count()
-        arrets_en_attente = arrets.filter(statut='en_attente').count()
-
-        ca_total = sum(
-            vente.montant_total for vente in self.ventes.all()
-        )
+        """
+        Statistiques de la tournée ; lues depuis les annotations de
+        tournee_stats_queryset (distribution_serializers) si présentes
+        """
+        if hasattr(self, 'stats_total_arrets'):
+            total_arrets = self.stats_total_arrets
+            arrets_livres = self.stats_arrets_livres
+            arrets_echec = self.stats_arrets_echec
+            arrets_en_attente = self.stats_arrets_en_attente
+            ca_total = self.stats_ca_total or 0
+        else:
+            arrets = self.arrets.all()
+            total_arrets = arrets.count()
+            arrets_livres = arrets.filter(statut='livre').count()
+            arrets_echec = arrets.filter(statut='echec').count()
+            arrets_en_attente = arrets.filter(statut='en_attente').count()
+
+            ca_total = sum(
+                vente.montant_total for vente in self.ventes.all()
+            )
 
         return {
             'total_arrets': total_arrets,
@@ -268,6 +278,8 @@ class VenteTourneeMobile(models.Model):
     # Synchronisation
     est_synchronise = models.BooleanField('Synchronisé', default=False)
     date_synchronisation = models.DateTimeField('Date synchronisation', null=True, blank=True)
+    # Identifiant généré par l'app : un push rejoué ne recrée pas la vente
+    app_id = models.CharField(max_length=200, unique=True, null=True, blank=True)
 
     # Notes
     notes = models.TextField('Notes', blank=True)
@@ -286,6 +298,7 @@ class VenteTourneeMobile(models.Model):
         verbose_name = 'Vente tournée'
         verbose_name_plural = 'Ventes tournées'
         ordering = ['-date_vente']
+        indexes = [models.Index(fields=['-date_vente', '-id'], name='ventetournee_date_id_idx')]
 
     def __str__(self):
         return f"{self.numero_vente} - {self.client.nom} - {self.montant_total}€"
@@ -515,6 +528,7 @@ class SyncLogMobile(models.Model):
         verbose_name = 'Log de synchronisation'
         verbose_name_plural = 'Logs de synchronisation'
         ordering = ['-date_sync']
+        indexes = [models.Index(fields=['livreur', '-date_sync', '-id'], name='synclog_livreur_date_id_idx')]
 
     def __str__(self):
         return f"{self.type_sync} - {self.livreur.nom} - {self.statut} - {self.date_sync}"
@@ -586,35 +600,20 @@ class CommandeClient(models.Model):
         return f"Commande {self.reference} - {self.client} ({self.statut})"
 
     def save(self, *args, **kwargs):
-        # Générer la référence si elle n'existe pas
+        # Générer la référence si elle n'existe pas (dans la transaction de l'enregistrement)
         if not self.reference:
-            self.reference = self.generer_reference()
+            from django.db import transaction
+            with transaction.atomic():
+                self.reference = self.generer_reference()
+                super().save(*args, **kwargs)
+            return
 
         super().save(*args, **kwargs)
 
     def generer_reference(self):
-        """Génère une référence unique pour la commande"""
-        from django.db.models import Max
-        import re
-
-        date_str = self.date_commande.strftime('%Y%m%d') if self.date_commande else timezone.now().strftime('%Y%m%d')
-        prefix = f"CMD-{date_str}-"
-
-        # Trouver le dernier numéro du jour
-        last_cmd = CommandeClient.objects.filter(
-            reference__startswith=prefix
-        ).aggregate(Max('reference'))['reference__max']
-
-        if last_cmd:
-            match = re.search(r'-(\d+)$', last_cmd)
-            if match:
-                counter = int(match.group(1)) + 1
-            else:
-                counter = 1
-        else:
-            counter = 1
-
-        return f"{prefix}{counter:04d}"
+        """Génère une référence unique pour la commande (compteur du jour)"""
+        from .numbering import next_numero
+        return next_numero('commande', date=self.date_commande)
 
     def calculer_totaux(self):
         """Recalcule les montants totaux à partir des lignes"""
@@ -782,11 +781,14 @@ class PlanningHebdomadaire(models.Model):
             # Retourner la tournée existante sans la modifier
             return existing
 
+        from .numbering import next_numero
+
         # Créer une nouvelle tournée
         tournee = TourneeMobile.objects.create(
             company=self.company,
             livreur=self.livreur,
             date_tournee=date,
+            numero_tournee=next_numero('tournee_mobile', date=date),
             statut='planifiee',
             code_prix=self.code_prix,
             notes=f"Générée depuis planning hebdomadaire: {self}"
@@ -806,40 +808,105 @@ class PlanningHebdomadaire(models.Model):
         return tournee
 
     @classmethod
-    def generer_tournees_pour_semaine(cls, date_debut_semaine, company=None):
+    def generer_tournees_pour_semaine(cls, date_debut_semaine, company=None, optimiser=False):
         """
-        Génère toutes les tournées planifiées pour une semaine donnée.
+        Génère toutes les tournées planifiées pour une semaine donnée, avec
+        leurs arrêts (ClientLivreurHebdo du jour, dans l'ordre de passage).
+
+        Plannings, affectations clients et tournées existantes sont lus en
+        une requête chacun ; tournées et arrêts sont créés par bulk_create.
 
         Args:
             date_debut_semaine: Date du lundi de la semaine à générer
             company: Company optionnelle pour filtrer
+            optimiser: Réordonner les arrêts selon les coordonnées clients (API.routing)
 
         Returns:
-            Liste des tournées créées
+            Liste des tournées créées (attribut nb_arrets renseigné) ; les
+            tournées déjà existantes ne sont ni recréées ni retournées
         """
+        from collections import defaultdict
         from datetime import timedelta
-
-        tournees_creees = []
-
-        # Récupérer tous les plannings actifs
-        plannings = cls.objects.filter(is_active=True)
+        from django.db import transaction
+        from .numbering import next_numeros
+        from .sync_changes import record_many
+        from .livreur_stats import invalidate_companies as invalidate_stats
+
+        # Date de chaque jour de la semaine (1=Lundi, 7=Dimanche)
+        semaine = [date_debut_semaine + timedelta(days=offset) for offset in range(7)]
+        dates = {date.isoweekday(): date for date in semaine}
+        date_fin_semaine = date_debut_semaine + timedelta(days=6)
+
+        plannings = cls.objects.filter(is_active=True).select_related('livreur')
+        configs = ClientLivreurHebdo.objects.filter(is_active=True).order_by('ordre_passage', 'id')
         if company:
             plannings = plannings.filter(company=company)
+            configs = configs.filter(company=company)
 
-        # Pour chaque jour de la semaine (0-6 pour lundi-dimanche)
-        for jour_offset in range(7):
-            date = date_debut_semaine + timedelta(days=jour_offset)
-            jour_semaine = date.isoweekday()  # 1=Lundi, 7=Dimanche
+        # Un planning valide par (livreur, date)
+        a_generer = {}
+        for planning in plannings:
+            date = dates[planning.jour_semaine]
+            if planning.est_valide_pour_date(date):
+                a_generer.setdefault((planning.livreur_id, date), planning)
+        if not a_generer:
+            return []
+
+        # Tournées déjà présentes (unicité livreur × date, toutes entreprises)
+        existantes = set(TourneeMobile.objects.filter(
+            livreur_id__in={livreur_id for livreur_id, _ in a_generer},
+            date_tournee__gte=date_debut_semaine, date_tournee__lte=date_fin_semaine,
+        ).values_list('livreur_id', 'date_tournee'))
+        a_generer = {key: planning for key, planning in a_generer.items() if key not in existantes}
+
+        clients = defaultdict(list)
+        for config in configs.filter(livreur_id__in={livreur_id for livreur_id, _ in a_generer}):
+            date = dates[config.jour_semaine]
+            if config.est_valide_pour_date(date):
+                clients[(config.livreur_id, date)].append(config.client_id)
+
+        par_date = defaultdict(list)
+        for livreur_id, date in sorted(a_generer, key=lambda key: (key[1], a_generer[key].livreur.nom)):
+            par_date[date].append((livreur_id, date))
+
+        with transaction.atomic():
+            tournees = []
+            for date, keys in sorted(par_date.items()):
+                # Numéros réservés en un incrément de compteur par jour
+                for key, numero in zip(keys, next_numeros('tournee_mobile', len(keys), date=date)):
+                    planning = a_generer[key]
+                    tournees.append(TourneeMobile(
+                        company_id=planning.company_id,
+                        livreur=planning.livreur,
+                        date_tournee=date,
+                        numero_tournee=numero,
+                        statut='planifiee',
+                        code_prix_id=planning.code_prix_id,
+                        notes=f"Générée depuis planning hebdomadaire: {planning}",
+                    ))
+            TourneeMobile.objects.bulk_create(tournees)
+
+            arrets = []
+            for tournee in tournees:
+                clients_tournee = clients[(tournee.livreur_id, tournee.date_tournee)]
+                tournee.nb_arrets = len(clients_tournee)
+                arrets.extend(
+                    ArretTourneeMobile(company_id=tournee.company_id, tournee=tournee, client_id=client_id,
+                                       ordre_passage=idx, statut='en_attente')
+                    for idx, client_id in enumerate(clients_tournee, start=1)
+                )
+            ArretTourneeMobile.objects.bulk_create(arrets)
 
-            # Trouver les plannings pour ce jour
-            plannings_jour = plannings.filter(jour_semaine=jour_semaine)
+            # bulk_create n'émet pas de signal : journal de synchronisation
+            record_many('tournee', [(t.pk, t.company_id, t.livreur_id) for t in tournees])
+            record_many('arret', [(a.pk, a.company_id, a.tournee.livreur_id) for a in arrets])
+            invalidate_stats(t.company_id for t in tournees)
 
-            for planning in plannings_jour:
-                tournee = planning.generer_tournee_pour_date(date)
-                if tournee:
-                    tournees_creees.append(tournee)
+            if optimiser and arrets:
+                from .routing import optimiser_tournees
+                optimiser_tournees(tournees)
 
-        return tournees_creees
+        return tournees
 
 
 class ClientLivreurHebdo(models.Model):
@@ -905,6 +972,8 @@ class ClientLivreurHebdo(models.Model):
             models.Index(fields=['livreur', 'jour_semaine', 'is_active']),
             models.Index(fields=['client', 'jour_semaine']),
             models.Index(fields=['company', 'is_active']),
+            models.Index(fields=['company', 'livreur', 'jour_semaine', 'is_active']),
+            models.Index(fields=['company', 'jour_semaine', 'is_active']),
         ]
 
     def __str__(self):
@@ -933,6 +1002,14 @@ class ClientLivreurHebdo(models.Model):
 
         return True
 
+    @staticmethod
+    def validite_q(date):
+        """Filtre SQL équivalent à est_valide_pour_date (hors jour de la semaine)"""
+        return (
+            (models.Q(date_debut__isnull=True) | models.Q(date_debut__lte=date))
+            & (models.Q(date_fin__isnull=True) | models.Q(date_fin__gte=date))
+        )
+
     @classmethod
     def get_clients_for_livreur(cls, livreur, jour_semaine, company=None, date=None):
         """
@@ -958,12 +1035,12 @@ class ClientLivreurHebdo(models.Model):
 
         # Filtrer par date si fournie
         if date:
-            configs = [c for c in configs if c.est_valide_pour_date(date)]
+            configs = configs.filter(cls.validite_q(date))
 
         return configs
 
     @classmethod
-    def get_livreur_for_client(cls, client, jour_semaine, company=None):
+    def get_livreur_for_client(cls, client, jour_semaine, company=None, date=None):
         """
         Récupère le livreur assigné à un client pour un jour donné.
 
@@ -971,6 +1048,7 @@ class ClientLivreurHebdo(models.Model):
             client: Instance de Client
             jour_semaine: Numéro du jour (1-7)
             company: Company optionnelle pour filtrer
+            date: Date optionnelle pour vérifier la validité
 
         Returns:
             Instance de LivreurDistribution ou None
@@ -979,10 +1057,85 @@ class ClientLivreurHebdo(models.Model):
             client=client,
             jour_semaine=jour_semaine,
             is_active=True
-        )
+        ).select_related('livreur')
 
         if company:
             config = config.filter(company=company)
+        if date:
+            config = config.filter(cls.validite_q(date))
 
         config = config.first()
         return config.livreur if config else None
+
+
+#####################
+# Positions GPS     #
+#####################
+
+class PositionLivreur(models.Model):
+    """
+    Historique des positions GPS d'un livreur (ajout seul, écrit en lot par
+    API.positions). Les anciennes traces sont sous-échantillonnées.
+    """
+    livreur = models.ForeignKey(LivreurDistribution, on_delete=models.CASCADE, related_name='positions')
+    company = models.ForeignKey('Company', on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='positions_livreurs')
+    lat = models.DecimalField('Latitude', max_digits=10, decimal_places=7)
+    lng = models.DecimalField('Longitude', max_digits=10, decimal_places=7)
+    horodatage = models.DateTimeField('Horodatage (appareil)')
+    precision_m = models.FloatField('Précision (m)', null=True, blank=True)
+    vitesse_kmh = models.FloatField('Vitesse (km/h)', null=True, blank=True)
+    # Point déjà passé par downsample_positions (les suivants ne relisent pas sa tranche)
+    sous_echantillonne = models.BooleanField('Sous-échantillonné', default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Position livreur'
+        verbose_name_plural = 'Positions livreurs'
+        ordering = ['-horodatage']
+        indexes = [
+            models.Index(fields=['livreur', 'horodatage'], name='position_livreur_date_idx'),
+            models.Index(fields=['horodatage'], condition=models.Q(sous_echantillonne=False),
+                         name='position_a_echantillonner_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.livreur_id} @ {self.horodatage}: {self.lat}, {self.lng}"
+
+
+##############################
+# Journal des changements    #
+##############################
+
+class SyncChange(models.Model):
+    """
+    Changement d'un objet synchronisé vers le mobile.
+    Ajouté sans séquence par l'écriture, numéroté après commit par
+    API.sync_changes.assign_sequences : `sequence` (compteur par entreprise)
+    sert de jeton de synchronisation, un mobile demande les lignes de séquence
+    supérieure à son jeton. La numérotation ne garde que la dernière ligne de
+    chaque objet par livreur (deleted=True pour une suppression ou une
+    tournée réaffectée à un autre livreur).
+    """
+    company = models.ForeignKey('Company', on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='sync_changes')
+    # Renseigné pour les objets propres à un livreur (tournées, arrêts)
+    livreur = models.ForeignKey(LivreurDistribution, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='sync_changes')
+    kind = models.CharField('Type d\'objet', max_length=20)
+    object_id = models.PositiveBigIntegerField()
+    deleted = models.BooleanField(default=False)
+    # NULL : en attente de numérotation
+    sequence = models.PositiveBigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Changement à synchroniser'
+        verbose_name_plural = 'Changements à synchroniser'
+        indexes = [
+            models.Index(fields=['company', 'sequence'], name='sync_change_company_seq_idx'),
+            models.Index(fields=['kind', 'object_id'], name='sync_change_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.sequence} {self.kind} {self.object_id}{' (supprimé)' if self.deleted else ''}"
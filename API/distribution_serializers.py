@@ -3,7 +3,7 @@ Serializers pour l'API de distribution mobile
 """
 from rest_framework import serializers
 from django.utils import timezone
-from django.db import models
+from django.db import models, transaction
 from .distribution_models import (
     LivreurDistribution, TourneeMobile, ArretTourneeMobile, VenteTourneeMobile,
     LigneVenteTourneeMobile, RapportCaisseMobile, DepenseTourneeMobile, SyncLogMobile,
@@ -40,6 +40,9 @@ class ProduitMobileSerializer(serializers.ModelSerializer):
         Calcule le stock total depuis ProductStock (somme de tous les entrepôts non-van).
         Exclut les vans pour avoir le stock disponible en entrepôt principal.
         """
+        if hasattr(obj, 'stock_entrepots'):
+            # Annoté par produit_mobile_queryset
+            return obj.stock_entrepots
         from .models import ProductStock
         # Calculer le stock total depuis ProductStock (entrepôts principaux uniquement, pas les vans)
         total_stock = ProductStock.objects.filter(
@@ -51,6 +54,44 @@ class ProduitMobileSerializer(serializers.ModelSerializer):
         return total_stock or 0
 
 
+def entrepots_stock_filter():
+    """ProductStock comptés dans le stock mobile : entrepôts actifs hors vans"""
+    return models.Q(warehouse__is_active=True) & ~models.Q(warehouse__code__icontains='van')
+
+
+def produit_mobile_queryset(queryset):
+    """
+    Prépare un queryset pour ProduitMobileSerializer : catégorie jointe et
+    stock hors vans en sous-requête (aucune requête par produit).
+    """
+    from django.db.models import OuterRef, Subquery
+    from django.db.models.functions import Coalesce
+    from .models import ProductStock
+    stock = ProductStock.objects.filter(entrepots_stock_filter(), produit=OuterRef('pk')).order_by().values(
+        'produit').annotate(total=models.Sum('quantity')).values('total')
+    return queryset.select_related('categorie').annotate(stock_entrepots=Coalesce(Subquery(stock), 0))
+
+
+def tournee_stats_queryset(queryset):
+    """
+    Prépare un queryset pour TourneeSerializer : compteurs d'arrêts par statut
+    et CA annotés, arrêts (avec client) et rapport de caisse chargés en lot.
+    Le nombre de requêtes ne dépend pas du nombre de tournées.
+    """
+    from django.db.models import Count, OuterRef, Prefetch, Q, Subquery
+    ca = VenteTourneeMobile.objects.filter(tournee=OuterRef('pk')).order_by().values(
+        'tournee').annotate(total=models.Sum('montant_total')).values('total')
+    return queryset.select_related('livreur', 'code_prix', 'rapport_caisse').prefetch_related(
+        Prefetch('arrets', queryset=ArretTourneeMobile.objects.select_related('client')),
+    ).annotate(
+        stats_total_arrets=Count('arrets'),
+        stats_arrets_livres=Count('arrets', filter=Q(arrets__statut='livre')),
+        stats_arrets_echec=Count('arrets', filter=Q(arrets__statut='echec')),
+        stats_arrets_en_attente=Count('arrets', filter=Q(arrets__statut='en_attente')),
+        stats_ca_total=Subquery(ca),
+    )
+
+
 class ClientMobileSerializer(serializers.ModelSerializer):
     """
     Serializer pour les clients - optimisé pour l'application mobile
@@ -302,14 +343,20 @@ class VenteMobileCreateSerializer(serializers.Serializer):
     lignes_vente = LigneVenteMobileSerializer(many=True)
 
     def create(self, validated_data):
-        from API.models import ProductStock, Client as ClientModel
-        from .distribution_models import LivreurDistribution
+        from API.models import Client as ClientModel
+        from .stock_ledger import StockLedger
 
         lignes_data = validated_data.pop('lignes_vente')
         client_id = validated_data.pop('client')
         mode_paiement = validated_data.pop('mode_paiement')
         montant_total = validated_data.pop('montant_total')
-        app_id = validated_data.pop('app_id', None)
+        app_id = validated_data.pop('app_id', None) or None
+
+        # Vente déjà reçue (envoi rejoué par l'app) : ne pas la recréer
+        if app_id:
+            existing = VenteTourneeMobile.objects.filter(app_id=app_id).first()
+            if existing is not None:
+                return existing
 
         # Récupérer le client
         try:
@@ -317,8 +364,9 @@ class VenteMobileCreateSerializer(serializers.Serializer):
         except ClientModel.DoesNotExist:
             raise serializers.ValidationError({'client': 'Client introuvable'})
 
-        # Trouver le livreur assigné à ce client
-        livreur = LivreurDistribution.objects.filter(clients_assignes=client).first()
+        # Trouver le livreur assigné à ce client (carte des affectations du jour, en cache)
+        from .assignments import livreur_for_client
+        livreur = livreur_for_client(client)
 
         # Mapper mode_paiement vers type_paiement
         type_paiement_map = {
@@ -331,48 +379,45 @@ class VenteMobileCreateSerializer(serializers.Serializer):
         import uuid
         numero_vente = f"VM-{timezone.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}"
 
-        # Créer la vente
-        vente = VenteTourneeMobile.objects.create(
-            client=client,
-            numero_vente=numero_vente,
-            montant_total=montant_total,
-            type_paiement=type_paiement_map.get(mode_paiement, 'especes'),
-            date_vente=timezone.now(),
-            est_synchronise=True,
-            date_synchronisation=timezone.now()
-        )
-
-        # Créer les lignes et décrémenter le stock
-        for ligne_data in lignes_data:
-            produit_id = ligne_data['produit']
-            quantite = ligne_data['quantite']
-            prix_unitaire = ligne_data['prix_unitaire']
-
-            try:
-                produit = Produit.objects.get(id=produit_id)
-            except Produit.DoesNotExist:
-                continue
-
-            # Créer la ligne de vente
-            LigneVenteTourneeMobile.objects.create(
-                vente=vente,
-                produit=produit,
-                quantite=quantite,
-                prix_unitaire=prix_unitaire,
-                montant_ttc=quantite * prix_unitaire
+        # Produits chargés en une requête ; les lignes inconnues sont ignorées
+        produits = Produit.objects.in_bulk({ligne['produit'] for ligne in lignes_data})
+        van = livreur.entrepot if livreur and livreur.entrepot else None
+        ledger = StockLedger(clamp=True, refresh=None)
+
+        with transaction.atomic():
+            # Créer la vente
+            vente = VenteTourneeMobile.objects.create(
+                client=client,
+                numero_vente=numero_vente,
+                montant_total=montant_total,
+                type_paiement=type_paiement_map.get(mode_paiement, 'especes'),
+                date_vente=timezone.now(),
+                app_id=app_id,
+                est_synchronise=True,
+                date_synchronisation=timezone.now()
             )
 
-            # Décrémenter le stock du van du livreur
-            if livreur and livreur.entrepot:
-                try:
-                    stock = ProductStock.objects.get(
-                        warehouse=livreur.entrepot,
-                        produit=produit
-                    )
-                    stock.quantity = max(0, stock.quantity - quantite)
-                    stock.save()
-                except ProductStock.DoesNotExist:
-                    pass
+            # Créer les lignes
+            for ligne_data in lignes_data:
+                produit = produits.get(ligne_data['produit'])
+                if produit is None:
+                    continue
+                quantite = ligne_data['quantite']
+                prix_unitaire = ligne_data['prix_unitaire']
+
+                LigneVenteTourneeMobile.objects.create(
+                    vente=vente,
+                    produit=produit,
+                    quantite=quantite,
+                    prix_unitaire=prix_unitaire,
+                    montant_ttc=quantite * prix_unitaire
+                )
+                # Sortie du stock du van du livreur
+                if van is not None:
+                    ledger.add(produit, van, -quantite, 'VENTE', numero_vente, f"Vente mobile {numero_vente}")
+
+            # Le stock du van ne descend pas sous zéro ; Produit.quantite n'est pas modifié
+            ledger.apply()
 
         return vente
 
@@ -408,8 +453,10 @@ class TourneeSerializer(serializers.ModelSerializer):
 
         stats = obj.stats()
 
-        # Ajouter détails des arrêts par statut
-        arrets = obj.arrets.all().select_related('client')
+        # Ajouter détails des arrêts par statut (préchargés par tournee_stats_queryset)
+        arrets = obj.arrets.all()
+        if 'arrets' not in getattr(obj, '_prefetched_objects_cache', {}):
+            arrets = arrets.select_related('client')
         arrets_visites = []
         arrets_restants = []
 
@@ -549,6 +596,28 @@ class SyncDeltaSerializer(serializers.Serializer):
     app_version = serializers.CharField(max_length=20, required=False)
 
 
+class SyncChangesSerializer(serializers.Serializer):
+    """Pull v2 : changements depuis le jeton du mobile"""
+    livreur_id = serializers.IntegerField(required=True)
+    token = serializers.IntegerField(required=False, default=0, min_value=0)
+    page_size = serializers.IntegerField(required=False, min_value=1)
+    device_id = serializers.CharField(max_length=100, required=False)
+    app_version = serializers.CharField(max_length=20, required=False)
+
+
+class TourneeChangeSerializer(TourneeSyncSerializer):
+    """Tournée sans ses arrêts (transmis séparément par le pull v2)"""
+    arrets = None
+
+    class Meta(TourneeSyncSerializer.Meta):
+        fields = [f for f in TourneeSyncSerializer.Meta.fields if f != 'arrets'] + ['est_cloturee']
+
+
+class ArretChangeSerializer(ArretTourneeSyncSerializer):
+    class Meta(ArretTourneeSyncSerializer.Meta):
+        fields = ['tournee'] + ArretTourneeSyncSerializer.Meta.fields
+
+
 class SyncResponseSerializer(serializers.Serializer):
     """Serializer pour la réponse de synchronisation"""
     timestamp = serializers.DateTimeField()
@@ -558,6 +627,50 @@ class SyncResponseSerializer(serializers.Serializer):
     message = serializers.CharField()
 
 
+class LignePushSerializer(serializers.Serializer):
+    produit = serializers.IntegerField()
+    quantite = serializers.DecimalField(max_digits=10, decimal_places=2)
+    prix_unitaire = serializers.DecimalField(max_digits=10, decimal_places=2)
+    taux_tva = serializers.DecimalField(max_digits=5, decimal_places=2, required=False, default=20)
+
+
+class VentePushSerializer(serializers.Serializer):
+    """
+    Vente poussée par le mobile : format de VenteTourneeCreateSerializer, mais
+    les références sont de simples ids résolus en lot par API.mobile_push
+    (pas de requête par vente à la validation).
+    """
+    app_id = serializers.CharField(max_length=200, required=False, allow_blank=True, allow_null=True)
+    tournee = serializers.IntegerField(required=False, allow_null=True)
+    arret = serializers.IntegerField(required=False, allow_null=True)
+    client = serializers.IntegerField()
+    numero_vente = serializers.CharField(max_length=50, required=False, allow_blank=True)
+    date_vente = serializers.DateTimeField(required=False)
+    montant_ht = serializers.DecimalField(max_digits=12, decimal_places=2, required=False, default=0)
+    montant_tva = serializers.DecimalField(max_digits=12, decimal_places=2, required=False, default=0)
+    montant_total = serializers.DecimalField(max_digits=12, decimal_places=2, required=False, default=0)
+    type_paiement = serializers.ChoiceField(choices=VenteTourneeMobile.TYPE_PAIEMENT_CHOICES)
+    montant_paye = serializers.DecimalField(max_digits=12, decimal_places=2, required=False, default=0)
+    montant_rendu = serializers.DecimalField(max_digits=12, decimal_places=2, required=False, default=0)
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+    lignes = LignePushSerializer(many=True)
+
+
+class ArretPushSerializer(serializers.ModelSerializer):
+    """Mise à jour d'arrêt poussée par le mobile (id obligatoire, autres champs facultatifs)"""
+    id = serializers.IntegerField()
+
+    class Meta:
+        model = ArretTourneeMobile
+        fields = [
+            'id', 'statut', 'heure_arrivee', 'heure_depart',
+            'latitude', 'longitude',
+            'signature_base64', 'nom_receptionnaire',
+            'motif_echec', 'notes_echec', 'notes'
+        ]
+        extra_kwargs = {f: {'required': False} for f in fields if f != 'id'}
+
+
 class MobileSyncPushSerializer(serializers.Serializer):
     """Serializer pour push de données depuis mobile vers serveur"""
     livreur_id = serializers.IntegerField()
@@ -565,8 +678,8 @@ class MobileSyncPushSerializer(serializers.Serializer):
     app_version = serializers.CharField(max_length=20, required=False)
 
     # Données à synchroniser
-    ventes = VenteTourneeCreateSerializer(many=True, required=False)
-    arrets_updates = ArretTourneeSyncSerializer(many=True, required=False)
+    ventes = VentePushSerializer(many=True, required=False)
+    arrets_updates = ArretPushSerializer(many=True, required=False)
     tournee_updates = serializers.DictField(required=False)
     depenses = DepenseTourneeSerializer(many=True, required=False)
 
@@ -660,8 +773,9 @@ class CommandeClientCreateSerializer(serializers.ModelSerializer):
 
         # Auto-assigner le livreur depuis le client si non fourni
         if not validated_data.get('livreur') and client:
-            # Trouver le livreur assigné à ce client
-            livreur = LivreurDistribution.objects.filter(clients_assignes=client).first()
+            # Livreur affecté au client le jour de livraison souhaité
+            from .assignments import livreur_for_client
+            livreur = livreur_for_client(client, validated_data.get('date_livraison_souhaitee'))
             if livreur:
                 validated_data['livreur'] = livreur
 
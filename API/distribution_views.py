@@ -23,17 +23,19 @@ from .distribution_models import (
 )
 from .distribution_serializers import (
     LivreurSerializer, LivreurDetailSerializer,
-    TourneeSerializer, TourneeSyncSerializer,
+    TourneeSerializer, TourneeSyncSerializer, tournee_stats_queryset,
     ArretTourneeSerializer, ArretTourneeSyncSerializer,
     VenteTourneeSerializer, VenteTourneeCreateSerializer,
     RapportCaisseSerializer, DepenseTourneeSerializer,
     SyncLogSerializer,
-    SyncDeltaSerializer, SyncResponseSerializer, MobileSyncPushSerializer,
+    SyncDeltaSerializer, SyncChangesSerializer, TourneeChangeSerializer, ArretChangeSerializer,
+    ProduitMobileSerializer, ClientMobileSerializer, produit_mobile_queryset, SyncResponseSerializer, MobileSyncPushSerializer,
     CommandeClientSerializer, CommandeClientCreateSerializer, LigneCommandeClientSerializer,
     PlanningHebdomadaireSerializer, PlanningHebdomadaireCreateSerializer,
     ClientLivreurHebdoSerializer, ClientLivreurHebdoCreateSerializer
     # BonLivraisonVanSerializer, BonLivraisonVanCreateSerializer, BonLivraisonVanMobileSerializer  # TODO: Serializers not yet created
 )
+from .pagination import OptInKeysetPagination
 
 User = get_user_model()
 
@@ -148,7 +150,7 @@ class LivreurViewSet(viewsets.ModelViewSet):
         if date_fin:
             tournees = tournees.filter(date_tournee__lte=date_fin)
 
-        serializer = TourneeSerializer(tournees, many=True)
+        serializer = TourneeSerializer(tournee_stats_queryset(tournees), many=True)
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'])
@@ -212,13 +214,15 @@ class LivreurViewSet(viewsets.ModelViewSet):
         """
         # Récupérer le livreur du user connecté
         try:
-            livreur = LivreurDistribution.objects.get(user=request.user)
+            livreur = LivreurDistribution.objects.select_related('user__profile').get(user=request.user)
         except LivreurDistribution.DoesNotExist:
             return Response(
                 {'error': 'Aucun livreur associé à cet utilisateur'},
                 status=status.HTTP_404_NOT_FOUND
             )
 
+        from .positions import ingest_points
+
         lat = request.data.get('lat')
         lng = request.data.get('lng')
 
@@ -228,31 +232,73 @@ class LivreurViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            # Arrondir à 7 décimales
-            lat = round(float(lat), 7)
-            lng = round(float(lng), 7)
+        # Point unique : même chemin que l'envoi par lot (historique + cache de la carte)
+        result = ingest_points(livreur, [{'lat': lat, 'lng': lng}])
+        if not result['accepted']:
+            return Response(
+                {'error': f'Coordonnées GPS invalides: {lat}, {lng}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-            # Mettre à jour la position
-            livreur.current_lat = lat
-            livreur.current_lng = lng
-            livreur.last_location_update = timezone.now()
-            livreur.save(update_fields=['current_lat', 'current_lng', 'last_location_update'])
+        return Response({
+            'success': True,
+            'livreur_id': livreur.id,
+            'livreur_nom': livreur.nom,
+            'lat': result['last']['lat'],
+            'lng': result['last']['lng'],
+            'last_update': result['last']['last_update']
+        })
 
-            return Response({
-                'success': True,
-                'livreur_id': livreur.id,
-                'livreur_nom': livreur.nom,
-                'lat': float(livreur.current_lat),
-                'lng': float(livreur.current_lng),
-                'last_update': livreur.last_location_update
-            })
-        except (ValueError, TypeError) as e:
+    @action(detail=False, methods=['post'], url_path='positions')
+    def positions(self, request):
+        """
+        Envoi par lot des positions GPS du livreur connecté
+        POST /API/distribution/livreurs/positions/
+        Body: { "points": [{"lat": 36.75, "lng": 3.05, "timestamp": "2025-01-07T10:00:00Z",
+                            "precision": 5, "vitesse": 30}, ...] }
+        """
+        from .positions import ingest_points, max_points
+
+        livreur = LivreurDistribution.objects.select_related('user__profile').filter(user=request.user).first()
+        if livreur is None:
             return Response(
-                {'error': f'Coordonnées GPS invalides: {str(e)}'},
-                status=status.HTTP_400_BAD_REQUEST
+                {'error': 'Aucun livreur associé à cet utilisateur'},
+                status=status.HTTP_404_NOT_FOUND
             )
 
+        points = request.data.get('points')
+        if not isinstance(points, list) or not points:
+            return Response({'error': 'Le champ points (liste) est requis'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(points) > max_points():
+            return Response({'error': f'Au plus {max_points()} points par envoi'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(ingest_points(livreur, points))
+
+    @action(detail=True, methods=['get'])
+    def trace(self, request, pk=None):
+        """
+        Trace GPS d'un livreur pour une journée (?date=YYYY-MM-DD, aujourd'hui par défaut)
+        Réponse compacte : points [lat, lng, horodatage]
+        """
+        from .distribution_models import PositionLivreur
+
+        livreur = self.get_object()
+        date_str = request.query_params.get('date')
+        try:
+            jour = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else timezone.localdate()
+        except ValueError:
+            return Response({'error': 'Format de date invalide. Utilisez YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+
+        debut = timezone.make_aware(datetime.combine(jour, datetime.min.time()))
+        points = PositionLivreur.objects.filter(
+            livreur=livreur, horodatage__gte=debut, horodatage__lt=debut + timedelta(days=1)
+        ).order_by('horodatage').values_list('lat', 'lng', 'horodatage')
+        return Response({
+            'livreur_id': livreur.id,
+            'date': jour,
+            'points': [[float(lat), float(lng), horodatage] for lat, lng, horodatage in points],
+        })
+
     @action(detail=True, methods=['post'])
     def assigner_clients(self, request, pk=None):
         """Assigner des clients à un livreur"""
@@ -575,7 +621,8 @@ class TourneeViewSet(viewsets.ModelViewSet):
         if statut:
             queryset = queryset.filter(statut=statut)
 
-        return queryset.select_related('livreur').prefetch_related('arrets', 'arrets__client')
+        # Statistiques annotées et relations chargées en lot (nombre de requêtes constant)
+        return tournee_stats_queryset(queryset)
 
     @action(detail=True, methods=['post'])
     def cloturer(self, request, pk=None):
@@ -639,6 +686,26 @@ class TourneeViewSet(viewsets.ModelViewSet):
             'tournee': TourneeSerializer(tournee).data
         })
 
+    @action(detail=True, methods=['post'])
+    def optimiser(self, request, pk=None):
+        """Réordonner les arrêts restants selon les coordonnées des clients"""
+        from .routing import optimiser_tournee
+
+        tournee = self.get_object()
+
+        if tournee.est_cloturee or tournee.statut in ['terminee', 'cloturee']:
+            return Response(
+                {'error': 'Impossible de réordonner une tournée terminée ou clôturée'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        resultat = optimiser_tournee(tournee)
+        return Response({
+            'message': 'Ordre de passage optimisé',
+            'tournee': tournee.pk,
+            **resultat,
+        })
+
 
 class ArretTourneeViewSet(viewsets.ModelViewSet):
     """ViewSet pour la gestion des arrêts"""
@@ -711,6 +778,9 @@ class VenteTourneeViewSet(viewsets.ModelViewSet):
     queryset = VenteTourneeMobile.objects.all()
     serializer_class = VenteTourneeSerializer
     permission_classes = [AllowAny]  # TODO: Ajouter authentification en production
+    # Liste simple pour l'app mobile ; ?page_size= / ?cursor= pour paginer sur (date_vente, id)
+    pagination_class = OptInKeysetPagination
+    cursor_field = 'date_vente'
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -1065,16 +1135,24 @@ class PlanningHebdomadaireViewSet(viewsets.ModelViewSet):
 
         # Générer les tournées
         company = self.request.company if hasattr(self.request, 'company') else None
-        tournees_creees = PlanningHebdomadaire.generer_tournees_pour_semaine(date_debut, company)
-
-        # Sérialiser les tournées créées
-        from .distribution_serializers import TourneeSerializer
-        serializer = TourneeSerializer(tournees_creees, many=True)
+        optimiser = str(request.data.get('optimiser', '')).lower() in ('1', 'true', 'oui')
+        tournees_creees = PlanningHebdomadaire.generer_tournees_pour_semaine(date_debut, company, optimiser=optimiser)
 
+        # Résumé léger (pas de sérialisation complète des tournées)
         return Response({
             'message': f'{len(tournees_creees)} tournée(s) générée(s) pour la semaine du {date_debut}',
             'date_debut': date_debut,
-            'tournees': serializer.data
+            'nb_tournees': len(tournees_creees),
+            'nb_arrets': sum(t.nb_arrets for t in tournees_creees),
+            'tournees': [{
+                'id': t.id,
+                'numero_tournee': t.numero_tournee,
+                'livreur': t.livreur_id,
+                'livreur_nom': t.livreur.nom,
+                'date_tournee': t.date_tournee,
+                'statut': t.statut,
+                'nb_arrets': t.nb_arrets,
+            } for t in tournees_creees],
         })
 
     @action(detail=True, methods=['post'])
@@ -1306,11 +1384,17 @@ class ClientLivreurHebdoViewSet(viewsets.ModelViewSet):
 
         company = request.user.company if hasattr(request.user, 'company') else None
 
+        from . import assignments
+
         assignations = self.get_queryset().filter(id__in=assignations_ids)
         count = assignations.count()
+        company_ids = set(assignations.order_by().values_list('company_id', flat=True))
 
         # Désactiver au lieu de supprimer
-        assignations.update(is_active=False, updated_by=request.user)
+        assignations.update(is_active=False, updated_at=timezone.now())
+        # update() n'émet pas de signal : cartes d'affectation (API.assignments) à recalculer
+        for company_id in company_ids:
+            assignments.invalidate(company_id)
 
         return Response({
             'message': f'{count} assignation(s) désactivée(s)',
@@ -1347,15 +1431,18 @@ class SyncViewSet(viewsets.ViewSet):
         if not derniere_sync:
             tournees = tournees.exclude(est_cloturee=True)
 
-        tournees = tournees.prefetch_related('arrets', 'arrets__client')
+        # Évalué une seule fois : les compteurs viennent des arrêts préchargés
+        tournees = list(tournees.prefetch_related('arrets', 'arrets__client'))
+        nb_tournees = len(tournees)
+        nb_arrets = sum(len(t.arrets.all()) for t in tournees)
 
         # Log de sync
         sync_log = SyncLogMobile.objects.create(
             livreur=livreur,
             type_sync='pull',
             statut='succes',
-            nb_tournees=tournees.count(),
-            nb_arrets=sum(t.arrets.count() for t in tournees),
+            nb_tournees=nb_tournees,
+            nb_arrets=nb_arrets,
             device_id=serializer.validated_data.get('device_id', ''),
             app_version=serializer.validated_data.get('app_version', '')
         )
@@ -1363,62 +1450,100 @@ class SyncViewSet(viewsets.ViewSet):
         response_data = {
             'timestamp': timezone.now(),
             'tournees': TourneeSyncSerializer(tournees, many=True).data,
-            'nb_tournees': tournees.count(),
-            'nb_arrets': sum(t.arrets.count() for t in tournees),
-            'message': f'Synchronisation réussie: {tournees.count()} tournée(s)'
+            'nb_tournees': nb_tournees,
+            'nb_arrets': nb_arrets,
+            'message': f'Synchronisation réussie: {nb_tournees} tournée(s)'
         }
 
         return Response(response_data)
 
+    @action(detail=False, methods=['get', 'post'])
+    def changes(self, request):
+        """
+        Pull v2 : objets modifiés ou supprimés depuis le jeton du mobile, par pages.
+        Le mobile renvoie le `token` reçu jusqu'à ce que `has_more` soit faux.
+        """
+        from .models import Client, Produit, PrixProduit
+        from .serializers import PrixProduitSerializer
+        from .pagination import parse_page_size
+        from .sync_changes import changes_since
+
+        # Type de changement -> (clé de réponse, queryset, serializer)
+        change_types = {
+            'tournee': ('tournees', TourneeMobile.objects.all(), TourneeChangeSerializer),
+            'arret': ('arrets', ArretTourneeMobile.objects.all(), ArretChangeSerializer),
+            'client': ('clients', Client.objects.all(), ClientMobileSerializer),
+            'produit': ('produits', produit_mobile_queryset(Produit.objects.all()), ProduitMobileSerializer),
+            'prix': ('prix', PrixProduit.objects.select_related('code_prix', 'type_prix', 'produit', 'currency'),
+                     PrixProduitSerializer),
+        }
+
+        data = request.data if request.method == 'POST' else request.query_params
+        serializer = SyncChangesSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        livreur = get_object_or_404(LivreurDistribution.objects.select_related('user__profile'), id=params['livreur_id'])
+        company = getattr(request, 'company', None)
+        if company is None:
+            profile = getattr(livreur.user, 'profile', None) if livreur.user_id else None
+            company = profile.company if profile else None
+
+        upserts, deleted, token, has_more = changes_since(
+            getattr(company, 'pk', None), livreur.pk, params['token'], parse_page_size(params.get('page_size')))
+
+        changes = {}
+        for kind, (key, queryset, serializer_class) in change_types.items():
+            ids = upserts.get(kind)
+            rows = queryset.filter(pk__in=ids).order_by('pk') if ids else []
+            changes[key] = serializer_class(rows, many=True).data
+        deleted = {change_types[kind][0]: ids for kind, ids in deleted.items()}
+
+        if not has_more:
+            SyncLogMobile.objects.create(
+                livreur=livreur,
+                type_sync='pull',
+                statut='succes',
+                nb_tournees=len(changes['tournees']),
+                nb_arrets=len(changes['arrets']),
+                message=f'Synchronisation v2 jusqu\'au jeton {token}',
+                device_id=params.get('device_id', ''),
+                app_version=params.get('app_version', '')
+            )
+
+        return Response({
+            'token': token,
+            'has_more': has_more,
+            'changes': changes,
+            'deleted': deleted,
+        })
+
     @action(detail=False, methods=['post'])
     def push(self, request):
-        """Push: Envoyer les données vers le serveur (Mobile -> Serveur)"""
+        """
+        Push: Envoyer les données vers le serveur (Mobile -> Serveur).
+        Intégré en lot par API.mobile_push ; rejouer un push ne recrée pas les
+        ventes déjà reçues (app_id). Résultat par élément dans `results`.
+        """
+        from .mobile_push import ingest_push
+
         serializer = MobileSyncPushSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
         livreur_id = serializer.validated_data['livreur_id']
-        livreur = get_object_or_404(LivreurDistribution, id=livreur_id)
-
-        nb_ventes = 0
-        nb_arrets = 0
-        errors = []
+        livreur = get_object_or_404(LivreurDistribution.objects.select_related('entrepot'), id=livreur_id)
 
         with transaction.atomic():
-            # Synchroniser les ventes
-            ventes_data = serializer.validated_data.get('ventes', [])
-            for vente_data in ventes_data:
-                vente_serializer = VenteTourneeCreateSerializer(data=vente_data)
-                if vente_serializer.is_valid():
-                    vente = vente_serializer.save()
-                    vente.est_synchronise = True
-                    vente.date_synchronisation = timezone.now()
-                    vente.save()
-                    nb_ventes += 1
-                else:
-                    errors.append({
-                        'type': 'vente',
-                        'data': vente_data,
-                        'errors': vente_serializer.errors
-                    })
-
-            # Synchroniser les mises à jour d'arrêts
-            arrets_updates = serializer.validated_data.get('arrets_updates', [])
-            for arret_data in arrets_updates:
-                arret_id = arret_data.get('id')
-                if arret_id:
-                    try:
-                        arret = ArretTourneeMobile.objects.get(id=arret_id)
-                        if not arret.tournee.est_cloturee:
-                            for field, value in arret_data.items():
-                                if field != 'id':
-                                    setattr(arret, field, value)
-                            arret.save()
-                            nb_arrets += 1
-                    except ArretTournee.DoesNotExist:
-                        errors.append({
-                            'type': 'arret',
-                            'error': f'Arrêt {arret_id} introuvable'
-                        })
+            results = ingest_push(
+                livreur,
+                serializer.validated_data.get('ventes', []),
+                serializer.validated_data.get('arrets_updates', []),
+                company=getattr(request, 'company', None),
+            )
+            nb_ventes = sum(1 for r in results['ventes'] if r['status'] == 'created')
+            nb_arrets = sum(1 for r in results['arrets'] if r['status'] == 'updated')
+            errors = [{'type': key[:-1], **r} for key in ('ventes', 'arrets') for r in results[key]
+                      if r['status'] == 'error']
 
             # Log de sync
             sync_log = SyncLogMobile.objects.create(
@@ -1438,6 +1563,7 @@ class SyncViewSet(viewsets.ViewSet):
             'nb_ventes': nb_ventes,
             'nb_arrets': nb_arrets,
             'errors': errors,
+            'results': results,
             'message': f'Synchronisation réussie: {nb_ventes} vente(s), {nb_arrets} arrêt(s)'
         })
 
@@ -1452,7 +1578,14 @@ class SyncViewSet(viewsets.ViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        logs = SyncLogMobile.objects.filter(livreur_id=livreur_id).order_by('-date_sync')[:50]
+        logs = SyncLogMobile.objects.filter(livreur_id=livreur_id)
+        paginator = OptInKeysetPagination()
+        paginator.cursor_field = 'date_sync'
+        page = paginator.paginate_queryset(logs, request)
+        if page is not None:
+            return paginator.get_paginated_response(SyncLogSerializer(page, many=True).data)
+
+        logs = logs.order_by('-date_sync')[:50]
         serializer = SyncLogSerializer(logs, many=True)
         return Response(serializer.data)
 
@@ -1479,8 +1612,8 @@ class ProduitMobileViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated]
     pagination_class = None  # Pas de pagination pour l'app mobile
 
-    def get_queryset(self):
-        """Filtre par company de l'utilisateur"""
+    def catalogue_queryset(self):
+        """Produits du catalogue, filtrés par company de l'utilisateur"""
         queryset = super().get_queryset()
 
         # Filtrer par company (utiliser request.company du middleware)
@@ -1489,15 +1622,54 @@ class ProduitMobileViewSet(viewsets.ReadOnlyModelViewSet):
 
         return queryset
 
+    def get_queryset(self):
+        # Stock hors vans annoté : une seule requête pour tout le catalogue
+        return produit_mobile_queryset(self.catalogue_queryset())
+
+    # Colonnes dont dépend la réponse (ProduitMobileSerializer), stock annoté compris
+    ETAG_FIELDS = ('id', 'reference', 'code_barre', 'designation', 'description', 'categorie', 'categorie__nom',
+                   'prixU', 'unite_mesure', 'stock_entrepots', 'quantite', 'is_active', 'updated_at')
+
+    def catalogue_etag(self, catalogue, shape):
+        """
+        ETag fort du catalogue : empreinte des valeurs servies, lues en une
+        requête sans instancier les produits. Toute écriture qui change la
+        réponse change l'ETag, y compris les .update() du StockLedger et le
+        renommage d'une catégorie.
+        """
+        import hashlib
+        company = getattr(getattr(self.request, 'company', None), 'pk', None)
+        digest = hashlib.sha1(repr((company, shape)).encode())
+        for row in produit_mobile_queryset(catalogue).order_by('id').values_list(*self.ETAG_FIELDS).iterator():
+            digest.update(repr(row).encode())
+        return '"%s"' % digest.hexdigest()
+
+    def list(self, request, *args, **kwargs):
+        """
+        Catalogue complet. Réponse 304 si l'ETag envoyé (If-None-Match) est à jour.
+        ?shape=columns : format compact {fields: [...], rows: [[...], ...]}.
+        """
+        shape = request.query_params.get('shape', 'objects')
+        catalogue = self.catalogue_queryset()
+        etag = self.catalogue_etag(catalogue, shape)
+        if_none_match = request.headers.get('If-None-Match', '')
+        if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        serializer = self.get_serializer(produit_mobile_queryset(catalogue), many=True)
+        data = serializer.data
+        if shape == 'columns':
+            fields = list(serializer.child.fields)
+            data = {'fields': fields, 'rows': [[row[f] for f in fields] for row in data]}
+        # no-cache : le client garde sa copie mais la revalide à chaque fois
+        return Response(data, headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+
 
 ############################
 # Statistiques Livreurs    #
 ############################
 
 from rest_framework.views import APIView
-from django.db.models import Sum, Count, Q, F
-from django.db.models.functions import TruncDate
-from collections import defaultdict
 
 
 class StatsLivreursAPIView(APIView):
@@ -1529,185 +1701,19 @@ class StatsLivreursAPIView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Récupérer la company de l'utilisateur
-        company = None
-        if hasattr(request.user, 'company') and request.user.company:
-            company = request.user.company
-
-        # Filtrer les tournées
-        tournees_qs = TourneeMobile.objects.filter(
-            date_tournee__gte=date_debut,
-            date_tournee__lte=date_fin
-        )
-
-        if company:
-            tournees_qs = tournees_qs.filter(company=company)
-
-        if livreur_id:
-            tournees_qs = tournees_qs.filter(livreur_id=livreur_id)
-
-        # Filtrer les ventes
-        ventes_qs = VenteTourneeMobile.objects.filter(
-            date_vente__date__gte=date_debut,
-            date_vente__date__lte=date_fin
-        )
-
-        if company:
-            ventes_qs = ventes_qs.filter(company=company)
-
-        if livreur_id:
-            ventes_qs = ventes_qs.filter(tournee__livreur_id=livreur_id)
-
-        # Filtrer les arrêts
-        arrets_qs = ArretTourneeMobile.objects.filter(
-            tournee__date_tournee__gte=date_debut,
-            tournee__date_tournee__lte=date_fin
-        )
-
-        if company:
-            arrets_qs = arrets_qs.filter(company=company)
-
-        if livreur_id:
-            arrets_qs = arrets_qs.filter(tournee__livreur_id=livreur_id)
-
-        # ========================================
-        # RÉSUMÉ GLOBAL
-        # ========================================
-        summary = {
-            'total_clients': arrets_qs.filter(statut='livre').values('client').distinct().count(),
-            'total_tournees': tournees_qs.count(),
-            'total_especes': float(ventes_qs.filter(type_paiement='especes').aggregate(
-                total=Sum('montant_total'))['total'] or 0),
-            'total_cheques': float(ventes_qs.filter(type_paiement='cheque').aggregate(
-                total=Sum('montant_total'))['total'] or 0),
-            'total_credits': float(ventes_qs.filter(type_paiement='credit').aggregate(
-                total=Sum('montant_total'))['total'] or 0),
-            'total_ventes': float(ventes_qs.aggregate(total=Sum('montant_total'))['total'] or 0),
-        }
-
-        # ========================================
-        # STATISTIQUES PAR LIVREUR
-        # ========================================
-        livreurs_stats = []
-
-        # Récupérer tous les livreurs concernés
-        livreurs_ids = tournees_qs.values_list('livreur_id', flat=True).distinct()
-        livreurs = LivreurDistribution.objects.filter(id__in=livreurs_ids)
-
-        for livreur in livreurs:
-            # Tournées du livreur
-            tournees_livreur = tournees_qs.filter(livreur=livreur)
-
-            # Ventes du livreur
-            ventes_livreur = ventes_qs.filter(tournee__livreur=livreur)
+        if livreur_id and not str(livreur_id).isdigit():
+            return Response({'error': 'livreur_id invalide'}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Arrêts du livreur
-            arrets_livreur = arrets_qs.filter(tournee__livreur=livreur)
-
-            # Calculer les stats
-            especes = float(ventes_livreur.filter(type_paiement='especes').aggregate(
-                total=Sum('montant_total'))['total'] or 0)
-            cheques = float(ventes_livreur.filter(type_paiement='cheque').aggregate(
-                total=Sum('montant_total'))['total'] or 0)
-            credits = float(ventes_livreur.filter(type_paiement='credit').aggregate(
-                total=Sum('montant_total'))['total'] or 0)
-
-            total_arrets = arrets_livreur.count()
-            arrets_livres = arrets_livreur.filter(statut='livre').count()
-            arrets_echec = arrets_livreur.filter(statut='echec').count()
-
-            livreurs_stats.append({
-                'id': livreur.id,
-                'nom': livreur.nom,
-                'matricule': livreur.matricule,
-                'tournees': tournees_livreur.count(),
-                'clients_visites': arrets_livreur.filter(statut='livre').values('client').distinct().count(),
-                'total_arrets': total_arrets,
-                'arrets_livres': arrets_livres,
-                'arrets_echec': arrets_echec,
-                'especes': especes,
-                'cheques': cheques,
-                'credits': credits,
-                'total': especes + cheques + credits,
-            })
-
-        # Trier par total décroissant
-        livreurs_stats.sort(key=lambda x: x['total'], reverse=True)
-
-        # ========================================
-        # STATISTIQUES PAR JOUR
-        # ========================================
-        par_jour = []
-
-        # Regrouper les ventes par jour
-        ventes_par_jour = ventes_qs.annotate(
-            jour=TruncDate('date_vente')
-        ).values('jour').annotate(
-            total=Sum('montant_total'),
-            especes=Sum('montant_total', filter=Q(type_paiement='especes')),
-            cheques=Sum('montant_total', filter=Q(type_paiement='cheque')),
-            credits=Sum('montant_total', filter=Q(type_paiement='credit')),
-            nb_ventes=Count('id')
-        ).order_by('jour')
-
-        # Pour chaque jour, récupérer les stats par livreur
-        jours_data = {}
-        for v in ventes_par_jour:
-            jour = v['jour']
-            if jour not in jours_data:
-                jours_data[jour] = {
-                    'date': jour,
-                    'date_label': jour.strftime('%d/%m'),
-                    'jour_semaine': ['Lun', 'Mar', 'Mer', 'Jeu', 'Ven', 'Sam', 'Dim'][jour.weekday()],
-                    'total': float(v['total'] or 0),
-                    'especes': float(v['especes'] or 0),
-                    'cheques': float(v['cheques'] or 0),
-                    'credits': float(v['credits'] or 0),
-                    'nb_ventes': v['nb_ventes'],
-                    'livreurs': []
-                }
-
-        # Ajouter les stats par livreur pour chaque jour
-        for jour, data in jours_data.items():
-            jour_ventes = ventes_qs.filter(date_vente__date=jour)
-            jour_arrets = arrets_qs.filter(tournee__date_tournee=jour)
-
-            livreurs_jour_ids = jour_ventes.values_list('tournee__livreur_id', flat=True).distinct()
-
-            for lid in livreurs_jour_ids:
-                try:
-                    liv = LivreurDistribution.objects.get(id=lid)
-                    liv_ventes = jour_ventes.filter(tournee__livreur_id=lid)
-                    liv_arrets = jour_arrets.filter(tournee__livreur_id=lid)
-
-                    data['livreurs'].append({
-                        'id': liv.id,
-                        'nom': liv.nom,
-                        'clients': liv_arrets.values('client').distinct().count(),
-                        'livres': liv_arrets.filter(statut='livre').count(),
-                        'echecs': liv_arrets.filter(statut='echec').count(),
-                        'especes': float(liv_ventes.filter(type_paiement='especes').aggregate(
-                            total=Sum('montant_total'))['total'] or 0),
-                        'cheques': float(liv_ventes.filter(type_paiement='cheque').aggregate(
-                            total=Sum('montant_total'))['total'] or 0),
-                        'credits': float(liv_ventes.filter(type_paiement='credit').aggregate(
-                            total=Sum('montant_total'))['total'] or 0),
-                        'total': float(liv_ventes.aggregate(total=Sum('montant_total'))['total'] or 0),
-                    })
-                except LivreurDistribution.DoesNotExist:
-                    pass
+        from .livreur_stats import cached_stats
 
-        # Convertir en liste triée par date
-        par_jour = sorted(jours_data.values(), key=lambda x: x['date'])
+        # Entreprise courante (middleware), à défaut celle de l'utilisateur
+        company = getattr(request, 'company', None) or getattr(request.user, 'company', None)
 
-        # Convertir les dates en string pour JSON
-        for jour in par_jour:
-            jour['date'] = jour['date'].strftime('%Y-%m-%d')
+        # Requêtes groupées par livreur et par jour, résultat mis en cache par période
+        stats = cached_stats(date_debut, date_fin, getattr(company, 'pk', None), livreur_id)
 
         return Response({
             'date_debut': date_debut_str,
             'date_fin': date_fin_str,
-            'summary': summary,
-            'livreurs': livreurs_stats,
-            'par_jour': par_jour,
+            **stats,
         })
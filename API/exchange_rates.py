@@ -0,0 +1,118 @@
+"""
+Table des taux de change en mémoire.
+
+Tous les taux actifs sont chargés en une requête et rangés par couple de
+devises dans des listes triées par date : le taux applicable à une date est
+trouvé par bisect. La table est mise en cache (API.config_cache) et
+invalidée à chaque enregistrement/suppression d'un ExchangeRate.
+
+Les règles sont celles de ExchangeRate.get_rate : taux direct le plus récent
+à la date, sinon l'inverse du taux réciproque, sinon passage par la devise
+par défaut.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+from decimal import Decimal
+
+from django.utils import timezone
+
+ONE = Decimal('1.0')
+
+
+def _pk(currency):
+    return getattr(currency, 'pk', currency)
+
+
+class RateTable:
+    def __init__(self, rows, default_currency_id=None):
+        """rows: (from_id, to_id, date, rate) triés par date croissante"""
+        pairs = defaultdict(lambda: ([], []))
+        for from_id, to_id, date, rate in rows:
+            dates, rates = pairs[(from_id, to_id)]
+            dates.append(date)
+            rates.append(rate)
+        self.pairs = dict(pairs)
+        self.default_currency_id = default_currency_id
+
+    @classmethod
+    def load(cls):
+        from .models import Currency, ExchangeRate
+        rows = ExchangeRate.objects.filter(is_active=True).order_by('date', 'created_at').values_list(
+            'from_currency_id', 'to_currency_id', 'date', 'rate'
+        )
+        default = Currency.get_default()
+        return cls(rows, default.pk if default else None)
+
+    def _direct(self, from_id, to_id, date):
+        pair = self.pairs.get((from_id, to_id))
+        if pair is None:
+            return None
+        dates, rates = pair
+        i = bisect_right(dates, date)
+        return rates[i - 1] if i else None
+
+    def _simple(self, from_id, to_id, date):
+        rate = self._direct(from_id, to_id, date)
+        if rate is not None:
+            return rate
+        rate = self._direct(to_id, from_id, date)
+        if rate is not None:
+            return ONE / rate
+        return None
+
+    def rate(self, from_currency, to_currency, date=None):
+        """Taux de from_currency vers to_currency (instances ou ids), ou None"""
+        from_id, to_id = _pk(from_currency), _pk(to_currency)
+        if date is None:
+            date = timezone.now().date()
+        if from_id == to_id:
+            return ONE
+
+        rate = self._simple(from_id, to_id, date)
+        if rate is not None:
+            return rate
+
+        default_id = self.default_currency_id
+        if default_id and default_id != from_id and default_id != to_id:
+            rate1 = self._simple(from_id, default_id, date)
+            rate2 = self._simple(default_id, to_id, date)
+            if rate1 and rate2:
+                return rate1 * rate2
+        return None
+
+    def convert_many(self, amounts, from_currencies, to_currency, dates=None):
+        """
+        Convertit une série de montants vers to_currency.
+        from_currencies et dates: une valeur commune ou une séquence de même
+        longueur que amounts. Un montant sans taux donne None.
+        """
+        amounts = list(amounts)
+        n = len(amounts)
+        if not isinstance(from_currencies, (list, tuple)):
+            from_currencies = [from_currencies] * n
+        if not isinstance(dates, (list, tuple)):
+            dates = [dates] * n
+
+        to_id = _pk(to_currency)
+        memo = {}
+        results = []
+        for amount, from_currency, date in zip(amounts, from_currencies, dates):
+            key = (_pk(from_currency), date)
+            if key[0] == to_id:
+                results.append(amount)
+                continue
+            if key not in memo:
+                memo[key] = self.rate(key[0], to_id, date)
+            rate = memo[key]
+            results.append(amount * rate if rate is not None else None)
+        return results
+
+
+def rate_table():
+    """Table courante (partagée, en lecture seule)"""
+    from .config_cache import get_cached
+    return get_cached('exchange_rates', RateTable.load, copy=False)
+
+
+def convert_many(amounts, from_currencies, to_currency, dates=None):
+    return rate_table().convert_many(amounts, from_currencies, to_currency, dates)
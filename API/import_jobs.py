@@ -0,0 +1,228 @@
+"""
+Imports différés par blocs (ImportJob).
+
+Le fichier est lu par blocs (pandas chunksize pour le CSV, openpyxl en lecture
+seule pour le XLSX) ; chaque bloc est importé avec ProductImporter et validé
+dans sa propre transaction avec le point de reprise (last_row) et les
+compteurs. Un job interrompu reprend donc au premier bloc non validé.
+Les erreurs sont ajoutées au fur et à mesure à un fichier CSV téléchargeable.
+"""
+import csv
+import logging
+import os
+from datetime import timedelta
+from itertools import islice
+
+import pandas as pd
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ImportJob
+from .product_import import ProductImporter, IMPORT_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+ERROR_HEADERS = ['ligne', 'message']
+
+
+def import_file_ttl():
+    return timedelta(hours=getattr(settings, 'IMPORT_FILE_TTL_HOURS', 24))
+
+
+def create_import_job(request, uploaded_file, import_type='products'):
+    """Enregistre le fichier envoyé et crée le job en attente"""
+    if not uploaded_file.name.lower().endswith(SUPPORTED_EXTENSIONS):
+        raise ValueError('Format de fichier non supporté')
+    if import_type not in dict(ImportJob.TYPES):
+        raise ValueError('Type d\'import non supporté')
+
+    user = getattr(request, 'user', None)
+    job = ImportJob(
+        company=getattr(request, 'company', None),
+        created_by=user if user is not None and user.is_authenticated else None,
+        import_type=import_type,
+        original_name=uploaded_file.name[:200],
+    )
+    job.source.save(os.path.basename(uploaded_file.name), uploaded_file, save=False)
+    job.save()
+    return job
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def count_rows(job):
+    """Nombre (approximatif pour le CSV) de lignes de données, pour la progression"""
+    name = job.source.name.lower()
+    if name.endswith('.csv'):
+        with job.source.open('rb') as f:
+            return max(0, sum(1 for line in f if line.strip()) - 1)
+    if name.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        with job.source.open('rb') as f:
+            wb = load_workbook(f, read_only=True, data_only=True)
+            max_row = wb.active.max_row
+            wb.close()
+        return max(0, max_row - 1) if max_row else None
+    return None
+
+
+def iter_chunks(job, start_row=0, chunk_size=IMPORT_BATCH_SIZE):
+    """
+    Produit des DataFrames (texte) de chunk_size lignes à partir de start_row.
+    L'index de chaque bloc est la position absolue de la ligne de données,
+    ce qui garde des numéros de ligne exacts après une reprise.
+    """
+    name = job.source.name.lower()
+
+    with job.source.open('rb') as f:
+        if name.endswith('.csv'):
+            # Les blocs déjà validés sont relus sans être importés : skiprows
+            # compterait les lignes physiques (champs multilignes, lignes vides)
+            for chunk in pd.read_csv(f, dtype=str, encoding='utf-8-sig', chunksize=chunk_size):
+                chunk = chunk.iloc[max(0, start_row - int(chunk.index[0])):]
+                if len(chunk):
+                    yield chunk
+
+        elif name.endswith('.xlsx'):
+            from openpyxl import load_workbook
+            wb = load_workbook(f, read_only=True, data_only=True)
+            try:
+                rows = wb.active.iter_rows(values_only=True)
+                headers = [_cell_text(h).strip() for h in next(rows, ())]
+                width = len(headers)
+                rows = (r for r in rows if any(v is not None for v in r))
+                rows = islice(rows, start_row, None)
+                position = start_row
+                while True:
+                    block = [
+                        [_cell_text(v) for v in (tuple(r) + (None,) * width)[:width]]
+                        for r in islice(rows, chunk_size)
+                    ]
+                    if not block:
+                        break
+                    yield pd.DataFrame(block, columns=headers,
+                                       index=pd.RangeIndex(position, position + len(block)))
+                    position += len(block)
+            finally:
+                wb.close()
+
+        else:
+            # .xls : pas de lecture en flux possible, découpage en mémoire
+            df = pd.read_excel(f, dtype=str)
+            for start in range(start_row, len(df), chunk_size):
+                yield df.iloc[start:start + chunk_size]
+
+
+def _prepare_errors_file(job):
+    """Crée le fichier d'erreurs, ou en retire les lignes des blocs non validés (reprise)"""
+    if not job.errors_file:
+        job.errors_file.save(f'{job.pk}_erreurs.csv',
+                             ContentFile('\ufeff' + ';'.join(ERROR_HEADERS) + '\n'), save=False)
+        ImportJob.objects.filter(pk=job.pk).update(errors_file=job.errors_file.name)
+        return
+
+    path = job.errors_file.path
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        kept = [row for row in csv.reader(f, delimiter=';')][1:]
+    kept = [row for row in kept if row and int(row[0]) < job.last_row + 2]
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(ERROR_HEADERS)
+        writer.writerows(kept)
+
+
+def _append_errors(job, errors):
+    if not errors:
+        return
+    with open(job.errors_file.path, 'a', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerows([e['row'], e['message']] for e in errors)
+
+
+def claim_next_import_job():
+    """Réserve le plus ancien job en attente (UPDATE conditionnel sur le statut)"""
+    candidates = ImportJob.objects.filter(statut='pending').order_by('created_at').values_list('id', flat=True)[:10]
+    for job_id in candidates:
+        now = timezone.now()
+        claimed = ImportJob.objects.filter(pk=job_id, statut='pending').update(
+            statut='running', started_at=now, updated_at=now
+        )
+        if claimed:
+            return ImportJob.objects.select_related('company').get(pk=job_id)
+    return None
+
+
+def run_import_job(job, chunk_size=IMPORT_BATCH_SIZE):
+    """Importe le fichier du job à partir de son point de reprise"""
+    importer = ProductImporter(job.company)
+    try:
+        if job.total_rows is None:
+            job.total_rows = count_rows(job)
+            job.save(update_fields=['total_rows', 'updated_at'])
+        _prepare_errors_file(job)
+
+        for chunk in iter_chunks(job, job.last_row, chunk_size):
+            with transaction.atomic():
+                importer.process(chunk)
+                result = importer.drain()
+                # Erreurs écrites avant le commit : une reprise les retire avec le bloc
+                _append_errors(job, result['errors'])
+                job.last_row = int(chunk.index[-1]) + 1
+                job.created_count += result['stats']['created']
+                job.updated_count += result['stats']['updated']
+                job.skipped_count += result['stats']['skipped']
+                job.errors_count += len(result['errors'])
+                job.save(update_fields=['last_row', 'created_count', 'updated_count',
+                                        'skipped_count', 'errors_count', 'updated_at'])
+
+        job.statut = 'done'
+        job.error = ''
+        if job.company is not None and (job.created_count or job.updated_count):
+            from .dashboard import rebuild_snapshot
+            rebuild_snapshot(job.company)
+    except Exception as e:
+        logger.exception('Import job %s failed at row %s: %s', job.pk, job.last_row, e)
+        job.statut = 'failed'
+        job.error = str(e)
+
+    job.finished_at = timezone.now()
+    job.expires_at = job.finished_at + import_file_ttl()
+    job.save(update_fields=['statut', 'error', 'finished_at', 'expires_at', 'updated_at'])
+    return job
+
+
+def resume_import_job(job):
+    """Remet un job en échec en attente ; il repartira de last_row"""
+    return ImportJob.objects.filter(pk=job.pk, statut='failed').update(
+        statut='pending', error='', finished_at=None, expires_at=None
+    )
+
+
+def requeue_stale_import_jobs(max_age=timedelta(minutes=10)):
+    """Jobs 'running' sans progression récente (worker arrêté) : remis en attente pour reprise"""
+    return ImportJob.objects.filter(
+        statut='running', updated_at__lt=timezone.now() - max_age
+    ).update(statut='pending')
+
+
+def cleanup_expired_import_jobs(now=None):
+    """Supprime les jobs expirés avec leur fichier source et leur fichier d'erreurs"""
+    expired = ImportJob.objects.filter(expires_at__lt=now or timezone.now())
+    count = 0
+    for job in expired.iterator():
+        if job.source:
+            job.source.delete(save=False)
+        if job.errors_file:
+            job.errors_file.delete(save=False)
+        job.delete()
+        count += 1
+    return count
@@ -0,0 +1,245 @@
+"""
+Statistiques des livreurs sur une période (StatsLivreursAPIView).
+
+Chaque table est agrégée par requêtes groupées (values(...).annotate(...)
+avec des Sum/Count conditionnels) puis fusionnée en Python : le nombre de
+requêtes ne dépend ni du nombre de livreurs ni du nombre de jours.
+
+Le résultat est gardé dans le cache Django par entreprise, période et
+livreur ; la durée est plus courte quand la période inclut aujourd'hui
+(ventes encore en cours de synchronisation). Toute écriture d'une tournée,
+d'un arrêt ou d'une vente change la version de l'entreprise : les
+statistiques précédentes ne sont plus lues.
+"""
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum, Count, Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .distribution_models import LivreurDistribution, TourneeMobile, ArretTourneeMobile, VenteTourneeMobile
+
+JOURS_SEMAINE = ['Lun', 'Mar', 'Mer', 'Jeu', 'Ven', 'Sam', 'Dim']
+PAIEMENTS = ('especes', 'cheques', 'credits')
+
+
+def _timeout(date_fin):
+    if date_fin >= timezone.localdate():
+        return getattr(settings, 'STATS_LIVREURS_CACHE_TIMEOUT_TODAY', 60)
+    return getattr(settings, 'STATS_LIVREURS_CACHE_TIMEOUT', 900)
+
+
+def _version_key(company_id):
+    return f'stats_livreurs:version:{company_id or "all"}'
+
+
+def _version(company_id):
+    key = _version_key(company_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate(company_id):
+    """Nouvelle version pour l'entreprise (et pour les statistiques toutes entreprises)"""
+    for key in {_version_key(company_id), _version_key(None)}:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def invalidate_companies(company_ids):
+    """
+    Pour les écritures en masse (bulk_create/bulk_update sans signal) : tout de
+    suite, puis au commit (une lecture concurrente a pu recalculer l'ancien état).
+    """
+    company_ids = set(company_ids)
+
+    def _invalidate():
+        for company_id in company_ids:
+            invalidate(company_id)
+
+    _invalidate()
+    transaction.on_commit(_invalidate)
+
+
+def _cache_key(date_debut, date_fin, company_id, livreur_id):
+    return (f'stats_livreurs:{company_id or "all"}:{_version(company_id)}:'
+            f'{date_debut}:{date_fin}:{livreur_id or "all"}')
+
+
+def _montants():
+    return {
+        'especes': Sum('montant_total', filter=Q(type_paiement='especes')),
+        'cheques': Sum('montant_total', filter=Q(type_paiement='cheque')),
+        'credits': Sum('montant_total', filter=Q(type_paiement='credit')),
+        'total': Sum('montant_total'),
+    }
+
+
+def _total(rows, key):
+    # Sommes en Decimal, converties une seule fois (pas d'arrondi cumulé)
+    return sum((row[key] or 0 for row in rows), Decimal(0))
+
+
+def _float(row, key):
+    return float(row[key] or 0)
+
+
+def compute_stats(date_debut, date_fin, company_id=None, livreur_id=None):
+    """{summary, livreurs, par_jour} pour la période (bornes incluses)"""
+    tournees_qs = TourneeMobile.objects.filter(date_tournee__gte=date_debut, date_tournee__lte=date_fin)
+    ventes_qs = VenteTourneeMobile.objects.filter(date_vente__date__gte=date_debut, date_vente__date__lte=date_fin)
+    arrets_qs = ArretTourneeMobile.objects.filter(
+        tournee__date_tournee__gte=date_debut, tournee__date_tournee__lte=date_fin)
+    if company_id:
+        tournees_qs = tournees_qs.filter(company_id=company_id)
+        ventes_qs = ventes_qs.filter(company_id=company_id)
+        arrets_qs = arrets_qs.filter(company_id=company_id)
+    if livreur_id:
+        tournees_qs = tournees_qs.filter(livreur_id=livreur_id)
+        ventes_qs = ventes_qs.filter(tournee__livreur_id=livreur_id)
+        arrets_qs = arrets_qs.filter(tournee__livreur_id=livreur_id)
+
+    # Ventes par (livreur, jour) : sert au résumé, aux livreurs et aux jours
+    ventes = list(ventes_qs.annotate(jour=TruncDate('date_vente')).order_by().values(
+        'tournee__livreur', 'jour').annotate(nb_ventes=Count('id'), **_montants()))
+    # Arrêts par livreur (clients distincts sur toute la période) et par (livreur, jour)
+    arrets_livreur = {
+        row['tournee__livreur']: row for row in arrets_qs.order_by().values('tournee__livreur').annotate(
+            total_arrets=Count('id'),
+            arrets_livres=Count('id', filter=Q(statut='livre')),
+            arrets_echec=Count('id', filter=Q(statut='echec')),
+            clients_visites=Count('client', distinct=True, filter=Q(statut='livre')),
+        )
+    }
+    arrets_jour = {
+        (row['tournee__livreur'], row['tournee__date_tournee']): row
+        for row in arrets_qs.order_by().values('tournee__livreur', 'tournee__date_tournee').annotate(
+            clients=Count('client', distinct=True),
+            livres=Count('id', filter=Q(statut='livre')),
+            echecs=Count('id', filter=Q(statut='echec')),
+        )
+    }
+    tournees = dict(tournees_qs.order_by().values('livreur').annotate(n=Count('id')).values_list('livreur', 'n'))
+    total_clients = arrets_qs.aggregate(
+        n=Count('client', distinct=True, filter=Q(statut='livre')))['n']
+
+    livreur_ids = set(tournees) | {row['tournee__livreur'] for row in ventes if row['tournee__livreur']}
+    livreurs = LivreurDistribution.objects.only('id', 'nom', 'matricule').in_bulk(livreur_ids)
+
+    # ========================================
+    # RÉSUMÉ GLOBAL
+    # ========================================
+    summary = {
+        'total_clients': total_clients,
+        'total_tournees': sum(tournees.values()),
+        'total_especes': float(_total(ventes, 'especes')),
+        'total_cheques': float(_total(ventes, 'cheques')),
+        'total_credits': float(_total(ventes, 'credits')),
+        'total_ventes': float(_total(ventes, 'total')),
+    }
+
+    # ========================================
+    # STATISTIQUES PAR LIVREUR
+    # ========================================
+    ventes_livreur = defaultdict(list)
+    for row in ventes:
+        ventes_livreur[row['tournee__livreur']].append(row)
+
+    livreurs_stats = []
+    for livreur in sorted((livreurs[pk] for pk in tournees if pk in livreurs), key=lambda l: (l.nom, l.pk)):
+        arrets = arrets_livreur.get(livreur.pk, {})
+        m = {key: float(_total(ventes_livreur[livreur.pk], key)) for key in PAIEMENTS}
+        livreurs_stats.append({
+            'id': livreur.id,
+            'nom': livreur.nom,
+            'matricule': livreur.matricule,
+            'tournees': tournees[livreur.pk],
+            'clients_visites': arrets.get('clients_visites', 0),
+            'total_arrets': arrets.get('total_arrets', 0),
+            'arrets_livres': arrets.get('arrets_livres', 0),
+            'arrets_echec': arrets.get('arrets_echec', 0),
+            'especes': m['especes'],
+            'cheques': m['cheques'],
+            'credits': m['credits'],
+            'total': m['especes'] + m['cheques'] + m['credits'],
+        })
+    # Trier par total décroissant
+    livreurs_stats.sort(key=lambda x: x['total'], reverse=True)
+
+    # ========================================
+    # STATISTIQUES PAR JOUR
+    # ========================================
+    ventes_jour = defaultdict(list)
+    for row in ventes:
+        ventes_jour[row['jour']].append(row)
+
+    par_jour = []
+    for jour in sorted(ventes_jour):
+        rows = ventes_jour[jour]
+        livreurs_jour = []
+        for row in rows:
+            livreur = livreurs.get(row['tournee__livreur'])
+            if livreur is None:
+                continue
+            arrets = arrets_jour.get((livreur.pk, jour), {})
+            livreurs_jour.append({
+                'id': livreur.id,
+                'nom': livreur.nom,
+                'clients': arrets.get('clients', 0),
+                'livres': arrets.get('livres', 0),
+                'echecs': arrets.get('echecs', 0),
+                'especes': _float(row, 'especes'),
+                'cheques': _float(row, 'cheques'),
+                'credits': _float(row, 'credits'),
+                'total': _float(row, 'total'),
+            })
+        livreurs_jour.sort(key=lambda l: (l['nom'], l['id']))
+        par_jour.append({
+            'date': jour.strftime('%Y-%m-%d'),
+            'date_label': jour.strftime('%d/%m'),
+            'jour_semaine': JOURS_SEMAINE[jour.weekday()],
+            'total': float(_total(rows, 'total')),
+            'especes': float(_total(rows, 'especes')),
+            'cheques': float(_total(rows, 'cheques')),
+            'credits': float(_total(rows, 'credits')),
+            'nb_ventes': sum(row['nb_ventes'] for row in rows),
+            'livreurs': livreurs_jour,
+        })
+
+    return {
+        'summary': summary,
+        'livreurs': livreurs_stats,
+        'par_jour': par_jour,
+    }
+
+
+def cached_stats(date_debut, date_fin, company_id=None, livreur_id=None):
+    """compute_stats gardé en cache par entreprise, période et livreur"""
+    key = _cache_key(date_debut, date_fin, company_id, livreur_id)
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_stats(date_debut, date_fin, company_id, livreur_id)
+        cache.set(key, stats, _timeout(date_fin))
+    return stats
+
+
+@receiver(post_save, sender=TourneeMobile)
+@receiver(post_delete, sender=TourneeMobile)
+@receiver(post_save, sender=ArretTourneeMobile)
+@receiver(post_delete, sender=ArretTourneeMobile)
+@receiver(post_save, sender=VenteTourneeMobile)
+@receiver(post_delete, sender=VenteTourneeMobile)
+def _stats_changed(sender, instance, **kwargs):
+    invalidate_companies([instance.company_id])
@@ -0,0 +1,65 @@
+"""
+Construit les agrégats journaliers (DailySalesRollup / DailyProductRollup).
+
+Les tables sont remplies par la migration 0063 puis tenues à jour par les
+signaux (API/rollups.py) : la commande ne sert qu'à recaler des jours passés.
+
+Par défaut (exécution nocturne) : reconstruit la veille. Le jour en cours,
+encore modifié par les ventes, n'est reconstruit qu'avec --today.
+--since YYYY-MM-DD : reconstruit tous les jours ayant des données depuis cette date.
+--full : reconstruit tout l'historique.
+"""
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from API.models import Company, DailySalesRollup, DailyProductRollup
+from API.rollups import rebuild_day, source_days
+
+
+class Command(BaseCommand):
+    help = 'Construit les tables d\'agrégats journaliers des ventes et du stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=str, help='Date de début (YYYY-MM-DD)')
+        parser.add_argument('--full', action='store_true', help='Reconstruire tout l\'historique')
+        parser.add_argument('--company-code', type=str, help='Limiter à une entreprise')
+        parser.add_argument('--today', action='store_true', help='Reconstruire aussi le jour en cours')
+
+    def handle(self, *args, **options):
+        company_id = None
+        if options.get('company_code'):
+            company = Company.objects.filter(code=options['company_code']).first()
+            if company is None:
+                raise CommandError(f"Entreprise {options['company_code']} introuvable")
+            company_id = company.id
+
+        if options['full']:
+            since = None
+        elif options.get('since'):
+            try:
+                since = datetime.strptime(options['since'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Format de date invalide. Utilisez YYYY-MM-DD')
+        else:
+            since = timezone.localdate() - timedelta(days=1)
+        until = None if options['today'] else timezone.localdate() - timedelta(days=1)
+
+        days = source_days(company_id=company_id, since=since)
+
+        # Les jours déjà agrégés mais sans données sources doivent aussi être purgés
+        for model in (DailySalesRollup, DailyProductRollup):
+            existing = model.objects.all()
+            if since is not None:
+                existing = existing.filter(jour__gte=since)
+            if company_id is not None:
+                existing = existing.filter(company_id=company_id)
+            days.update(existing.values_list('company_id', 'jour').distinct())
+        if until is not None:
+            days = {(company, jour) for company, jour in days if jour <= until}
+
+        for company, jour in sorted(days, key=lambda d: (d[0] or 0, d[1])):
+            rebuild_day(company, jour)
+
+        self.stdout.write(self.style.SUCCESS(f'{len(days)} jour(s) reconstruit(s)'))
@@ -0,0 +1,32 @@
+"""
+Sous-échantillonne les traces GPS anciennes (PositionLivreur).
+
+Par défaut (exécution nocturne) : au-delà de POSITION_FULL_HISTORY_DAYS jours
+(7), garde un point par livreur et par tranche de 5 minutes.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from API.positions import default_downsample_before, downsample_positions
+
+
+class Command(BaseCommand):
+    help = 'Sous-échantillonne l\'historique des positions GPS des livreurs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Garder toutes les positions des N derniers jours')
+        parser.add_argument('--interval', type=int, default=300, help='Un point par intervalle (secondes)')
+        parser.add_argument('--livreur', type=int, help='Limiter à un livreur (id)')
+
+    def handle(self, *args, **options):
+        if options['interval'] <= 0:
+            raise CommandError("L'intervalle doit être positif")
+        if options.get('days') is not None:
+            before = timezone.now() - timedelta(days=options['days'])
+        else:
+            before = default_downsample_before()
+
+        deleted = downsample_positions(before, options['interval'], options.get('livreur'))
+        self.stdout.write(self.style.SUCCESS(f'{deleted} position(s) supprimée(s)'))
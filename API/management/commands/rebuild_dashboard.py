@@ -0,0 +1,31 @@
+"""
+Reconstruit les instantanés du tableau de bord (DashboardSnapshot).
+
+À lancer après des modifications massives faites hors ORM/signaux
+(ex: setup_multitenancy, imports SQL).
+"""
+from django.core.management.base import BaseCommand
+from API.models import Company
+from API.dashboard import rebuild_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Reconstruit les compteurs matérialisés du tableau de bord par entreprise'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--company-code',
+            type=str,
+            help='Ne reconstruire que l\'entreprise ayant ce code'
+        )
+
+    def handle(self, *args, **options):
+        companies = Company.objects.all()
+        if options.get('company_code'):
+            companies = companies.filter(code=options['company_code'])
+
+        for company in companies:
+            rebuild_snapshot(company)
+            self.stdout.write(f'  - {company.name}: instantané reconstruit')
+
+        self.stdout.write(self.style.SUCCESS(f'{companies.count()} entreprise(s) traitée(s)'))
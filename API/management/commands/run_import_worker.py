@@ -0,0 +1,55 @@
+"""
+Worker des imports différés (ImportJob).
+
+Traite les jobs un par un (les imports écrivent beaucoup : pas de parallélisme
+sur une même base). Au démarrage, les jobs restés 'running' sans progression
+sont remis en attente et reprennent à leur dernier bloc validé.
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from API.import_jobs import (
+    claim_next_import_job, run_import_job, requeue_stale_import_jobs, cleanup_expired_import_jobs,
+)
+
+
+class Command(BaseCommand):
+    help = 'Exécute les imports différés (ImportJob) en attente'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Attente (s) quand la file est vide')
+        parser.add_argument('--stale-minutes', type=int, default=10,
+                            help='Délai sans progression après lequel un job en cours est repris')
+        parser.add_argument('--once', action='store_true', help='Traiter la file puis s\'arrêter')
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(minutes=options['stale_minutes'])
+        last_cleanup = 0
+
+        while True:
+            requeued = requeue_stale_import_jobs(stale_after)
+            if requeued:
+                self.stdout.write(f'{requeued} job(s) interrompu(s) remis en attente')
+            if time.monotonic() - last_cleanup >= 300:
+                purged = cleanup_expired_import_jobs()
+                if purged:
+                    self.stdout.write(f'{purged} import(s) expiré(s) supprimé(s)')
+                last_cleanup = time.monotonic()
+
+            job = claim_next_import_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f'Import #{job.pk} ({job.original_name}) démarré à la ligne {job.last_row}')
+            job = run_import_job(job)
+            self.stdout.write(
+                f'Import #{job.pk} {job.statut}: {job.created_count} créé(s), '
+                f'{job.updated_count} mis à jour, {job.skipped_count} ignoré(s)'
+            )
+
+        self.stdout.write(self.style.SUCCESS('Worker arrêté'))
@@ -0,0 +1,67 @@
+"""
+Worker de génération des rapports différés (ReportJob).
+
+Interroge la table ReportJob, exécute les jobs en attente dans un pool de
+threads et purge périodiquement les artefacts expirés. Pas de broker : lancer
+une ou plusieurs instances de cette commande (supervisor, systemd, cron --once).
+"""
+import time
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from API.models import ReportJob
+from API.report_jobs import claim_next_job, run_job, cleanup_expired_jobs, requeue_stale_jobs
+
+
+def _execute(job):
+    try:
+        run_job(job)
+    finally:
+        # Chaque thread a sa propre connexion : la fermer en fin de job
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Exécute les rapports différés (ReportJob) en attente'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2, help='Nombre de jobs exécutés en parallèle')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Attente (s) quand la file est vide')
+        parser.add_argument('--cleanup-interval', type=int, default=300, help='Intervalle (s) de purge des artefacts expirés')
+        parser.add_argument('--stale-minutes', type=int, default=10,
+                            help='Délai sans heartbeat après lequel un job en cours est repris')
+        parser.add_argument('--once', action='store_true', help='Traiter la file puis s\'arrêter')
+
+    def handle(self, *args, **options):
+        threads = max(1, options['threads'])
+        stale_after = timedelta(minutes=options['stale_minutes'])
+
+        last_cleanup = 0
+        running = set()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            while True:
+                requeued = requeue_stale_jobs(stale_after)
+                if requeued:
+                    self.stdout.write(f'{requeued} job(s) interrompu(s) remis en attente')
+                if time.monotonic() - last_cleanup >= options['cleanup_interval']:
+                    purged = cleanup_expired_jobs()
+                    if purged:
+                        self.stdout.write(f'{purged} rapport(s) expiré(s) supprimé(s)')
+                    last_cleanup = time.monotonic()
+
+                running = {f for f in running if not f.done()}
+                while len(running) < threads:
+                    job = claim_next_job()
+                    if job is None:
+                        break
+                    self.stdout.write(f'Job #{job.pk} ({job.report_type}/{job.format}) démarré')
+                    running.add(executor.submit(_execute, job))
+
+                if options['once'] and not running and not ReportJob.objects.filter(statut='pending').exists():
+                    break
+                time.sleep(options['poll_interval'] if not running else 0.2)
+
+        self.stdout.write(self.style.SUCCESS('Worker arrêté'))
@@ -4,30 +4,15 @@ Vue de la carte GPS des livreurs
 import json
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from .distribution_models import LivreurDistribution
+from .positions import last_positions
 
 
 @login_required
 def livreurs_map_view(request):
     """Vue de la carte des livreurs en temps réel"""
-    # Récupérer tous les livreurs qui ont une position GPS
-    livreurs = LivreurDistribution.objects.filter(
-        current_lat__isnull=False,
-        current_lng__isnull=False
-    ).select_related('user')
-
-    # Préparer les données pour le template
-    livreurs_data = []
-    for livreur in livreurs:
-        livreurs_data.append({
-            'id': livreur.id,
-            'nom': livreur.nom,
-            'matricule': livreur.matricule,
-            'lat': float(livreur.current_lat),
-            'lng': float(livreur.current_lng),
-            'last_update': livreur.last_location_update.isoformat() if livreur.last_location_update else None,
-            'statut': livreur.statut,
-        })
+    # Dernières positions lues dans le cache (API.positions), filtrées par entreprise
+    company = getattr(request, 'company', None)
+    livreurs_data = last_positions(company.pk if company is not None else None)
 
     return render(request, 'api/livreurs_map.html', {
         'livreurs_json': json.dumps(livreurs_data),
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0047_add_distribution_permissions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('produits_count', models.IntegerField(default=0)),
+                ('clients_count', models.IntegerField(default=0)),
+                ('fournisseurs_count', models.IntegerField(default=0)),
+                ('achats_count', models.IntegerField(default=0)),
+                ('ventes_count', models.IntegerField(default=0)),
+                ('ventes_aujourd_hui', models.IntegerField(default=0)),
+                ('ca_total', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('ca_mois', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('produits_stock_bas', models.IntegerField(default=0)),
+                ('produits_stock_critique', models.IntegerField(default=0)),
+                ('produits_rupture', models.IntegerField(default=0)),
+                ('jour_reference', models.DateField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dashboard_snapshot', to='API.company')),
+            ],
+            options={
+                'verbose_name': 'Instantané tableau de bord',
+                'verbose_name_plural': 'Instantanés tableau de bord',
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0048_dashboard_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jour', models.DateField()),
+                ('type_paiement', models.CharField(max_length=10)),
+                ('nb_ventes', models.IntegerField(default=0)),
+                ('total_ht', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('total_ttc', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='API.company')),
+                ('warehouse', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='API.warehouse')),
+            ],
+            options={
+                'verbose_name': 'Agrégat journalier des ventes',
+                'verbose_name_plural': 'Agrégats journaliers des ventes',
+                'ordering': ['jour'],
+                'indexes': [models.Index(fields=['company', 'jour'], name='API_dailysa_company_27eace_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jour', models.DateField()),
+                ('qte_vendue', models.IntegerField(default=0)),
+                ('ca', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('entrees', models.IntegerField(default=0)),
+                ('sorties', models.IntegerField(default=0)),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='product_rollups', to='API.company')),
+                ('produit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='API.produit')),
+                ('warehouse', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='product_rollups', to='API.warehouse')),
+            ],
+            options={
+                'verbose_name': 'Agrégat journalier produit',
+                'verbose_name_plural': 'Agrégats journaliers produits',
+                'ordering': ['jour'],
+                'indexes': [models.Index(fields=['company', 'jour'], name='API_dailypr_company_5d0602_idx')],
+            },
+        ),
+    ]
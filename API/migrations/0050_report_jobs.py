@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:56
+
+import API.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('API', '0049_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('report_type', models.CharField(choices=[('stock_valuation', 'Valorisation du stock'), ('sales', 'Rapport des ventes'), ('inventory', 'Inventaire complet')], max_length=30)),
+                ('format', models.CharField(choices=[('excel', 'Excel'), ('csv', 'CSV'), ('pdf', 'PDF')], default='excel', max_length=10)),
+                ('params', models.JSONField(blank=True, default=dict)),
+                ('statut', models.CharField(choices=[('pending', 'En attente'), ('running', 'En cours'), ('done', 'Terminé'), ('failed', 'Échec')], default='pending', max_length=10)),
+                ('progress', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('artifact', models.FileField(blank=True, null=True, storage=API.models.report_artifact_storage, upload_to='%Y/%m/')),
+                ('filename', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='report_jobs', to='API.company')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='report_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Job de rapport',
+                'verbose_name_plural': 'Jobs de rapports',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['statut', 'created_at'], name='API_reportj_statut_de1d67_idx')],
+            },
+        ),
+    ]
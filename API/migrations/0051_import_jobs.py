@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:01
+
+import API.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('API', '0050_report_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('import_type', models.CharField(choices=[('products', 'Produits')], default='products', max_length=20)),
+                ('source', models.FileField(storage=API.models.import_file_storage, upload_to='sources/%Y/%m/')),
+                ('original_name', models.CharField(blank=True, max_length=200)),
+                ('statut', models.CharField(choices=[('pending', 'En attente'), ('running', 'En cours'), ('done', 'Terminé'), ('failed', 'Échec')], default='pending', max_length=10)),
+                ('total_rows', models.PositiveIntegerField(blank=True, null=True)),
+                ('last_row', models.PositiveIntegerField(default=0, help_text='Lignes de données déjà validées (point de reprise)')),
+                ('created_count', models.PositiveIntegerField(default=0)),
+                ('updated_count', models.PositiveIntegerField(default=0)),
+                ('skipped_count', models.PositiveIntegerField(default=0)),
+                ('errors_count', models.PositiveIntegerField(default=0)),
+                ('errors_file', models.FileField(blank=True, null=True, storage=API.models.import_file_storage, upload_to='errors/%Y/%m/')),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='API.company')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': "Job d'import",
+                'verbose_name_plural': "Jobs d'import",
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['statut', 'created_at'], name='API_importj_statut_1b1645_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0051_import_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doc_type', models.CharField(max_length=30)),
+                ('period', models.CharField(blank=True, help_text='Période du compteur (AAAA, AAAAMMJJ ou vide)', max_length=8)),
+                ('last_value', models.PositiveIntegerField(default=0)),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='document_sequences', to='API.company')),
+            ],
+            options={
+                'verbose_name': 'Séquence de documents',
+                'verbose_name_plural': 'Séquences de documents',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='documentsequence',
+            constraint=models.UniqueConstraint(fields=('company', 'doc_type', 'period'), name='uniq_document_sequence'),
+        ),
+        migrations.AddConstraint(
+            model_name='documentsequence',
+            constraint=models.UniqueConstraint(condition=models.Q(('company__isnull', True)), fields=('doc_type', 'period'), name='uniq_document_sequence_global'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:18
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remplir_chemins(apps, schema_editor):
+    """Chemins matérialisés, profondeurs et nombre de produits actifs directs"""
+    Categorie = apps.get_model('API', 'Categorie')
+    Produit = apps.get_model('API', 'Produit')
+    parents = dict(Categorie.objects.values_list('id', 'parent_id'))
+    counts = dict(Produit.objects.filter(is_active=True).values('categorie_id')
+                  .annotate(n=Count('id')).values_list('categorie_id', 'n'))
+    paths = {}
+
+    def path_of(pk, seen=()):
+        if pk not in paths:
+            parent = parents.get(pk)
+            # Cycle éventuel dans les données existantes : rattacher à la racine
+            prefix = path_of(parent, seen + (pk,)) if parent and parent not in seen else '/'
+            paths[pk] = f'{prefix}{pk}/'
+        return paths[pk]
+
+    for pk in parents:
+        path = path_of(pk)
+        Categorie.objects.filter(pk=pk).update(path=path, depth=path.count('/') - 2,
+                                               nb_produits=counts.get(pk, 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0052_document_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categorie',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='categorie',
+            name='nb_produits',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Produits actifs directement dans la catégorie'),
+        ),
+        migrations.AddField(
+            model_name='categorie',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(remplir_chemins, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0053_categorie_path'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['-created_at', '-id'], name='auditlog_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmove',
+            index=models.Index(fields=['-date', '-id'], name='stockmove_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='synclogmobile',
+            index=models.Index(fields=['livreur', '-date_sync', '-id'], name='synclog_livreur_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vente',
+            index=models.Index(fields=['company', '-date_vente', '-id'], name='vente_company_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ventetourneemobile',
+            index=models.Index(fields=['-date_vente', '-id'], name='ventetournee_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def journaliser_existant(apps, schema_editor):
+    """Un changement par objet existant : le premier pull v2 (jeton 0) reçoit tout"""
+    SyncChange = apps.get_model('API', 'SyncChange')
+    sources = [
+        ('tournee', 'TourneeMobile', 'company_id', 'livreur_id'),
+        ('arret', 'ArretTourneeMobile', 'company_id', 'tournee__livreur_id'),
+        ('client', 'Client', 'company_id', None),
+        ('produit', 'Produit', 'company_id', None),
+        ('prix', 'PrixProduit', 'produit__company_id', None),
+    ]
+    for kind, model_name, company, livreur in sources:
+        fields = ['id', company] + ([livreur] if livreur else [])
+        rows = apps.get_model('API', model_name).objects.order_by('id').values_list(*fields)
+        SyncChange.objects.bulk_create([
+            SyncChange(kind=kind, object_id=row[0], company_id=row[1], livreur_id=row[2] if livreur else None)
+            for row in rows.iterator()
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0054_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20, verbose_name="Type d'objet")),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sync_changes', to='API.company')),
+                ('livreur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sync_changes', to='API.livreurdistribution')),
+            ],
+            options={
+                'verbose_name': 'Changement à synchroniser',
+                'verbose_name_plural': 'Changements à synchroniser',
+                'indexes': [models.Index(fields=['company', 'id'], name='sync_change_company_id_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='syncchange',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='uniq_sync_change_object'),
+        ),
+        migrations.RunPython(journaliser_existant, migrations.RunPython.noop),
+    ]
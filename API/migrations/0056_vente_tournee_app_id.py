@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0055_sync_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ventetourneemobile',
+            name='app_id',
+            field=models.CharField(blank=True, max_length=200, null=True, unique=True),
+        ),
+    ]
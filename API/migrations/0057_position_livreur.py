@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0056_vente_tournee_app_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionLivreur',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lat', models.DecimalField(decimal_places=7, max_digits=10, verbose_name='Latitude')),
+                ('lng', models.DecimalField(decimal_places=7, max_digits=10, verbose_name='Longitude')),
+                ('horodatage', models.DateTimeField(verbose_name='Horodatage (appareil)')),
+                ('precision_m', models.FloatField(blank=True, null=True, verbose_name='Précision (m)')),
+                ('vitesse_kmh', models.FloatField(blank=True, null=True, verbose_name='Vitesse (km/h)')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='positions_livreurs', to='API.company')),
+                ('livreur', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='API.livreurdistribution')),
+            ],
+            options={
+                'verbose_name': 'Position livreur',
+                'verbose_name_plural': 'Positions livreurs',
+                'ordering': ['-horodatage'],
+                'indexes': [models.Index(fields=['livreur', 'horodatage'], name='position_livreur_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0057_position_livreur'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clientlivreurhebdo',
+            index=models.Index(fields=['company', 'livreur', 'jour_semaine', 'is_active'], name='API_clientl_company_060fdc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientlivreurhebdo',
+            index=models.Index(fields=['company', 'jour_semaine', 'is_active'], name='API_clientl_company_d016ec_idx'),
+        ),
+    ]
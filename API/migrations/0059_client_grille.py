@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:40
+
+import math
+
+from django.db import migrations, models
+
+GRILLE_DEG = 0.01
+
+
+def remplir_grille(apps, schema_editor):
+    """Case de la grille spatiale des clients géolocalisés"""
+    Client = apps.get_model('API', 'Client')
+    clients = []
+    for client in Client.objects.filter(lat__isnull=False, lng__isnull=False).only('id', 'lat', 'lng').iterator():
+        client.grille_lat = math.floor(float(client.lat) / GRILLE_DEG)
+        client.grille_lng = math.floor(float(client.lng) / GRILLE_DEG)
+        clients.append(client)
+    Client.objects.bulk_update(clients, ['grille_lat', 'grille_lng'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0058_clientlivreurhebdo_company_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='grille_lat',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='grille_lng',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['company', 'grille_lat', 'grille_lng'], name='API_client_company_7373a5_idx'),
+        ),
+        migrations.RunPython(remplir_grille, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:51
+
+from django.db import migrations, models
+
+
+def sequence_depuis_id(apps, schema_editor):
+    """Les jetons déjà remis aux mobiles sont des id : la séquence reprend l'id"""
+    SyncChange = apps.get_model('API', 'SyncChange')
+    SyncChange.objects.update(sequence=models.F('id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0059_client_grille'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='syncchange',
+            name='uniq_sync_change_object',
+        ),
+        migrations.RemoveIndex(
+            model_name='syncchange',
+            name='sync_change_company_id_idx',
+        ),
+        migrations.AddField(
+            model_name='syncchange',
+            name='sequence',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(sequence_depuis_id, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='syncchange',
+            index=models.Index(fields=['company', 'sequence'], name='sync_change_company_seq_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='syncchange',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id', 'livreur'), name='uniq_sync_change_object_livreur'),
+        ),
+        migrations.AddConstraint(
+            model_name='syncchange',
+            constraint=models.UniqueConstraint(condition=models.Q(('livreur__isnull', True)), fields=('kind', 'object_id'), name='uniq_sync_change_object'),
+        ),
+    ]
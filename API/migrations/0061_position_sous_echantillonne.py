@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0060_sync_change_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='positionlivreur',
+            name='sous_echantillonne',
+            field=models.BooleanField(default=False, verbose_name='Sous-échantillonné'),
+        ),
+        migrations.AddIndex(
+            model_name='positionlivreur',
+            index=models.Index(condition=models.Q(('sous_echantillonne', False)), fields=['horodatage'], name='position_a_echantillonner_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0061_position_sous_echantillonne'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='syncchange',
+            name='uniq_sync_change_object_livreur',
+        ),
+        migrations.RemoveConstraint(
+            model_name='syncchange',
+            name='uniq_sync_change_object',
+        ),
+        migrations.AlterField(
+            model_name='syncchange',
+            name='sequence',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='syncchange',
+            index=models.Index(fields=['kind', 'object_id'], name='sync_change_object_idx'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:16
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.functions.comparison
+
+
+def remplir_agregats(apps, schema_editor):
+    """
+    Agrégats reconstruits depuis tout l'historique (requêtes groupées), ce qui
+    supprime aussi les doublons éventuels avant les contraintes uniques.
+    """
+    Vente = apps.get_model('API', 'Vente')
+    LigneVente = apps.get_model('API', 'LigneVente')
+    StockMove = apps.get_model('API', 'StockMove')
+    DailySalesRollup = apps.get_model('API', 'DailySalesRollup')
+    DailyProductRollup = apps.get_model('API', 'DailyProductRollup')
+
+    DailySalesRollup.objects.all().delete()
+    DailyProductRollup.objects.all().delete()
+
+    ventes = Vente.objects.filter(statut='completed').annotate(jour=TruncDate('date_vente')).values(
+        'company_id', 'jour', 'warehouse_id', 'type_paiement').annotate(
+        nb=Count('id'), ht=Sum('total_ht'), ttc=Sum('total_ttc')).order_by()
+    DailySalesRollup.objects.bulk_create((
+        DailySalesRollup(company_id=row['company_id'], jour=row['jour'], warehouse_id=row['warehouse_id'],
+                         type_paiement=row['type_paiement'], nb_ventes=row['nb'],
+                         total_ht=row['ht'] or 0, total_ttc=row['ttc'] or 0)
+        for row in ventes.iterator()
+    ), batch_size=1000)
+
+    produits = {}
+    lignes = LigneVente.objects.filter(vente__statut='completed').annotate(
+        jour=TruncDate('vente__date_vente')).values(
+        'vente__company_id', 'jour', 'vente__warehouse_id', 'produit_id').annotate(
+        qte=Sum('quantite'),
+        ca=Sum(ExpressionWrapper(F('quantite') * F('prixU_snapshot'),
+                                 output_field=DecimalField(max_digits=16, decimal_places=2))),
+    ).order_by()
+    for row in lignes.iterator():
+        key = (row['vente__company_id'], row['jour'], row['vente__warehouse_id'], row['produit_id'])
+        produits.setdefault(key, {}).update(qte_vendue=row['qte'] or 0, ca=row['ca'] or 0)
+    moves = StockMove.objects.annotate(jour=TruncDate('date')).values(
+        'produit__company_id', 'jour', 'warehouse_id', 'produit_id').annotate(
+        entrees=Sum('delta', filter=Q(delta__gt=0)), sorties=Sum('delta', filter=Q(delta__lt=0)),
+    ).order_by()
+    for row in moves.iterator():
+        key = (row['produit__company_id'], row['jour'], row['warehouse_id'], row['produit_id'])
+        produits.setdefault(key, {}).update(entrees=row['entrees'] or 0, sorties=abs(row['sorties'] or 0))
+    DailyProductRollup.objects.bulk_create((
+        DailyProductRollup(company_id=company_id, jour=jour, warehouse_id=warehouse_id, produit_id=produit_id,
+                           **values)
+        for (company_id, jour, warehouse_id, produit_id), values in produits.items()
+    ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0062_sync_change_pending'),
+    ]
+
+    operations = [
+        migrations.RunPython(remplir_agregats, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailyproductrollup',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Coalesce('company', models.Value(0)), models.F('jour'), django.db.models.functions.comparison.Coalesce('warehouse', models.Value(0)), models.F('produit'), name='uniq_daily_product_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailysalesrollup',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Coalesce('company', models.Value(0)), models.F('jour'), django.db.models.functions.comparison.Coalesce('warehouse', models.Value(0)), models.F('type_paiement'), name='uniq_daily_sales_rollup'),
+        ),
+    ]
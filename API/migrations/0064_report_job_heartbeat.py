@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0063_rollup_backfill_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,194 @@
+"""
+Intégration en lot d'un push mobile (ventes et mises à jour d'arrêts).
+
+Les références (tournées, arrêts, clients, produits) sont chargées en une
+requête par type, les ventes et leurs lignes sont créées par bulk_create et
+les sorties du van passent par un seul StockLedger. Le nombre de requêtes ne
+dépend donc pas du nombre de ventes.
+
+Le push est idempotent : une vente dont l'app_id (ou le numéro) existe déjà
+n'est pas recréée et est renvoyée avec le statut 'duplicate'. Chaque élément
+reçoit un résultat (created, duplicate, updated ou error).
+"""
+import uuid
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Client, Produit
+from .distribution_models import TourneeMobile, ArretTourneeMobile, VenteTourneeMobile, LigneVenteTourneeMobile
+from .stock_ledger import StockLedger
+from .livreur_stats import invalidate_companies as invalidate_stats
+from .sync_changes import record_many
+
+CENT = Decimal('100')
+
+
+def _numero_vente():
+    return f"VM-{timezone.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}"
+
+
+def _existing_ventes(ventes_data):
+    """{app_id ou numéro: id} des ventes déjà enregistrées"""
+    app_ids = {v['app_id'] for v in ventes_data if v.get('app_id')}
+    numeros = {v['numero_vente'] for v in ventes_data if v.get('numero_vente')}
+    existing = {}
+    if app_ids:
+        existing.update((('app', a), pk) for a, pk in
+                        VenteTourneeMobile.objects.filter(app_id__in=app_ids).values_list('app_id', 'id'))
+    if numeros:
+        existing.update((('numero', n), pk) for n, pk in
+                        VenteTourneeMobile.objects.filter(numero_vente__in=numeros).values_list('numero_vente', 'id'))
+    return existing
+
+
+class PushIngestor:
+    def __init__(self, livreur, company=None):
+        self.livreur = livreur
+        self.company = company
+        self.results = {'ventes': [], 'arrets': []}
+
+    def _error(self, key, index, message, **extra):
+        self.results[key].append({'index': index, 'status': 'error', 'error': message, **extra})
+
+    def ingest(self, ventes_data=(), arrets_data=()):
+        """Applique le push ; rejoué une fois si un push concurrent a créé les mêmes ventes"""
+        for attempt in range(2):
+            self.results = {'ventes': [], 'arrets': []}
+            try:
+                with transaction.atomic():
+                    self._ingest_ventes(list(ventes_data))
+                    self._ingest_arrets(list(arrets_data))
+                return self.results
+            except IntegrityError:
+                if attempt:
+                    raise
+
+    def _ingest_ventes(self, ventes_data):
+        if not ventes_data:
+            return
+        existing = _existing_ventes(ventes_data)
+        tournees = TourneeMobile.objects.in_bulk({v['tournee'] for v in ventes_data if v.get('tournee')})
+        arrets = ArretTourneeMobile.objects.in_bulk({v['arret'] for v in ventes_data if v.get('arret')})
+        clients = Client.objects.only('id', 'company_id').in_bulk({v['client'] for v in ventes_data})
+        produits = Produit.objects.in_bulk({l['produit'] for v in ventes_data for l in v['lignes']})
+
+        now = timezone.now()
+        seen = {}  # clés des ventes créées par ce push
+        pending = []  # (index, vente, lignes)
+        repeated = []  # (résultat, vente) : doublons internes au push
+        for index, data in enumerate(ventes_data):
+            app_id = data.get('app_id') or None
+            keys = ([('app', app_id)] if app_id else []) + (
+                [('numero', data['numero_vente'])] if data.get('numero_vente') else [])
+            known = next((existing[k] for k in keys if k in existing), None)
+            twin = next((seen[k] for k in keys if k in seen), None)
+            if known is not None or twin is not None:
+                result = {'index': index, 'app_id': app_id, 'status': 'duplicate', 'id': known}
+                self.results['ventes'].append(result)
+                if twin is not None:
+                    repeated.append((result, twin))
+                continue
+
+            client = clients.get(data['client'])
+            tournee = tournees.get(data.get('tournee')) if data.get('tournee') else None
+            if client is None:
+                self._error('ventes', index, f"Client {data['client']} introuvable", app_id=app_id)
+                continue
+            if data.get('tournee') and tournee is None:
+                self._error('ventes', index, f"Tournée {data['tournee']} introuvable", app_id=app_id)
+                continue
+            if tournee is not None and tournee.est_cloturee:
+                self._error('ventes', index, "Impossible d'ajouter une vente à une tournée clôturée.", app_id=app_id)
+                continue
+            if data.get('arret') and data['arret'] not in arrets:
+                self._error('ventes', index, f"Arrêt {data['arret']} introuvable", app_id=app_id)
+                continue
+            inconnus = [l['produit'] for l in data['lignes'] if l['produit'] not in produits]
+            if inconnus:
+                self._error('ventes', index, f"Produit(s) introuvable(s): {inconnus}", app_id=app_id)
+                continue
+
+            vente = VenteTourneeMobile(
+                tournee=tournee,
+                arret_id=data.get('arret'),
+                client_id=client.pk,
+                numero_vente=data.get('numero_vente') or _numero_vente(),
+                date_vente=data.get('date_vente') or now,
+                montant_ht=data['montant_ht'],
+                montant_tva=data['montant_tva'],
+                montant_total=data['montant_total'],
+                type_paiement=data['type_paiement'],
+                montant_paye=data['montant_paye'],
+                montant_rendu=data['montant_rendu'],
+                notes=data['notes'],
+                app_id=app_id,
+                est_synchronise=True,
+                date_synchronisation=now,
+                company_id=tournee.company_id if tournee is not None else (client.company_id or getattr(self.company, 'pk', None)),
+            )
+            for key in keys:
+                seen[key] = vente
+            pending.append((index, vente, data['lignes']))
+
+        VenteTourneeMobile.objects.bulk_create([vente for _, vente, _ in pending])
+
+        van = self.livreur.entrepot
+        ledger = StockLedger(clamp=True, refresh=None)
+        lignes = []
+        for index, vente, lignes_data in pending:
+            for data in lignes_data:
+                montant_ht = data['quantite'] * data['prix_unitaire']
+                montant_tva = montant_ht * (data['taux_tva'] / CENT)
+                lignes.append(LigneVenteTourneeMobile(
+                    vente=vente, produit_id=data['produit'], company_id=vente.company_id,
+                    quantite=data['quantite'], prix_unitaire=data['prix_unitaire'], taux_tva=data['taux_tva'],
+                    montant_ht=montant_ht, montant_tva=montant_tva, montant_ttc=montant_ht + montant_tva,
+                ))
+                # Sortie du stock du van du livreur
+                if van is not None:
+                    ledger.add(produits[data['produit']], van, -data['quantite'], 'VENTE', vente.numero_vente,
+                               f"Vente tournée {vente.numero_vente}")
+            self.results['ventes'].append({'index': index, 'app_id': vente.app_id, 'status': 'created', 'id': vente.pk})
+        LigneVenteTourneeMobile.objects.bulk_create(lignes)
+        # Le stock du van ne descend pas sous zéro ; Produit.quantite n'est pas modifié
+        ledger.apply()
+        # bulk_create n'émet pas de signal : statistiques livreurs
+        invalidate_stats(vente.company_id for _, vente, _ in pending)
+
+        for result, vente in repeated:
+            result['id'] = vente.pk
+        self.results['ventes'].sort(key=lambda r: r['index'])
+
+    def _ingest_arrets(self, arrets_data):
+        if not arrets_data:
+            return
+        arrets = ArretTourneeMobile.objects.select_related('tournee').in_bulk({a['id'] for a in arrets_data})
+        fields, updated = set(), {}
+        for index, data in enumerate(arrets_data):
+            arret = arrets.get(data['id'])
+            if arret is None:
+                self._error('arrets', index, f"Arrêt {data['id']} introuvable", id=data['id'])
+                continue
+            if arret.tournee.est_cloturee:
+                self._error('arrets', index, "Impossible de modifier un arrêt d'une tournée clôturée.", id=data['id'])
+                continue
+            for field, value in data.items():
+                if field != 'id':
+                    setattr(arret, field, value)
+                    fields.add(field)
+            updated[arret.pk] = arret
+            self.results['arrets'].append({'index': index, 'id': arret.pk, 'status': 'updated'})
+        if updated:
+            now = timezone.now()
+            for arret in updated.values():
+                arret.updated_at = now
+            ArretTourneeMobile.objects.bulk_update(list(updated.values()), sorted(fields) + ['updated_at'])
+            # bulk_update n'émet pas de signal : journal de synchronisation
+            record_many('arret', [(a.pk, a.company_id, a.tournee.livreur_id) for a in updated.values()])
+            invalidate_stats(a.company_id for a in updated.values())
+
+
+def ingest_push(livreur, ventes_data=(), arrets_data=(), company=None):
+    return PushIngestor(livreur, company).ingest(ventes_data, arrets_data)
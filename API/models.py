@@ -1,4 +1,7 @@
+import math
+
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -69,6 +72,7 @@ class AuditLog(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['-created_at', '-id'], name='auditlog_created_id_idx')]
 
     def __str__(self):
         return f"{self.created_at} - {self.action} by {self.actor} on {self.target_model}({self.target_id})"
@@ -107,7 +111,13 @@ class Currency(models.Model):
     @classmethod
     def get_default(cls):
         """Retourne la devise par défaut configurée dans les paramètres système.
-        Fallback: utilise is_default=True si SystemConfig n'a pas de devise configurée."""
+        Fallback: utilise is_default=True si SystemConfig n'a pas de devise configurée.
+        Mise en cache (API.config_cache), invalidée à chaque modification."""
+        from .config_cache import get_cached
+        return get_cached('default_currency', cls._load_default)
+
+    @classmethod
+    def _load_default(cls):
         try:
             from .models import SystemConfig
             config = SystemConfig.get_solo()
@@ -137,44 +147,10 @@ class ExchangeRate(models.Model):
     
     @classmethod
     def get_rate(cls, from_currency, to_currency, date=None):
-        """Obtenir le taux de change entre deux devises à une date donnée"""
-        if date is None:
-            date = timezone.now().date()
-        
-        if from_currency == to_currency:
-            return Decimal('1.0')
-        
-        # Chercher le taux direct
-        rate = cls.objects.filter(
-            from_currency=from_currency,
-            to_currency=to_currency,
-            date__lte=date,
-            is_active=True
-        ).first()
-        
-        if rate:
-            return rate.rate
-        
-        # Chercher le taux inverse
-        rate = cls.objects.filter(
-            from_currency=to_currency,
-            to_currency=from_currency,
-            date__lte=date,
-            is_active=True
-        ).first()
-        
-        if rate:
-            return Decimal('1.0') / rate.rate
-        
-        # Si pas de taux trouvé, essayer via la devise par défaut
-        default_currency = Currency.get_default()
-        if default_currency and default_currency != from_currency and default_currency != to_currency:
-            rate1 = cls.get_rate(from_currency, default_currency, date)
-            rate2 = cls.get_rate(default_currency, to_currency, date)
-            if rate1 and rate2:
-                return rate1 * rate2
-        
-        return None
+        """Obtenir le taux de change entre deux devises à une date donnée
+        (table en mémoire, voir API.exchange_rates)"""
+        from .exchange_rates import rate_table
+        return rate_table().rate(from_currency, to_currency, date)
     
     @classmethod
     def convert_amount(cls, amount, from_currency, to_currency, date=None):
@@ -239,6 +215,13 @@ class Categorie(models.Model):
     icone = models.CharField(max_length=50, default='fa-cube', help_text="Icône Font Awesome")
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    # Index de hiérarchie (chemin matérialisé "/1/5/12/") et compteur dénormalisé,
+    # maintenus par save() et par les signaux de API.categories
+    path = models.CharField(max_length=255, blank=True, default='', db_index=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    nb_produits = models.PositiveIntegerField(default=0, editable=False,
+                                              help_text="Produits actifs directement dans la catégorie")
     
     class Meta:
         ordering = ['nom']
@@ -250,9 +233,63 @@ class Categorie(models.Model):
         if self.parent:
             return f"{self.parent.nom} > {self.nom}"
         return self.nom
+
+    HIERARCHY_FIELDS = ('path', 'depth', 'nb_produits')
+
+    def save(self, *args, **kwargs):
+        from django.core.exceptions import ValidationError
+        from django.db import transaction
+        from django.db.models import Value
+        from django.db.models.functions import Concat, Substr
+
+        parent_path = '/'
+        if self.parent_id:
+            parent_path = Categorie.objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or '/'
+            if self.pk and f'/{self.pk}/' in parent_path:
+                raise ValidationError("Une catégorie ne peut pas être placée sous une de ses sous-catégories")
+        old_path = Categorie.objects.filter(pk=self.pk).values_list('path', flat=True).first() if self.pk else None
+
+        if not self._state.adding and not kwargs.get('update_fields') and not kwargs.get('force_insert'):
+            # Champs de hiérarchie gérés ici et par des UPDATE : ne pas écraser avec une instance périmée
+            kwargs['update_fields'] = [f.attname for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.attname not in self.HIERARCHY_FIELDS]
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            path = f'{parent_path}{self.pk}/'
+            depth = path.count('/') - 2
+            if path != old_path:
+                Categorie.objects.filter(pk=self.pk).update(path=path, depth=depth)
+                if old_path:
+                    # Déplacement : le sous-arbre suit
+                    Categorie.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                        path=Concat(Value(path), Substr('path', len(old_path) + 1)),
+                        depth=models.F('depth') + (depth - (old_path.count('/') - 2)),
+                    )
+            self.path, self.depth = path, depth
+
+    @classmethod
+    def recount_products(cls, ids):
+        """Recalcule nb_produits des catégories données (après des écritures en lot)"""
+        from django.db.models import Count, OuterRef, Subquery
+        from django.db.models.functions import Coalesce
+        ids = [pk for pk in set(ids) if pk]
+        if not ids:
+            return
+        actifs = Produit.objects.filter(categorie=OuterRef('pk'), is_active=True).order_by().values(
+            'categorie').annotate(n=Count('id')).values('n')
+        cls.objects.filter(id__in=ids).update(nb_produits=Coalesce(Subquery(actifs), 0))
     
     def get_full_path(self):
         """Retourne le chemin complet de la catégorie"""
+        if self.path:
+            # Ancêtres lus en une requête via le chemin matérialisé
+            from .categories import CategorieIndex
+            ids = [int(x) for x in self.path.strip('/').split('/') if x and int(x) != self.pk]
+            if not ids:
+                return self.nom
+            ancestors = list(Categorie.objects.filter(pk__in=ids).only('id', 'nom', 'parent', 'path', 'is_active'))
+            return CategorieIndex(ancestors + [self]).full_path(self.pk)
         path = [self.nom]
         parent = self.parent
         while parent:
@@ -260,19 +297,31 @@ class Categorie(models.Model):
             parent = parent.parent
         return " > ".join(path)
     
+    @classmethod
+    def full_path_map(cls, company=None):
+        """{id: chemin complet} des catégories de l'entreprise (CategorieIndex, mis en cache)"""
+        from .categories import CategorieIndex
+        from .config_cache import get_cached, company_scope
+        company_id = getattr(company, 'pk', company)
+
+        def load():
+            qs = cls.objects.filter(company_id=company_id) if company_id else cls.objects.all()
+            return CategorieIndex(qs.only('id', 'nom', 'parent', 'path', 'is_active')).full_paths()
+
+        return get_cached('categorie_paths', load, copy=False, scope=company_scope(company_id))
+
+    def subtree_index(self):
+        """Index (API.categories) du sous-arbre de la catégorie, en une requête"""
+        from .categories import CategorieIndex
+        return CategorieIndex(Categorie.objects.filter(path__startswith=self.path) if self.path else [self])
+
     def get_all_children(self):
-        """Retourne toutes les sous-catégories (récursif)"""
-        children = list(self.sous_categories.filter(is_active=True))
-        for child in list(children):
-            children.extend(child.get_all_children())
-        return children
+        """Retourne toutes les sous-catégories actives (récursif)"""
+        return self.subtree_index().descendants(self.pk)
     
     def get_products_count(self):
         """Nombre de produits dans cette catégorie et ses sous-catégories"""
-        count = self.produits.filter(is_active=True).count()
-        for child in self.sous_categories.filter(is_active=True):
-            count += child.get_products_count()
-        return count
+        return self.subtree_index().products_count(self.pk)
 
 #####################
 #   Types de Prix   #
@@ -550,10 +599,34 @@ class Client(models.Model):
                              help_text="Latitude GPS")
     lng = models.DecimalField(max_digits=10, decimal_places=7, null=True, blank=True,
                              help_text="Longitude GPS")
+    # Case de la grille spatiale (API.spatial) : floor(coordonnée / GRILLE_DEG)
+    grille_lat = models.IntegerField(null=True, blank=True, editable=False)
+    grille_lng = models.IntegerField(null=True, blank=True, editable=False)
+
+    # Taille d'une case en degrés (~1,1 km) ; la modifier impose de recalculer les cases
+    GRILLE_DEG = 0.01
+    GRILLE_FIELDS = ('grille_lat', 'grille_lng')
+
+    class Meta:
+        indexes = [models.Index(fields=['company', 'grille_lat', 'grille_lng'])]
 
     def __str__(self):
         return '{} {}'.format(self.nom, self.prenom)
 
+    @classmethod
+    def cellule(cls, lat, lng):
+        """Case (grille_lat, grille_lng) d'un point, ou (None, None) sans coordonnées"""
+        if lat is None or lng is None:
+            return None, None
+        return math.floor(float(lat) / cls.GRILLE_DEG), math.floor(float(lng) / cls.GRILLE_DEG)
+
+    def save(self, *args, **kwargs):
+        self.grille_lat, self.grille_lng = self.cellule(self.lat, self.lng)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'lat', 'lng'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | set(self.GRILLE_FIELDS)
+        super().save(*args, **kwargs)
+
 class Achat(models.Model):
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='achats',
                                null=True, blank=True,
@@ -719,6 +792,8 @@ class StockMove(models.Model):
 
     class Meta:
         ordering = ['-date', 'id']
+        # Pagination par curseur (API.pagination)
+        indexes = [models.Index(fields=['-date', '-id'], name='stockmove_date_id_idx')]
 
     def __str__(self):
         return f"{self.date.date()} {self.produit.reference} {self.delta} ({self.source} #{self.ref_id})"
@@ -860,8 +935,19 @@ class SystemConfig(models.Model):
         super().save(*args, **kwargs)
 
     @classmethod
-    def get_solo(cls):
-        obj, _ = cls.objects.get_or_create(pk=1)
+    def get_solo(cls, cached=True):
+        """Singleton mis en cache ; cached=False pour le relire avant modification"""
+        if not cached:
+            obj, _ = cls.objects.get_or_create(pk=1)
+            return obj
+        from .config_cache import get_cached
+        return get_cached('system_config', cls._load_solo)
+
+    @classmethod
+    def _load_solo(cls):
+        obj = cls.objects.select_related('default_currency').filter(pk=1).first()
+        if obj is None:
+            obj, _ = cls.objects.get_or_create(pk=1)
         return obj
 
     @classmethod
@@ -929,6 +1015,7 @@ class Vente(models.Model):
     class Meta:
         ordering = ['-date_vente', 'numero']
         unique_together = ['company', 'numero']
+        indexes = [models.Index(fields=['company', '-date_vente', '-id'], name='vente_company_date_id_idx')]
 
     def __str__(self):
         currency_symbol = self.currency.symbol if self.currency else Currency.get_default().symbol if Currency.get_default() else '€'
@@ -940,23 +1027,22 @@ class Vente(models.Model):
 
     def recompute_totals(self):
         """Recalculer les totaux en tenant compte des conversions de devises"""
+        from .exchange_rates import convert_many
         sale_currency = self.get_sale_currency()
         ht = Decimal('0')
-        
-        for ligne in self.lignes.all():
-            # Convertir le prix de chaque ligne dans la devise de la vente
-            if ligne.currency and ligne.currency != sale_currency:
-                converted_price = ExchangeRate.convert_amount(
-                    ligne.prixU_snapshot, ligne.currency, sale_currency, self.date_vente.date()
-                )
-                if converted_price is not None:
-                    ligne_total = converted_price * ligne.quantite
-                else:
-                    ligne_total = ligne.prixU_snapshot * ligne.quantite
-            else:
-                ligne_total = ligne.prixU_snapshot * ligne.quantite
-            
-            ht += ligne_total
+
+        # Prix des lignes convertis dans la devise de la vente en un appel
+        # (lignes sans devise ou sans taux: prix d'origine)
+        lignes = list(self.lignes.all())
+        converted = convert_many(
+            [ligne.prixU_snapshot for ligne in lignes],
+            [ligne.currency_id or sale_currency for ligne in lignes],
+            sale_currency, self.date_vente.date()
+        )
+        for ligne, converted_price in zip(lignes, converted):
+            if converted_price is None:
+                converted_price = ligne.prixU_snapshot
+            ht += converted_price * ligne.quantite
         
         # Appliquer la remise
         if self.remise_percent > 0:
@@ -1359,13 +1445,13 @@ class TransfertStock(models.Model):
     def save(self, *args, **kwargs):
         # Générer le numéro automatiquement
         if not self.numero:
-            from datetime import datetime
-            date_str = datetime.now().strftime('%Y%m%d')
-            # Compter les transferts du jour
-            count = TransfertStock.objects.filter(
-                numero__startswith=f'TRANS-{date_str}'
-            ).count() + 1
-            self.numero = f'TRANS-{date_str}-{count:04d}'
+            from django.db import transaction
+            from .numbering import next_numero
+            # Compteur du jour, attribué dans la transaction de l'enregistrement
+            with transaction.atomic():
+                self.numero = next_numero('transfert')
+                super().save(*args, **kwargs)
+            return
         super().save(*args, **kwargs)
 
     def valider(self, user):
@@ -1385,52 +1471,24 @@ class TransfertStock(models.Model):
             self.valideur = user
             self.save()
 
-            # Créer les mouvements de stock pour chaque ligne
-            for ligne in self.lignes.all():
-                # Sortie de l'entrepôt source
-                stock_source, _ = ProductStock.objects.get_or_create(
-                    produit=ligne.produit,
-                    warehouse=self.entrepot_source,
-                    defaults={'quantity': 0}
-                )
-
-                # Vérifier le stock disponible
-                if stock_source.quantity < ligne.quantite:
-                    raise ValidationError(
-                        f"Stock insuffisant pour {ligne.produit.designation}: "
-                        f"disponible={stock_source.quantity}, demandé={ligne.quantite}"
-                    )
-
-                stock_source.quantity -= ligne.quantite
-                stock_source.save()
-
-                # Mouvement de sortie
-                StockMove.objects.create(
-                    produit=ligne.produit,
-                    warehouse=self.entrepot_source,
-                    delta=-ligne.quantite,
-                    source='TRANS',
-                    ref_id=self.numero,
-                    note=f'Transfert vers {self.entrepot_destination.code}'
-                )
-
-                # Entrée dans l'entrepôt destination
-                stock_dest, _ = ProductStock.objects.get_or_create(
-                    produit=ligne.produit,
-                    warehouse=self.entrepot_destination,
-                    defaults={'quantity': 0}
-                )
-                stock_dest.quantity += ligne.quantite
-                stock_dest.save()
-
-                # Mouvement d'entrée
-                StockMove.objects.create(
-                    produit=ligne.produit,
-                    warehouse=self.entrepot_destination,
-                    delta=+ligne.quantite,
-                    source='TRANS',
-                    ref_id=self.numero,
-                    note=f'Transfert depuis {self.entrepot_source.code}'
+            # Sortie de l'entrepôt source et entrée dans l'entrepôt destination,
+            # appliquées en un lot (stock source vérifié sous verrou)
+            from .stock_ledger import StockLedger, StockInsuffisant
+            lignes = list(self.lignes.select_related('produit'))
+            ledger = StockLedger(check='warehouse', refresh=None)
+            for ligne in lignes:
+                ledger.add(ligne.produit, self.entrepot_source, -ligne.quantite, 'TRANS', self.numero,
+                           f'Transfert vers {self.entrepot_destination.code}')
+                ledger.add(ligne.produit, self.entrepot_destination, ligne.quantite, 'TRANS', self.numero,
+                           f'Transfert depuis {self.entrepot_source.code}')
+            try:
+                ledger.apply()
+            except StockInsuffisant as e:
+                designations = {l.produit_id: l.produit.designation for l in lignes}
+                manque = e.lignes[0]
+                raise ValidationError(
+                    f"Stock insuffisant pour {designations[manque['produit']]}: "
+                    f"disponible={manque['stock']}, demandé={manque['demande']}"
                 )
 
     def annuler(self, user, motif):
@@ -1493,6 +1551,270 @@ class LigneTransfertStock(models.Model):
             return 0
 
 
+#####################
+#  Tableau de bord  #
+#####################
+class DashboardSnapshot(models.Model):
+    """
+    Compteurs du tableau de bord matérialisés par entreprise.
+    Maintenus incrémentalement par les signaux (voir API/dashboard.py) afin que
+    /API/prod/count/ se résume à une seule lecture.
+    """
+    company = models.OneToOneField(Company, on_delete=models.CASCADE, related_name='dashboard_snapshot')
+
+    produits_count = models.IntegerField(default=0)
+    clients_count = models.IntegerField(default=0)
+    fournisseurs_count = models.IntegerField(default=0)
+    achats_count = models.IntegerField(default=0)
+    ventes_count = models.IntegerField(default=0)
+    ventes_aujourd_hui = models.IntegerField(default=0)
+    ca_total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    ca_mois = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    produits_stock_bas = models.IntegerField(default=0)
+    produits_stock_critique = models.IntegerField(default=0)
+    produits_rupture = models.IntegerField(default=0)
+
+    # Période couverte par ventes_aujourd_hui / ca_mois
+    jour_reference = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Instantané tableau de bord"
+        verbose_name_plural = "Instantanés tableau de bord"
+
+    def __str__(self):
+        return f"Tableau de bord {self.company} ({self.jour_reference})"
+
+
+class DailySalesRollup(models.Model):
+    """
+    Agrégat journalier des ventes terminées (entreprise × jour × entrepôt × type de paiement).
+    Tenu à jour par API/rollups.py (variations F()), reconstruit par build_rollups.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='sales_rollups')
+    jour = models.DateField()
+    warehouse = models.ForeignKey('Warehouse', on_delete=models.CASCADE, null=True, blank=True,
+                                  related_name='sales_rollups')
+    type_paiement = models.CharField(max_length=10)
+    nb_ventes = models.IntegerField(default=0)
+    total_ht = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    total_ttc = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['jour']
+        indexes = [models.Index(fields=['company', 'jour'])]
+        constraints = [
+            # Entreprise et entrepôt peuvent être NULL : clés comparées via COALESCE
+            models.UniqueConstraint(Coalesce('company', models.Value(0)), models.F('jour'),
+                                    Coalesce('warehouse', models.Value(0)),
+                                    models.F('type_paiement'), name='uniq_daily_sales_rollup'),
+        ]
+        verbose_name = "Agrégat journalier des ventes"
+        verbose_name_plural = "Agrégats journaliers des ventes"
+
+    def __str__(self):
+        return f"{self.jour} {self.type_paiement}: {self.nb_ventes} vente(s)"
+
+
+class DailyProductRollup(models.Model):
+    """
+    Agrégat journalier par produit (entreprise × jour × entrepôt × produit):
+    quantités vendues, CA des lignes, entrées et sorties de stock.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='product_rollups')
+    jour = models.DateField()
+    warehouse = models.ForeignKey('Warehouse', on_delete=models.CASCADE, null=True, blank=True,
+                                  related_name='product_rollups')
+    produit = models.ForeignKey(Produit, on_delete=models.CASCADE, related_name='daily_rollups')
+    qte_vendue = models.IntegerField(default=0)
+    ca = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    entrees = models.IntegerField(default=0)
+    sorties = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['jour']
+        indexes = [models.Index(fields=['company', 'jour'])]
+        constraints = [
+            models.UniqueConstraint(Coalesce('company', models.Value(0)), models.F('jour'),
+                                    Coalesce('warehouse', models.Value(0)),
+                                    models.F('produit'), name='uniq_daily_product_rollup'),
+        ]
+        verbose_name = "Agrégat journalier produit"
+        verbose_name_plural = "Agrégats journaliers produits"
+
+    def __str__(self):
+        return f"{self.jour} {self.produit_id}: vendu {self.qte_vendue}, +{self.entrees}/-{self.sorties}"
+
+
+#####################
+#  Rapports différés #
+#####################
+def report_artifact_storage():
+    """Stockage des fichiers de rapports générés (hors MEDIA_ROOT)"""
+    import os
+    from django.conf import settings
+    from django.core.files.storage import FileSystemStorage
+    location = getattr(settings, 'REPORT_ARTIFACTS_ROOT', os.path.join(settings.BASE_DIR, 'report_artifacts'))
+    return FileSystemStorage(location=location)
+
+
+class ReportJob(models.Model):
+    """
+    Génération de rapport exécutée hors requête par la commande run_report_worker.
+    Le client crée le job, interroge sa progression puis télécharge le fichier
+    tant qu'il n'a pas expiré.
+    """
+    TYPES = (
+        ('stock_valuation', 'Valorisation du stock'),
+        ('sales', 'Rapport des ventes'),
+        ('inventory', 'Inventaire complet'),
+    )
+    FORMATS = (
+        ('excel', 'Excel'),
+        ('csv', 'CSV'),
+        ('pdf', 'PDF'),
+    )
+    STATUTS = (
+        ('pending', 'En attente'),
+        ('running', 'En cours'),
+        ('done', 'Terminé'),
+        ('failed', 'Échec'),
+    )
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='report_jobs')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='report_jobs')
+    report_type = models.CharField(max_length=30, choices=TYPES)
+    format = models.CharField(max_length=10, choices=FORMATS, default='excel')
+    params = models.JSONField(default=dict, blank=True)
+
+    statut = models.CharField(max_length=10, choices=STATUTS, default='pending')
+    progress = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    artifact = models.FileField(upload_to='%Y/%m/', storage=report_artifact_storage, null=True, blank=True)
+    filename = models.CharField(max_length=200, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Heartbeat : mis à jour à chaque paquet de lignes pendant la génération
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['statut', 'created_at'])]
+        verbose_name = "Job de rapport"
+        verbose_name_plural = "Jobs de rapports"
+
+    def __str__(self):
+        return f"{self.get_report_type_display()} ({self.format}) - {self.statut}"
+
+
+#####################
+#  Imports différés  #
+#####################
+def import_file_storage():
+    """Stockage des fichiers importés et des rapports d'erreurs (hors MEDIA_ROOT)"""
+    import os
+    from django.conf import settings
+    from django.core.files.storage import FileSystemStorage
+    location = getattr(settings, 'IMPORT_FILES_ROOT', os.path.join(settings.BASE_DIR, 'import_files'))
+    return FileSystemStorage(location=location)
+
+
+class ImportJob(models.Model):
+    """
+    Import de fichier traité par blocs par la commande run_import_worker.
+    Chaque bloc est validé dans sa propre transaction avec last_row : après un
+    arrêt, le job reprend au premier bloc non validé.
+    """
+    TYPES = (
+        ('products', 'Produits'),
+    )
+    STATUTS = (
+        ('pending', 'En attente'),
+        ('running', 'En cours'),
+        ('done', 'Terminé'),
+        ('failed', 'Échec'),
+    )
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='import_jobs')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='import_jobs')
+    import_type = models.CharField(max_length=20, choices=TYPES, default='products')
+    source = models.FileField(upload_to='sources/%Y/%m/', storage=import_file_storage)
+    original_name = models.CharField(max_length=200, blank=True)
+
+    statut = models.CharField(max_length=10, choices=STATUTS, default='pending')
+    total_rows = models.PositiveIntegerField(null=True, blank=True)
+    last_row = models.PositiveIntegerField(default=0, help_text="Lignes de données déjà validées (point de reprise)")
+    created_count = models.PositiveIntegerField(default=0)
+    updated_count = models.PositiveIntegerField(default=0)
+    skipped_count = models.PositiveIntegerField(default=0)
+    errors_count = models.PositiveIntegerField(default=0)
+    errors_file = models.FileField(upload_to='errors/%Y/%m/', storage=import_file_storage, null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['statut', 'created_at'])]
+        verbose_name = "Job d'import"
+        verbose_name_plural = "Jobs d'import"
+
+    def __str__(self):
+        return f"{self.get_import_type_display()} {self.original_name} - {self.statut}"
+
+    @property
+    def progress(self):
+        if self.statut == 'done':
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(99, int(self.last_row * 100 / self.total_rows))
+
+
+##############################
+# Numérotation des documents #
+##############################
+class DocumentSequence(models.Model):
+    """
+    Compteur de numérotation (entreprise × type de document × période).
+    Incrémenté par API.numbering.next_numero dans la transaction du document :
+    pas de comptage de table, pas de doublon sous charge, pas de trou si la
+    création est annulée. company est nul pour les numéros uniques globalement.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='document_sequences')
+    doc_type = models.CharField(max_length=30)
+    period = models.CharField(max_length=8, blank=True, help_text="Période du compteur (AAAA, AAAAMMJJ ou vide)")
+    last_value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'doc_type', 'period'], name='uniq_document_sequence'),
+            # NULL n'est pas comparable en SQL : contrainte dédiée aux compteurs globaux
+            models.UniqueConstraint(fields=['doc_type', 'period'], condition=models.Q(company__isnull=True),
+                                    name='uniq_document_sequence_global'),
+        ]
+        verbose_name = "Séquence de documents"
+        verbose_name_plural = "Séquences de documents"
+
+    def __str__(self):
+        return f"{self.doc_type} {self.period or '-'} = {self.last_value} ({self.company_id or 'global'})"
+
+
 #####################
 # Permissions Pages #
 #####################
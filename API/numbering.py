@@ -0,0 +1,115 @@
+"""
+Numérotation des documents (ventes, factures, BL, inventaires, transferts...).
+
+Chaque numéro provient d'une ligne DocumentSequence (entreprise × type ×
+période) incrémentée par UPDATE ... F() + 1 : la ligne reste verrouillée
+jusqu'au commit de la transaction appelante, les créations concurrentes
+attendent au lieu de se disputer le même numéro, et une création annulée
+rend son numéro. À la première utilisation d'un compteur, il repart du plus
+grand numéro déjà attribué (seul balayage de table, une fois par période).
+
+Les types sans préfixe sont des compteurs numériques (jetons de
+synchronisation, API.sync_changes) : next_value seul, repris du maximum du
+champ.
+"""
+import re
+from collections import namedtuple
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .models import DocumentSequence
+
+DocumentType = namedtuple('DocumentType', 'model field prefix period width per_company')
+
+PERIOD_FORMATS = {None: '', 'year': '%Y', 'day': '%Y%m%d'}
+
+# Les numéros uniques globalement (unique=True) utilisent un compteur global
+DOCUMENT_TYPES = {
+    'vente': DocumentType('API.Vente', 'numero', 'VTE-', None, 5, True),
+    'facture': DocumentType('API.Facture', 'numero', 'FA-', None, 5, True),
+    'bon_livraison': DocumentType('API.BonLivraison', 'numero', 'BL-', None, 5, True),
+    'inventaire': DocumentType('API.InventorySession', 'numero', 'INV-{period}-', 'year', 4, True),
+    'transfert': DocumentType('API.TransfertStock', 'numero', 'TRANS-{period}-', 'day', 4, False),
+    'tournee': DocumentType('API.Tournee', 'numero', 'TOUR-{period}-', 'day', 3, False),
+    'commande': DocumentType('API.CommandeClient', 'reference', 'CMD-{period}-', 'day', 4, False),
+    'tournee_mobile': DocumentType('API.TourneeMobile', 'numero_tournee', 'TM-{period}-', 'day', 4, False),
+    'sync_change': DocumentType('API.SyncChange', 'sequence', None, None, 0, True),
+}
+
+
+def _period(spec, date):
+    if spec.period is None:
+        return ''
+    if date is None:
+        date = timezone.localdate()
+    elif hasattr(date, 'tzinfo') and timezone.is_aware(date):
+        date = timezone.localtime(date)
+    return date.strftime(PERIOD_FORMATS[spec.period])
+
+
+def _seed(spec, company_id, prefix):
+    """Plus grand numéro existant pour ce préfixe (reprise des données antérieures)"""
+    model = apps.get_model(spec.model)
+    qs = model.objects.all() if spec.prefix is None else model.objects.filter(**{f'{spec.field}__startswith': prefix})
+    if spec.per_company:
+        qs = qs.filter(company_id=company_id) if company_id else qs.filter(company__isnull=True)
+    if spec.prefix is None:
+        return qs.aggregate(best=Max(spec.field))['best'] or 0
+    pattern = re.compile(re.escape(prefix) + r'(\d+)$')
+    best = 0
+    for value in qs.values_list(spec.field, flat=True).iterator():
+        match = pattern.match(value or '')
+        if match:
+            best = max(best, int(match.group(1)))
+    return best
+
+
+def next_value(doc_type, company=None, period='', count=1):
+    """
+    Incrémente le compteur de `count` et retourne la dernière valeur réservée ;
+    à appeler dans la transaction du document
+    """
+    spec = DOCUMENT_TYPES[doc_type]
+    company_id = getattr(company, 'pk', company) if spec.per_company else None
+    lookup = {'doc_type': doc_type, 'period': period}
+    if company_id:
+        lookup['company_id'] = company_id
+    else:
+        lookup['company__isnull'] = True
+
+    with transaction.atomic():
+        while True:
+            if DocumentSequence.objects.filter(**lookup).update(last_value=F('last_value') + count):
+                return DocumentSequence.objects.filter(**lookup).values_list('last_value', flat=True).get()
+            prefix = spec.prefix.format(period=period) if spec.prefix is not None else None
+            value = _seed(spec, company_id, prefix) + count
+            try:
+                with transaction.atomic():
+                    DocumentSequence.objects.create(company_id=company_id or None, doc_type=doc_type,
+                                                    period=period, last_value=value)
+                return value
+            except IntegrityError:
+                # Compteur créé en parallèle : l'incrémenter
+                continue
+
+
+def next_numero(doc_type, company=None, date=None):
+    """Numéro formaté du prochain document (ex: VTE-00042, TRANS-20250107-0003)"""
+    spec = DOCUMENT_TYPES[doc_type]
+    period = _period(spec, date)
+    value = next_value(doc_type, company, period)
+    return f'{spec.prefix.format(period=period)}{value:0{spec.width}d}'
+
+
+def next_numeros(doc_type, count, company=None, date=None):
+    """`count` numéros consécutifs réservés en un seul incrément du compteur"""
+    if count <= 0:
+        return []
+    spec = DOCUMENT_TYPES[doc_type]
+    period = _period(spec, date)
+    last = next_value(doc_type, company, period, count)
+    prefix = spec.prefix.format(period=period)
+    return [f'{prefix}{value:0{spec.width}d}' for value in range(last - count + 1, last + 1)]
@@ -0,0 +1,139 @@
+"""
+Pagination par curseur (keyset) sur (date, id) pour les tables en ajout seul
+(mouvements de stock, journal d'audit, ventes, ventes tournée, logs de sync).
+
+La page suivante est lue par WHERE (date, id) < (curseur) ORDER BY date DESC,
+id DESC LIMIT n : pas d'OFFSET, le coût d'une page ne dépend pas de sa
+position et un index composite (date, id) sert directement la requête.
+
+Le curseur est opaque (base64 de la date et de l'id de la dernière ligne).
+Les listes web sont toujours paginées : KEYSET_PAGE_SIZE lignes par défaut
+(100), ?page_size= choisit la taille, bornée à KEYSET_MAX_PAGE_SIZE (500).
+Les endpoints de l'app mobile utilisent OptInKeysetPagination : sans
+?page_size= ni ?cursor=, ils gardent leur réponse historique (liste simple).
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+DEFAULT_PAGE_SIZE = 100
+
+
+def default_page_size():
+    return getattr(settings, 'KEYSET_PAGE_SIZE', DEFAULT_PAGE_SIZE)
+
+
+def max_page_size():
+    return getattr(settings, 'KEYSET_MAX_PAGE_SIZE', 500)
+
+
+def encode_cursor(value, pk):
+    raw = json.dumps({'d': value.isoformat(), 'i': pk}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(date, id) du curseur ; ValueError si le curseur est invalide"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        value, pk = parse_datetime(data['d']), int(data['i'])
+    except (TypeError, KeyError, ValueError, AttributeError) as e:
+        raise ValueError(str(e))
+    if value is None:
+        raise ValueError('date invalide')
+    return value, pk
+
+
+def parse_page_size(value, default=None):
+    """Taille demandée (KEYSET_PAGE_SIZE à défaut) bornée à [1, KEYSET_MAX_PAGE_SIZE]"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        size = default or default_page_size()
+    return max(1, min(size, max_page_size()))
+
+
+def keyset_page(queryset, field, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Lignes suivant `cursor` (les plus récentes d'abord) et curseur de la page
+    suivante (None en fin de liste). Lève ValueError si le curseur est invalide.
+    """
+    queryset = queryset.order_by(f'-{field}', '-pk')
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk}))
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.pk)
+    return rows, next_cursor
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pagination DRF sur (cursor_field, id), cursor_field étant défini par la vue
+    (ex: cursor_field = 'date') ou par le paginateur. Réponse :
+    {next, next_cursor, results}.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    cursor_field = 'date'
+    paginate_by_default = True
+
+    def is_requested(self, request):
+        """Vrai si le client demande une page (?page_size= ou ?cursor=)"""
+        params = request.query_params
+        return self.page_size_query_param in params or self.cursor_query_param in params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not (self.paginate_by_default or self.is_requested(request)):
+            return None
+        params = request.query_params
+        self.request = request
+        field = getattr(view, 'cursor_field', None) or self.cursor_field
+        size = parse_page_size(params.get(self.page_size_query_param))
+        try:
+            rows, self.next_cursor = keyset_page(queryset, field, params.get(self.cursor_query_param), size)
+        except ValueError:
+            raise NotFound('Curseur invalide')
+        return rows
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'next_cursor': self.next_cursor,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'next_cursor': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class OptInKeysetPagination(KeysetPagination):
+    """
+    Pagination keyset activée seulement par ?page_size= ou ?cursor= : sans ces
+    paramètres la vue renvoie la liste simple attendue par l'app mobile.
+    """
+    paginate_by_default = False
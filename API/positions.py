@@ -0,0 +1,232 @@
+"""
+Positions GPS des livreurs.
+
+Le mobile envoie ses points par lots : ils sont ajoutés à PositionLivreur en
+un bulk_create et seul le point le plus récent met à jour la position
+courante du livreur (un UPDATE par lot). La dernière position de chaque
+livreur est aussi gardée dans le cache Django (une clé par livreur et un
+index des livreurs par entreprise) : la carte (API.map_view) la lit sans
+requête tant que le cache est chaud, et la reconstruit depuis la base sinon.
+L'index n'est jamais réécrit par l'ingestion : un livreur absent de l'index
+incrémente (cache.incr, atomique) la génération de l'entreprise, et un index
+construit avant cette génération n'est plus lu.
+
+Les traces anciennes sont sous-échantillonnées par downsample_positions
+(commande downsample_positions) : un point par livreur et par intervalle.
+Chaque passage ne relit que la fenêtre pas encore traitée.
+"""
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q, Min
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .distribution_models import LivreurDistribution, PositionLivreur
+
+GPS_PRECISION = Decimal('0.0000001')
+
+
+def _timeout():
+    return getattr(settings, 'POSITION_CACHE_TIMEOUT', 24 * 3600)
+
+
+def max_points():
+    return getattr(settings, 'POSITION_BATCH_MAX', 1000)
+
+
+def _entry_key(livreur_id):
+    return f'positions:livreur:{livreur_id}'
+
+
+def _index_key(company_id):
+    return f'positions:index:{company_id or "all"}'
+
+
+def _generation_key(company_id):
+    return f'positions:generation:{company_id or "all"}'
+
+
+def _generation(company_id):
+    key = _generation_key(company_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def _new_generation(company_id):
+    key = _generation_key(company_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def livreur_company_id(livreur):
+    """Entreprise du livreur (via le profil de son utilisateur), ou None"""
+    user = livreur.user if livreur.user_id else None
+    profile = getattr(user, 'profile', None) if user is not None else None
+    return profile.company_id if profile is not None else None
+
+
+def _entry(livreur, lat, lng, when):
+    return {
+        'id': livreur.id,
+        'nom': livreur.nom,
+        'matricule': livreur.matricule,
+        'lat': float(lat),
+        'lng': float(lng),
+        'last_update': when.isoformat() if when else None,
+        'statut': livreur.statut,
+    }
+
+
+def _coordinate(value, limit):
+    value = Decimal(str(value)).quantize(GPS_PRECISION, rounding=ROUND_HALF_UP)
+    if not -limit <= value <= limit:
+        raise ValueError(f'{value} hors de [-{limit}, {limit}]')
+    return value
+
+
+def parse_points(raw_points):
+    """Points valides triés par horodatage, et nombre de points rejetés"""
+    now = timezone.now()
+    points, rejected = [], 0
+    for raw in raw_points:
+        try:
+            horodatage = raw.get('timestamp') or raw.get('horodatage')
+            if horodatage is None:
+                horodatage = now
+            elif not isinstance(horodatage, str) or parse_datetime(horodatage) is None:
+                raise ValueError('horodatage invalide')
+            else:
+                horodatage = parse_datetime(horodatage)
+            if timezone.is_naive(horodatage):
+                horodatage = timezone.make_aware(horodatage)
+            precision = raw.get('precision')
+            vitesse = raw.get('vitesse')
+            points.append({
+                'lat': _coordinate(raw['lat'], 90),
+                'lng': _coordinate(raw['lng'], 180),
+                'horodatage': min(horodatage, now),
+                'precision_m': float(precision) if precision is not None else None,
+                'vitesse_kmh': float(vitesse) if vitesse is not None else None,
+            })
+        except (KeyError, TypeError, ValueError, ArithmeticError, AttributeError):
+            rejected += 1
+    points.sort(key=lambda p: p['horodatage'])
+    return points, rejected
+
+
+def ingest_points(livreur, raw_points):
+    """
+    Enregistre un lot de points du livreur : deux requêtes quel que soit le
+    nombre de points. Retourne {accepted, rejected, last}.
+    """
+    points, rejected = parse_points(raw_points)
+    if not points:
+        return {'accepted': 0, 'rejected': rejected, 'last': None}
+
+    company_id = livreur_company_id(livreur)
+    PositionLivreur.objects.bulk_create([
+        PositionLivreur(livreur=livreur, company_id=company_id, **point) for point in points
+    ])
+
+    last = points[-1]
+    # Un lot en retard (réseau) ne fait pas reculer la position courante
+    moved = LivreurDistribution.objects.filter(pk=livreur.pk).filter(
+        Q(last_location_update__isnull=True) | Q(last_location_update__lte=last['horodatage'])
+    ).update(current_lat=last['lat'], current_lng=last['lng'], last_location_update=last['horodatage'])
+    if moved:
+        livreur.current_lat, livreur.current_lng = last['lat'], last['lng']
+        livreur.last_location_update = last['horodatage']
+        _remember(livreur, company_id, _entry(livreur, last['lat'], last['lng'], last['horodatage']))
+
+    return {'accepted': len(points), 'rejected': rejected, 'last': {
+        'lat': float(livreur.current_lat), 'lng': float(livreur.current_lng),
+        'last_update': livreur.last_location_update,
+    }}
+
+
+def _remember(livreur, company_id, entry):
+    cache.set(_entry_key(livreur.pk), entry, _timeout())
+    for scope in {company_id, None}:
+        index = cache.get(_index_key(scope))
+        # Nouveau livreur sur la carte : l'index sera reconstruit depuis la base
+        if index is None or livreur.pk not in index['ids']:
+            _new_generation(scope)
+
+
+def last_positions(company_id=None):
+    """Dernière position des livreurs (de l'entreprise, ou tous), triés par nom"""
+    # Génération lue avant la base : un livreur ajouté pendant la reconstruction la rend périmée
+    generation = _generation(company_id)
+    index = cache.get(_index_key(company_id))
+    if index is not None and index['generation'] == generation:
+        entries = cache.get_many([_entry_key(pk) for pk in index['ids']])
+        if len(entries) == len(index['ids']):
+            return sorted(entries.values(), key=lambda e: (e['nom'], e['id']))
+    return _rebuild(company_id, generation)
+
+
+def _rebuild(company_id, generation):
+    livreurs = LivreurDistribution.objects.filter(current_lat__isnull=False, current_lng__isnull=False)
+    if company_id:
+        livreurs = livreurs.filter(user__profile__company_id=company_id)
+    entries = {
+        _entry_key(l.pk): _entry(l, l.current_lat, l.current_lng, l.last_location_update)
+        for l in livreurs.order_by('nom', 'id')
+    }
+    cache.set_many(entries, _timeout())
+    cache.set(_index_key(company_id), {'generation': generation, 'ids': {e['id'] for e in entries.values()}},
+              _timeout())
+    return list(entries.values())
+
+
+def downsample_positions(before, interval_seconds=300, livreur_id=None):
+    """
+    Garde un point par livreur et par intervalle de interval_seconds pour les
+    positions antérieures à `before`. Seule la fenêtre pas encore traitée est
+    lue : depuis le plus ancien point non sous-échantillonné (points arrivés en
+    retard compris), ramené au début de son intervalle pour retrouver le point
+    déjà gardé. Retourne le nombre de points supprimés.
+    """
+    qs = PositionLivreur.objects.filter(horodatage__lt=before)
+    if livreur_id is not None:
+        qs = qs.filter(livreur_id=livreur_id)
+    a_traiter = qs.filter(sous_echantillonne=False)
+    debut = a_traiter.aggregate(debut=Min('horodatage'))['debut']
+    if debut is None:
+        return 0
+    debut = datetime.fromtimestamp(int(debut.timestamp()) // interval_seconds * interval_seconds, tz=dt_timezone.utc)
+
+    doublons, seen = [], set()
+    for pk, livreur, horodatage in qs.filter(horodatage__gte=debut).order_by(
+            'livreur_id', 'horodatage', 'id').values_list('id', 'livreur_id', 'horodatage').iterator():
+        bucket = (livreur, int(horodatage.timestamp()) // interval_seconds)
+        if bucket in seen:
+            doublons.append(pk)
+        else:
+            seen.add(bucket)
+    for start in range(0, len(doublons), 1000):
+        PositionLivreur.objects.filter(id__in=doublons[start:start + 1000]).delete()
+    a_traiter.update(sous_echantillonne=True)
+    return len(doublons)
+
+
+def default_downsample_before():
+    return timezone.now() - timedelta(days=getattr(settings, 'POSITION_FULL_HISTORY_DAYS', 7))
+
+
+@receiver(post_save, sender=LivreurDistribution)
+@receiver(post_delete, sender=LivreurDistribution)
+def _livreur_changed(sender, instance, **kwargs):
+    # Nom/statut/position modifiés hors ingestion : relu depuis la base au prochain affichage
+    cache.delete(_entry_key(instance.pk))
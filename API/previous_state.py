@@ -0,0 +1,34 @@
+"""
+État précédent d'une ligne avant sa sauvegarde, lu une seule fois.
+
+Plusieurs modules (tableau de bord, catégories, agrégats journaliers, journal
+de synchronisation) comparent l'ancienne et la nouvelle valeur d'une ligne.
+Chacun déclare les champs dont il a besoin avec track(modèle, champs) ; un
+seul receiver pre_save par modèle lit l'union de ces champs en une requête et
+la garde sur l'instance, où les receivers post_save la retrouvent avec
+previous(instance).
+"""
+from django.db.models.signals import pre_save
+
+_FIELDS = {}
+
+
+def _remember(sender, instance, raw=False, **kwargs):
+    instance._previous_state = None
+    if not raw and instance.pk:
+        instance._previous_state = sender.objects.filter(pk=instance.pk).values(*_FIELDS[sender]).first()
+
+
+def track(model, fields):
+    """Ajoute des champs à l'état précédent lu avant chaque sauvegarde de `model`"""
+    if model not in _FIELDS:
+        _FIELDS[model] = set()
+        pre_save.connect(_remember, sender=model, dispatch_uid=f'previous_state:{model._meta.label}')
+    _FIELDS[model].update(fields)
+
+
+def previous(instance, created=False):
+    """{champ: valeur} de la ligne avant la sauvegarde (None si créée ou inconnue)"""
+    if created:
+        return None
+    return getattr(instance, '_previous_state', None)
@@ -0,0 +1,221 @@
+"""
+Import de produits par lots (ensembles, pas ligne à ligne).
+
+La validation est faite colonne par colonne avec pandas, les catégories et
+fournisseurs sont résolus avec un dictionnaire préchargé, puis chaque lot est
+séparé en créations/mises à jour avec une seule requête reference__in et
+appliqué par bulk_create/bulk_update dans sa propre transaction courte.
+"""
+from decimal import Decimal
+
+import pandas as pd
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Produit, Categorie, Fournisseur
+from .sync_changes import record_many
+
+IMPORT_BATCH_SIZE = 1000
+
+# bulk_update génère un CASE WHEN par champ : des requêtes plus courtes restent rapides
+UPDATE_BATCH_SIZE = 200
+
+TEXT_COLUMNS = ('reference', 'designation', 'code_barre', 'description', 'unite_mesure',
+                'categorie', 'fournisseur')
+
+INTEGER_FIELDS = ('quantite', 'seuil_alerte', 'seuil_critique')
+
+# Anciens noms de colonnes (template d'import) -> champ du modèle
+COLUMN_ALIASES = {'stock_min': 'seuil_alerte'}
+
+MAX_PRICE = Decimal('999999.99')
+
+
+def _scope(queryset, company):
+    if company is None:
+        return queryset.filter(company__isnull=True)
+    return queryset.filter(company=company)
+
+
+class ProductImporter:
+    """
+    Importe des DataFrames de produits pour une entreprise.
+    Les numéros de ligne des erreurs sont calculés à partir de l'index du
+    DataFrame (ligne 1 = en-tête), ce qui reste vrai pour un fichier lu par blocs.
+    """
+
+    def __init__(self, company=None, batch_size=IMPORT_BATCH_SIZE):
+        self.company = company
+        self.batch_size = batch_size
+        self.categories = {}
+        for cat_id, nom in _scope(Categorie.objects, company).order_by('id').values_list('id', 'nom'):
+            self.categories.setdefault(nom.strip().lower(), cat_id)
+        self.fournisseurs = {}
+        for four_id, libelle in _scope(Fournisseur.objects, company).order_by('id').values_list('id', 'libelle'):
+            self.fournisseurs.setdefault(libelle.strip().lower(), four_id)
+        self.stats = {'created': 0, 'updated': 0, 'skipped': 0, 'total': 0}
+        self.errors = []
+
+    def result(self):
+        return {'stats': dict(self.stats), 'errors': sorted(self.errors, key=lambda e: e['row'])}
+
+    def drain(self):
+        """Retourne le résultat accumulé puis le remet à zéro (traitement par blocs)"""
+        result = self.result()
+        self.stats = dict.fromkeys(self.stats, 0)
+        self.errors = []
+        return result
+
+    def _error(self, rows, message):
+        for row in rows:
+            self.errors.append({'row': int(row) + 2, 'message': message})
+
+    def validate(self, df):
+        """Retourne le DataFrame des lignes valides, colonnes normalisées et clés résolues"""
+        df = df.copy()
+        for col in TEXT_COLUMNS + ('prixU',) + INTEGER_FIELDS + tuple(COLUMN_ALIASES):
+            if col not in df.columns:
+                df[col] = ''
+        df = df.fillna('')
+        for col in TEXT_COLUMNS + ('prixU',):
+            df[col] = df[col].astype(str).str.strip()
+
+        rejected = pd.Series(False, index=df.index)
+
+        def reject(mask, message):
+            mask = mask & ~rejected
+            self._error(df.index[mask], message)
+            rejected[mask] = True
+
+        reject(df['reference'] == '', 'Référence manquante')
+        reject(df['designation'] == '', 'Désignation manquante')
+        reject(df['prixU'] == '', 'Prix manquant')
+        prix = pd.to_numeric(df['prixU'], errors='coerce')
+        reject(prix.isna() | (prix <= 0) | (prix > float(MAX_PRICE)), 'Prix invalide: le prix doit être un nombre positif')
+
+        # Dernière occurrence d'une référence retenue (comme des mises à jour successives)
+        reject(df['reference'].where(~rejected).duplicated(keep='last'), 'Référence en double dans le fichier (dernière ligne retenue)')
+        with_code = (df['code_barre'] != '') & ~rejected
+        reject(with_code & df['code_barre'].where(with_code).duplicated(keep='first'), 'Code-barres en double dans le fichier')
+
+        # Clés étrangères résolues par dictionnaire : erreur signalée mais ligne conservée
+        df['categorie_id'] = df['categorie'].str.lower().map(self.categories)
+        unknown = (df['categorie'] != '') & df['categorie_id'].isna() & ~rejected
+        for idx in df.index[unknown]:
+            self._error([idx], f'Catégorie "{df.at[idx, "categorie"]}" introuvable')
+        df['fournisseur_id'] = df['fournisseur'].str.lower().map(self.fournisseurs)
+        unknown = (df['fournisseur'] != '') & df['fournisseur_id'].isna() & ~rejected
+        for idx in df.index[unknown]:
+            self._error([idx], f'Fournisseur "{df.at[idx, "fournisseur"]}" introuvable')
+
+        for field in INTEGER_FIELDS:
+            df[field] = pd.to_numeric(df[field], errors='coerce')
+        for alias, field in COLUMN_ALIASES.items():
+            # La colonne au nom du modèle a priorité sur l'alias
+            df[field] = df[field].fillna(pd.to_numeric(df[alias], errors='coerce'))
+
+        self.stats['skipped'] += int(rejected.sum())
+        return df[~rejected]
+
+    def _row_values(self, row):
+        """Champs à écrire pour une ligne (les colonnes vides ne modifient rien)"""
+        data = {
+            'designation': row.designation,
+            'prixU': Decimal(row.prixU).quantize(Decimal('0.01')),
+        }
+        for field in ('code_barre', 'description', 'unite_mesure'):
+            value = getattr(row, field)
+            if value:
+                data[field] = value
+        for field in INTEGER_FIELDS:
+            value = getattr(row, field)
+            if pd.notna(value):
+                data[field] = int(value)
+        if pd.notna(row.categorie_id):
+            data['categorie_id'] = int(row.categorie_id)
+        if pd.notna(row.fournisseur_id):
+            data['fournisseur_id'] = int(row.fournisseur_id)
+        return data
+
+    def _apply_batch(self, batch):
+        refs = batch['reference'].tolist()
+        existing = {p.reference: p for p in _scope(Produit.objects, self.company).filter(reference__in=refs)}
+        # Les références servent de code-barres par défaut aux nouveaux produits
+        codes = [c for c in set(batch['code_barre']) | set(refs) if c]
+        taken = dict(_scope(Produit.objects, self.company).filter(code_barre__in=codes).values_list('code_barre', 'reference'))
+
+        now = timezone.now()
+        to_create, to_update = [], []
+        changed_fields, unchanged = set(), 0
+        # Catégories dont le nombre de produits actifs peut changer
+        categories = set()
+        for row in batch.itertuples():
+            data = self._row_values(row)
+            owner = taken.get(data.get('code_barre'))
+            if owner is not None and owner != row.reference:
+                self._error([row.Index], f'Code-barres "{data["code_barre"]}" déjà utilisé par le produit {owner}')
+                self.stats['skipped'] += 1
+                continue
+
+            produit = existing.get(row.reference)
+            if produit is None:
+                if 'categorie_id' not in data:
+                    self._error([row.Index], 'Catégorie requise pour un nouveau produit')
+                    self.stats['skipped'] += 1
+                    continue
+                # Sans code-barres, la référence en tient lieu (unique par entreprise)
+                data.setdefault('code_barre', row.reference)
+                if taken.get(data['code_barre'], row.reference) != row.reference:
+                    self._error([row.Index], f'Code-barres "{data["code_barre"]}" déjà utilisé')
+                    self.stats['skipped'] += 1
+                    continue
+                to_create.append(Produit(company=self.company, reference=row.reference, **data))
+                categories.add(data['categorie_id'])
+            else:
+                changed = {field for field, value in data.items() if getattr(produit, field) != value}
+                if changed & {'categorie_id', 'is_active'}:
+                    categories.update((produit.categorie_id, data.get('categorie_id', produit.categorie_id)))
+                for field in changed:
+                    setattr(produit, field, data[field])
+                if changed:
+                    produit.updated_at = now
+                    to_update.append(produit)
+                    changed_fields.update(changed)
+                unchanged += not changed
+
+        try:
+            with transaction.atomic():
+                Produit.objects.bulk_create(to_create, batch_size=self.batch_size)
+                if to_update:
+                    # Seuls les champs réellement modifiés figurent dans les CASE WHEN
+                    fields = [f.removesuffix('_id') for f in changed_fields] + ['updated_at']
+                    Produit.objects.bulk_update(to_update, fields, batch_size=UPDATE_BATCH_SIZE)
+                Categorie.recount_products(categories)
+                # Journal de synchronisation mobile (les signaux ne sont pas émis)
+                record_many('produit', [(p.pk, p.company_id, None) for p in to_create + to_update])
+        except Exception as e:
+            self._error([batch.index[0]], f'Lot ignoré (lignes {batch.index[0] + 2} à {batch.index[-1] + 2}): {e}')
+            self.stats['skipped'] += len(to_create) + len(to_update)
+            self.stats['updated'] += unchanged
+            return
+        self.stats['created'] += len(to_create)
+        self.stats['updated'] += len(to_update) + unchanged
+
+    def process(self, df):
+        """Valide puis applique un DataFrame par lots de batch_size lignes"""
+        self.stats['total'] += len(df)
+        valid = self.validate(df)
+        for start in range(0, len(valid), self.batch_size):
+            self._apply_batch(valid.iloc[start:start + self.batch_size])
+        return self
+
+    def finish(self):
+        """bulk_create/bulk_update ne déclenchent pas les signaux : recalculer le tableau de bord"""
+        if self.company is not None and (self.stats['created'] or self.stats['updated']):
+            from .dashboard import rebuild_snapshot
+            rebuild_snapshot(self.company)
+        return self.result()
+
+
+def import_products(df, company=None, batch_size=IMPORT_BATCH_SIZE):
+    return ProductImporter(company, batch_size).process(df).finish()
@@ -0,0 +1,205 @@
+"""
+Génération différée des rapports (ReportJob).
+
+Les vues créent un job ; la commande run_report_worker le réserve, génère le
+fichier avec les fonctions de API/reports.py et l'enregistre comme artefact
+téléchargeable jusqu'à expiration (REPORT_ARTIFACT_TTL_HOURS, 24h par défaut).
+Aucun broker externe : la file d'attente est la table ReportJob elle-même.
+"""
+import logging
+import tempfile
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+
+from .models import ReportJob
+from .reports import (
+    generate_stock_valuation_excel,
+    generate_stock_valuation_pdf,
+    generate_sales_report_excel,
+    generate_sales_report_pdf,
+    generate_inventory_report_excel,
+    generate_inventory_report_pdf,
+    stream_stock_valuation_csv,
+    stream_sales_report_csv,
+)
+
+logger = logging.getLogger(__name__)
+
+FILENAME_PREFIXES = {
+    'stock_valuation': 'valorisation_stock',
+    'sales': 'rapport_ventes',
+    'inventory': 'inventaire_complet',
+}
+
+EXTENSIONS = {'excel': 'xlsx', 'csv': 'csv', 'pdf': 'pdf'}
+
+# Formats disponibles par type de rapport
+SUPPORTED_FORMATS = {
+    'stock_valuation': ('excel', 'csv', 'pdf'),
+    'sales': ('excel', 'csv', 'pdf'),
+    'inventory': ('excel', 'pdf'),
+}
+
+
+def artifact_ttl():
+    return timedelta(hours=getattr(settings, 'REPORT_ARTIFACT_TTL_HOURS', 24))
+
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+
+def _csv_to_file(chunks):
+    tmp = tempfile.TemporaryFile()
+    for chunk in chunks:
+        tmp.write(chunk.encode('utf-8'))
+    tmp.seek(0)
+    return tmp
+
+
+def wants_async(query):
+    """?async=1|true|yes : rapport en arrière-plan (async=0/false : génération immédiate)"""
+    return str(query.get('async', '')).lower() in ('1', 'true', 'yes')
+
+
+def queue_report(request, report_type, export_format, params):
+    """Crée un ReportJob au lieu de générer le rapport dans la requête : (données, statut HTTP)"""
+    from .serializers import ReportJobSerializer
+    try:
+        job = create_job(request, report_type, export_format, params)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    return ReportJobSerializer(job, context={'request': request}).data, 202
+
+
+def create_job(request, report_type, export_format, params=None):
+    """Crée un job en attente pour l'utilisateur/l'entreprise de la requête"""
+    if report_type not in SUPPORTED_FORMATS:
+        raise ValueError(f"Type de rapport inconnu: {report_type}")
+    if export_format not in SUPPORTED_FORMATS[report_type]:
+        raise ValueError(f"Format non supporté pour ce rapport: {export_format}")
+    # Valider les dates dès la création plutôt que dans le worker
+    for key in ('start_date', 'end_date'):
+        _parse_date((params or {}).get(key))
+
+    user = getattr(request, 'user', None)
+    return ReportJob.objects.create(
+        company=getattr(request, 'company', None),
+        created_by=user if user is not None and user.is_authenticated else None,
+        report_type=report_type,
+        format=export_format,
+        params=params or {},
+    )
+
+
+def generate_artifact(job, progress=None):
+    """
+    Exécute le générateur correspondant au job et retourne un fichier ouvert.
+    progress(lues, total) est appelé à chaque paquet de lignes.
+    """
+    params = job.params or {}
+    company = job.company
+
+    if job.report_type == 'stock_valuation':
+        warehouse_id = params.get('warehouse')
+        if job.format == 'pdf':
+            return generate_stock_valuation_pdf(warehouse_id, company, progress=progress)
+        if job.format == 'csv':
+            return _csv_to_file(stream_stock_valuation_csv(warehouse_id, company, progress=progress))
+        return generate_stock_valuation_excel(warehouse_id, company, progress=progress)
+
+    if job.report_type == 'sales':
+        start_date = _parse_date(params.get('start_date'))
+        end_date = _parse_date(params.get('end_date'))
+        if job.format == 'pdf':
+            return generate_sales_report_pdf(start_date, end_date, company=company, progress=progress)
+        if job.format == 'csv':
+            return _csv_to_file(stream_sales_report_csv(start_date, end_date, company, progress=progress))
+        return generate_sales_report_excel(start_date, end_date, company=company, progress=progress)
+
+    if job.report_type == 'inventory':
+        if job.format == 'pdf':
+            return generate_inventory_report_pdf(company, progress=progress)
+        return generate_inventory_report_excel(company, progress=progress)
+
+    raise ValueError(f"Type de rapport inconnu: {job.report_type}")
+
+
+def claim_next_job():
+    """
+    Réserve le plus ancien job en attente.
+    La réservation est un UPDATE conditionnel sur le statut : deux workers ne
+    peuvent pas prendre le même job, quel que soit le moteur de base de données.
+    """
+    candidates = ReportJob.objects.filter(statut='pending').order_by('created_at').values_list('id', flat=True)[:10]
+    for job_id in candidates:
+        now = timezone.now()
+        claimed = ReportJob.objects.filter(pk=job_id, statut='pending').update(
+            statut='running', progress=5, started_at=now, updated_at=now
+        )
+        if claimed:
+            return ReportJob.objects.select_related('company').get(pk=job_id)
+    return None
+
+
+def _set_progress(job, progress):
+    """Progression et heartbeat (updated_at) : un job qui avance n'est jamais repris"""
+    job.progress = progress
+    ReportJob.objects.filter(pk=job.pk).update(progress=progress, updated_at=timezone.now())
+
+
+def _chunk_progress(job):
+    """Callback des générateurs : lignes lues ramenées sur 5-90 %"""
+    def report(done, total):
+        _set_progress(job, 5 + 85 * min(done, total) // total if total else 5)
+    return report
+
+
+def run_job(job):
+    """Génère l'artefact d'un job réservé et enregistre le résultat"""
+    try:
+        fileobj = generate_artifact(job, progress=_chunk_progress(job))
+        _set_progress(job, 90)
+
+        stamp = timezone.now().strftime('%Y%m%d_%H%M%S')
+        job.filename = f"{FILENAME_PREFIXES[job.report_type]}_{stamp}.{EXTENSIONS[job.format]}"
+        try:
+            job.artifact.save(job.filename, File(fileobj), save=False)
+        finally:
+            fileobj.close()
+
+        job.statut = 'done'
+        job.progress = 100
+        job.error = ''
+    except Exception as e:
+        logger.exception('Report job %s failed: %s', job.pk, e)
+        job.statut = 'failed'
+        job.error = str(e)
+
+    job.finished_at = timezone.now()
+    job.expires_at = job.finished_at + artifact_ttl()
+    job.save(update_fields=['statut', 'progress', 'error', 'artifact', 'filename', 'finished_at', 'expires_at',
+                            'updated_at'])
+    return job
+
+
+def requeue_stale_jobs(max_age=timedelta(minutes=10)):
+    """Jobs 'running' sans heartbeat récent (worker arrêté en cours de route) : remis en attente"""
+    return ReportJob.objects.filter(
+        statut='running', updated_at__lt=timezone.now() - max_age
+    ).update(statut='pending', progress=0, started_at=None, updated_at=timezone.now())
+
+
+def cleanup_expired_jobs(now=None):
+    """Supprime les jobs expirés et leurs fichiers ; retourne le nombre de jobs supprimés"""
+    expired = ReportJob.objects.filter(expires_at__lt=now or timezone.now())
+    count = 0
+    for job in expired.iterator():
+        if job.artifact:
+            job.artifact.delete(save=False)
+        job.delete()
+        count += 1
+    return count
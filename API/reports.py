@@ -1,11 +1,14 @@
 """
 Module de génération de rapports Excel et PDF
 """
+import csv
+import tempfile
 from datetime import datetime
 from decimal import Decimal
 from io import BytesIO
 
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from openpyxl.utils import get_column_letter
 
@@ -22,14 +25,10 @@ from django.utils import timezone
 from .models import Produit, Vente, LigneVente, Achat, StockMove, ProductStock, Warehouse
 
 
-class ExcelReportGenerator:
-    """Générateur de rapports Excel avec styles professionnels"""
+class ExcelStyleMixin:
+    """Styles et largeurs de colonnes communs aux rapports Excel"""
 
-    def __init__(self):
-        self.wb = Workbook()
-        self.ws = self.wb.active
-
-        # Styles
+    def _init_styles(self):
         self.header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
         self.header_font = Font(bold=True, color="FFFFFF", size=12)
         self.title_font = Font(bold=True, size=14)
@@ -45,6 +44,15 @@ class ExcelReportGenerator:
         for idx, width in enumerate(widths, start=1):
             self.ws.column_dimensions[get_column_letter(idx)].width = width
 
+
+class ExcelReportGenerator(ExcelStyleMixin):
+    """Générateur de rapports Excel avec styles professionnels"""
+
+    def __init__(self):
+        self.wb = Workbook()
+        self.ws = self.wb.active
+        self._init_styles()
+
     def add_title(self, title, row=1):
         """Ajouter un titre au rapport"""
         self.ws.merge_cells(f'A{row}:F{row}')
@@ -127,6 +135,116 @@ class ExcelReportGenerator:
         return buffer
 
 
+class StreamingExcelReport(ExcelStyleMixin):
+    """
+    Rapport Excel write-only pour les gros volumes (mêmes styles
+    qu'ExcelReportGenerator). Les lignes sont ajoutées à la suite, sans numéro
+    de ligne : elles sont écrites au fil de l'eau (openpyxl write_only) puis le
+    classeur est enregistré dans un fichier temporaire, la mémoire reste
+    constante quel que soit le nombre de lignes.
+    """
+
+    def __init__(self, sheet_title):
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet(sheet_title)
+        self._init_styles()
+
+    def _cell(self, value, font=None, fill=None, border=None, alignment=None, number_format=None):
+        cell = WriteOnlyCell(self.ws, value=value)
+        if font:
+            cell.font = font
+        if fill:
+            cell.fill = fill
+        if border:
+            cell.border = border
+        if alignment:
+            cell.alignment = alignment
+        if number_format:
+            cell.number_format = number_format
+        return cell
+
+    @staticmethod
+    def _number_format(value):
+        if isinstance(value, (Decimal, float)):
+            return '#,##0.00'
+        if isinstance(value, int):
+            return '#,##0'
+        return None
+
+    def add_title(self, title):
+        self.ws.append([self._cell(title, font=self.title_font)])
+
+    def add_line(self, *values):
+        self.ws.append(list(values))
+
+    def add_metadata(self, company_name="GestionStock", date=None):
+        if date is None:
+            date = timezone.now().strftime('%d/%m/%Y %H:%M')
+        self.ws.append(["Date:", date])
+        self.ws.append(["Société:", company_name])
+        self.ws.append([])
+
+    def add_header_row(self, headers):
+        center = Alignment(horizontal='center', vertical='center')
+        self.ws.append([
+            self._cell(header, font=self.header_font, fill=self.header_fill,
+                       border=self.border, alignment=center)
+            for header in headers
+        ])
+
+    def add_data_rows(self, rows, number_columns=None):
+        """Écrit les lignes d'un itérable (générateur accepté)"""
+        number_columns = set(number_columns or [])
+        left, right = Alignment(horizontal='left'), Alignment(horizontal='right')
+        for row_data in rows:
+            self.ws.append([
+                self._cell(
+                    value, border=self.border,
+                    alignment=right if col_idx in number_columns else left,
+                    number_format=self._number_format(value) if col_idx in number_columns else None,
+                )
+                for col_idx, value in enumerate(row_data, start=1)
+            ])
+
+    def add_total_row(self, label_col, label, value_cols_values):
+        bold, right = Font(bold=True), Alignment(horizontal='right')
+        width = max([label_col] + list(value_cols_values))
+        row = []
+        for col_idx in range(1, width + 1):
+            if col_idx == label_col:
+                value = label
+            elif col_idx in value_cols_values:
+                value = value_cols_values[col_idx]
+            else:
+                row.append(None)
+                continue
+            row.append(self._cell(value, font=bold, border=self.border, alignment=right,
+                                  number_format=self._number_format(value)))
+        self.ws.append(row)
+
+    def save_to_file(self):
+        """Enregistre dans un fichier temporaire (supprimé à sa fermeture)"""
+        tmp = tempfile.TemporaryFile()
+        self.wb.save(tmp)
+        tmp.seek(0)
+        return tmp
+
+
+class _Echo:
+    """Pseudo-fichier pour csv.writer : renvoie la ligne au lieu de l'écrire"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(headers, rows):
+    """Générateur de lignes CSV (séparateur ';', BOM UTF-8 pour Excel)"""
+    writer = csv.writer(_Echo(), delimiter=';')
+    yield '\ufeff' + writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
 class PDFReportGenerator:
     """Générateur de rapports PDF avec styles professionnels"""
 
@@ -235,93 +353,132 @@ class PDFReportGenerator:
 # RAPPORTS SPÉCIFIQUES
 # ======================
 
-def generate_stock_valuation_excel(warehouse_id=None):
-    """
-    Rapport de valorisation du stock (Excel)
-    Montre la valeur totale du stock par produit
-    """
-    gen = ExcelReportGenerator()
-    gen.ws.title = "Valorisation Stock"
+EXPORT_CHUNK_SIZE = 2000
 
-    # Titre
-    current_row = gen.add_title("RAPPORT DE VALORISATION DU STOCK")
-    current_row = gen.add_metadata(current_row)
+STOCK_VALUATION_HEADERS = ['Référence', 'Désignation', 'Catégorie', 'Qté Stock', 'Prix Unit.', 'Valeur Stock', 'Statut']
+SALES_REPORT_HEADERS = ['N° Vente', 'Date', 'Client', 'Type Paiement', 'HT', 'TTC', 'Remise %']
 
+
+def _with_progress(rows, progress=None, total=None):
+    """
+    Transmet les lignes en appelant progress(lues, total) tous les
+    EXPORT_CHUNK_SIZE lignes puis en fin de parcours (jobs différés).
+    """
+    if progress is None:
+        yield from rows
+        return
+    done = 0
+    for row in rows:
+        yield row
+        done += 1
+        if done % EXPORT_CHUNK_SIZE == 0:
+            progress(done, total)
+    progress(done, total)
+
+
+def _stock_status(quantite, seuil_alerte, seuil_critique):
+    """Même logique que Produit.get_stock_status, sans instancier le produit"""
+    if quantite <= 0:
+        return 'out_of_stock'
+    if quantite <= seuil_critique:
+        return 'critical'
+    if quantite <= seuil_alerte:
+        return 'low'
+    return 'normal'
+
+
+def iter_stock_valuation_rows(warehouse_id=None, company=None, progress=None):
+    """
+    Lignes du rapport de valorisation, agrégées en base et lues par paquets
+    (values_list + iterator) sans charger les objets en mémoire.
+    """
+    stock_filter = Q(stocks__quantity__gt=0)
     if warehouse_id:
-        # Stock par entrepôt spécifique
-        warehouse = Warehouse.objects.get(pk=warehouse_id)
-        gen.ws[f'A{current_row}'] = f"Entrepôt: {warehouse.name}"
-        current_row += 2
-
-        product_stocks = ProductStock.objects.filter(
-            warehouse=warehouse,
-            quantity__gt=0
-        ).select_related('produit', 'produit__categorie')
-    else:
-        # Tous les entrepôts - calculer la somme des stocks
-        gen.ws[f'A{current_row}'] = "Tous les entrepôts"
-        current_row += 2
+        stock_filter &= Q(stocks__warehouse_id=warehouse_id)
+
+    rows = _active_products(company).annotate(
+        qty=Sum('stocks__quantity', filter=stock_filter)
+    ).filter(qty__gt=0).order_by('reference').values_list(
+        'reference', 'designation', 'categorie__nom', 'qty', 'prixU',
+        'quantite', 'seuil_alerte', 'seuil_critique'
+    )
+
+    total = rows.count() if progress else None
+    for reference, designation, categorie, qty, prix, quantite, seuil_alerte, seuil_critique in _with_progress(
+            rows.iterator(chunk_size=EXPORT_CHUNK_SIZE), progress, total):
+        unit_price = prix or Decimal('0.00')
+        yield [
+            reference,
+            designation,
+            categorie or 'N/A',
+            qty,
+            float(unit_price),
+            float(qty * unit_price),
+            _stock_status(quantite, seuil_alerte, seuil_critique),
+        ]
 
-        # Obtenir tous les stocks groupés par produit
-        product_stocks = ProductStock.objects.filter(
-            quantity__gt=0
-        ).select_related('produit', 'produit__categorie')
 
-    # En-têtes
-    headers = ['Référence', 'Désignation', 'Catégorie', 'Qté Stock', 'Prix Unit.', 'Valeur Stock', 'Statut']
-    gen.set_column_widths([15, 30, 20, 12, 15, 18, 15])
-    current_row = gen.add_header_row(headers, current_row)
+def _get_warehouse(warehouse_id, company=None):
+    """Entrepôt de la société (DoesNotExist s'il appartient à une autre)"""
+    warehouses = Warehouse.objects.all()
+    if company is not None:
+        warehouses = warehouses.filter(company=company)
+    return warehouses.get(pk=warehouse_id)
 
-    # Regrouper les stocks par produit et calculer les totaux
-    from collections import defaultdict
-    product_totals = defaultdict(int)
 
-    for ps in product_stocks:
-        product_totals[ps.produit.id] += ps.quantity
+def _warehouse_label(warehouse_id, company=None):
+    if not warehouse_id:
+        return "Tous les entrepôts"
+    return f"Entrepôt: {_get_warehouse(warehouse_id, company).name}"
 
-    # Données
-    data_rows = []
-    total_value = Decimal('0.00')
-    total_qty = 0
 
-    # Récupérer les produits avec stock
-    products = Produit.objects.filter(
-        id__in=product_totals.keys(),
-        is_active=True
-    ).select_related('categorie')
+def _active_products(company=None):
+    produits = Produit.objects.filter(is_active=True)
+    if company is not None:
+        produits = produits.filter(company=company)
+    return produits
 
-    for product in products:
-        qty = product_totals[product.id]
-        if qty <= 0:
-            continue
 
-        unit_price = product.prixU or Decimal('0.00')
-        value = qty * unit_price
-        total_value += value
-        total_qty += qty
+def generate_stock_valuation_excel(warehouse_id=None, company=None, progress=None):
+    """
+    Rapport de valorisation du stock (Excel, écrit en flux)
+    Montre la valeur totale du stock par produit.
+    Retourne un fichier temporaire positionné au début.
+    """
+    gen = StreamingExcelReport("Valorisation Stock")
+    gen.set_column_widths([15, 30, 20, 12, 15, 18, 15])
 
-        data_rows.append([
-            product.reference,
-            product.designation,
-            product.categorie.nom if product.categorie else 'N/A',
-            qty,
-            float(unit_price),
-            float(value),
-            product.get_stock_status()
-        ])
+    gen.add_title("RAPPORT DE VALORISATION DU STOCK")
+    gen.add_metadata()
+    gen.add_line(_warehouse_label(warehouse_id, company))
+    gen.add_line()
+    gen.add_header_row(STOCK_VALUATION_HEADERS)
+
+    totals = {'qty': 0, 'value': 0.0}
+
+    def rows():
+        for row in iter_stock_valuation_rows(warehouse_id, company, progress):
+            totals['qty'] += row[3]
+            totals['value'] += row[5]
+            yield row
+
+    gen.add_data_rows(rows(), number_columns=[4, 5, 6])
+    gen.add_total_row(3, "TOTAL", {
+        4: totals['qty'],
+        6: round(totals['value'], 2)
+    })
 
-    current_row = gen.add_data_rows(data_rows, current_row, number_columns=[4, 5, 6])
+    return gen.save_to_file()
 
-    # Total
-    gen.add_total_row(current_row, 3, "TOTAL", {
-        4: total_qty,
-        6: float(total_value)
-    })
 
-    return gen.save_to_buffer()
+def stream_stock_valuation_csv(warehouse_id=None, company=None, progress=None):
+    """Rapport de valorisation du stock en CSV (générateur pour StreamingHttpResponse)"""
+    if warehouse_id:
+        _warehouse_label(warehouse_id, company)  # Entrepôt inconnu -> DoesNotExist avant le flux
+    return stream_csv(STOCK_VALUATION_HEADERS, iter_stock_valuation_rows(warehouse_id, company, progress))
 
 
-def generate_stock_valuation_pdf(warehouse_id=None):
+def generate_stock_valuation_pdf(warehouse_id=None, company=None, progress=None):
     """
     Rapport de valorisation du stock (PDF)
     """
@@ -329,24 +486,23 @@ def generate_stock_valuation_pdf(warehouse_id=None):
     gen.add_title()
     gen.add_metadata()
 
+    product_stocks = ProductStock.objects.filter(quantity__gt=0)
+    if company is not None:
+        product_stocks = product_stocks.filter(produit__company=company)
+
     if warehouse_id:
         # Stock par entrepôt spécifique
-        warehouse = Warehouse.objects.get(pk=warehouse_id)
+        warehouse = _get_warehouse(warehouse_id, company)
         gen.elements.append(Paragraph(f"<b>Entrepôt:</b> {warehouse.name}", gen.styles['Normal']))
         gen.elements.append(Spacer(1, 12))
 
-        product_stocks = ProductStock.objects.filter(
-            warehouse=warehouse,
-            quantity__gt=0
-        ).select_related('produit', 'produit__categorie')
+        product_stocks = product_stocks.filter(warehouse=warehouse)
     else:
         # Tous les entrepôts
         gen.elements.append(Paragraph("<b>Tous les entrepôts</b>", gen.styles['Normal']))
         gen.elements.append(Spacer(1, 12))
 
-        product_stocks = ProductStock.objects.filter(
-            quantity__gt=0
-        ).select_related('produit', 'produit__categorie')
+    product_stocks = product_stocks.select_related('produit', 'produit__categorie')
 
     # Regrouper les stocks par produit
     from collections import defaultdict
@@ -356,9 +512,8 @@ def generate_stock_valuation_pdf(warehouse_id=None):
         product_totals[ps.produit.id] += ps.quantity
 
     # Récupérer les produits avec stock
-    products = Produit.objects.filter(
-        id__in=product_totals.keys(),
-        is_active=True
+    products = _active_products(company).filter(
+        id__in=product_totals.keys()
     ).select_related('categorie')
 
     # Tableau
@@ -367,7 +522,7 @@ def generate_stock_valuation_pdf(warehouse_id=None):
     total_value = Decimal('0.00')
     total_qty = 0
 
-    for product in products:
+    for product in _with_progress(products, progress, len(product_totals) if progress else None):
         qty = product_totals[product.id]
         unit_price = product.prixU or Decimal('0.00')
         value = qty * unit_price
@@ -400,72 +555,76 @@ def generate_stock_valuation_pdf(warehouse_id=None):
     return gen.build()
 
 
-def generate_sales_report_excel(start_date=None, end_date=None):
+def _completed_sales(company=None, start_date=None, end_date=None):
+    ventes = Vente.objects.filter(statut='completed')
+    if company is not None:
+        ventes = ventes.filter(company=company)
+    if start_date:
+        ventes = ventes.filter(date_vente__date__gte=start_date)
+    if end_date:
+        ventes = ventes.filter(date_vente__date__lte=end_date)
+    return ventes.order_by('-date_vente')
+
+
+def iter_sales_rows(start_date=None, end_date=None, company=None, progress=None):
+    """Lignes du rapport des ventes, lues par paquets via values_list + iterator"""
+    paiements = dict(Vente.TYPES_PAIEMENT)
+    rows = _completed_sales(company, start_date, end_date).values_list(
+        'numero', 'date_vente', 'client__nom', 'client__prenom',
+        'type_paiement', 'total_ht', 'total_ttc', 'remise_percent'
+    )
+    total = rows.count() if progress else None
+    for numero, date_vente, nom, prenom, type_paiement, ht, ttc, remise in _with_progress(
+            rows.iterator(chunk_size=EXPORT_CHUNK_SIZE), progress, total):
+        yield [
+            numero,
+            date_vente.strftime('%d/%m/%Y'),
+            f"{nom} {prenom}" if nom is not None else 'N/A',
+            paiements.get(type_paiement, type_paiement),
+            float(ht or 0),
+            float(ttc or 0),
+            float(remise or 0)
+        ]
+
+
+def generate_sales_report_excel(start_date=None, end_date=None, company=None, progress=None):
     """
-    Rapport des ventes (Excel)
+    Rapport des ventes (Excel, écrit en flux)
+    Retourne un fichier temporaire positionné au début.
     """
-    gen = ExcelReportGenerator()
-    gen.ws.title = "Rapport Ventes"
-
-    # Titre
-    current_row = gen.add_title("RAPPORT DES VENTES")
+    gen = StreamingExcelReport("Rapport Ventes")
+    gen.set_column_widths([15, 12, 25, 15, 15, 15, 12])
 
-    # Période
+    gen.add_title("RAPPORT DES VENTES")
     if start_date and end_date:
-        gen.ws.merge_cells(f'A{current_row}:F{current_row}')
-        cell = gen.ws[f'A{current_row}']
-        cell.value = f"Période: {start_date.strftime('%d/%m/%Y')} - {end_date.strftime('%d/%m/%Y')}"
-        cell.alignment = Alignment(horizontal='center')
-        current_row += 1
-
-    current_row = gen.add_metadata(current_row)
-
-    # Requête
-    ventes = Vente.objects.filter(statut='completed').select_related('client', 'warehouse')
-
-    if start_date:
-        ventes = ventes.filter(date_vente__gte=start_date)
-    if end_date:
-        ventes = ventes.filter(date_vente__lte=end_date)
-
-    ventes = ventes.order_by('-date_vente')
-
-    # En-têtes
-    headers = ['N° Vente', 'Date', 'Client', 'Type Paiement', 'HT', 'TTC', 'Remise %']
-    gen.set_column_widths([15, 12, 25, 15, 15, 15, 12])
-    current_row = gen.add_header_row(headers, current_row)
+        gen.add_line(f"Période: {start_date.strftime('%d/%m/%Y')} - {end_date.strftime('%d/%m/%Y')}")
+    gen.add_metadata()
+    gen.add_header_row(SALES_REPORT_HEADERS)
 
-    # Données
-    data_rows = []
-    total_ht = Decimal('0.00')
-    total_ttc = Decimal('0.00')
+    # Totaux cumulés sur les lignes écrites : le TOTAL correspond toujours au détail
+    totals = {'ht': 0.0, 'ttc': 0.0}
 
-    for vente in ventes:
-        total_ht += vente.total_ht or Decimal('0.00')
-        total_ttc += vente.total_ttc or Decimal('0.00')
+    def rows():
+        for row in iter_sales_rows(start_date, end_date, company, progress):
+            totals['ht'] += row[4]
+            totals['ttc'] += row[5]
+            yield row
 
-        data_rows.append([
-            vente.numero,
-            vente.date_vente.strftime('%d/%m/%Y'),
-            f"{vente.client.nom} {vente.client.prenom}" if vente.client else 'N/A',
-            vente.get_type_paiement_display(),
-            float(vente.total_ht or 0),
-            float(vente.total_ttc or 0),
-            float(vente.remise_percent or 0)
-        ])
+    gen.add_data_rows(rows(), number_columns=[5, 6, 7])
+    gen.add_total_row(4, "TOTAL", {
+        5: round(totals['ht'], 2),
+        6: round(totals['ttc'], 2)
+    })
 
-    current_row = gen.add_data_rows(data_rows, current_row, number_columns=[5, 6, 7])
+    return gen.save_to_file()
 
-    # Total
-    gen.add_total_row(current_row, 4, "TOTAL", {
-        5: float(total_ht),
-        6: float(total_ttc)
-    })
 
-    return gen.save_to_buffer()
+def stream_sales_report_csv(start_date=None, end_date=None, company=None, progress=None):
+    """Rapport des ventes en CSV (générateur pour StreamingHttpResponse)"""
+    return stream_csv(SALES_REPORT_HEADERS, iter_sales_rows(start_date, end_date, company, progress))
 
 
-def generate_sales_report_pdf(start_date=None, end_date=None):
+def generate_sales_report_pdf(start_date=None, end_date=None, company=None, progress=None):
     """
     Rapport des ventes (PDF)
     """
@@ -484,14 +643,7 @@ def generate_sales_report_pdf(start_date=None, end_date=None):
     gen.add_metadata()
 
     # Requête
-    ventes = Vente.objects.filter(statut='completed').select_related('client')
-
-    if start_date:
-        ventes = ventes.filter(date_vente__gte=start_date)
-    if end_date:
-        ventes = ventes.filter(date_vente__lte=end_date)
-
-    ventes = ventes.order_by('-date_vente')
+    ventes = _completed_sales(company, start_date, end_date).select_related('client')
 
     # Tableau
     table_data = [['N° Vente', 'Date', 'Client', 'Type Paiement', 'Montant HT', 'Montant TTC', 'Remise %']]
@@ -500,11 +652,10 @@ def generate_sales_report_pdf(start_date=None, end_date=None):
     total_ttc = Decimal('0.00')
     count_ventes = 0
 
-    for vente in ventes:
-        total_ht += vente.total_ht or Decimal('0.00')
-        total_ttc += vente.total_ttc or Decimal('0.00')
+    for vente in _with_progress(ventes, progress, ventes.count() if progress else None):
+        total_ht += vente.total_ht or 0
+        total_ttc += vente.total_ttc or 0
         count_ventes += 1
-
         table_data.append([
             vente.numero,
             vente.date_vente.strftime('%d/%m/%Y'),
@@ -533,7 +684,7 @@ def generate_sales_report_pdf(start_date=None, end_date=None):
     return gen.build()
 
 
-def generate_inventory_report_excel():
+def generate_inventory_report_excel(company=None, progress=None):
     """
     Rapport d'inventaire complet (Excel)
     """
@@ -550,10 +701,10 @@ def generate_inventory_report_excel():
     current_row = gen.add_header_row(headers, current_row)
 
     # Données
-    products = Produit.objects.filter(is_active=True).select_related('categorie', 'fournisseur').order_by('reference')
+    products = _active_products(company).select_related('categorie', 'fournisseur').order_by('reference')
 
     data_rows = []
-    for product in products:
+    for product in _with_progress(products, progress, products.count() if progress else None):
         data_rows.append([
             product.reference,
             product.code_barre or '',
@@ -571,7 +722,7 @@ def generate_inventory_report_excel():
     return gen.save_to_buffer()
 
 
-def generate_inventory_report_pdf():
+def generate_inventory_report_pdf(company=None, progress=None):
     """
     Rapport d'inventaire complet (PDF)
     """
@@ -579,12 +730,12 @@ def generate_inventory_report_pdf():
     gen.add_title()
     gen.add_metadata()
 
-    products = Produit.objects.filter(is_active=True).select_related('categorie', 'fournisseur').order_by('reference')
+    products = _active_products(company).select_related('categorie', 'fournisseur').order_by('reference')
 
     # Tableau
     table_data = [['Réf.', 'Désignation', 'Catégorie', 'Fournisseur', 'Qté', 'Seuil', 'Prix', 'Statut']]
 
-    for product in products:
+    for product in _with_progress(products, progress, products.count() if progress else None):
         table_data.append([
             product.reference,
             product.designation[:25],
@@ -0,0 +1,297 @@
+"""
+Tables d'agrégats journaliers (DailySalesRollup / DailyProductRollup).
+
+La migration 0063 remplit les tables depuis l'historique ; la commande
+build_rollups reconstruit des jours entiers à partir des tables sources
+(Vente, LigneVente, StockMove). Les signaux ci-dessous calculent la
+contribution de chaque objet avant et après l'écriture et appliquent la
+différence aux seules lignes d'agrégat touchées, par mises à jour F() dans la
+transaction de l'écriture (annulées avec elle). Les écritures en lot
+(StockLedger) passent leurs variations d'un bloc à apply_product_deltas : une
+mise à jour par (jour, entrepôt, produit).
+
+Une ligne par clé (contraintes uniques) : une variation met à jour la ligne
+de sa clé ou la crée, et reprend la mise à jour si une écriture concurrente
+l'a créée entre-temps.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Sum, Count, F, Q, DecimalField, ExpressionWrapper
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    DailySalesRollup, DailyProductRollup, Vente, LigneVente, StockMove, Produit,
+)
+from . import previous_state
+
+SALES_KEY = ('company_id', 'jour', 'warehouse_id', 'type_paiement')
+PRODUCT_KEY = ('company_id', 'jour', 'warehouse_id', 'produit_id')
+VENTE_FIELDS = ('company_id', 'statut', 'date_vente', 'warehouse_id', 'type_paiement', 'total_ht', 'total_ttc')
+LIGNE_FIELDS = ('vente_id', 'produit_id', 'quantite', 'prixU_snapshot')
+MOVE_FIELDS = ('produit_id', 'warehouse_id', 'delta', 'date')
+
+
+def _local_date(value):
+    if value is None:
+        return None
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+
+@transaction.atomic
+def rebuild_day(company_id, jour):
+    """
+    Recalcule les agrégats d'une entreprise pour un jour donné.
+    Les lignes sont supprimées avant la lecture des sources : une écriture
+    concurrente attend la fin de la reconstruction (ligne verrouillée) puis
+    s'applique à la nouvelle ligne, ou fait échouer la reconstruction (clé
+    unique) ; aucune variation n'est perdue.
+    """
+    DailySalesRollup.objects.filter(company_id=company_id, jour=jour).delete()
+    DailyProductRollup.objects.filter(company_id=company_id, jour=jour).delete()
+
+    ventes = Vente.objects.filter(company_id=company_id, statut='completed', date_vente__date=jour)
+    sales_rows = [
+        DailySalesRollup(
+            company_id=company_id,
+            jour=jour,
+            warehouse_id=row['warehouse_id'],
+            type_paiement=row['type_paiement'],
+            nb_ventes=row['nb'],
+            total_ht=row['ht'] or 0,
+            total_ttc=row['ttc'] or 0,
+        )
+        for row in ventes.values('warehouse_id', 'type_paiement').annotate(
+            nb=Count('id'), ht=Sum('total_ht'), ttc=Sum('total_ttc')
+        ).order_by()
+    ]
+
+    produits = defaultdict(lambda: {'qte_vendue': 0, 'ca': Decimal('0'), 'entrees': 0, 'sorties': 0})
+    lignes = LigneVente.objects.filter(
+        vente__company_id=company_id, vente__statut='completed', vente__date_vente__date=jour
+    ).values('vente__warehouse_id', 'produit_id').annotate(
+        qte=Sum('quantite'),
+        ca=Sum(ExpressionWrapper(
+            F('quantite') * F('prixU_snapshot'),
+            output_field=DecimalField(max_digits=16, decimal_places=2)
+        )),
+    ).order_by()
+    for row in lignes:
+        entry = produits[(row['vente__warehouse_id'], row['produit_id'])]
+        entry['qte_vendue'] = row['qte'] or 0
+        entry['ca'] = row['ca'] or 0
+
+    moves = StockMove.objects.filter(
+        produit__company_id=company_id, date__date=jour
+    ).values('warehouse_id', 'produit_id').annotate(
+        entrees=Sum('delta', filter=Q(delta__gt=0)),
+        sorties=Sum('delta', filter=Q(delta__lt=0)),
+    ).order_by()
+    for row in moves:
+        entry = produits[(row['warehouse_id'], row['produit_id'])]
+        entry['entrees'] = row['entrees'] or 0
+        entry['sorties'] = abs(row['sorties'] or 0)
+
+    product_rows = [
+        DailyProductRollup(company_id=company_id, jour=jour, warehouse_id=warehouse_id,
+                           produit_id=produit_id, **values)
+        for (warehouse_id, produit_id), values in produits.items()
+    ]
+
+    DailySalesRollup.objects.bulk_create(sales_rows)
+    DailyProductRollup.objects.bulk_create(product_rows)
+
+
+def source_days(company_id=None, since=None):
+    """Ensemble des (company_id, jour) présents dans les tables sources"""
+    ventes = Vente.objects.filter(statut='completed')
+    moves = StockMove.objects.all()
+    if company_id is not None:
+        ventes = ventes.filter(company_id=company_id)
+        moves = moves.filter(produit__company_id=company_id)
+    if since is not None:
+        ventes = ventes.filter(date_vente__date__gte=since)
+        moves = moves.filter(date__date__gte=since)
+
+    days = set()
+    for company, dt in ventes.values_list('company_id', 'date_vente').iterator(chunk_size=2000):
+        days.add((company, _local_date(dt)))
+    for company, dt in moves.values_list('produit__company_id', 'date').iterator(chunk_size=2000):
+        days.add((company, _local_date(dt)))
+    return days
+
+
+def _apply(model, key_fields, deltas):
+    """
+    deltas {clé: {champ: variation}} : mise à jour F() de la ligne de chaque
+    clé (créée si absente) ; une ligne revenue à zéro est supprimée.
+    """
+    counters = [f.name for f in model._meta.concrete_fields if f.name not in key_fields
+                and f.attname not in key_fields and not f.primary_key]
+    for key, values in deltas.items():
+        values = {field: value for field, value in values.items() if value}
+        if not values:
+            continue
+        lookup = {(f'{field}__isnull' if value is None else field): (True if value is None else value)
+                  for field, value in zip(key_fields, key)}
+        updates = {field: F(field) + value for field, value in values.items()}
+        with transaction.atomic():
+            if not model.objects.filter(**lookup).update(**updates):
+                try:
+                    with transaction.atomic():
+                        model.objects.create(**dict(zip(key_fields, key)), **values)
+                except IntegrityError:
+                    # Ligne créée par une écriture concurrente : lui appliquer la variation
+                    model.objects.filter(**lookup).update(**updates)
+            if any(value < 0 for value in values.values()):
+                model.objects.filter(**lookup, **{field: 0 for field in counters}).delete()
+
+
+def _merge(target, deltas, sign=1):
+    for key, values in deltas.items():
+        entry = target.setdefault(key, defaultdict(int))
+        for field, value in values.items():
+            entry[field] += sign * value
+    return target
+
+
+def apply_sales_deltas(deltas):
+    _apply(DailySalesRollup, SALES_KEY, deltas)
+
+
+def apply_product_deltas(deltas):
+    _apply(DailyProductRollup, PRODUCT_KEY, deltas)
+
+
+def _vente_contribution(values):
+    """{clé: variations} des agrégats de ventes pour une vente (dict VENTE_FIELDS)"""
+    if not values or values['statut'] != 'completed':
+        return {}
+    key = (values['company_id'], _local_date(values['date_vente']), values['warehouse_id'], values['type_paiement'])
+    return {key: {'nb_ventes': 1, 'total_ht': values['total_ht'] or 0, 'total_ttc': values['total_ttc'] or 0}}
+
+
+def _lignes_base(vente):
+    """(entreprise, jour, entrepôt) des agrégats produits d'une vente terminée, sinon None"""
+    if not vente or vente['statut'] != 'completed':
+        return None
+    return vente['company_id'], _local_date(vente['date_vente']), vente['warehouse_id']
+
+
+def _lignes_contribution(vente_id, values):
+    """Lignes d'une vente terminée : une requête groupée par produit"""
+    base = _lignes_base(values)
+    if base is None:
+        return {}
+    rows = LigneVente.objects.filter(vente_id=vente_id).values('produit_id').annotate(
+        qte=Sum('quantite'),
+        ca=Sum(ExpressionWrapper(F('quantite') * F('prixU_snapshot'),
+                                 output_field=DecimalField(max_digits=16, decimal_places=2))),
+    ).order_by()
+    return {base + (row['produit_id'],): {'qte_vendue': row['qte'] or 0, 'ca': row['ca'] or 0} for row in rows}
+
+
+def _ligne_contribution(ligne, vente):
+    """Une ligne (dict LIGNE_FIELDS) d'une vente (dict VENTE_FIELDS)"""
+    base = _lignes_base(vente)
+    if not ligne or base is None:
+        return {}
+    key = base + (ligne['produit_id'],)
+    quantite = ligne['quantite'] or 0
+    return {key: {'qte_vendue': quantite, 'ca': quantite * (ligne['prixU_snapshot'] or 0)}}
+
+
+def move_contributions(moves, companies):
+    """Entrées/sorties de mouvements (dicts MOVE_FIELDS) ; companies {produit_id: company_id}"""
+    deltas = {}
+    for move in moves:
+        key = (companies.get(move['produit_id']), _local_date(move['date']), move['warehouse_id'], move['produit_id'])
+        delta = move['delta'] or 0
+        _merge(deltas, {key: {'entrees': max(delta, 0), 'sorties': max(-delta, 0)}})
+    return deltas
+
+
+def _values(instance, fields):
+    return {field: getattr(instance, field) for field in fields}
+
+
+def _vente_values(vente_id):
+    return Vente.objects.filter(pk=vente_id).values(*VENTE_FIELDS).first()
+
+
+def _produit_company(instance):
+    produit = instance._state.fields_cache.get('produit')
+    if produit is not None:
+        return produit.company_id
+    return Produit.objects.filter(pk=instance.produit_id).values_list('company_id', flat=True).first()
+
+
+previous_state.track(Vente, VENTE_FIELDS)
+previous_state.track(LigneVente, LIGNE_FIELDS)
+previous_state.track(StockMove, MOVE_FIELDS)
+
+
+@receiver(post_save, sender=Vente)
+def _vente_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = previous_state.previous(instance, created)
+    current = _values(instance, VENTE_FIELDS)
+    apply_sales_deltas(_merge(_merge({}, _vente_contribution(current)), _vente_contribution(previous), -1))
+
+    # Les lignes ne changent d'agrégat que si la vente entre/sort de l'état terminé ou change de jour/entrepôt
+    if not created and _lignes_base(previous) != _lignes_base(current):
+        lignes = _merge({}, _lignes_contribution(instance.pk, current))
+        apply_product_deltas(_merge(lignes, _lignes_contribution(instance.pk, previous), -1))
+
+
+@receiver(post_delete, sender=Vente)
+def _vente_deleted(sender, instance, **kwargs):
+    # Les lignes (supprimées en cascade) retirent elles-mêmes leur contribution
+    apply_sales_deltas(_merge({}, _vente_contribution(_values(instance, VENTE_FIELDS)), -1))
+
+
+@receiver(post_save, sender=LigneVente)
+def _ligne_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    vente = _vente_values(instance.vente_id)
+    deltas = _merge({}, _ligne_contribution(_values(instance, LIGNE_FIELDS), vente))
+    previous = previous_state.previous(instance, created)
+    if previous:
+        old_vente = vente if previous['vente_id'] == instance.vente_id else _vente_values(previous['vente_id'])
+        _merge(deltas, _ligne_contribution(previous, old_vente), -1)
+    apply_product_deltas(deltas)
+
+
+@receiver(post_delete, sender=LigneVente)
+def _ligne_deleted(sender, instance, **kwargs):
+    vente = _vente_values(instance.vente_id)
+    apply_product_deltas(_merge({}, _ligne_contribution(_values(instance, LIGNE_FIELDS), vente), -1))
+
+
+@receiver(post_save, sender=StockMove)
+def _stock_move_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    company_id = _produit_company(instance)
+    deltas = move_contributions([_values(instance, MOVE_FIELDS)], {instance.produit_id: company_id})
+    previous = previous_state.previous(instance, created)
+    if previous:
+        companies = {instance.produit_id: company_id}
+        if previous['produit_id'] != instance.produit_id:
+            companies[previous['produit_id']] = Produit.objects.filter(
+                pk=previous['produit_id']).values_list('company_id', flat=True).first()
+        _merge(deltas, move_contributions([previous], companies), -1)
+    apply_product_deltas(deltas)
+
+
+@receiver(post_delete, sender=StockMove)
+def _stock_move_deleted(sender, instance, **kwargs):
+    companies = {instance.produit_id: _produit_company(instance)}
+    apply_product_deltas(_merge({}, move_contributions([_values(instance, MOVE_FIELDS)], companies), -1))
@@ -0,0 +1,171 @@
+"""
+Ordre de passage des arrêts d'une tournée à partir des coordonnées clients.
+
+La matrice des distances (haversine, km) est calculée d'un bloc avec NumPy,
+puis l'ordre est construit par plus proche voisin et amélioré par 2-opt
+(chemin ouvert : le retour au dépôt n'est pas compté). Chaque passe 2-opt
+évalue toutes les inversions d'un point en une opération vectorisée : une
+tournée de 150 arrêts s'ordonne en quelques millisecondes.
+
+Les arrêts déjà visités (livré, échec) gardent leur ordre et restent en tête ;
+l'itinéraire repart du dernier visité, sinon du point de départ de la
+tournée. Les clients sans coordonnées sont placés en fin de tournée.
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .distribution_models import ArretTourneeMobile
+from .sync_changes import record_many
+
+EARTH_RADIUS_KM = 6371.0088
+STATUTS_VISITES = ('livre', 'echec')
+ORDRE_PROVISOIRE = 1000000
+
+
+def distance_matrix(coords):
+    """Distances haversine (km) entre tous les points [(lat, lng), ...]"""
+    rad = np.radians(np.asarray(coords, dtype=float).reshape(-1, 2))
+    lat, lng = rad[:, 0], rad[:, 1]
+    dlat = lat[:, None] - lat[None, :]
+    dlng = lng[:, None] - lng[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def path_length(dist, order):
+    order = np.asarray(order)
+    return float(dist[order[:-1], order[1:]].sum()) if len(order) > 1 else 0.0
+
+
+def nearest_neighbour(dist, start=0):
+    """Chemin glouton depuis `start` vers le point non visité le plus proche"""
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    order = [start]
+    visited[start] = True
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, dist[order[-1]])
+        nxt = int(row.argmin())
+        order.append(nxt)
+        visited[nxt] = True
+    return np.array(order)
+
+
+def two_opt(dist, order, max_passes=50):
+    """
+    Améliore un chemin ouvert dont le premier point est fixe : inversion de
+    order[i..j] tant qu'elle raccourcit le chemin.
+    """
+    order = np.array(order)
+    n = len(order)
+    if n < 4:
+        return order
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 1):
+            a, b = order[i - 1], order[i]
+            js = np.arange(i + 1, n)
+            c = order[js]
+            # Successeur de c (aucun pour le dernier point du chemin)
+            d = order[np.minimum(js + 1, n - 1)]
+            delta = dist[a, c] - dist[a, b] + np.where(js < n - 1, dist[b, d] - dist[c, d], 0.0)
+            k = int(delta.argmin())
+            if delta[k] < -1e-9:
+                j = js[k]
+                order[i:j + 1] = order[i:j + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return order
+
+
+def best_order(coords, origin=None):
+    """
+    Indices de `coords` dans l'ordre de visite. Avec `origin` (lat, lng),
+    le chemin part de ce point ; sinon du premier point de `coords`.
+    """
+    if len(coords) < 2:
+        return list(range(len(coords)))
+    points = ([origin] if origin is not None else []) + list(coords)
+    dist = distance_matrix(points)
+    order = two_opt(dist, nearest_neighbour(dist, 0))
+    if origin is not None:
+        return [int(i) - 1 for i in order[1:]]
+    return [int(i) for i in order]
+
+
+def _coords(obj, lat, lng):
+    lat, lng = getattr(obj, lat, None), getattr(obj, lng, None)
+    return (float(lat), float(lng)) if lat is not None and lng is not None else None
+
+
+def _ordonner(tournee, arrets):
+    """(arrêts dans le nouvel ordre, distance avant, distance après)"""
+    arrets = sorted(arrets, key=lambda a: (a.ordre_passage, a.pk))
+    visites = [a for a in arrets if a.statut in STATUTS_VISITES]
+    restants = [a for a in arrets if a.statut not in STATUTS_VISITES]
+    places = [a for a in restants if _coords(a.client, 'lat', 'lng') is not None]
+    sans_coordonnees = [a for a in restants if _coords(a.client, 'lat', 'lng') is None]
+    if not places:
+        return visites + sans_coordonnees, 0.0, 0.0
+
+    # Départ : dernier arrêt visité localisé, sinon point de départ de la tournée
+    dernier = next((a for a in reversed(visites) if _coords(a.client, 'lat', 'lng') is not None), None)
+    origin = (_coords(dernier.client, 'lat', 'lng') if dernier is not None
+              else _coords(tournee, 'position_depart_lat', 'position_depart_lng'))
+
+    coords = [_coords(a.client, 'lat', 'lng') for a in places]
+    offset = 1 if origin is not None else 0
+    dist = distance_matrix(([origin] if origin is not None else []) + coords)
+    actuel = list(range(len(dist)))
+    order = best_order(coords, origin)
+    propose = list(range(offset)) + [i + offset for i in order]
+    avant, apres = path_length(dist, actuel), path_length(dist, propose)
+    if apres >= avant:
+        # Déjà au moins aussi bon : ordre inchangé
+        return visites + places + sans_coordonnees, avant, avant
+    return visites + [places[i] for i in order] + sans_coordonnees, avant, apres
+
+
+def optimiser_tournees(tournees):
+    """
+    Réordonne les arrêts des tournées (une requête de lecture, un bulk_update).
+    Retourne {tournee_id: {arrets, distance_avant_km, distance_apres_km, sans_coordonnees}}.
+    """
+    tournees = {t.pk: t for t in tournees}
+    par_tournee = {pk: [] for pk in tournees}
+    for arret in ArretTourneeMobile.objects.filter(tournee_id__in=tournees).select_related('client'):
+        par_tournee[arret.tournee_id].append(arret)
+
+    resultats, modifies = {}, []
+    for pk, arrets in par_tournee.items():
+        ordered, avant, apres = _ordonner(tournees[pk], arrets)
+        for ordre, arret in enumerate(ordered, start=1):
+            if arret.ordre_passage != ordre:
+                arret.ordre_passage = ordre
+                modifies.append(arret)
+        resultats[pk] = {
+            'arrets': [a.pk for a in ordered],
+            'distance_avant_km': round(avant, 3),
+            'distance_apres_km': round(apres, 3),
+            'sans_coordonnees': sum(1 for a in ordered if _coords(a.client, 'lat', 'lng') is None),
+        }
+
+    if modifies:
+        now = timezone.now()
+        for arret in modifies:
+            arret.updated_at = now
+        with transaction.atomic():
+            # (tournée, ordre) est unique : valeurs provisoires hors plage avant l'ordre final
+            ArretTourneeMobile.objects.filter(pk__in=[a.pk for a in modifies]).update(
+                ordre_passage=F('ordre_passage') + ORDRE_PROVISOIRE)
+            ArretTourneeMobile.objects.bulk_update(modifies, ['ordre_passage', 'updated_at'], batch_size=500)
+        # bulk_update n'émet pas de signal : journal de synchronisation
+        record_many('arret', [(a.pk, a.company_id, tournees[a.tournee_id].livreur_id) for a in modifies])
+    return resultats
+
+
+def optimiser_tournee(tournee):
+    return optimiser_tournees([tournee])[tournee.pk]
@@ -0,0 +1,72 @@
+"""
+Finalisation d'une vente en lot.
+
+Les lignes sont lues en une requête, le stock est vérifié et décrémenté par
+StockLedger (verrous, F(), bulk_create des StockMove) et le bon de livraison
+validé est créé avec ses lignes en bulk_create. Le nombre de requêtes ne
+dépend plus (ou presque) du nombre de lignes de la vente.
+
+La vente est relue avec select_for_update() dans la transaction et son
+statut vérifié sous ce verrou : deux finalisations simultanées ne
+décrémentent pas deux fois le stock.
+"""
+import logging
+
+from django.db import transaction
+
+from .models import BonLivraison, LigneLivraison, Vente
+from .numbering import next_numero
+from .stock_ledger import StockLedger
+
+logger = logging.getLogger(__name__)
+
+
+class VenteNonBrouillon(Exception):
+    """La vente n'est plus en brouillon (déjà finalisée ou annulée)"""
+
+
+def create_bon_livraison(vente, lignes):
+    """Bon de livraison validé reprenant les lignes de la vente"""
+    bon = BonLivraison.objects.create(
+        company_id=vente.company_id,
+        numero=next_numero('bon_livraison', vente.company_id),
+        client_id=vente.client_id,
+        statut='validated',
+    )
+    LigneLivraison.objects.bulk_create([
+        LigneLivraison(bon=bon, produit_id=l.produit_id, quantite=int(l.quantite or 0),
+                       prixU_snapshot=l.prixU_snapshot)
+        for l in lignes
+    ])
+    return bon
+
+
+def complete_vente(vente):
+    """
+    Passe une vente brouillon à 'completed' : décrément du stock et bon de
+    livraison dans une transaction. Retourne la vente relue sous verrou.
+    Lève VenteNonBrouillon ou StockInsuffisant sans rien écrire.
+    Un échec de création du BL n'empêche pas la finalisation (comme avant).
+    """
+    with transaction.atomic():
+        vente = Vente.objects.select_for_update().get(pk=vente.pk)
+        if vente.statut != 'draft':
+            raise VenteNonBrouillon(vente.statut)
+
+        lignes = list(vente.lignes.select_related('produit'))
+        ledger = StockLedger(check='produit', clamp=True)
+        for ligne in lignes:
+            qty = int(ligne.quantite or 0)
+            if qty > 0:
+                ledger.add(ligne.produit, vente.warehouse, -qty, 'VENTE', vente.id,
+                           f"Vente {vente.numero} - finalisée")
+        ledger.apply()
+        if not vente.bon_livraison_id and vente.client_id:
+            try:
+                with transaction.atomic():
+                    vente.bon_livraison = create_bon_livraison(vente, lignes)
+            except Exception as e:
+                logger.exception('Erreur creation BL lors de la finalisation de la vente: %s', e)
+        vente.statut = 'completed'
+        vente.save()
+    return vente
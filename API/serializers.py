@@ -38,34 +38,60 @@ class UserProfileSerializer(serializers.ModelSerializer):
 
 
 # Serializers pour les Catégories
+def _categorie_index(serializer, obj):
+    """Index de hiérarchie fourni par la vue (context['categorie_index']), s'il couvre obj"""
+    index = serializer.context.get('categorie_index')
+    return index if index is not None and obj.pk in index.by_id else None
+
 class CategorieSerializer(serializers.ModelSerializer):
     parent_nom = serializers.CharField(source='parent.nom', read_only=True)
-    full_path = serializers.CharField(source='get_full_path', read_only=True)
-    products_count = serializers.IntegerField(source='get_products_count', read_only=True)
+    full_path = serializers.SerializerMethodField()
+    products_count = serializers.SerializerMethodField()
     sous_categories_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Categorie
         fields = ['id', 'nom', 'description', 'parent', 'parent_nom', 'full_path', 
                  'couleur', 'icone', 'is_active', 'products_count', 'sous_categories_count', 'created_at']
+
+    def validate_parent(self, value):
+        if value is not None and self.instance is not None and f'/{self.instance.pk}/' in (value.path or ''):
+            raise serializers.ValidationError("Une catégorie ne peut pas être placée sous elle-même ou une de ses sous-catégories")
+        return value
+
+    def get_full_path(self, obj):
+        index = _categorie_index(self, obj)
+        return index.full_path(obj.pk) if index else obj.get_full_path()
+
+    def get_products_count(self, obj):
+        index = _categorie_index(self, obj)
+        return index.products_count(obj.pk) if index else obj.get_products_count()
     
     def get_sous_categories_count(self, obj):
+        index = _categorie_index(self, obj)
+        if index:
+            return index.sous_categories_count(obj.pk)
         return obj.sous_categories.filter(is_active=True).count()
 
 class CategorieTreeSerializer(serializers.ModelSerializer):
     """Serializer pour affichage hiérarchique des catégories"""
     sous_categories = serializers.SerializerMethodField()
-    products_count = serializers.CharField(source='get_products_count', read_only=True)
+    products_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Categorie
         fields = ['id', 'nom', 'description', 'couleur', 'icone', 'is_active', 
                  'products_count', 'sous_categories']
+
+    def get_products_count(self, obj):
+        # Chaîne, comme auparavant (CharField)
+        index = _categorie_index(self, obj)
+        return str(index.products_count(obj.pk) if index else obj.get_products_count())
     
     def get_sous_categories(self, obj):
-        if obj.sous_categories.filter(is_active=True).exists():
-            return CategorieTreeSerializer(obj.sous_categories.filter(is_active=True), many=True).data
-        return []
+        index = _categorie_index(self, obj)
+        children = index.children(obj.pk) if index else obj.sous_categories.filter(is_active=True)
+        return CategorieTreeSerializer(children, many=True, context=self.context).data
 
 from django.contrib.auth.models import Group, Permission
 from .models import AuditLog
@@ -90,6 +116,55 @@ class AuditLogSerializer(serializers.ModelSerializer):
         fields = ['id', 'created_at', 'actor', 'actor_username', 'action', 'target_model', 'target_id', 'target_repr', 'metadata', 'ip_address', 'user_agent']
         read_only_fields = fields
 
+class ReportJobSerializer(serializers.ModelSerializer):
+    """Job de rapport différé : seuls type, format et paramètres sont fournis par le client"""
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = ['id', 'report_type', 'format', 'params', 'statut', 'progress', 'error',
+                  'filename', 'download_url', 'created_at', 'started_at', 'finished_at', 'expires_at']
+        read_only_fields = ['statut', 'progress', 'error', 'filename', 'download_url',
+                            'created_at', 'started_at', 'finished_at', 'expires_at']
+
+    def validate(self, attrs):
+        from .report_jobs import SUPPORTED_FORMATS
+        if attrs.get('format', 'excel') not in SUPPORTED_FORMATS[attrs['report_type']]:
+            raise serializers.ValidationError({'format': 'Format non supporté pour ce rapport'})
+        return attrs
+
+    def get_download_url(self, obj):
+        if obj.statut != 'done':
+            return None
+        from rest_framework.reverse import reverse
+        return reverse('report-jobs-download', args=[obj.pk], request=self.context.get('request'))
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    """Job d'import par blocs : le client envoie le fichier puis suit la progression"""
+    progress = serializers.IntegerField(read_only=True)
+    errors_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = ['id', 'import_type', 'source', 'original_name', 'statut', 'progress',
+                  'total_rows', 'last_row', 'created_count', 'updated_count', 'skipped_count',
+                  'errors_count', 'errors_url', 'error', 'created_at', 'started_at',
+                  'finished_at', 'expires_at']
+        read_only_fields = [f for f in fields if f not in ('import_type', 'source')]
+        extra_kwargs = {'source': {'write_only': True}}
+
+    def validate_source(self, value):
+        from .import_jobs import SUPPORTED_EXTENSIONS
+        if not value.name.lower().endswith(SUPPORTED_EXTENSIONS):
+            raise serializers.ValidationError('Format de fichier non supporté')
+        return value
+
+    def get_errors_url(self, obj):
+        if not obj.errors_count:
+            return None
+        from rest_framework.reverse import reverse
+        return reverse('import-jobs-errors', args=[obj.pk], request=self.context.get('request'))
+
 class UserSerializer(serializers.ModelSerializer):
     groups = serializers.PrimaryKeyRelatedField(queryset=Group.objects.all(), many=True, required=False)
     group_names = serializers.SlugRelatedField(source='groups', slug_field='name', read_only=True, many=True)
@@ -252,6 +327,55 @@ class ProduitSerializer(serializers.ModelSerializer):
     def get_nombre_prix(self, obj):
         return obj.prix_multiples.filter(is_active=True).count()
 
+def produit_list_queryset(queryset):
+    """
+    Prépare un queryset de produits pour ProduitListSerializer :
+    total des mouvements et nombre de prix actifs en sous-requêtes,
+    relations jointes et prix multiples préchargés (aucune requête par ligne).
+    """
+    from django.db.models import Count, OuterRef, Prefetch, Subquery, Sum
+    from django.db.models.functions import Coalesce
+    mouvements = StockMove.objects.filter(produit=OuterRef('pk')).order_by().values('produit').annotate(
+        total=Sum('delta')).values('total')
+    prix_actifs = PrixProduit.objects.filter(produit=OuterRef('pk'), is_active=True).order_by().values(
+        'produit').annotate(n=Count('id')).values('n')
+    return queryset.select_related('categorie', 'currency', 'fournisseur').prefetch_related(
+        Prefetch('prix_multiples', queryset=PrixProduit.objects.select_related('code_prix', 'type_prix', 'currency'))
+    ).annotate(
+        stock_mouvements=Coalesce(Subquery(mouvements), 0),
+        nombre_prix=Coalesce(Subquery(prix_actifs), 0),
+    )
+
+
+class ProduitListSerializer(ProduitSerializer):
+    """
+    Variante de liste de ProduitSerializer (même représentation) pour un
+    queryset préparé par produit_list_queryset. Les chemins de catégorie
+    viennent de context['categorie_paths'] (Categorie.full_path_map).
+    """
+    stock_mouvements = serializers.IntegerField(read_only=True)
+    nombre_prix = serializers.IntegerField(read_only=True)
+    categorie_path = serializers.SerializerMethodField()
+
+    def get_categorie_path(self, obj):
+        if obj.categorie_id is None:
+            return None
+        paths = self.context.get('categorie_paths') or {}
+        if obj.categorie_id in paths:
+            return paths[obj.categorie_id]
+        return obj.categorie.get_full_path()
+
+    def get_prix_formatted(self, obj):
+        currency = obj.currency
+        if currency is None:
+            # Devise par défaut lue une fois pour toute la liste
+            if not hasattr(self, '_default_currency'):
+                self._default_currency = Currency.get_default()
+            currency = self._default_currency
+        symbol = currency.symbol if currency else '€'
+        return f"{obj.prixU} {symbol}"
+
+
 class ClientSerializer(serializers.ModelSerializer):
     produits = ProduitSerializer(many=True,read_only=True)
     class Meta:
@@ -296,22 +420,18 @@ class BonLivraisonSerializer(serializers.ModelSerializer):
         }
 
     def create(self, validated_data):
+        from django.db import transaction
+        from .numbering import next_numero
         lignes_data = validated_data.pop('lignes', [])
-        numero = validated_data.get('numero')
-        if not numero:
-            base = 'BL-'
-            n = BonLivraison.objects.count() + 1
-            # ensure unique number
-            while True:
-                candidate = f"{base}{n:05d}"
-                if not BonLivraison.objects.filter(numero=candidate).exists():
-                    numero = candidate
-                    break
-                n += 1
-            validated_data['numero'] = numero
-        bon = BonLivraison.objects.create(**validated_data)
-        for ld in lignes_data:
-            LigneLivraison.objects.create(bon=bon, **ld)
+        request = self.context.get('request')
+        if not validated_data.get('company') and getattr(request, 'company', None) is not None:
+            validated_data['company'] = request.company
+        with transaction.atomic():
+            if not validated_data.get('numero'):
+                validated_data['numero'] = next_numero('bon_livraison', validated_data.get('company'))
+            bon = BonLivraison.objects.create(**validated_data)
+            for ld in lignes_data:
+                LigneLivraison.objects.create(bon=bon, **ld)
         return bon
 
     def update(self, instance, validated_data):
@@ -585,19 +705,15 @@ class VenteCreateSerializer(serializers.ModelSerializer):
         from django.db import transaction
         lignes_data = validated_data.pop('lignes')
 
-        # Générer un numéro automatique si pas fourni
-        if not validated_data.get('numero'):
-            base = 'VTE-'
-            n = Vente.objects.count() + 1
-            while True:
-                candidate = f"{base}{n:05d}"
-                if not Vente.objects.filter(numero=candidate).exists():
-                    validated_data['numero'] = candidate
-                    break
-                n += 1
+        # Entreprise de l'utilisateur (numérotation par entreprise)
+        request = self.context.get('request')
+        if not validated_data.get('company') and getattr(request, 'company', None) is not None:
+            validated_data['company'] = request.company
 
         # Exiger un entrepôt: utiliser par défaut si non fourni
-        from .models import SystemConfig, Warehouse, ProductStock
+        from .models import SystemConfig, Warehouse
+        from .stock_ledger import StockLedger, StockInsuffisant
+        from .numbering import next_numero
         wh = validated_data.get('warehouse')
         if not wh or (hasattr(wh, 'is_active') and not wh.is_active):
             wh = SystemConfig.ensure_default_warehouse()
@@ -611,20 +727,11 @@ class VenteCreateSerializer(serializers.ModelSerializer):
         if 'statut' not in validated_data:
             validated_data['statut'] = 'draft'
 
-        # Pré-vérifier le stock disponible pour chaque ligne SEULEMENT si la vente est completed
-        if validated_data.get('statut') == 'completed':
-            insuffisants = []
-            for ld in lignes_data:
-                produit = ld['produit']
-                qty = int(ld.get('quantite') or 0)
-                if qty <= 0:
-                    continue
-                if produit.quantite < qty:
-                    insuffisants.append({'produit': produit.id, 'reference': produit.reference, 'stock': produit.quantite, 'demande': qty})
-            if insuffisants:
-                raise serializers.ValidationError({'detail': 'Stock insuffisant', 'lignes': insuffisants})
-
+        ledger = StockLedger(check='produit', clamp=True)
         with transaction.atomic():
+            # Numéro attribué dans la transaction : rendu si la vente est annulée
+            if not validated_data.get('numero'):
+                validated_data['numero'] = next_numero('vente', validated_data.get('company'))
             vente = Vente.objects.create(**validated_data)
 
             for ligne_data in lignes_data:
@@ -647,15 +754,13 @@ class VenteCreateSerializer(serializers.ModelSerializer):
 
                 # Décrémenter le stock SEULEMENT si la vente est finalisée (completed)
                 if qty > 0 and vente.statut == 'completed':
-                    # décrément agrégé (back-compat)
-                    produit.quantite = produit.quantite - qty
-                    produit.save(update_fields=['quantite'])
-                    # décrément par entrepôt
-                    ps, _ = ProductStock.objects.get_or_create(produit=produit, warehouse=vente.warehouse, defaults={'quantity': 0})
-                    ps.quantity = max(0, (ps.quantity or 0) - qty)
-                    ps.save(update_fields=['quantity'])
-                    # mouvement de sortie rattaché à l'entrepôt
-                    StockMove.objects.create(produit=produit, warehouse=vente.warehouse, delta=-(qty), source='VENTE', ref_id=str(vente.id), note=f"Vente {vente.numero}")
+                    ledger.add(produit, vente.warehouse, -qty, 'VENTE', vente.id, f"Vente {vente.numero}")
+
+            # Stock vérifié et décrémenté sous verrou ; une rupture annule toute la vente
+            try:
+                ledger.apply()
+            except StockInsuffisant as e:
+                raise serializers.ValidationError({'detail': 'Stock insuffisant', 'lignes': e.lignes})
 
             vente.recompute_totals()
             vente.save()
@@ -786,29 +891,14 @@ class TourneeSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         """Générer automatiquement le numéro de tournée"""
         from datetime import datetime
+        from django.db import transaction
+        from .numbering import next_numero
 
-        # Générer le numéro automatiquement
+        # Générer le numéro automatiquement (compteur du jour)
         date = validated_data.get('date', datetime.now().date())
-        date_str = date.strftime('%Y%m%d')
-
-        # Trouver le dernier numéro de tournée du jour
-        from API.models import Tournee
-        last_tournee = Tournee.objects.filter(
-            numero__startswith=f'TOUR-{date_str}'
-        ).order_by('-numero').first()
-
-        if last_tournee:
-            # Extraire le compteur et incrémenter
-            last_counter = int(last_tournee.numero.split('-')[-1])
-            counter = last_counter + 1
-        else:
-            counter = 1
-
-        # Générer le numéro
-        numero = f'TOUR-{date_str}-{counter:03d}'
-        validated_data['numero'] = numero
-
-        return super().create(validated_data)
+        with transaction.atomic():
+            validated_data['numero'] = next_numero('tournee', date=date)
+            return super().create(validated_data)
 
 
 class TourneeListSerializer(serializers.ModelSerializer):
@@ -0,0 +1,160 @@
+"""
+Index spatial des clients (grille fixe) et recherches de proximité.
+
+Chaque client géolocalisé porte sa case de grille (Client.grille_lat /
+grille_lng, cases de Client.GRILLE_DEG degrés) :
+- clients_in_bbox (emprise visible de la carte) est une requête SQL sur les
+  cases, servie par l'index (company, grille_lat, grille_lng) ;
+- clients_within (clients à moins de R km d'un point) lit une grille en
+  mémoire par entreprise (tableaux NumPy triés par case), construite en une
+  requête et reconstruite quand la version partagée (cache Django) change,
+  c'est-à-dire à chaque modification ou suppression d'un client ;
+- nearest_livreurs : k livreurs les plus proches (dernières positions, API.positions).
+
+Seules les cases qui recouvrent la zone sont lues ; les candidats sont
+ensuite filtrés par distance haversine vectorisée.
+"""
+import math
+import threading
+import time
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Client
+from .positions import last_positions
+from .routing import EARTH_RADIUS_KM
+
+KM_PAR_DEGRE = 111.32
+
+_lock = threading.Lock()
+_grids = {}  # {company_id: (version, ClientGrid)}
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """Distances (km) d'un point à un ensemble de points (tableaux NumPy)"""
+    lat, lng = math.radians(lat), math.radians(lng)
+    lats, lngs = np.radians(lats), np.radians(lngs)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def bbox_around(lat, lng, radius_km):
+    """(sud, ouest, nord, est) englobant le cercle de rayon radius_km"""
+    dlat = radius_km / KM_PAR_DEGRE
+    dlng = radius_km / (KM_PAR_DEGRE * max(math.cos(math.radians(lat)), 1e-6))
+    return lat - dlat, lng - dlng, lat + dlat, lng + dlng
+
+
+class ClientGrid:
+    """Clients géolocalisés d'une entreprise, regroupés par case de grille"""
+
+    def __init__(self, rows):
+        """rows : (id, lat, lng)"""
+        rows = sorted(((Client.cellule(lat, lng), pk, float(lat), float(lng)) for pk, lat, lng in rows))
+        self.ids = np.array([r[1] for r in rows], dtype=np.int64)
+        self.lats = np.array([r[2] for r in rows], dtype=float)
+        self.lngs = np.array([r[3] for r in rows], dtype=float)
+        # {(case_lat, case_lng): (début, fin)} dans les tableaux triés
+        self.cells = {}
+        for index, (cell, *_) in enumerate(rows):
+            start, _ = self.cells.get(cell, (index, index))
+            self.cells[cell] = (start, index + 1)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _candidates(self, south, west, north, east):
+        """Indices des clients des cases recouvrant l'emprise"""
+        (i0, j0), (i1, j1) = Client.cellule(south, west), Client.cellule(north, east)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.cells):
+            # Grande emprise : parcourir les cases occupées plutôt que toutes les cases
+            spans = [span for (i, j), span in self.cells.items() if i0 <= i <= i1 and j0 <= j <= j1]
+        else:
+            spans = [self.cells[(i, j)] for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)
+                     if (i, j) in self.cells]
+        if not spans:
+            return np.array([], dtype=np.int64)
+        return np.concatenate([np.arange(start, end) for start, end in spans])
+
+    def within(self, lat, lng, radius_km):
+        """[(client_id, distance_km)] triés par distance"""
+        idx = self._candidates(*bbox_around(lat, lng, radius_km))
+        dist = haversine_km(lat, lng, self.lats[idx], self.lngs[idx])
+        keep = dist <= radius_km
+        idx, dist = idx[keep], dist[keep]
+        order = np.argsort(dist, kind='stable')
+        return [(int(self.ids[i]), float(d)) for i, d in zip(idx[order], dist[order])]
+
+
+def _version_key(company_id):
+    return f'spatial:clients:version:{company_id or "all"}'
+
+
+def _version(company_id):
+    key = _version_key(company_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate(company_id):
+    for key in {_version_key(company_id), _version_key(None)}:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def client_grid(company_id=None):
+    """Grille des clients de l'entreprise (tous les clients si None)"""
+    version = _version(company_id)
+    with _lock:
+        cached = _grids.get(company_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    clients = Client.objects.filter(lat__isnull=False, lng__isnull=False)
+    if company_id:
+        clients = clients.filter(company_id=company_id)
+    grid = ClientGrid(clients.values_list('id', 'lat', 'lng'))
+    with _lock:
+        _grids[company_id] = (version, grid)
+    return grid
+
+
+def clients_within(company_id, lat, lng, radius_km):
+    return client_grid(company_id).within(lat, lng, radius_km)
+
+
+def clients_in_bbox(queryset, south, west, north, east):
+    """Clients de `queryset` dans l'emprise (cases de grille puis coordonnées exactes)"""
+    (i0, j0), (i1, j1) = Client.cellule(south, west), Client.cellule(north, east)
+    return queryset.filter(
+        grille_lat__gte=i0, grille_lat__lte=i1, grille_lng__gte=j0, grille_lng__lte=j1,
+        lat__gte=south, lat__lte=north, lng__gte=west, lng__lte=east,
+    )
+
+
+def nearest_livreurs(company_id, lat, lng, k=5):
+    """k livreurs les plus proches du point (dernière position connue), avec distance_km"""
+    positions = last_positions(company_id)
+    if not positions:
+        return []
+    dist = haversine_km(lat, lng, np.array([p['lat'] for p in positions]), np.array([p['lng'] for p in positions]))
+    order = np.argsort(dist, kind='stable')[:k]
+    return [{**positions[i], 'distance_km': round(float(dist[i]), 3)} for i in order]
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def _client_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Tout de suite, puis au commit (une lecture concurrente a pu recharger l'ancienne grille)
+    invalidate(instance.company_id)
+    transaction.on_commit(lambda: invalidate(instance.company_id))
@@ -0,0 +1,205 @@
+"""
+Registre des mouvements de stock (StockLedger).
+
+Point d'entrée unique pour modifier ProductStock.quantity et Produit.quantite.
+Un lot de mouvements (produit, entrepôt, delta, source, ref) est appliqué en
+une transaction :
+- verrouillage (select_for_update) des produits puis des stocks par entrepôt,
+  toujours dans l'ordre des clés pour éviter les interblocages ;
+- contrôle de disponibilité sur les valeurs verrouillées ;
+- mises à jour par expressions F() (aucune écriture de valeurs lues en Python) ;
+- bulk_create des StockMove et une seule mise à jour de Produit.quantite par produit.
+
+bulk_create et update() ne déclenchent pas les signaux : les agrégats
+journaliers et les compteurs du tableau de bord sont mis à jour ici.
+"""
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+from django.db.models import F, Sum, Value, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Produit, ProductStock, StockMove
+
+Mouvement = namedtuple('Mouvement', 'produit warehouse delta source ref_id note date')
+
+PRODUIT_FIELDS = ('id', 'reference', 'company_id', 'quantite', 'seuil_alerte', 'seuil_critique', 'is_active')
+
+
+class StockInsuffisant(Exception):
+    """Levée avant toute écriture ; lignes: [{'produit', 'reference', 'stock', 'demande', ...}]"""
+
+    def __init__(self, lignes):
+        super().__init__('Stock insuffisant')
+        self.lignes = lignes
+
+
+class StockLedger:
+    """
+    check: None, 'produit' (Produit.quantite) ou 'warehouse' (ProductStock de l'entrepôt)
+    clamp: un stock d'entrepôt ne descend pas sous zéro (ventes)
+    refresh: mise à jour de Produit.quantite
+        'delta' -> quantite + somme des deltas du lot
+        'sum'   -> somme des stocks par entrepôt
+        None    -> inchangé (transferts entre entrepôts, stock des vans)
+    allocate: une sortie sans entrepôt est prélevée sur les entrepôts les mieux fournis
+    """
+
+    def __init__(self, check=None, clamp=False, refresh='delta', allocate=False):
+        self.check = check
+        self.clamp = clamp
+        self.refresh = refresh
+        self.allocate = allocate
+        self.mouvements = []
+
+    def add(self, produit, warehouse, delta, source, ref_id='', note='', date=None):
+        self.mouvements.append(Mouvement(produit, warehouse, int(delta), source,
+                                         str(ref_id or ''), note or '', date))
+        return self
+
+    def apply(self):
+        """Applique le lot et retourne les StockMove créés (dans l'ordre d'ajout)"""
+        if not self.mouvements:
+            return []
+        with transaction.atomic():
+            produits = self._lock_produits()
+            stocks = self._lock_stocks()
+            self._check(produits, stocks)
+            self._update_stocks(stocks)
+            nouvelles_quantites = self._refresh_produits(produits)
+            moves = self._create_moves()
+            self._after_write(produits, nouvelles_quantites, moves)
+        return moves
+
+    def _lock_produits(self):
+        ids = sorted({m.produit.pk for m in self.mouvements})
+        rows = Produit.objects.select_for_update().filter(id__in=ids).order_by('id').values(*PRODUIT_FIELDS)
+        return {row['id']: row for row in rows}
+
+    def _lock_stocks(self):
+        pairs = sorted({(m.produit.pk, m.warehouse.pk) for m in self.mouvements if m.warehouse is not None})
+        produit_ids = {pid for pid, _ in pairs}
+        if self.allocate:
+            produit_ids |= {m.produit.pk for m in self.mouvements if m.warehouse is None and m.delta < 0}
+        if not produit_ids:
+            return {}
+        # Lignes manquantes créées sous le verrou des produits (conflits ignorés)
+        ProductStock.objects.bulk_create(
+            [ProductStock(produit_id=pid, warehouse_id=wid, quantity=0) for pid, wid in pairs],
+            ignore_conflicts=True,
+        )
+        rows = ProductStock.objects.select_for_update().filter(
+            produit_id__in=sorted(produit_ids)
+        ).order_by('produit_id', 'warehouse_id')
+        return {(s.produit_id, s.warehouse_id): s for s in rows}
+
+    def _check(self, produits, stocks):
+        if self.check is None:
+            return
+        demandes = defaultdict(int)
+        for m in self.mouvements:
+            if m.delta < 0:
+                key = m.produit.pk if self.check == 'produit' else (m.produit.pk, getattr(m.warehouse, 'pk', None))
+                demandes[key] -= m.delta
+
+        lignes = []
+        for key, demande in demandes.items():
+            if self.check == 'produit':
+                produit = produits[key]
+                disponible = produit['quantite']
+                ligne = {'produit': key, 'reference': produit['reference']}
+            else:
+                stock = stocks.get(key)
+                disponible = stock.quantity if stock is not None else 0
+                ligne = {'produit': key[0], 'reference': produits[key[0]]['reference'], 'warehouse': key[1]}
+            if disponible < demande:
+                ligne.update(stock=disponible, demande=demande)
+                lignes.append(ligne)
+        if lignes:
+            raise StockInsuffisant(lignes)
+
+    def _update_stocks(self, stocks):
+        deltas = defaultdict(int)
+        for m in self.mouvements:
+            if m.warehouse is not None:
+                deltas[(m.produit.pk, m.warehouse.pk)] += m.delta
+            elif self.allocate and m.delta < 0:
+                # Prélever d'abord sur les entrepôts ayant le plus de stock
+                reste = -m.delta
+                candidats = sorted(
+                    (key for key in stocks if key[0] == m.produit.pk),
+                    key=lambda k: -(stocks[k].quantity + deltas[k])
+                )
+                for key in candidats:
+                    pris = min(max(stocks[key].quantity + deltas[key], 0), reste)
+                    if pris > 0:
+                        deltas[key] -= pris
+                        reste -= pris
+
+        # Les lignes ayant la même variation partagent une requête
+        par_delta = defaultdict(list)
+        for key, delta in deltas.items():
+            if delta:
+                par_delta[delta].append(stocks[key].pk)
+        for delta, ids in sorted(par_delta.items()):
+            expression = F('quantity') + delta
+            if self.clamp:
+                expression = Greatest(expression, Value(0))
+            ProductStock.objects.filter(pk__in=sorted(ids)).update(quantity=expression)
+
+    def _refresh_produits(self, produits):
+        """Une mise à jour par produit ; retourne {produit_id: nouvelle quantite}"""
+        if self.refresh == 'delta':
+            totaux = defaultdict(int)
+            for m in self.mouvements:
+                totaux[m.produit.pk] += m.delta
+            # Les produits ayant la même variation partagent une requête
+            par_delta = defaultdict(list)
+            for pid, delta in totaux.items():
+                if delta:
+                    par_delta[delta].append(pid)
+            for delta, ids in par_delta.items():
+                Produit.objects.filter(id__in=ids).update(quantite=F('quantite') + delta)
+            return {pid: produits[pid]['quantite'] + delta for pid, delta in totaux.items()}
+
+        if self.refresh == 'sum':
+            ids = list(produits)
+            total = ProductStock.objects.filter(produit=OuterRef('pk')).values('produit').annotate(
+                total=Sum('quantity')
+            ).values('total')
+            Produit.objects.filter(id__in=ids).update(quantite=Coalesce(Subquery(total), 0))
+            return dict(Produit.objects.filter(id__in=ids).values_list('id', 'quantite'))
+
+        return {}
+
+    def _create_moves(self):
+        now = timezone.now()
+        date_field = StockMove._meta.get_field('date')
+        moves = [
+            StockMove(produit=m.produit, warehouse=m.warehouse, delta=m.delta, source=m.source,
+                      ref_id=m.ref_id, note=m.note, date=date_field.to_python(m.date) if m.date else now)
+            for m in self.mouvements
+        ]
+        return StockMove.objects.bulk_create(moves)
+
+    def _after_write(self, produits, nouvelles_quantites, moves):
+        from .dashboard import apply_stock_changes
+        from .rollups import apply_product_deltas, move_contributions
+        from .sync_changes import record_many
+
+        changed = [pid for pid, quantite in nouvelles_quantites.items() if quantite != produits[pid]['quantite']]
+        apply_stock_changes((produits[pid], nouvelles_quantites[pid]) for pid in changed)
+        # Stock affiché par l'app mobile : à renvoyer au prochain pull v2
+        record_many('produit', [(pid, produits[pid]['company_id'], None) for pid in changed])
+        # Garder les instances des appelants cohérentes avec la base
+        for m in self.mouvements:
+            if m.produit.pk in nouvelles_quantites:
+                m.produit.quantite = nouvelles_quantites[m.produit.pk]
+
+        # bulk_create n'émet pas de signal : agrégats journaliers en une mise à jour par produit/jour
+        apply_product_deltas(move_contributions(
+            [{'produit_id': m.produit_id, 'warehouse_id': m.warehouse_id, 'delta': m.delta, 'date': m.date}
+             for m in moves],
+            {pid: values['company_id'] for pid, values in produits.items()},
+        ))
@@ -0,0 +1,161 @@
+"""
+Journal des changements pour la synchronisation mobile (protocole v2).
+
+Chaque enregistrement/suppression d'une tournée, d'un arrêt, d'un client,
+d'un produit ou d'un prix ajoute une ligne SyncChange (par livreur pour les
+tournées et arrêts) sans séquence : l'écriture ne prend aucun verrou partagé,
+ventes, mouvements de stock et imports d'une même entreprise ne s'attendent
+pas sur le journal.
+
+Les séquences sont attribuées après le commit (transaction.on_commit, et à
+défaut au début de chaque lecture) par assign_sequences : courte transaction
+qui verrouille le compteur de l'entreprise (API.numbering, DocumentSequence
+'sync_change'), numérote les lignes en attente par ordre d'insertion puis
+supprime les lignes qu'elles remplacent. Une séquence n'est visible qu'une
+fois sa transaction validée et les numérotations s'exécutent l'une après
+l'autre : un mobile qui a reçu la séquence N+1 ne peut plus voir arriver N.
+
+Le mobile garde la dernière séquence reçue comme jeton et ne télécharge
+ensuite que les objets modifiés depuis, suppressions comprises (tombstones).
+Une tournée réaffectée laisse un tombstone (tournée et arrêts) à l'ancien
+livreur et est journalisée, avec ses arrêts, pour le nouveau. Les écritures
+en lot (bulk_create/bulk_update) appellent record_many explicitement.
+"""
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Client, Produit, PrixProduit
+from .distribution_models import TourneeMobile, ArretTourneeMobile, SyncChange
+from .numbering import next_value
+from . import previous_state
+
+
+def _prix_company(prix):
+    return Produit.objects.filter(pk=prix.produit_id).values_list('company_id', flat=True).first()
+
+
+def _arret_livreur(arret):
+    return TourneeMobile.objects.filter(pk=arret.tournee_id).values_list('livreur_id', flat=True).first()
+
+
+# Modèle -> (type, entreprise, livreur)
+TRACKED = {
+    TourneeMobile: ('tournee', lambda o: o.company_id, lambda o: o.livreur_id),
+    ArretTourneeMobile: ('arret', lambda o: o.company_id, _arret_livreur),
+    Client: ('client', lambda o: o.company_id, lambda o: None),
+    Produit: ('produit', lambda o: o.company_id, lambda o: None),
+    PrixProduit: ('prix', _prix_company, lambda o: None),
+}
+
+
+def _write(kind, rows):
+    """rows: (object_id, company_id, livreur_id, deleted) ; lignes en attente de séquence"""
+    SyncChange.objects.bulk_create([
+        SyncChange(kind=kind, object_id=pk, company_id=company_id, livreur_id=livreur_id, deleted=deleted)
+        for pk, company_id, livreur_id, deleted in rows
+    ])
+    for company_id in {row[1] for row in rows}:
+        transaction.on_commit(lambda company_id=company_id: assign_sequences(company_id), robust=True)
+
+
+def assign_sequences(company_id):
+    """Numérote les changements en attente de l'entreprise et supprime ceux qu'ils remplacent"""
+    pending = SyncChange.objects.filter(sequence__isnull=True)
+    pending = pending.filter(company_id=company_id) if company_id else pending.filter(company__isnull=True)
+    with transaction.atomic():
+        # Verrou du compteur (incrément nul) : une numérotation à la fois par entreprise
+        next_value('sync_change', company_id, count=0)
+        rows = list(pending.order_by('id').values_list('id', 'kind', 'object_id', 'livreur_id'))
+        if not rows:
+            return 0
+        last = next_value('sync_change', company_id, count=len(rows))
+        first = last - len(rows) + 1
+        SyncChange.objects.bulk_update(
+            [SyncChange(pk=pk, sequence=sequence) for sequence, (pk, *_) in enumerate(rows, start=first)],
+            ['sequence'], batch_size=500)
+
+        # Une ligne par (objet, livreur) : la plus récente
+        latest, groups = {}, defaultdict(set)
+        for pk, kind, object_id, livreur_id in rows:
+            latest[kind, object_id, livreur_id] = pk
+            groups[kind, livreur_id].add(object_id)
+        superseded = [pk for pk, kind, object_id, livreur_id in rows if latest[kind, object_id, livreur_id] != pk]
+        older = reduce(or_, (
+            Q(kind=kind, object_id__in=ids, **({'livreur_id': livreur_id} if livreur_id else {'livreur__isnull': True}))
+            for (kind, livreur_id), ids in groups.items()
+        ))
+        SyncChange.objects.filter(Q(pk__in=superseded) | (Q(sequence__lt=first) & older)).delete()
+    return len(rows)
+
+
+def record_many(kind, rows, deleted=False):
+    """rows: (object_id, company_id, livreur_id) ; requêtes en nombre fixe quel que soit le nombre de lignes"""
+    rows = [(pk, company_id, livreur_id, deleted) for pk, company_id, livreur_id in rows]
+    if rows:
+        _write(kind, rows)
+
+
+def record(instance, deleted=False):
+    kind, company, livreur = TRACKED[type(instance)]
+    record_many(kind, [(instance.pk, company(instance), livreur(instance))], deleted)
+
+
+def record_reassignment(tournee, ancien_livreur_id):
+    """Tournée passée d'un livreur à un autre : tombstones pour l'ancien, upserts pour le nouveau"""
+    arrets = list(ArretTourneeMobile.objects.filter(tournee_id=tournee.pk).values_list('id', 'company_id'))
+    _write('tournee', [(tournee.pk, tournee.company_id, ancien_livreur_id, True),
+                       (tournee.pk, tournee.company_id, tournee.livreur_id, False)])
+    if arrets:
+        _write('arret', [(pk, company_id, ancien_livreur_id, True) for pk, company_id in arrets]
+               + [(pk, company_id, tournee.livreur_id, False) for pk, company_id in arrets])
+
+
+previous_state.track(TourneeMobile, ('livreur_id',))
+
+
+@receiver(post_save, sender=TourneeMobile)
+@receiver(post_save, sender=ArretTourneeMobile)
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=Produit)
+@receiver(post_save, sender=PrixProduit)
+def _track_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    precedent = (previous_state.previous(instance) or {}).get('livreur_id') if sender is TourneeMobile else None
+    if precedent and precedent != instance.livreur_id:
+        record_reassignment(instance, precedent)
+    else:
+        record(instance)
+
+
+@receiver(post_delete, sender=TourneeMobile)
+@receiver(post_delete, sender=ArretTourneeMobile)
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=Produit)
+@receiver(post_delete, sender=PrixProduit)
+def _track_delete(sender, instance, **kwargs):
+    record(instance, deleted=True)
+
+
+def changes_since(company_id, livreur_id, token=0, limit=500):
+    """
+    Changements de séquence > token visibles par le livreur, par ordre de séquence.
+    Retourne (upserts {type: [ids]}, deleted {type: [ids]}, nouveau jeton, has_more).
+    """
+    # Changements validés dont la numérotation après commit n'a pas (encore) eu lieu
+    assign_sequences(company_id)
+    qs = SyncChange.objects.filter(sequence__gt=token).filter(Q(livreur__isnull=True) | Q(livreur_id=livreur_id))
+    qs = qs.filter(company_id=company_id) if company_id else qs.filter(company__isnull=True)
+    rows = list(qs.order_by('sequence').values_list('sequence', 'kind', 'object_id', 'deleted')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    upserts, deleted = {}, {}
+    for _, kind, object_id, is_deleted in rows:
+        (deleted if is_deleted else upserts).setdefault(kind, []).append(object_id)
+    return upserts, deleted, (rows[-1][0] if rows else token), has_more
@@ -82,3 +82,1691 @@ class StockMultiWarehouseTests(TestCase):
         self.assertEqual(res2.status_code, 201, res2.content)
         self.p.refresh_from_db()
         self.assertEqual(self.p.quantite, 10)
+
+
+class DashboardSnapshotTests(TestCase):
+    def setUp(self):
+        from API.models import Company, Client
+        self.company = Company.objects.create(name='Société A', code='SA')
+        self.cat = Categorie.objects.create(nom='Cat A', company=self.company)
+        self.cur = Currency.objects.create(code='EUR', name='Euro', symbol='€', is_default=True)
+        self.p = Produit.objects.create(company=self.company, reference='P1', code_barre='CB1', designation='Prod 1', categorie=self.cat, prixU=10, currency=self.cur, quantite=50)
+        self.cl = Client.objects.create(company=self.company, nom='Doe', prenom='John', email='j@d.com', telephone='1', adresse='x')
+
+    def test_snapshot_follows_incremental_changes(self):
+        from API.dashboard import get_snapshot, compute_counters, snapshot_to_dict
+        from API.models import Client, Vente
+
+        snap = get_snapshot(self.company)
+        self.assertEqual(snap.produits_count, 1)
+        self.assertEqual(snap.clients_count, 1)
+        self.assertEqual(snap.produits_rupture, 0)
+
+        # Stock à zéro -> rupture/critique/bas
+        self.p.quantite = 0
+        self.p.save(update_fields=['quantite'])
+        Client.objects.create(company=self.company, nom='Roe', prenom='Jane', email='r@d.com', telephone='2', adresse='y')
+        vente = Vente.objects.create(company=self.company, numero='V1', client=self.cl, total_ttc=120)
+        vente.statut = 'completed'
+        vente.save()
+
+        snap.refresh_from_db()
+        self.assertEqual(snap.produits_rupture, 1)
+        self.assertEqual(snap.produits_stock_critique, 1)
+        self.assertEqual(snap.clients_count, 2)
+        self.assertEqual(snap.ventes_count, 1)
+        self.assertEqual(snap.ventes_aujourd_hui, 1)
+        self.assertEqual(float(snap.ca_mois), 120.0)
+
+        vente.statut = 'canceled'
+        vente.save()
+        snap.refresh_from_db()
+        self.assertEqual(snap.ventes_count, 0)
+
+        # L'état incrémental doit correspondre à un recalcul complet
+        expected = compute_counters(self.company)
+        self.assertEqual(snapshot_to_dict(snap), snapshot_to_dict(type(snap)(**expected)))
+
+    def test_previous_state_is_read_once_per_save(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from API.models import Vente
+
+        vente = Vente.objects.create(company=self.company, numero='V2', client=self.cl, total_ttc=10)
+        for instance, table in ((self.p, Produit._meta.db_table), (vente, Vente._meta.db_table)):
+            with CaptureQueriesContext(connection) as ctx:
+                instance.save()
+            lectures = [q['sql'] for q in ctx.captured_queries
+                        if q['sql'].startswith('SELECT') and f'FROM "{table}" WHERE "{table}"."id" =' in q['sql']]
+            self.assertEqual(len(lectures), 1, lectures)
+
+
+class DailyRollupTests(TestCase):
+    def setUp(self):
+        from API.models import Company, Client
+        self.company = Company.objects.create(name='Société R', code='SR')
+        self.cat = Categorie.objects.create(nom='Cat R', company=self.company)
+        self.p = Produit.objects.create(company=self.company, reference='R1', code_barre='RB1', designation='Prod R', categorie=self.cat, prixU=10)
+        self.cl = Client.objects.create(company=self.company, nom='Doe', prenom='John', email='j@d.com', telephone='1', adresse='x')
+        self.w = Warehouse.objects.create(name='Depot R', code='DR', company=self.company)
+
+    def test_rollups_follow_sale_and_moves(self):
+        from django.utils import timezone
+        from API.models import Vente, LigneVente, StockMove, DailySalesRollup, DailyProductRollup
+
+        with self.captureOnCommitCallbacks(execute=True):
+            vente = Vente.objects.create(company=self.company, numero='V1', client=self.cl, warehouse=self.w, statut='completed', total_ht=30, total_ttc=30)
+            LigneVente.objects.create(vente=vente, produit=self.p, designation='Prod R', quantite=3, prixU_snapshot=10)
+            StockMove.objects.create(produit=self.p, warehouse=self.w, delta=-3, source='VENTE')
+            StockMove.objects.create(produit=self.p, warehouse=self.w, delta=10, source='ACHAT')
+
+        jour = timezone.localdate()
+        sales = DailySalesRollup.objects.get(company=self.company, jour=jour)
+        self.assertEqual((sales.nb_ventes, float(sales.total_ttc)), (1, 30.0))
+        prod = DailyProductRollup.objects.get(company=self.company, jour=jour, produit=self.p)
+        self.assertEqual((prod.qte_vendue, float(prod.ca), prod.entrees, prod.sorties), (3, 30.0, 10, 3))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            vente.statut = 'canceled'
+            vente.save()
+        self.assertFalse(DailySalesRollup.objects.filter(company=self.company).exists())
+        prod = DailyProductRollup.objects.get(company=self.company, jour=jour, produit=self.p)
+        self.assertEqual((prod.qte_vendue, prod.entrees), (0, 10))
+
+
+    def _rollups(self):
+        from API.models import DailySalesRollup, DailyProductRollup
+        ventes = sorted(DailySalesRollup.objects.values_list('jour', 'warehouse_id', 'type_paiement', 'nb_ventes', 'total_ht', 'total_ttc'))
+        produits = sorted(DailyProductRollup.objects.values_list('jour', 'warehouse_id', 'produit_id', 'qte_vendue', 'ca', 'entrees', 'sorties'))
+        return ventes, produits
+
+    def test_incremental_updates_match_full_rebuild(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from API.models import Vente, LigneVente, StockMove
+        from API.rollups import rebuild_day
+
+        hier = timezone.now() - timedelta(days=1)
+        vente = Vente.objects.create(company=self.company, numero='V2', client=self.cl, warehouse=self.w, total_ht=20, total_ttc=24)
+        ligne = LigneVente.objects.create(vente=vente, produit=self.p, designation='Prod R', quantite=2, prixU_snapshot=10)
+        vente.statut = 'completed'
+        vente.save()
+        ligne.quantite = 4
+        ligne.save()
+        # Vente déplacée à la veille : ventes et lignes changent de jour
+        vente.date_vente = hier
+        vente.save()
+        move = StockMove.objects.create(produit=self.p, warehouse=self.w, delta=-4, source='VENTE')
+        move.delta = -5
+        move.save()
+        StockMove.objects.create(produit=self.p, warehouse=self.w, delta=8, source='ACHAT').delete()
+
+        incremental = self._rollups()
+        self.assertEqual(incremental[0], [(timezone.localdate(hier), self.w.pk, vente.type_paiement, 1, 20, 24)])
+        for jour in (timezone.localdate(), timezone.localdate(hier)):
+            rebuild_day(self.company.pk, jour)
+        self.assertEqual(self._rollups(), incremental)
+
+    def test_one_row_per_key(self):
+        from django.db import IntegrityError, transaction
+        from django.utils import timezone
+        from API.models import DailySalesRollup
+        from API.rollups import apply_sales_deltas
+
+        key = (self.company.pk, timezone.localdate(), None, 'cash')
+        apply_sales_deltas({key: {'nb_ventes': 1, 'total_ttc': 5}})
+        apply_sales_deltas({key: {'nb_ventes': 2, 'total_ttc': 7}})
+        row = DailySalesRollup.objects.get(company=self.company)
+        self.assertEqual((row.nb_ventes, row.total_ttc), (3, 12))
+        # Entrepôt NULL compris dans la clé unique
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DailySalesRollup.objects.create(company=self.company, jour=key[1], type_paiement='cash', nb_ventes=1)
+
+    def test_nightly_build_leaves_the_live_day_alone(self):
+        from datetime import timedelta
+        from io import StringIO
+        from django.core.management import call_command
+        from django.utils import timezone
+        from API.models import Vente, DailySalesRollup
+
+        hier = timezone.now() - timedelta(days=1)
+        for numero, date in (('V4', hier), ('V5', timezone.now())):
+            Vente.objects.create(company=self.company, numero=numero, client=self.cl, warehouse=self.w,
+                                 statut='completed', total_ht=10, total_ttc=10, date_vente=date)
+        DailySalesRollup.objects.update(nb_ventes=99)
+        call_command('build_rollups', stdout=StringIO())
+        self.assertEqual(dict(DailySalesRollup.objects.values_list('jour', 'nb_ventes')),
+                         {timezone.localdate(hier): 1, timezone.localdate(): 99})
+        call_command('build_rollups', today=True, stdout=StringIO())
+        self.assertEqual(DailySalesRollup.objects.get(jour=timezone.localdate()).nb_ventes, 1)
+
+    def test_sales_report_total_matches_its_rows(self):
+        from openpyxl import load_workbook
+        from API.models import Vente, DailySalesRollup
+        from API.reports import generate_sales_report_excel
+
+        for i, total in enumerate((10, 15.5)):
+            Vente.objects.create(company=self.company, numero=f'V6{i}', client=self.cl, warehouse=self.w,
+                                 statut='completed', total_ht=total, total_ttc=total)
+        # Agrégats absents ou en retard : le total vient des lignes du rapport
+        DailySalesRollup.objects.all().delete()
+        rows = list(load_workbook(generate_sales_report_excel(company=self.company)).active.values)
+        self.assertEqual(rows[-1][3:6], ('TOTAL', 25.5, 25.5))
+
+    def test_writes_do_not_rescan_the_day(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from API.models import Vente, LigneVente, StockMove
+
+        vente = Vente.objects.create(company=self.company, numero='V3', client=self.cl, warehouse=self.w, statut='completed', total_ht=10, total_ttc=10)
+        with CaptureQueriesContext(connection) as queries:
+            LigneVente.objects.create(vente=vente, produit=self.p, designation='Prod R', quantite=1, prixU_snapshot=10)
+            StockMove.objects.create(produit=self.p, warehouse=self.w, delta=-1, source='VENTE')
+        sql = ' '.join(q['sql'] for q in queries)
+        self.assertNotIn('SUM(', sql)
+        self.assertNotIn('DELETE', sql)
+
+
+class TimeseriesTests(TestCase):
+    def setUp(self):
+        from datetime import date
+        from API.models import Company
+        self.company = Company.objects.create(name='Société T', code='ST')
+        self.today = date(2026, 10, 14)  # mercredi
+
+    def test_parse_range_aligns_week_and_month(self):
+        from datetime import date
+        from API.timeseries import parse_range
+
+        self.assertEqual(parse_range('day', '3d', today=self.today), ('day', date(2026, 10, 12), self.today))
+        self.assertEqual(parse_range('week', '2w', today=self.today)[1], date(2026, 10, 5))
+        self.assertEqual(parse_range('week', '11d', today=self.today)[1], date(2026, 9, 28))
+        self.assertEqual(parse_range('month', '3m', today=self.today)[1], date(2026, 8, 1))
+        self.assertEqual(parse_range('month', '1y', today=self.today)[1], date(2025, 11, 1))
+        self.assertEqual(parse_range(today=self.today), ('month', date(2025, 11, 1), self.today))
+
+    def test_parse_range_rejects_invalid_and_oversized_ranges(self):
+        from API.timeseries import MAX_BUCKETS, parse_range
+
+        for granularity, range_str in (('hour', '3d'), ('day', '0d'), ('day', 'abc'), ('day', '3x')):
+            with self.assertRaises(ValueError):
+                parse_range(granularity, range_str, today=self.today)
+        self.assertEqual(parse_range('day', f'{MAX_BUCKETS}d', today=self.today)[0], 'day')
+        with self.assertRaises(ValueError):
+            parse_range('day', f'{MAX_BUCKETS + 1}d', today=self.today)
+
+    def test_bucket_calendar_crosses_year(self):
+        from datetime import date
+        from API.timeseries import bucket_calendar
+
+        self.assertEqual(bucket_calendar(date(2025, 11, 20), date(2026, 1, 3), 'month'),
+                         [date(2025, 11, 1), date(2025, 12, 1), date(2026, 1, 1)])
+        self.assertEqual(bucket_calendar(date(2026, 10, 14), date(2026, 10, 20), 'week'),
+                         [date(2026, 10, 12), date(2026, 10, 19)])
+
+    def test_aggregate_series_fills_empty_buckets(self):
+        from datetime import date
+        from django.db.models import Sum
+        from API.models import DailySalesRollup
+        from API.timeseries import aggregate_series
+
+        for jour, nb in ((date(2026, 10, 12), 2), (date(2026, 10, 14), 3), (date(2026, 10, 19), 4)):
+            DailySalesRollup.objects.create(company=self.company, jour=jour, type_paiement='cash', nb_ventes=nb)
+        sales = DailySalesRollup.objects.filter(company=self.company)
+
+        daily = aggregate_series(sales, 'jour', 'day', date(2026, 10, 12), date(2026, 10, 15), ventes=Sum('nb_ventes'))
+        self.assertEqual([(p['label'], p['ventes']) for p in daily], [('12/10', 2), ('13/10', 0), ('14/10', 3), ('15/10', 0)])
+        weekly = aggregate_series(sales, 'jour', 'week', date(2026, 10, 5), date(2026, 10, 20), ventes=Sum('nb_ventes'))
+        self.assertEqual([(p['periode'], p['ventes']) for p in weekly],
+                         [(date(2026, 10, 5), 0), (date(2026, 10, 12), 5), (date(2026, 10, 19), 4)])
+
+    def test_charts_view_rejects_invalid_parameters(self):
+        from rest_framework.test import APIRequestFactory
+        from API.views import StatisticsChartsViewSet
+
+        for params in ({'granularity': 'hour'}, {'range': '12q'}, {'granularity': 'day', 'range': '5000d'}):
+            request = APIRequestFactory().get('/API/statistics/charts/', params)
+            response = StatisticsChartsViewSet.as_view()(request)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.data)
+        response = StatisticsChartsViewSet.as_view()(APIRequestFactory().get('/API/statistics/charts/', {'granularity': 'week', 'range': '4w'}))
+        self.assertEqual(response.status_code, 200)
+
+
+class ReportExportTests(TestCase):
+    def setUp(self):
+        from API.models import Company, Client, Vente
+        self.company = Company.objects.create(name='Société E', code='SE')
+        self.autre = Company.objects.create(name='Société F', code='SF')
+        self.w = Warehouse.objects.create(name='Depot E', code='DE', company=self.company)
+        self.w_autre = Warehouse.objects.create(name='Depot F', code='DF', company=self.autre)
+        for i, (company, warehouse, qty) in enumerate(((self.company, self.w, 2), (self.company, self.w, 3), (self.autre, self.w_autre, 7))):
+            cat = Categorie.objects.create(nom=f'Cat E{i}', company=company)
+            produit = Produit.objects.create(company=company, reference=f'E{i}', code_barre=f'EB{i}', designation=f'Prod E{i}', categorie=cat, prixU=10)
+            ProductStock.objects.create(produit=produit, warehouse=warehouse, quantity=qty)
+        cl = Client.objects.create(company=self.company, nom='Doe', prenom='John', email='e@d.com', telephone='1', adresse='x')
+        cl_autre = Client.objects.create(company=self.autre, nom='Roe', prenom='Jane', email='f@d.com', telephone='2', adresse='y')
+        for i, (company, client, total) in enumerate(((self.company, cl, 10), (self.company, cl, 5.5), (self.autre, cl_autre, 99))):
+            Vente.objects.create(company=company, numero=f'VE{i}', client=client, statut='completed', total_ht=total, total_ttc=total)
+
+    def _csv(self, chunks):
+        import csv
+        return list(csv.reader(''.join(chunks).lstrip('\ufeff').splitlines(), delimiter=';'))
+
+    def test_stock_valuation_excel_rows_and_total(self):
+        from openpyxl import load_workbook
+        from API.reports import generate_stock_valuation_excel, STOCK_VALUATION_HEADERS
+
+        rows = list(load_workbook(generate_stock_valuation_excel(company=self.company)).active.values)
+        body = rows[rows.index(tuple(STOCK_VALUATION_HEADERS)) + 1:-1]
+        self.assertEqual([r[0] for r in body], ['E0', 'E1'])
+        self.assertEqual((rows[-1][2], rows[-1][3], rows[-1][5]), ('TOTAL', 5, 50.0))
+
+    def test_stock_valuation_csv_is_filtered_by_company(self):
+        from API.reports import stream_stock_valuation_csv
+
+        rows = self._csv(stream_stock_valuation_csv(company=self.company))
+        self.assertEqual([r[0] for r in rows[1:]], ['E0', 'E1'])
+        self.assertEqual(len(self._csv(stream_stock_valuation_csv(company=self.autre))), 2)
+        with self.assertRaises(Warehouse.DoesNotExist):
+            stream_stock_valuation_csv(self.w_autre.pk, company=self.company)
+
+    def test_sales_csv_is_filtered_by_company(self):
+        from API.reports import stream_sales_report_csv
+
+        rows = self._csv(stream_sales_report_csv(company=self.company))
+        self.assertEqual(sorted(r[0] for r in rows[1:]), ['VE0', 'VE1'])
+        self.assertEqual(sum(float(r[5]) for r in rows[1:]), 15.5)
+
+    def test_pdf_and_inventory_reports_are_filtered_by_company(self):
+        from openpyxl import load_workbook
+        from API.reports import generate_inventory_report_excel, generate_stock_valuation_pdf
+
+        rows = list(load_workbook(generate_inventory_report_excel(company=self.company)).active.values)
+        self.assertEqual([r[0] for r in rows if r[0] in ('E0', 'E1', 'E2')], ['E0', 'E1'])
+        self.assertTrue(generate_stock_valuation_pdf(self.w.pk, company=self.company).getvalue().startswith(b'%PDF'))
+        with self.assertRaises(Warehouse.DoesNotExist):
+            generate_stock_valuation_pdf(self.w_autre.pk, company=self.company)
+
+
+class ReportJobTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from API.models import Company
+        self.company = Company.objects.create(name='Société J', code='SJ')
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def test_job_runs_and_expires(self):
+        from datetime import timedelta
+        from unittest import mock
+        from django.core.files.storage import FileSystemStorage
+        from django.utils import timezone
+        from API.models import ReportJob
+        from API.report_jobs import claim_next_job, run_job, cleanup_expired_jobs
+
+        ReportJob.objects.create(company=self.company, report_type='sales', format='csv')
+        field = ReportJob._meta.get_field('artifact')
+        with mock.patch.object(field, 'storage', FileSystemStorage(location=self.tmpdir.name)):
+            job = claim_next_job()
+            self.assertEqual(job.statut, 'running')
+            self.assertIsNone(claim_next_job())
+
+            run_job(job)
+            job.refresh_from_db()
+            self.assertEqual((job.statut, job.progress), ('done', 100))
+            with job.artifact.open('rb') as f:
+                self.assertIn('N° Vente', f.read().decode('utf-8-sig'))
+
+            self.assertEqual(cleanup_expired_jobs(now=timezone.now() + timedelta(days=2)), 1)
+            self.assertFalse(ReportJob.objects.exists())
+
+    def test_progress_is_reported_per_chunk(self):
+        from unittest import mock
+        from django.core.files.storage import FileSystemStorage
+        from API import report_jobs
+        from API.models import Client, ReportJob, Vente
+
+        cl = Client.objects.create(company=self.company, nom='Doe', prenom='John', email='j@d.com', telephone='1', adresse='x')
+        for i in range(4):
+            Vente.objects.create(company=self.company, numero=f'VJ{i}', client=cl, statut='completed', total_ht=1, total_ttc=1)
+        ReportJob.objects.create(company=self.company, report_type='sales', format='csv')
+        field = ReportJob._meta.get_field('artifact')
+        with mock.patch.object(field, 'storage', FileSystemStorage(location=self.tmpdir.name)), \
+                mock.patch('API.reports.EXPORT_CHUNK_SIZE', 2), \
+                mock.patch.object(report_jobs, '_set_progress', wraps=report_jobs._set_progress) as set_progress:
+            report_jobs.run_job(report_jobs.claim_next_job())
+        self.assertEqual([c.args[1] for c in set_progress.call_args_list], [47, 90, 90, 90])
+
+    def test_only_jobs_without_recent_heartbeat_are_requeued(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from API.models import ReportJob
+        from API.report_jobs import requeue_stale_jobs
+
+        old = timezone.now() - timedelta(hours=2)
+        long_job = ReportJob.objects.create(company=self.company, report_type='sales', format='csv', statut='running')
+        dead_job = ReportJob.objects.create(company=self.company, report_type='sales', format='csv', statut='running')
+        # Job long mais vivant : démarré il y a 2h, heartbeat récent
+        ReportJob.objects.filter(pk=long_job.pk).update(started_at=old, updated_at=timezone.now())
+        ReportJob.objects.filter(pk=dead_job.pk).update(started_at=old, updated_at=old)
+
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=10)), 1)
+        self.assertEqual(dict(ReportJob.objects.values_list('pk', 'statut')),
+                         {long_job.pk: 'running', dead_job.pk: 'pending'})
+
+    def test_async_flag_on_api_and_frontoffice_exports(self):
+        from django.contrib.auth.models import User
+        from django.test import RequestFactory
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from API.models import ReportJob
+        from API.views import export_sales_report
+        from frontoffice.views_reports import export_sales_report as front_export_sales_report
+
+        user = User.objects.create_user('rapports', password='x')
+
+        def api(params):
+            request = APIRequestFactory().get('/', params)
+            request.company = self.company
+            force_authenticate(request, user=user)
+            return export_sales_report(request)
+
+        def front(params):
+            request = RequestFactory().get('/', params)
+            request.user, request.company = user, self.company
+            return front_export_sales_report(request)
+
+        for get in (api, front):
+            self.assertEqual(get({'async': '0'}).status_code, 200)
+            self.assertEqual(get({'async': 'false'}).status_code, 200)
+            self.assertFalse(ReportJob.objects.exists())
+            self.assertEqual(get({'async': '1'}).status_code, 202)
+            self.assertEqual(ReportJob.objects.get().statut, 'pending')
+            ReportJob.objects.all().delete()
+        self.assertEqual(front({'format': 'docx', 'async': 'true'}).status_code, 400)
+
+
+class ProductImportTests(TestCase):
+    def setUp(self):
+        from API.models import Company
+        self.company = Company.objects.create(name='Société I', code='SI')
+        self.cat = Categorie.objects.create(nom='Boissons', company=self.company)
+        Produit.objects.create(company=self.company, reference='EX1', code_barre='CB-EX1', designation='Ancien', categorie=self.cat, prixU=5)
+
+    def test_bulk_upsert_and_row_errors(self):
+        import pandas as pd
+        from API.product_import import ProductImporter
+
+        df = pd.DataFrame([
+            {'reference': 'EX1', 'designation': 'Nouveau nom', 'prixU': '6', 'categorie': '', 'stock_min': ''},
+            {'reference': 'N1', 'designation': 'Eau', 'prixU': '1.5', 'categorie': 'boissons', 'stock_min': '4'},
+            {'reference': 'N2', 'designation': 'Jus', 'prixU': 'abc', 'categorie': 'Boissons', 'stock_min': ''},
+            {'reference': 'N3', 'designation': 'Soda', 'prixU': '2', 'categorie': 'Inconnue', 'stock_min': ''},
+        ], dtype=str)
+        result = ProductImporter(self.company, batch_size=2).process(df).finish()
+
+        self.assertEqual(result['stats'], {'created': 1, 'updated': 1, 'skipped': 2, 'total': 4})
+        self.assertEqual([e['row'] for e in result['errors']], [4, 5, 5])
+        existing = Produit.objects.get(company=self.company, reference='EX1')
+        self.assertEqual((existing.designation, float(existing.prixU)), ('Nouveau nom', 6.0))
+        new = Produit.objects.get(company=self.company, reference='N1')
+        self.assertEqual((new.categorie_id, new.seuil_alerte, new.code_barre), (self.cat.id, 4, 'N1'))
+
+
+class ImportJobTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+        from django.core.files.storage import FileSystemStorage
+        from API.models import Company, ImportJob
+        self.company = Company.objects.create(name='Société K', code='SK')
+        self.cat = Categorie.objects.create(nom='Cat K', company=self.company)
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        storage = FileSystemStorage(location=tmpdir.name)
+        for name in ('source', 'errors_file'):
+            patcher = mock.patch.object(ImportJob._meta.get_field(name), 'storage', storage)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_job_resumes_after_failed_chunk(self):
+        from unittest import mock
+        from django.core.files.base import ContentFile
+        from API.models import ImportJob
+        from API.import_jobs import run_import_job, resume_import_job
+        from API.product_import import ProductImporter
+
+        lines = ['reference,designation,prixU,categorie'] + [f'K{i},Prod {i},{i or "x"},Cat K' for i in range(10)]
+        job = ImportJob(company=self.company, statut='running')
+        job.source.save('k.csv', ContentFile('\n'.join(lines).encode()), save=False)
+        job.save()
+
+        original = ProductImporter.process
+        def fail_on_third_chunk(importer, df):
+            if df.index[0] == 6:
+                raise RuntimeError('arrêt du worker')
+            return original(importer, df)
+
+        with mock.patch.object(ProductImporter, 'process', fail_on_third_chunk):
+            run_import_job(job, chunk_size=3)
+        self.assertEqual((job.statut, job.last_row), ('failed', 6))
+        self.assertEqual(Produit.objects.filter(company=self.company).count(), 5)
+
+        resume_import_job(job)
+        job.refresh_from_db()
+        run_import_job(job, chunk_size=3)
+        self.assertEqual((job.statut, job.last_row, job.created_count, job.skipped_count), ('done', 10, 9, 1))
+        with job.errors_file.open('rb') as f:
+            self.assertEqual(f.read().decode('utf-8-sig').splitlines()[1:], ['2;Prix invalide: le prix doit être un nombre positif'])
+
+    def test_async_flag(self):
+        from django.contrib.auth.models import User
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from API.models import ImportJob
+        from API.views_import import ImportExecuteView
+
+        user = User.objects.create_user('imports', password='x')
+
+        def post(flag):
+            csv = SimpleUploadedFile('k.csv', f'reference,designation,prixU,categorie\nA{flag},Prod,2,Cat K'.encode())
+            request = APIRequestFactory().post('/', {'file': csv, 'type': 'products', 'async': flag})
+            request.company = self.company
+            force_authenticate(request, user=user)
+            return ImportExecuteView.as_view()(request)
+
+        for flag in ('0', 'false'):
+            self.assertEqual(post(flag).data['stats']['created'], 1)
+        self.assertFalse(ImportJob.objects.exists())
+        self.assertEqual(post('1').status_code, 202)
+        self.assertEqual(ImportJob.objects.get().statut, 'pending')
+
+
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        from API.models import Company
+        self.company = Company.objects.create(name='Société L', code='SL')
+        self.cat = Categorie.objects.create(nom='Cat L', company=self.company)
+        self.p = Produit.objects.create(company=self.company, reference='L1', code_barre='LB1', designation='Prod L', categorie=self.cat, prixU=10)
+        self.w1 = Warehouse.objects.create(name='Depot L', code='DL', company=self.company)
+        self.w2 = Warehouse.objects.create(name='Van L', code='VL', company=self.company)
+        ProductStock.objects.create(produit=self.p, warehouse=self.w1, quantity=8)
+
+    def test_batch_is_checked_then_applied_atomically(self):
+        from django.utils import timezone
+        from API.models import StockMove, DailyProductRollup
+        from API.stock_ledger import StockLedger, StockInsuffisant
+
+        ledger = StockLedger(check='warehouse', refresh='sum')
+        ledger.add(self.p, self.w1, -5, 'TRANS', 'T1').add(self.p, self.w1, -5, 'TRANS', 'T2')
+        with self.assertRaises(StockInsuffisant) as ctx:
+            ledger.apply()
+        self.assertEqual(ctx.exception.lignes[0]['demande'], 10)
+        self.assertFalse(StockMove.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            moves = StockLedger(check='warehouse', refresh='sum').add(
+                self.p, self.w1, -5, 'TRANS', 'T3').add(self.p, self.w2, 5, 'TRANS', 'T3').apply()
+        self.assertEqual([m.delta for m in moves], [-5, 5])
+        stocks = dict(ProductStock.objects.filter(produit=self.p).values_list('warehouse_id', 'quantity'))
+        self.assertEqual(stocks, {self.w1.id: 3, self.w2.id: 5})
+        self.assertEqual(self.p.quantite, 8)
+        self.p.refresh_from_db()
+        self.assertEqual(self.p.quantite, 8)
+        rollups = DailyProductRollup.objects.filter(company=self.company, jour=timezone.localdate(), produit=self.p)
+        self.assertEqual(sorted(rollups.values_list('warehouse_id', 'entrees', 'sorties')), [(self.w1.id, 0, 5), (self.w2.id, 5, 0)])
+
+
+class SaleCompletionTests(TestCase):
+    def setUp(self):
+        from API.models import Company, Client
+        self.company = Company.objects.create(name='Société V', code='SV')
+        self.cat = Categorie.objects.create(nom='Cat V', company=self.company)
+        self.cl = Client.objects.create(company=self.company, nom='Doe', prenom='John', email='j@d.com', telephone='1', adresse='x')
+        self.w = Warehouse.objects.create(name='Depot V', code='DV', company=self.company)
+        self.produits = [
+            Produit.objects.create(company=self.company, reference=f'V{i}', code_barre=f'VB{i}', designation=f'Prod {i}',
+                                   categorie=self.cat, prixU=10, quantite=10)
+            for i in range(3)
+        ]
+
+    def _vente(self, quantites):
+        from API.models import Vente, LigneVente
+        vente = Vente.objects.create(company=self.company, numero=f'V{Vente.objects.count()}', client=self.cl, warehouse=self.w)
+        for produit, qty in zip(self.produits, quantites):
+            LigneVente.objects.create(vente=vente, produit=produit, designation=produit.designation, quantite=qty, prixU_snapshot=10)
+        return vente
+
+    def test_complete_creates_moves_and_delivery_note(self):
+        from API.models import StockMove
+        from API.sale_completion import complete_vente
+        from API.stock_ledger import StockInsuffisant
+
+        vente = self._vente([1, 2, 3])
+        complete_vente(vente)
+        vente.refresh_from_db()
+        self.assertEqual(vente.statut, 'completed')
+        self.assertEqual(sorted(vente.bon_livraison.lignes.values_list('quantite', flat=True)), [1, 2, 3])
+        self.assertEqual(StockMove.objects.filter(ref_id=str(vente.id)).count(), 3)
+        self.assertEqual(list(Produit.objects.order_by('reference').values_list('quantite', flat=True)), [9, 8, 7])
+
+        vente = self._vente([1, 50])
+        with self.assertRaises(StockInsuffisant):
+            complete_vente(vente)
+        vente.refresh_from_db()
+        self.assertEqual((vente.statut, vente.bon_livraison_id), ('draft', None))
+        self.assertEqual(list(Produit.objects.order_by('reference').values_list('quantite', flat=True)), [9, 8, 7])
+
+    def test_status_is_checked_under_the_lock(self):
+        from API.models import StockMove, Vente
+        from API.sale_completion import complete_vente, VenteNonBrouillon
+
+        vente = self._vente([1, 2, 3])
+        # Deux requêtes ont lu la vente en brouillon avant la finalisation
+        copie = Vente.objects.get(pk=vente.pk)
+        self.assertEqual(complete_vente(vente).statut, 'completed')
+        with self.assertRaises(VenteNonBrouillon):
+            complete_vente(copie)
+        self.assertEqual(StockMove.objects.filter(ref_id=str(vente.id)).count(), 3)
+        self.assertEqual(list(Produit.objects.order_by('reference').values_list('quantite', flat=True)), [9, 8, 7])
+
+
+class DocumentNumberingTests(TestCase):
+    def test_sequences_are_per_company_and_resume_existing_numbers(self):
+        from django.db import transaction
+        from API.models import Company, Client, Vente
+        from API.numbering import next_numero
+
+        a = Company.objects.create(name='Société A', code='NA')
+        b = Company.objects.create(name='Société B', code='NB')
+        cl = Client.objects.create(company=a, nom='Doe', prenom='John', email='j@d.com', telephone='1', adresse='x')
+        Vente.objects.create(company=a, numero='VTE-00007', client=cl)
+
+        self.assertEqual(next_numero('vente', a), 'VTE-00008')
+        self.assertEqual(next_numero('vente', b), 'VTE-00001')
+        # Numéro rendu quand la transaction du document est annulée
+        try:
+            with transaction.atomic():
+                self.assertEqual(next_numero('vente', a), 'VTE-00009')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(next_numero('vente', a), 'VTE-00009')
+        # Numéros de transfert uniques globalement : compteur partagé
+        self.assertNotEqual(next_numero('transfert', a), next_numero('transfert', b))
+
+
+class ConfigCacheTests(TestCase):
+    def test_default_currency_cached_until_config_changes(self):
+        from API.models import SystemConfig
+
+        SystemConfig.get_solo(cached=False)
+        eur = Currency.objects.create(code='EUR', name='Euro', symbol='€', is_default=True)
+        self.assertEqual(Currency.get_default(), eur)
+        with self.assertNumQueries(0):
+            self.assertEqual(Currency.get_default().code, 'EUR')
+            self.assertEqual(SystemConfig.get_solo().pk, 1)
+
+        mad = Currency.objects.create(code='MAD', name='Dirham', symbol='DH')
+        cfg = SystemConfig.get_solo()
+        cfg.default_currency = mad
+        cfg.save()
+        self.assertEqual(Currency.get_default(), mad)
+        mad.symbol = 'DHS'
+        mad.save()
+        self.assertEqual(Currency.get_default().symbol, 'DHS')
+
+    def test_categorie_change_only_invalidates_its_company(self):
+        from API.models import Company, SystemConfig
+
+        SystemConfig.get_solo(cached=False)
+        Currency.objects.create(code='EUR', name='Euro', symbol='€', is_default=True)
+        societe_a = Company.objects.create(name='Société A', code='CA')
+        societe_b = Company.objects.create(name='Société B', code='CB')
+        cat_a = Categorie.objects.create(nom='Boissons', company=societe_a)
+        cat_b = Categorie.objects.create(nom='Épicerie', company=societe_b)
+        for company in (societe_a, societe_b, None):
+            Categorie.full_path_map(company)
+        Currency.get_default()
+
+        cat_b.nom = 'Épicerie fine'
+        cat_b.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(Categorie.full_path_map(societe_a), {cat_a.pk: 'Boissons'})
+            self.assertEqual(Currency.get_default().code, 'EUR')
+        self.assertEqual(Categorie.full_path_map(societe_b), {cat_b.pk: 'Épicerie fine'})
+        self.assertEqual(Categorie.full_path_map(None)[cat_b.pk], 'Épicerie fine')
+
+
+class ExchangeRateTableTests(TestCase):
+    def test_rates_by_date_inverse_and_via_default(self):
+        from datetime import date
+        from decimal import Decimal
+        from API.models import ExchangeRate, SystemConfig
+        from API.exchange_rates import convert_many
+
+        SystemConfig.get_solo(cached=False)
+        eur = Currency.objects.create(code='EUR', name='Euro', symbol='€', is_default=True)
+        usd = Currency.objects.create(code='USD', name='Dollar', symbol='$')
+        mad = Currency.objects.create(code='MAD', name='Dirham', symbol='DH')
+        ExchangeRate.objects.create(from_currency=usd, to_currency=eur, rate=Decimal('0.5'), date=date(2025, 1, 1))
+        ExchangeRate.objects.create(from_currency=usd, to_currency=eur, rate=Decimal('0.8'), date=date(2025, 6, 1))
+        ExchangeRate.objects.create(from_currency=eur, to_currency=mad, rate=Decimal('10'), date=date(2025, 1, 1))
+
+        ExchangeRate.get_rate(usd, eur)
+        with self.assertNumQueries(0):
+            self.assertEqual(ExchangeRate.get_rate(usd, eur, date(2025, 3, 1)), Decimal('0.5'))
+            self.assertEqual(ExchangeRate.get_rate(usd, eur, date(2025, 7, 1)), Decimal('0.8'))
+            self.assertIsNone(ExchangeRate.get_rate(usd, eur, date(2024, 12, 31)))
+            self.assertEqual(ExchangeRate.get_rate(eur, usd, date(2025, 7, 1)), Decimal('1.25'))
+            self.assertEqual(ExchangeRate.get_rate(usd, mad, date(2025, 7, 1)), Decimal('8'))
+            self.assertEqual(
+                convert_many([Decimal('10'), Decimal('10'), Decimal('3')], [usd, eur, mad.pk], eur,
+                             [date(2025, 3, 1), date(2025, 3, 1), date(2024, 1, 1)]),
+                [Decimal('5.0'), Decimal('10'), None]
+            )
+
+
+class ProduitListSerializerTests(TestCase):
+    def test_list_variant_matches_detail_without_per_row_queries(self):
+        from API.models import Company, PrixProduit, TypePrix, StockMove, SystemConfig
+        from API.serializers import ProduitSerializer, ProduitListSerializer, produit_list_queryset
+
+        SystemConfig.get_solo(cached=False)
+        company = Company.objects.create(name='Société P', code='SP')
+        parent = Categorie.objects.create(nom='Boissons', company=company)
+        cat = Categorie.objects.create(nom='Sodas', company=company, parent=parent)
+        type_prix = TypePrix.objects.create(code='GROS', libelle='Gros')
+        for i in range(3):
+            p = Produit.objects.create(company=company, reference=f'P{i}', code_barre=f'PB{i}', designation=f'Prod {i}', categorie=cat, prixU=10)
+            PrixProduit.objects.create(produit=p, type_prix=type_prix, prix=8)
+            PrixProduit.objects.create(produit=p, type_prix=type_prix, prix=7, quantite_min=10, is_active=False)
+            StockMove.objects.create(produit=p, delta=5, source='ACHAT')
+
+        queryset = Produit.objects.filter(company=company).order_by('reference')
+        expected = ProduitSerializer(queryset, many=True).data
+        context = {'categorie_paths': Categorie.full_path_map(company)}
+        with self.assertNumQueries(2):
+            data = ProduitListSerializer(produit_list_queryset(queryset), many=True, context=context).data
+        self.assertEqual(data, expected)
+        self.assertEqual((data[0]['categorie_path'], data[0]['stock_mouvements'], data[0]['nombre_prix']), ('Boissons > Sodas', 5, 1))
+
+
+class CategorieHierarchyTests(TestCase):
+    def test_paths_follow_moves_and_counts_stay_in_sync(self):
+        from API.models import Company
+        from API.categories import CategorieIndex
+
+        company = Company.objects.create(name='Société H', code='SH')
+        a = Categorie.objects.create(nom='A', company=company)
+        b = Categorie.objects.create(nom='B', company=company, parent=a)
+        c = Categorie.objects.create(nom='C', company=company, parent=b)
+        other = Categorie.objects.create(nom='Autre', company=company)
+        self.assertEqual((c.path, c.depth), (f'/{a.pk}/{b.pk}/{c.pk}/', 2))
+
+        p1 = Produit.objects.create(company=company, reference='H1', code_barre='HB1', designation='H1', categorie=c, prixU=1)
+        Produit.objects.create(company=company, reference='H2', code_barre='HB2', designation='H2', categorie=b, prixU=1)
+        Produit.objects.create(company=company, reference='H3', code_barre='HB3', designation='H3', categorie=b, prixU=1, is_active=False)
+        self.assertEqual(a.get_products_count(), 2)
+
+        # Déplacement du sous-arbre B sous "Autre"
+        b.parent = other
+        b.save()
+        c.refresh_from_db()
+        self.assertEqual((c.path, c.depth), (f'/{other.pk}/{b.pk}/{c.pk}/', 2))
+        from django.core.exceptions import ValidationError
+        with self.assertRaises(ValidationError):
+            other.parent = c
+            other.save()
+
+        p1.categorie = a
+        p1.save()
+        p1.is_active = False
+        p1.save()
+        index = CategorieIndex.for_company(company)
+        self.assertEqual([index.products_count(x.pk) for x in (a, other, b, c)], [0, 1, 1, 0])
+        self.assertEqual(index.full_path(c.pk), 'Autre > B > C')
+        self.assertEqual([x.nom for x in index.descendants(other.pk)], ['B', 'C'])
+
+    def test_full_paths_and_raw_list_order(self):
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from API.models import Company
+        from API.views import categories_raw
+
+        company = Company.objects.create(name='Société N', code='SN')
+        zeta = Categorie.objects.create(nom='Zeta', company=company)
+        alpha = Categorie.objects.create(nom='Alpha', company=company, parent=zeta)
+        milieu = Categorie.objects.create(nom='Milieu', company=company, parent=alpha)
+        self.assertEqual(Categorie.full_path_map(company), {
+            zeta.pk: 'Zeta', alpha.pk: 'Zeta > Alpha', milieu.pk: 'Zeta > Alpha > Milieu'})
+        self.assertEqual(Categorie.objects.get(pk=milieu.pk).get_full_path(), 'Zeta > Alpha > Milieu')
+
+        alpha.parent = None
+        alpha.save()
+        self.assertEqual(Categorie.full_path_map(company)[milieu.pk], 'Alpha > Milieu')
+
+        request = APIRequestFactory().get('/')
+        request.company = company
+        force_authenticate(request, User.objects.create_user('raw_user', password='x'))
+        self.assertEqual([row['nom'] for row in categories_raw(request).data], ['Alpha', 'Milieu', 'Zeta'])
+
+    def test_tree_and_stats_use_constant_queries(self):
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from API.models import Company
+        from API.views import CategorieViewSet
+
+        company = Company.objects.create(name='Société T', code='ST')
+        user = User.objects.create_user('cat_user', password='x')
+        for i in range(3):
+            root = Categorie.objects.create(nom=f'R{i}', company=company)
+            child = Categorie.objects.create(nom=f'R{i}-1', company=company, parent=root)
+            Produit.objects.create(company=company, reference=f'T{i}', code_barre=f'TB{i}', designation='T', categorie=child, prixU=1)
+
+        def get(action):
+            request = APIRequestFactory().get('/')
+            request.company = company
+            force_authenticate(request, user)
+            return CategorieViewSet.as_view({'get': action})(request).data
+
+        with self.assertNumQueries(1):
+            tree = get('tree')
+        self.assertEqual([(n['nom'], n['products_count'], len(n['sous_categories'])) for n in tree],
+                         [('R0', '1', 1), ('R1', '1', 1), ('R2', '1', 1)])
+        with self.assertNumQueries(1):
+            stats = get('stats')
+        self.assertEqual(stats, {'total_categories': 6, 'categories_racines': 3, 'categories_avec_produits': 3})
+
+
+class KeysetPaginationTests(TestCase):
+    def test_pages_cover_ties_without_offset(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django.utils import timezone
+        from API.models import StockMove
+        from API.pagination import keyset_page
+
+        cat = Categorie.objects.create(nom='Cat K')
+        p = Produit.objects.create(reference='K1', code_barre='KB1', designation='K', categorie=cat, prixU=1)
+        now = timezone.now()
+        # Dates en double : l'id départage
+        moves = [StockMove.objects.create(produit=p, delta=i, source='ACHAT', date=now - timezone.timedelta(minutes=i // 3))
+                 for i in range(10)]
+
+        seen, cursor = [], None
+        with CaptureQueriesContext(connection) as ctx:
+            while True:
+                rows, cursor = keyset_page(StockMove.objects.all(), 'date', cursor, page_size=4)
+                seen.extend(m.pk for m in rows)
+                if cursor is None:
+                    break
+        expected = [m.pk for m in sorted(moves, key=lambda m: (m.date, m.pk), reverse=True)]
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(ctx.captured_queries), 3)
+        self.assertFalse(any('OFFSET' in q['sql'] for q in ctx.captured_queries))
+
+    def test_api_is_paginated_by_default(self):
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from API.models import AuditLog
+        from API.views import AuditLogViewSet
+
+        admin = User.objects.create_user('audit_admin', password='x', is_staff=True)
+        for i in range(5):
+            AuditLog.objects.create(actor=admin, action=f'test.{i}')
+
+        def get(params):
+            request = APIRequestFactory().get('/API/audit-logs/', params)
+            force_authenticate(request, admin)
+            return AuditLogViewSet.as_view({'get': 'list'})(request)
+
+        with self.settings(KEYSET_PAGE_SIZE=3):
+            page = get({}).data
+        self.assertEqual([r['action'] for r in page['results']], ['test.4', 'test.3', 'test.2'])
+        self.assertIsNotNone(page['next_cursor'])
+        with self.settings(KEYSET_MAX_PAGE_SIZE=4):
+            self.assertEqual(len(get({'page_size': 1000}).data['results']), 4)
+        page = get({'page_size': 2}).data
+        self.assertEqual([r['action'] for r in page['results']], ['test.4', 'test.3'])
+        page = get({'page_size': 2, 'cursor': page['next_cursor']}).data
+        self.assertEqual([r['action'] for r in page['results']], ['test.2', 'test.1'])
+        self.assertEqual(get({'cursor': 'invalide'}).status_code, 404)
+
+    def test_mobile_endpoints_keep_plain_lists_unless_paged(self):
+        from rest_framework.test import APIRequestFactory
+        from API.distribution_models import LivreurDistribution, SyncLogMobile
+        from API.distribution_views import SyncViewSet
+
+        livreur = LivreurDistribution.objects.create(matricule='LP1', nom='Livreur P', telephone='1')
+        for _ in range(3):
+            SyncLogMobile.objects.create(livreur=livreur, type_sync='pull', statut='succes')
+
+        def get(params):
+            request = APIRequestFactory().get('/API/distribution/sync/logs/', {'livreur': livreur.pk, **params})
+            return SyncViewSet.as_view({'get': 'logs'})(request)
+
+        self.assertEqual(len(get({}).data), 3)
+        page = get({'page_size': 2}).data
+        self.assertEqual(len(page['results']), 2)
+        self.assertEqual(len(get({'cursor': page['next_cursor']}).data['results']), 1)
+
+
+class SyncChangesTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from django.utils import timezone
+        from API.models import Company, UserProfile, Client
+        from API.distribution_models import LivreurDistribution, TourneeMobile, ArretTourneeMobile
+
+        self.company = Company.objects.create(name='Société S', code='SS')
+        user = User.objects.create_user('livreur_s', password='x')
+        UserProfile.objects.create(user=user, company=self.company)
+        self.livreur = LivreurDistribution.objects.create(user=user, matricule='LS1', nom='Livreur S', telephone='1')
+        self.autre = LivreurDistribution.objects.create(matricule='LS2', nom='Autre', telephone='2')
+        self.client_s = Client.objects.create(company=self.company, nom='Client S', prenom='X', email='s@x.com', telephone='1', adresse='x')
+        self.tournee = TourneeMobile.objects.create(company=self.company, livreur=self.livreur, date_tournee=timezone.localdate(), numero_tournee='TS-1')
+        TourneeMobile.objects.create(company=self.company, livreur=self.autre, date_tournee=timezone.localdate(), numero_tournee='TS-2')
+        self.arret = ArretTourneeMobile.objects.create(company=self.company, tournee=self.tournee, client=self.client_s)
+
+    def pull(self, livreur=None, token=0, **params):
+        from rest_framework.test import APIRequestFactory
+        from API.distribution_views import SyncViewSet
+        request = APIRequestFactory().get('/', {'livreur_id': (livreur or self.livreur).pk, 'token': token, **params})
+        request.company = self.company
+        return SyncViewSet.as_view({'get': 'changes'})(request).data
+
+    def test_pull_returns_own_changes_since_token(self):
+        first = self.pull()
+        self.assertEqual([t['numero_tournee'] for t in first['changes']['tournees']], ['TS-1'])
+        self.assertEqual([a['id'] for a in first['changes']['arrets']], [self.arret.pk])
+        self.assertEqual([c['id'] for c in first['changes']['clients']], [self.client_s.pk])
+        self.assertEqual(self.pull(token=first['token'])['changes']['tournees'], [])
+
+    def test_pages_follow_token(self):
+        page = self.pull(page_size=1)
+        self.assertTrue(page['has_more'])
+        self.assertEqual(sum(len(v) for v in page['changes'].values()), 1)
+        rest = self.pull(token=page['token'])
+        self.assertFalse(rest['has_more'])
+        self.assertEqual(sum(len(v) for v in rest['changes'].values()), 2)
+
+    def test_delete_leaves_tombstone(self):
+        token = self.pull()['token']
+        arret_id = self.arret.pk
+        self.arret.delete()
+        self.tournee.statut = 'en_cours'
+        self.tournee.save()
+        delta = self.pull(token=token)
+        self.assertEqual(delta['deleted'], {'arrets': [arret_id]})
+        self.assertEqual([t['statut'] for t in delta['changes']['tournees']], ['en_cours'])
+        self.assertEqual(delta['changes']['clients'], [])
+
+    def test_reassigned_tournee_moves_with_its_arrets(self):
+        from API.distribution_models import LivreurDistribution
+
+        remplacant = LivreurDistribution.objects.create(matricule='LS3', nom='Remplaçant', telephone='3')
+        token_a = self.pull()['token']
+        token_b = self.pull(remplacant)['token']
+        self.tournee.livreur = remplacant
+        self.tournee.save()
+
+        delta = self.pull(token=token_a)
+        self.assertEqual(delta['deleted'], {'tournees': [self.tournee.pk], 'arrets': [self.arret.pk]})
+        self.assertEqual(delta['changes']['tournees'], [])
+        for data in (self.pull(remplacant), self.pull(remplacant, token=token_b)):
+            self.assertEqual([t['id'] for t in data['changes']['tournees']], [self.tournee.pk])
+            self.assertEqual([a['id'] for a in data['changes']['arrets']], [self.arret.pk])
+            self.assertEqual(data['deleted'], {})
+
+        # Modification suivante : le tombstone de l'ancien livreur reste
+        self.tournee.statut = 'en_cours'
+        self.tournee.save()
+        self.assertEqual(self.pull(token=token_a)['deleted']['tournees'], [self.tournee.pk])
+
+    def test_token_is_a_per_company_sequence(self):
+        from API.models import Company, Client
+        from API.distribution_models import SyncChange
+        from API.sync_changes import assign_sequences
+
+        autre_societe = Company.objects.create(name='Société U', code='SU')
+        Client.objects.create(company=autre_societe, nom='Client U', prenom='X', email='u@x.com', telephone='1', adresse='x')
+        token = self.pull()['token']
+        sequences = list(SyncChange.objects.filter(company=self.company).order_by('sequence').values_list('sequence', flat=True))
+        self.assertEqual(sequences, list(range(1, len(sequences) + 1)))
+        self.assertEqual(token, sequences[-1])
+        self.assertEqual(list(SyncChange.objects.filter(company=autre_societe).values_list('sequence', flat=True)), [None])
+        assign_sequences(autre_societe.pk)
+        self.assertEqual(list(SyncChange.objects.filter(company=autre_societe).values_list('sequence', flat=True)), [1])
+
+    def test_writes_take_no_counter_lock_and_are_numbered_after_commit(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from API.distribution_models import SyncChange
+
+        self.pull()
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks() as callbacks:
+            for statut in ('en_cours', 'terminee'):
+                self.tournee.statut = statut
+                self.tournee.save()
+        self.assertFalse(any('documentsequence' in q['sql'].lower() for q in queries))
+        self.assertEqual(SyncChange.objects.filter(kind='tournee', object_id=self.tournee.pk).count(), 3)
+
+        for callback in callbacks:
+            callback()
+        # Une ligne par objet et par livreur, numérotée après la précédente
+        changes = SyncChange.objects.filter(kind='tournee', object_id=self.tournee.pk)
+        self.assertEqual(changes.count(), 1)
+        self.assertGreater(changes.get().sequence, 1)
+
+
+class MobilePushTests(TestCase):
+    def setUp(self):
+        from django.utils import timezone
+        from API.models import Company, Client
+        from API.distribution_models import LivreurDistribution, TourneeMobile, ArretTourneeMobile
+
+        company = Company.objects.create(name='Société M', code='SM')
+        self.van = Warehouse.objects.create(name='Van M', code='VANM', company=company)
+        self.livreur = LivreurDistribution.objects.create(matricule='LM1', nom='Livreur M', telephone='1', entrepot=self.van)
+        cat = Categorie.objects.create(nom='Cat M', company=company)
+        self.produits = [Produit.objects.create(company=company, reference=f'M{i}', code_barre=f'MB{i}', designation='M',
+                                                categorie=cat, prixU=10) for i in range(3)]
+        for p in self.produits:
+            ProductStock.objects.create(produit=p, warehouse=self.van, quantity=1000)
+        self.client_m = Client.objects.create(company=company, nom='Client M', prenom='X', email='m@x.com',
+                                              telephone='1', adresse='x')
+        self.tournee = TourneeMobile.objects.create(company=company, livreur=self.livreur,
+                                                    date_tournee=timezone.localdate(), numero_tournee='TM-1')
+        self.arret = ArretTourneeMobile.objects.create(company=company, tournee=self.tournee, client=self.client_m)
+
+    def payload(self, n):
+        ventes = [{'app_id': f'app-{i}', 'tournee': self.tournee.pk, 'arret': self.arret.pk, 'client': self.client_m.pk,
+                   'type_paiement': 'especes', 'montant_total': '30.00',
+                   'lignes': [{'produit': p.pk, 'quantite': '1', 'prix_unitaire': '10'} for p in self.produits]}
+                  for i in range(n)]
+        ventes.append({'app_id': 'app-bad', 'client': 999999, 'type_paiement': 'especes', 'lignes': []})
+        return {'livreur_id': self.livreur.pk, 'ventes': ventes,
+                'arrets_updates': [{'id': self.arret.pk, 'statut': 'livre'}, {'id': 999999, 'statut': 'livre'}]}
+
+    def push(self, data):
+        from rest_framework.test import APIRequestFactory
+        from API.distribution_views import SyncViewSet
+        request = APIRequestFactory().post('/', data, format='json')
+        return SyncViewSet.as_view({'post': 'push'})(request).data
+
+    def stock(self):
+        return ProductStock.objects.get(produit=self.produits[0], warehouse=self.van).quantity
+
+    def test_push_creates_sales_stock_moves_and_stop_updates(self):
+        from API.distribution_models import LigneVenteTourneeMobile
+
+        data = self.push(self.payload(30))
+        self.assertEqual((data['nb_ventes'], data['nb_arrets'], len(data['errors'])), (30, 1, 2))
+        self.assertEqual(LigneVenteTourneeMobile.objects.count(), 90)
+        self.assertEqual(self.stock(), 970)
+        self.arret.refresh_from_db()
+        self.assertEqual(self.arret.statut, 'livre')
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from API.models import StockMove
+        from API.distribution_models import VenteTourneeMobile
+
+        with CaptureQueriesContext(connection) as small:
+            self.push(self.payload(2))
+        VenteTourneeMobile.objects.all().delete()
+        StockMove.objects.all().delete()
+        with CaptureQueriesContext(connection) as large:
+            self.push(self.payload(30))
+        self.assertEqual(len(large), len(small))
+
+    def test_replayed_push_is_idempotent(self):
+        from API.distribution_models import VenteTourneeMobile
+
+        self.push(self.payload(30))
+        again = self.push(self.payload(30))
+        self.assertEqual(again['nb_ventes'], 0)
+        self.assertEqual({r['status'] for r in again['results']['ventes'][:30]}, {'duplicate'})
+        self.assertEqual(VenteTourneeMobile.objects.count(), 30)
+        self.assertEqual(self.stock(), 970)
+
+
+class ProduitMobileCatalogueTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from API.models import Company
+
+        self.company = Company.objects.create(name='Société C', code='SC')
+        self.user = User.objects.create_user('catalogue_user', password='x')
+        self.depot = Warehouse.objects.create(name='Depot C', code='DEPC', company=self.company)
+        van = Warehouse.objects.create(name='Van C', code='VANC', company=self.company)
+        self.cat = Categorie.objects.create(nom='Cat C', company=self.company)
+        self.produits = []
+        for i in range(5):
+            p = Produit.objects.create(company=self.company, reference=f'C{i}', code_barre=f'CB{i}', designation=f'C{i}',
+                                       categorie=self.cat, prixU=1)
+            ProductStock.objects.create(produit=p, warehouse=self.depot, quantity=10 + i)
+            ProductStock.objects.create(produit=p, warehouse=van, quantity=100)
+            self.produits.append(p)
+
+    def get(self, params=None, etag=None):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from API.distribution_views import ProduitMobileViewSet
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        request = APIRequestFactory().get('/', params or {}, **headers)
+        request.company = self.company
+        force_authenticate(request, self.user)
+        return ProduitMobileViewSet.as_view({'get': 'list'})(request)
+
+    def test_catalogue_annotated_and_revalidated(self):
+        with self.assertNumQueries(2):
+            response = self.get()
+        self.assertEqual([row['stock'] for row in response.data], [10, 11, 12, 13, 14])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(etag=response['ETag']).status_code, 304)
+
+    def test_columns_shape(self):
+        columns = self.get({'shape': 'columns'}).data
+        self.assertEqual(columns['rows'][0][columns['fields'].index('stock')], 10)
+
+    def test_etag_follows_stock_deltas_that_keep_totals(self):
+        from django.db.models import F
+
+        etag = self.get()['ETag']
+        # +1 / -2 / +1 sur trois produits consécutifs : nombre, somme et somme pondérée inchangés
+        for produit, delta in zip(self.produits, (1, -2, 1)):
+            ProductStock.objects.filter(produit=produit, warehouse=self.depot).update(quantity=F('quantity') + delta)
+        response = self.get(etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['stock'] for row in response.data][:3], [11, 9, 13])
+
+    def test_etag_follows_quantite_updates_and_category_rename(self):
+        etag = self.get()['ETag']
+        Produit.objects.filter(pk=self.produits[0].pk).update(quantite=7)
+        response = self.get(etag=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        Categorie.objects.filter(pk=self.cat.pk).update(nom='Cat C renommée')
+        response = self.get(etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({row['categorie_nom'] for row in response.data}, {'Cat C renommée'})
+
+
+class PositionLivreurTests(TestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from django.core.cache import cache
+        from django.utils import timezone
+        from API.models import Company
+
+        cache.clear()
+        self.company = Company.objects.create(name='Société G', code='SG')
+        self.livreur = self._livreur('LG1', 'Livreur G')
+        debut = timezone.now() - timedelta(days=10)
+        self.debut = debut.replace(minute=debut.minute - debut.minute % 5, second=0, microsecond=0)
+
+    def _livreur(self, matricule, nom):
+        from django.contrib.auth.models import User
+        from API.models import UserProfile
+        from API.distribution_models import LivreurDistribution
+        user = User.objects.create_user(f'livreur_{matricule}', password='x')
+        UserProfile.objects.create(user=user, company=self.company)
+        pk = LivreurDistribution.objects.create(user=user, matricule=matricule, nom=nom, telephone='1').pk
+        return LivreurDistribution.objects.select_related('user__profile').get(pk=pk)
+
+    def _points(self, n, start=None, step=30):
+        from datetime import timedelta
+        start = start or self.debut
+        return [{'lat': 36.7 + i / 1000, 'lng': 3.05, 'timestamp': (start + timedelta(seconds=step * i)).isoformat()}
+                for i in range(n)]
+
+    def test_batch_ingest_and_late_batch(self):
+        from API.positions import ingest_points, last_positions
+
+        with self.assertNumQueries(2):
+            result = ingest_points(self.livreur, self._points(60) + [{'lat': 'x', 'lng': 3}])
+        self.assertEqual((result['accepted'], result['rejected']), (60, 1))
+        self.assertEqual(last_positions(self.company.pk)[0]['lat'], 36.759)
+
+        # Lot plus ancien (arrivé en retard) : historique complété, position courante inchangée
+        ingest_points(self.livreur, [{'lat': 1, 'lng': 1, 'timestamp': self.debut.isoformat()}])
+        with self.assertNumQueries(0):
+            positions = last_positions(self.company.pk)
+        self.assertEqual([(p['nom'], p['lat']) for p in positions], [('Livreur G', 36.759)])
+
+    def test_new_livreur_not_lost_by_concurrent_index_rebuild(self):
+        from django.core.cache import cache
+        from API.positions import ingest_points, last_positions, _generation, _index_key
+
+        ingest_points(self.livreur, self._points(1))
+        self.assertEqual(len(last_positions(self.company.pk)), 1)
+
+        # Reconstruction commencée avant le premier point de B, écrite après
+        generation = _generation(self.company.pk)
+        autre = self._livreur('LG2', 'Livreur H')
+        ingest_points(autre, self._points(1))
+        cache.set(_index_key(self.company.pk), {'generation': generation, 'ids': {self.livreur.pk}})
+        self.assertEqual([p['nom'] for p in last_positions(self.company.pk)], ['Livreur G', 'Livreur H'])
+
+    def test_downsampling_reads_only_pending_window(self):
+        from datetime import timedelta
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django.utils import timezone
+        from API.distribution_models import PositionLivreur
+        from API.positions import ingest_points, downsample_positions
+
+        ingest_points(self.livreur, self._points(60) + [{'lat': 1, 'lng': 1, 'timestamp': self.debut.isoformat()}])
+        before = timezone.now() - timedelta(days=7)
+        # 61 points sur 30 minutes : un par tranche de 5 minutes
+        self.assertEqual(downsample_positions(before, 300), 61 - 6)
+        self.assertEqual(PositionLivreur.objects.count(), 6)
+        with self.assertNumQueries(1):
+            self.assertEqual(downsample_positions(before, 300), 0)
+
+        # Points arrivés en retard dans la dernière tranche : fenêtre limitée à cette tranche
+        ingest_points(self.livreur, self._points(3, self.debut + timedelta(minutes=26)))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(downsample_positions(before, 300), 3)
+        scan = next(q['sql'] for q in queries if 'ORDER BY' in q['sql'])
+        self.assertIn('"horodatage" >=', scan)
+        self.assertEqual(PositionLivreur.objects.count(), 6)
+
+
+class StatsLivreursTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from django.utils import timezone
+        from API.models import Company, Client
+
+        cache.clear()
+        self.company = Company.objects.create(name='Société S', code='SS')
+        self.autre = Company.objects.create(name='Société T', code='ST')
+        self.client_s = Client.objects.create(company=self.company, nom='Client S', prenom='X', email='s@x.com',
+                                              telephone='1', adresse='x')
+        self.jour = timezone.localdate()
+        self.add_livreur(99, self.autre)
+
+    def add_livreur(self, i, company=None):
+        """Une tournée (un arrêt livré, un en échec) et 5 ventes de i+1 chacune"""
+        from API.distribution_models import LivreurDistribution, TourneeMobile, ArretTourneeMobile, VenteTourneeMobile
+        company = company or self.company
+        livreur = LivreurDistribution.objects.create(matricule=f'LS{i}', nom=f'Livreur {i:02d}', telephone='1')
+        tournee = TourneeMobile.objects.create(company=company, livreur=livreur, date_tournee=self.jour,
+                                               numero_tournee=f'TS-{i}')
+        ArretTourneeMobile.objects.create(company=company, tournee=tournee, client=self.client_s, statut='livre')
+        ArretTourneeMobile.objects.create(company=company, tournee=tournee, client=self.client_s, statut='echec',
+                                          ordre_passage=2)
+        for n, paiement in enumerate(['especes', 'especes', 'cheque', 'credit', 'carte']):
+            VenteTourneeMobile.objects.create(company=company, tournee=tournee, client=self.client_s,
+                                              numero_vente=f'VS-{i}-{n}', type_paiement=paiement, montant_total=i + 1)
+
+    def stats(self):
+        from rest_framework.test import APIRequestFactory
+        from API.distribution_views import StatsLivreursAPIView
+        request = APIRequestFactory().get('/', {'date_debut': str(self.jour), 'date_fin': str(self.jour)})
+        request.company = self.company
+        return StatsLivreursAPIView.as_view()(request).data
+
+    def test_summary_livreurs_and_days(self):
+        for i in range(8):
+            self.add_livreur(i)
+        data = self.stats()
+        # Livreurs 0..7 de la société : montant i+1 par vente, 5 ventes chacun
+        self.assertEqual(data['summary'], {
+            'total_clients': 1, 'total_tournees': 8,
+            'total_especes': 72.0, 'total_cheques': 36.0, 'total_credits': 36.0, 'total_ventes': 180.0,
+        })
+        premier = data['livreurs'][0]
+        self.assertEqual((premier['nom'], premier['tournees'], premier['total_arrets'], premier['arrets_livres'],
+                          premier['arrets_echec'], premier['clients_visites'], premier['total']),
+                         ('Livreur 07', 1, 2, 1, 1, 1, 32.0))
+        self.assertEqual(len(data['par_jour']), 1)
+        jour_data = data['par_jour'][0]
+        self.assertEqual((jour_data['nb_ventes'], jour_data['total'], len(jour_data['livreurs'])), (40, 180.0, 8))
+        self.assertEqual(jour_data['livreurs'][0], {
+            'id': jour_data['livreurs'][0]['id'], 'nom': 'Livreur 00', 'clients': 1, 'livres': 1, 'echecs': 1,
+            'especes': 2.0, 'cheques': 1.0, 'credits': 1.0, 'total': 5.0,
+        })
+
+    def test_query_count_does_not_depend_on_livreurs(self):
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        for i in range(2):
+            self.add_livreur(i)
+        with CaptureQueriesContext(connection) as small:
+            self.stats()
+        for i in range(2, 8):
+            self.add_livreur(i)
+        cache.clear()
+        with CaptureQueriesContext(connection) as large:
+            self.stats()
+        self.assertEqual(len(large), len(small))
+
+    def test_period_is_served_from_cache(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.add_livreur(0)
+        data = self.stats()
+        with CaptureQueriesContext(connection) as cached:
+            self.assertEqual(self.stats(), data)
+        self.assertEqual(len(cached), 0)
+
+    def test_writes_invalidate_only_their_company(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from API.distribution_models import ArretTourneeMobile, VenteTourneeMobile
+
+        self.add_livreur(0)
+        data = self.stats()
+        # Écriture dans une autre entreprise : le cache reste valable
+        VenteTourneeMobile.objects.filter(company=self.autre).first().delete()
+        with CaptureQueriesContext(connection) as cached:
+            self.assertEqual(self.stats(), data)
+        self.assertEqual(len(cached), 0)
+
+        tournee = ArretTourneeMobile.objects.filter(company=self.company).first().tournee
+        VenteTourneeMobile.objects.create(company=self.company, tournee=tournee, client=self.client_s,
+                                          numero_vente='VS-new', type_paiement='especes', montant_total=4)
+        self.assertEqual(self.stats()['summary']['total_especes'], data['summary']['total_especes'] + 4)
+        ArretTourneeMobile.objects.filter(company=self.company, statut='echec').get().delete()
+        self.assertEqual(self.stats()['livreurs'][0]['arrets_echec'], 0)
+
+
+class TourneeStatistiquesTests(TestCase):
+    def setUp(self):
+        from django.utils import timezone
+        from API.models import Company, Client, CodePrix
+
+        self.company = Company.objects.create(name='Société R', code='SR')
+        self.client_r = Client.objects.create(company=self.company, nom='Client R', prenom='X', email='r@x.com',
+                                              telephone='1', adresse='x')
+        self.code_prix = CodePrix.objects.create(code='STD-R', libelle='Standard')
+        self.jour = timezone.localdate()
+
+    def add_tournee(self, i):
+        """4 arrêts (2 livrés, 1 échec, 1 en attente), 3 ventes de 10, rapport de caisse si i impair"""
+        from API.distribution_models import (LivreurDistribution, TourneeMobile, ArretTourneeMobile,
+                                             VenteTourneeMobile, RapportCaisseMobile)
+        livreur = LivreurDistribution.objects.create(matricule=f'LR{i}', nom=f'Livreur R{i}', telephone='1')
+        tournee = TourneeMobile.objects.create(company=self.company, livreur=livreur, date_tournee=self.jour,
+                                               numero_tournee=f'TR-{i}', code_prix=self.code_prix)
+        for n, statut in enumerate(['livre', 'livre', 'echec', 'en_attente']):
+            ArretTourneeMobile.objects.create(company=self.company, tournee=tournee, client=self.client_r,
+                                              statut=statut, ordre_passage=n)
+        for n in range(3):
+            VenteTourneeMobile.objects.create(company=self.company, tournee=tournee, client=self.client_r,
+                                              numero_vente=f'VR-{i}-{n}', type_paiement='especes', montant_total=10)
+        if i % 2:
+            RapportCaisseMobile.objects.create(company=self.company, tournee=tournee, fonds_depart=100)
+        return tournee
+
+    def liste(self):
+        from rest_framework.test import APIRequestFactory
+        from API.distribution_views import TourneeViewSet
+        request = APIRequestFactory().get('/', {'date': str(self.jour)})
+        return TourneeViewSet.as_view({'get': 'list'})(request).data
+
+    def test_query_count_does_not_depend_on_tournees(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        for i in range(2):
+            self.add_tournee(i)
+        with CaptureQueriesContext(connection) as small:
+            self.liste()
+        for i in range(2, 8):
+            self.add_tournee(i)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(len(self.liste()), 8)
+        self.assertEqual(len(large), len(small))
+
+    def test_annotated_statistics_match_per_tournee_computation(self):
+        from API.distribution_models import TourneeMobile
+        from API.distribution_serializers import TourneeSerializer
+
+        for i in range(4):
+            self.add_tournee(i)
+        data = self.liste()
+        # Mêmes statistiques que le calcul par tournée (sans annotations)
+        for item in data:
+            attendu = TourneeSerializer(TourneeMobile.objects.get(pk=item['id'])).data['statistiques']
+            self.assertEqual(item['statistiques'], attendu)
+        stats = data[0]['statistiques']
+        self.assertEqual((stats['total_arrets'], stats['arrets_livres'], stats['arrets_echec'],
+                          stats['arrets_en_attente'], stats['taux_reussite'], stats['ca_total']),
+                         (4, 2, 1, 1, 50.0, 30))
+        self.assertEqual(len(stats['arrets_visites']), 3)
+        self.assertEqual({item['statistiques']['caisse'] is None for item in data}, {True, False})
+
+
+class PlanningGenerationTests(TestCase):
+    def setUp(self):
+        from datetime import date
+        from API.models import Company
+
+        self.company = Company.objects.create(name='Société P', code='SP')
+        self.clients = {}
+        self.lundi = date(2026, 3, 2)
+
+    def flotte(self, debut, fin):
+        """Livreurs planifiés du lundi au vendredi, deux clients le lundi (ordre de passage inversé)"""
+        from API.models import Client
+        from API.distribution_models import LivreurDistribution, PlanningHebdomadaire, ClientLivreurHebdo
+        for i in range(debut, fin):
+            livreur = LivreurDistribution.objects.create(matricule=f'LP{i}', nom=f'Livreur P{i:02d}', telephone='1')
+            for jour in range(1, 6):
+                PlanningHebdomadaire.objects.create(company=self.company, livreur=livreur, jour_semaine=jour)
+            for n, ordre in enumerate([2, 1]):
+                self.clients[i, n] = Client.objects.create(company=self.company, nom=f'Client P{i}-{n}', prenom='X',
+                                                           email=f'p{i}{n}@x.com', telephone='1', adresse='x')
+                ClientLivreurHebdo.objects.create(company=self.company, livreur=livreur, client=self.clients[i, n],
+                                                  jour_semaine=1, ordre_passage=ordre)
+
+    def generer(self, lundi, **options):
+        from rest_framework.test import APIRequestFactory
+        from API.distribution_views import PlanningHebdomadaireViewSet
+        request = APIRequestFactory().post('/', {'date_debut': str(lundi), **options}, format='json')
+        request.company = self.company
+        return PlanningHebdomadaireViewSet.as_view({'post': 'generer_semaine'})(request).data
+
+    def test_query_count_does_not_depend_on_fleet_size(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from API.distribution_models import TourneeMobile
+
+        self.flotte(0, 1)
+        self.generer(self.lundi)  # compteurs de numérotation créés
+        TourneeMobile.objects.all().delete()
+        with CaptureQueriesContext(connection) as small:
+            self.generer(self.lundi)
+        self.flotte(1, 3)
+        TourneeMobile.objects.all().delete()
+        with CaptureQueriesContext(connection) as large:
+            self.generer(self.lundi)
+        self.assertEqual(len(large), len(small))
+
+    def test_generates_numbered_tournees_and_ordered_stops(self):
+        from datetime import timedelta
+        from API.distribution_models import TourneeMobile, SyncChange
+
+        self.flotte(0, 3)
+        data = self.generer(self.lundi + timedelta(days=2))  # ramené au lundi
+        self.assertEqual((data['nb_tournees'], data['nb_arrets']), (15, 6))
+        self.assertEqual(len(set(TourneeMobile.objects.values_list('numero_tournee', flat=True))), 15)
+        tournee = TourneeMobile.objects.get(livreur__matricule='LP1', date_tournee=self.lundi)
+        self.assertEqual(list(tournee.arrets.order_by('ordre_passage').values_list('client_id', flat=True)),
+                         [self.clients[1, 1].pk, self.clients[1, 0].pk])
+        # bulk_create : journal de synchronisation écrit explicitement
+        self.assertEqual(SyncChange.objects.filter(kind='arret', deleted=False).count(), 6)
+
+    def test_generated_week_is_not_recreated(self):
+        from API.distribution_models import ArretTourneeMobile
+
+        self.flotte(0, 3)
+        self.generer(self.lundi)
+        self.assertEqual(self.generer(self.lundi)['nb_tournees'], 0)
+        self.assertEqual(ArretTourneeMobile.objects.count(), 6)
+
+    def test_optimiser_option(self):
+        # Clients sans coordonnées : ordre conservé
+        self.flotte(0, 3)
+        self.assertEqual(self.generer(self.lundi, optimiser=True)['nb_arrets'], 6)
+
+
+class ClientLivreurAssignmentTests(TestCase):
+    def setUp(self):
+        from datetime import date
+        from django.core.cache import cache
+        from API.models import Company, Client
+        from API.distribution_models import LivreurDistribution, ClientLivreurHebdo
+
+        cache.clear()
+        self.company = Company.objects.create(name='Société A', code='SA')
+        self.a = LivreurDistribution.objects.create(matricule='LA1', nom='Livreur A', telephone='1')
+        self.b = LivreurDistribution.objects.create(matricule='LA2', nom='Livreur B', telephone='1')
+        self.clients = [Client.objects.create(company=self.company, nom=f'Client A{i}', prenom='X', email=f'a{i}@x.com',
+                                              telephone='1', adresse='x') for i in range(4)]
+        self.lundi = date(2026, 3, 2)
+        ClientLivreurHebdo.objects.create(company=self.company, livreur=self.a, client=self.clients[0], jour_semaine=1, ordre_passage=2)
+        ClientLivreurHebdo.objects.create(company=self.company, livreur=self.a, client=self.clients[1], jour_semaine=1, ordre_passage=1)
+        # Période terminée : ignorée
+        ClientLivreurHebdo.objects.create(company=self.company, livreur=self.b, client=self.clients[2], jour_semaine=1,
+                                          date_fin=date(2026, 2, 1))
+        ClientLivreurHebdo.objects.create(company=self.company, livreur=self.b, client=self.clients[3], jour_semaine=1,
+                                          date_debut=date(2026, 1, 1))
+        self.b.clients_assignes.add(self.clients[2])
+
+    def test_map_filters_validity_in_sql(self):
+        from API.assignments import assignment_map
+        from API.distribution_models import ClientLivreurHebdo
+
+        carte = assignment_map(self.company.pk, self.lundi)
+        self.assertEqual(carte['livreur_clients'], {self.a.pk: [self.clients[1].pk, self.clients[0].pk],
+                                                    self.b.pk: [self.clients[3].pk]})
+        self.assertEqual(carte['client_livreur'][self.clients[0].pk], self.a.pk)
+        self.assertEqual(list(ClientLivreurHebdo.get_clients_for_livreur(self.b, 1, self.company, self.lundi)
+                              .values_list('client_id', flat=True)), [self.clients[3].pk])
+
+    def test_map_cached_with_fallback_on_assigned_clients(self):
+        from API.assignments import assignment_map, livreur_for_client
+
+        assignment_map(self.company.pk, self.lundi)
+        with self.assertNumQueries(0):
+            assignment_map(self.company.pk, self.lundi)
+        self.assertEqual(livreur_for_client(self.clients[2], self.lundi), self.b)
+
+    def test_deleted_assignment_invalidates_map(self):
+        from API.assignments import assignment_map
+        from API.distribution_models import ClientLivreurHebdo
+
+        assignment_map(self.company.pk, self.lundi)
+        ClientLivreurHebdo.objects.get(client=self.clients[0]).delete()
+        self.assertNotIn(self.clients[0].pk, assignment_map(self.company.pk, self.lundi)['client_livreur'])
+
+    def test_bulk_deactivation_invalidates_map(self):
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from API.assignments import livreur_for_client
+        from API.distribution_models import ClientLivreurHebdo
+        from API.distribution_views import ClientLivreurHebdoViewSet
+
+        self.assertEqual(livreur_for_client(self.clients[3], self.lundi), self.b)
+        ids = list(ClientLivreurHebdo.objects.filter(client__in=self.clients[:2] + [self.clients[3]]).values_list('id', flat=True))
+        request = APIRequestFactory().delete('/', {'assignations_ids': ids}, format='json')
+        force_authenticate(request, User.objects.create_user('planning', password='x'))
+        response = ClientLivreurHebdoViewSet.as_view({'delete': 'supprimer_assignations'})(request)
+        self.assertEqual(response.data['count'], 3)
+        self.assertIsNone(livreur_for_client(self.clients[3], self.lundi))
+        self.assertIsNone(livreur_for_client(self.clients[0], self.lundi))
+
+
+class RoutingTests(TestCase):
+    def setUp(self):
+        from django.utils import timezone
+        from API.models import Company
+        from API.distribution_models import LivreurDistribution, TourneeMobile
+
+        self.company = Company.objects.create(name='Société O', code='SO')
+        livreur = LivreurDistribution.objects.create(matricule='LO1', nom='Livreur O', telephone='1')
+        self.tournee = TourneeMobile.objects.create(company=self.company, livreur=livreur,
+                                                    date_tournee=timezone.localdate(), numero_tournee='TO-1',
+                                                    position_depart_lat=36.0, position_depart_lng=3.0)
+
+    def arret(self, i, lng, statut='en_attente'):
+        """Arrêt n°i chez un client à (36.0, lng), sans coordonnées si lng est None"""
+        from API.models import Client
+        from API.distribution_models import ArretTourneeMobile
+        client = Client.objects.create(company=self.company, nom=f'Client O{i}', prenom='X', email=f'o{i}@x.com',
+                                       telephone='1', adresse='x', lat=36.0 if lng else None, lng=lng)
+        return ArretTourneeMobile.objects.create(company=self.company, tournee=self.tournee, client=client,
+                                                 ordre_passage=i, statut=statut)
+
+    def optimiser(self):
+        from rest_framework.test import APIRequestFactory
+        from API.distribution_views import TourneeViewSet
+        request = APIRequestFactory().post('/')
+        return TourneeViewSet.as_view({'post': 'optimiser'})(request, pk=self.tournee.pk).data
+
+    def ordre(self):
+        return list(self.tournee.arrets.order_by('ordre_passage').values_list('id', flat=True))
+
+    def test_best_order_follows_aligned_points(self):
+        import random
+        from API.routing import best_order
+
+        # Points alignés, mélangés : parcours dans l'ordre depuis l'origine
+        ligne = [(36.0, 3.0 + i * 0.01) for i in range(12)]
+        melange = random.Random(1).sample(range(12), 12)
+        order = best_order([ligne[i] for i in melange], origin=(36.0, 2.99))
+        self.assertEqual([melange[i] for i in order], list(range(12)))
+
+    def test_best_order_shortens_150_stops_quickly(self):
+        import random
+        import time
+        from API.routing import best_order, distance_matrix, path_length
+
+        rng = random.Random(7)
+        coords = [(36.7 + rng.random() * 0.3, 3.0 + rng.random() * 0.3) for _ in range(150)]
+        debut = time.perf_counter()
+        order = best_order(coords, origin=(36.7, 3.0))
+        self.assertLess(time.perf_counter() - debut, 1.0)
+        self.assertEqual(sorted(order), list(range(150)))
+        dist = distance_matrix([(36.7, 3.0)] + coords)
+        self.assertLess(path_length(dist, [0] + [i + 1 for i in order]), path_length(dist, range(151)))
+
+    def test_optimiser_keeps_visited_first_and_unlocated_last(self):
+        visite = self.arret(1, 3.5, 'livre')
+        sans_gps = self.arret(2, None)
+        loin, proche, milieu = self.arret(3, 3.1), self.arret(4, 3.45), self.arret(5, 3.3)
+
+        data = self.optimiser()
+        # Arrêt visité en tête, itinéraire depuis sa position, client sans GPS en fin
+        attendu = [visite.pk, proche.pk, milieu.pk, loin.pk, sans_gps.pk]
+        self.assertEqual(data['arrets'], attendu)
+        self.assertEqual(self.ordre(), attendu)
+        self.assertLess(data['distance_apres_km'], data['distance_avant_km'])
+        self.assertEqual(data['sans_coordonnees'], 1)
+
+    def test_optimiser_records_reordered_stops_for_sync(self):
+        from django.db.models import Max
+        from API.distribution_models import SyncChange
+
+        self.arret(1, 3.1)  # déjà en tête
+        moved = {self.arret(2, 3.3).pk, self.arret(3, 3.2).pk}
+        precedent = SyncChange.objects.aggregate(m=Max('id'))['m']
+        self.optimiser()
+        # bulk_update n'émet pas de signal : seuls les arrêts déplacés sont journalisés
+        changes = SyncChange.objects.filter(kind='arret', id__gt=precedent)
+        self.assertEqual(set(changes.values_list('object_id', flat=True)), moved)
+        self.assertEqual(set(changes.values_list('livreur_id', flat=True)), {self.tournee.livreur_id})
+
+    def test_optimiser_keeps_an_already_optimal_order(self):
+        from API.distribution_models import SyncChange
+
+        arrets = [self.arret(i, 3.0 + i * 0.1) for i in range(1, 4)]
+        nb_changes = SyncChange.objects.count()
+        data = self.optimiser()
+        self.assertEqual(data['arrets'], [a.pk for a in arrets])
+        self.assertEqual(data['distance_apres_km'], data['distance_avant_km'])
+        self.assertEqual(SyncChange.objects.count(), nb_changes)
+
+
+class SpatialIndexTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from django.core.cache import cache
+        from API.models import Company
+
+        cache.clear()
+        self.company = Company.objects.create(name='Société G', code='SG')
+        self.autre = Company.objects.create(name='Société H', code='SH')
+        self.user = User.objects.create_user('spatial', password='x')
+        # Alignés vers l'est depuis (36.75, 3.05), un tous les ~450 m
+        self.alignes = [self.client_at(i, 36.75, 3.05 + i * 0.005) for i in range(10)]
+        self.client_at(20, 36.75, 3.05, self.autre)
+        self.client_at(21, None, None)
+
+    def client_at(self, i, lat, lng, company=None):
+        from API.models import Client
+        return Client.objects.create(company=company or self.company, nom=f'Client G{i}', prenom='X',
+                                     email=f'g{i}@x.com', telephone='1', adresse='x', lat=lat, lng=lng)
+
+    def get(self, action, params, user=None, company=True, **kwargs):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from API.views import ClientViewSet
+        request = APIRequestFactory().get('/', params)
+        request.company = self.company if company else None
+        force_authenticate(request, user=user or self.user)
+        return ClientViewSet.as_view({'get': action})(request, **kwargs)
+
+    def test_grid_cells_and_radius_search(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from API.spatial import clients_within
+
+        self.assertEqual((self.alignes[3].grille_lat, self.alignes[3].grille_lng), (3675, 306))
+        proches = clients_within(self.company.pk, 36.75, 3.05, 1.0)
+        self.assertEqual([pk for pk, _ in proches], [c.pk for c in self.alignes[:3]])
+        with CaptureQueriesContext(connection) as queries:
+            clients_within(self.company.pk, 36.75, 3.05, 1.0)
+        self.assertEqual(len(queries), 0)  # grille en mémoire
+
+    def test_moved_client_invalidates_grid(self):
+        from API.spatial import clients_within
+
+        clients_within(self.company.pk, 36.75, 3.05, 1.0)
+        deplace = self.alignes[9]
+        deplace.lat, deplace.lng = 36.7501, 3.0501
+        deplace.save()
+        self.assertIn(deplace.pk, [pk for pk, _ in clients_within(self.company.pk, 36.75, 3.05, 1.0)])
+
+    def test_zone(self):
+        data = self.get('zone', {'bbox': '36.74,3.05,36.76,3.066'}).data
+        self.assertEqual([r['id'] for r in data['results']], [self.alignes[i].pk for i in (0, 1, 2, 3)])
+        self.assertFalse(data['tronque'])
+        self.assertTrue(self.get('zone', {'bbox': '36.74,3.0,36.76,3.2', 'limit': 2}).data['tronque'])
+        self.assertEqual(self.get('zone', {'bbox': '1,2'}).status_code, 400)
+
+    def test_proches(self):
+        data = self.get('proches', {'lat': 36.75, 'lng': 3.05, 'rayon_km': 0.6}).data
+        self.assertEqual([r['id'] for r in data['results']], [self.alignes[0].pk, self.alignes[1].pk])
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(self.get('proches', {'lat': 95, 'lng': 3}).status_code, 400)
+
+    def test_proches_limit_and_count_apply_to_visible_clients(self):
+        from django.contrib.auth.models import User
+        from API.distribution_models import LivreurDistribution
+
+        # Livreur sans entreprise : seuls ses clients assignés sont visibles
+        user = User.objects.create_user('livreur-proches', password='x')
+        livreur = LivreurDistribution.objects.create(matricule='LGP', nom='Livreur proches', telephone='1', user=user)
+        livreur.clients_assignes.add(self.alignes[4], self.alignes[6])
+        data = self.get('proches', {'lat': 36.75, 'lng': 3.05, 'rayon_km': 5, 'limit': 1},
+                        user=user, company=False).data
+        self.assertEqual([r['id'] for r in data['results']], [self.alignes[4].pk])
+        self.assertEqual(data['count'], 2)
+
+    def test_livreurs_proches(self):
+        from django.contrib.auth.models import User
+        from django.core.cache import cache
+        from django.utils import timezone
+        from API.models import UserProfile
+        from API.distribution_models import LivreurDistribution
+
+        for i, lng in enumerate([3.2, 3.06, 3.1]):
+            livreur = LivreurDistribution.objects.create(matricule=f'LG{i}', nom=f'Livreur G{i}', telephone='1',
+                                                         user=User.objects.create_user(f'livreur-g{i}', password='x'),
+                                                         current_lat=36.75, current_lng=lng,
+                                                         last_location_update=timezone.now())
+            UserProfile.objects.create(user=livreur.user, company=self.company)
+        cache.clear()
+        data = self.get('livreurs_proches', {'k': 2}, pk=self.alignes[0].pk).data
+        self.assertEqual([l['nom'] for l in data], ['Livreur G1', 'Livreur G2'])
+        self.assertLess(data[0]['distance_km'], data[1]['distance_km'])
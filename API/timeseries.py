@@ -0,0 +1,131 @@
+"""
+Agrégations par tranches de temps (jour / semaine / mois).
+
+Chaque série est calculée en une seule requête groupée (Trunc + agrégats
+conditionnels) ; le calendrier des tranches est complété en Python pour que
+les périodes sans données apparaissent à zéro.
+"""
+import calendar
+import re
+from datetime import date, timedelta
+
+from django.db.models import DateField, DateTimeField
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+
+GRANULARITIES = ('day', 'week', 'month')
+
+# Plage par défaut pour chaque granularité
+DEFAULT_RANGES = {
+    'day': '30d',
+    'week': '12w',
+    'month': '12m',
+}
+
+# Nombre maximum de tranches renvoyées, pour borner la taille des réponses
+MAX_BUCKETS = 1000
+
+_RANGE_RE = re.compile(r'^(\d+)([dwmy])$')
+
+
+def _add_months(d, months):
+    month_index = d.year * 12 + (d.month - 1) + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def bucket_start(d, granularity):
+    """Début de la tranche contenant la date d"""
+    if granularity == 'month':
+        return d.replace(day=1)
+    if granularity == 'week':
+        return d - timedelta(days=d.weekday())
+    return d
+
+
+def next_bucket(d, granularity):
+    if granularity == 'month':
+        return _add_months(d, 1)
+    if granularity == 'week':
+        return d + timedelta(days=7)
+    return d + timedelta(days=1)
+
+
+def parse_range(granularity=None, range_str=None, today=None):
+    """
+    Interprète les paramètres ?granularity= et ?range= (ex: 30d, 8w, 12m, 2y).
+    Retourne (granularity, date_debut, date_fin) ; date_debut est alignée sur
+    le début de sa tranche. Lève ValueError si un paramètre est invalide.
+    """
+    granularity = granularity or 'month'
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity invalide. Choix: {', '.join(GRANULARITIES)}")
+
+    range_str = (range_str or DEFAULT_RANGES[granularity]).strip().lower()
+    match = _RANGE_RE.match(range_str)
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError("range invalide. Format attendu: <n>d, <n>w, <n>m ou <n>y (ex: 12m)")
+
+    count, unit = int(match.group(1)), match.group(2)
+    today = today or timezone.localdate()
+    if unit == 'd':
+        start = today - timedelta(days=count - 1)
+    elif unit == 'w':
+        start = bucket_start(today, 'week') - timedelta(weeks=count - 1)
+    elif unit == 'm':
+        start = _add_months(today.replace(day=1), -(count - 1))
+    else:
+        start = _add_months(today.replace(day=1), -(12 * count - 1))
+
+    start = bucket_start(start, granularity)
+    if len(bucket_calendar(start, today, granularity)) > MAX_BUCKETS:
+        raise ValueError(f"Plage trop longue (maximum {MAX_BUCKETS} tranches)")
+    return granularity, start, today
+
+
+def bucket_calendar(start, end, granularity):
+    """Liste des débuts de tranche entre start et end inclus"""
+    buckets = []
+    current = bucket_start(start, granularity)
+    while current <= end:
+        buckets.append(current)
+        current = next_bucket(current, granularity)
+    return buckets
+
+
+def bucket_label(d, granularity):
+    """Libellé court d'une tranche (mêmes formats que les anciens graphiques)"""
+    if granularity == 'month':
+        return calendar.month_name[d.month][:3]
+    return d.strftime('%d/%m')
+
+
+def aggregate_series(queryset, date_field, granularity, start, end, **metrics):
+    """
+    Agrège un queryset par tranche de temps en une seule requête.
+
+    metrics: agrégats nommés (ex: ca=Sum('total_ttc'), entrees=Sum('delta', filter=Q(delta__gt=0))).
+    Retourne une liste ordonnée de dicts {'periode': date, 'label': str, <metric>: valeur}
+    couvrant toutes les tranches de [start, end], les tranches vides valant 0.
+    """
+    # Les champs DateTime sont comparés sur leur date locale
+    lookup = date_field
+    if isinstance(queryset.model._meta.get_field(date_field), DateTimeField):
+        lookup = f'{date_field}__date'
+
+    rows = queryset.filter(**{
+        f'{lookup}__gte': start,
+        f'{lookup}__lte': end,
+    }).annotate(
+        _bucket=Trunc(date_field, granularity, output_field=DateField())
+    ).values('_bucket').annotate(**metrics).order_by('_bucket')
+
+    by_bucket = {row['_bucket']: row for row in rows}
+    series = []
+    for bucket in bucket_calendar(start, end, granularity):
+        row = by_bucket.get(bucket, {})
+        point = {'periode': bucket, 'label': bucket_label(bucket, granularity)}
+        for name in metrics:
+            point[name] = row.get(name) or 0
+        series.append(point)
+    return series
@@ -13,7 +13,7 @@ from .distribution_views import (
 
 # Try to import with error handling
 try:
-    from .views_import import ImportPreviewView, ImportExecuteView, ImportTemplateView
+    from .views_import import ImportPreviewView, ImportExecuteView, ImportTemplateView, ImportJobViewSet
     IMPORT_VIEWS_LOADED = True
     IMPORT_ERROR = None
 except Exception as e:
@@ -157,6 +157,9 @@ router.register(r'user-profiles', views.UserProfileViewSet)
 router.register(r'roles', views.GroupViewSet)
 router.register(r'permissions', views.PermissionViewSet)
 router.register(r'audit-logs', views.AuditLogViewSet)
+router.register(r'report-jobs', views.ReportJobViewSet, basename='report-jobs')
+if IMPORT_VIEWS_LOADED:
+    router.register(r'import-jobs', ImportJobViewSet, basename='import-jobs')
 
 # Module de distribution - nouveau système complet
 router.register(r'livreurs', LivreurDistributionViewSet, basename='livreur-compat')
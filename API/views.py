@@ -1,6 +1,7 @@
 import logging
 from django.contrib.auth import authenticate
 from django.shortcuts import render
+from django.db import transaction
 from django.db.models import Sum, Q, F
 from rest_framework import viewsets, generics, status
 from rest_framework import permissions
@@ -17,6 +18,8 @@ from .models import *
 from django.shortcuts import get_object_or_404
 from .audit import log_event
 from .mixins import TenantFilterMixin, WarehouseRelatedTenantMixin
+from .stock_ledger import StockLedger, StockInsuffisant
+from .pagination import KeysetPagination
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -35,8 +38,11 @@ def categories_raw(request):
             # Si l'utilisateur n'a pas de company, retourner une liste vide
             categories = Categorie.objects.none()
 
+        from .categories import CategorieIndex
+        index = CategorieIndex(categories)
         rows = []
-        for cat in categories:
+        # Ordre du queryset (Categorie.Meta.ordering : nom)
+        for cat in index.by_id.values():
             rows.append({
                 'id': cat.id,
                 'nom': cat.nom,
@@ -45,7 +51,7 @@ def categories_raw(request):
                 'couleur': cat.couleur,
                 'icone': cat.icone,
                 'is_active': cat.is_active,
-                'products_count': cat.get_products_count()  # Calculer le nombre de produits
+                'products_count': index.products_count(cat.id)  # Calculé en mémoire
             })
         return Response(rows)
     except Exception as e:
@@ -54,7 +60,7 @@ def categories_raw(request):
 
 # API pour les Catégories
 class CategorieViewSet(TenantFilterMixin, viewsets.ModelViewSet):
-    queryset = Categorie.objects.all().order_by('nom')
+    queryset = Categorie.objects.select_related('parent').order_by('nom')
     serializer_class = CategorieSerializer
     pagination_class = None  # Désactiver la pagination pour simplifier le front
     permission_classes = [IsAuthenticated]
@@ -87,22 +93,35 @@ class CategorieViewSet(TenantFilterMixin, viewsets.ModelViewSet):
         if self.action == 'tree':
             return CategorieTreeSerializer
         return CategorieSerializer
+
+    INDEX_ACTIONS = ('list', 'retrieve', 'tree', 'roots', 'children')
+
+    def get_categorie_index(self):
+        """Catégories de l'entreprise chargées en une requête (compteurs, chemins, sous-arbres)"""
+        if not hasattr(self, '_categorie_index'):
+            from .categories import CategorieIndex
+            self._categorie_index = CategorieIndex(self.get_queryset())
+        return self._categorie_index
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in self.INDEX_ACTIONS:
+            context['categorie_index'] = self.get_categorie_index()
+        return context
     
     @action(detail=False)
     def tree(self, request):
         """Retourne la hiérarchie complète des catégories sous forme d'arbre (filtrée par entreprise)"""
-        # Utiliser get_queryset() pour avoir le filtrage automatique par entreprise
-        base_qs = self.get_queryset()
-        root_categories = base_qs.filter(parent=None, is_active=True).order_by('nom')
-        serializer = CategorieTreeSerializer(root_categories, many=True)
+        # L'index est construit sur get_queryset() (filtrage automatique par entreprise)
+        root_categories = self.get_categorie_index().roots()
+        serializer = self.get_serializer(root_categories, many=True)
         return Response(serializer.data)
     
     @action(detail=False)
     def roots(self, request):
         """Retourne uniquement les catégories racines (sans parent, filtrées par entreprise)"""
-        # Utiliser get_queryset() pour avoir le filtrage automatique par entreprise
-        base_qs = self.get_queryset()
-        root_categories = base_qs.filter(parent=None, is_active=True).order_by('nom')
+        # L'index est construit sur get_queryset() (filtrage automatique par entreprise)
+        root_categories = self.get_categorie_index().roots()
         serializer = self.get_serializer(root_categories, many=True)
         return Response(serializer.data)
     
@@ -110,7 +129,7 @@ class CategorieViewSet(TenantFilterMixin, viewsets.ModelViewSet):
     def children(self, request, pk=None):
         """Retourne les sous-catégories directes d'une catégorie"""
         categorie = self.get_object()
-        children = categorie.sous_categories.filter(is_active=True).order_by('nom')
+        children = self.get_categorie_index().children(categorie.pk)
         serializer = self.get_serializer(children, many=True)
         return Response(serializer.data)
     
@@ -126,30 +145,30 @@ class CategorieViewSet(TenantFilterMixin, viewsets.ModelViewSet):
     def all_products(self, request, pk=None):
         """Retourne tous les produits d'une catégorie et de ses sous-catégories"""
         categorie = self.get_object()
-        # Récupérer tous les IDs des catégories et sous-catégories
-        category_ids = [categorie.id]
-        for child in categorie.get_all_children():
-            category_ids.append(child.id)
-        
-        products = Produit.objects.filter(
+        # IDs de la catégorie et de ses sous-catégories actives (une requête sur le chemin)
+        category_ids = categorie.subtree_index().subtree_ids(categorie.id)
+
+        products = produit_list_queryset(Produit.objects.filter(
             categorie_id__in=category_ids, 
             is_active=True
-        ).order_by('reference')
-        serializer = ProduitSerializer(products, many=True)
+        )).order_by('reference')
+        context = self.get_serializer_context()
+        context['categorie_paths'] = Categorie.full_path_map(getattr(request, 'company', None))
+        serializer = ProduitListSerializer(products, many=True, context=context)
         return Response(serializer.data)
     
     @action(detail=False)
     def stats(self, request):
         """Statistiques des catégories (filtrées par entreprise)"""
         # Utiliser get_queryset() pour avoir le filtrage automatique par entreprise
-        base_qs = self.get_queryset()
-        stats = {
-            'total_categories': base_qs.filter(is_active=True).count(),
-            'categories_racines': base_qs.filter(parent=None, is_active=True).count(),
-            'categories_avec_produits': base_qs.filter(
-                produits__is_active=True, is_active=True
-            ).distinct().count(),
-        }
+        from django.db.models import Count
+        actives = Q(is_active=True)
+        stats = self.get_queryset().aggregate(
+            total_categories=Count('id', filter=actives),
+            categories_racines=Count('id', filter=actives & Q(parent=None)),
+            # nb_produits : produits actifs directs (dénormalisé)
+            categories_avec_produits=Count('id', filter=actives & Q(nb_produits__gt=0)),
+        )
         return Response(stats)
 
 class ClientViewSet(TenantFilterMixin, viewsets.ModelViewSet):
@@ -184,6 +203,78 @@ class ClientViewSet(TenantFilterMixin, viewsets.ModelViewSet):
 
         return queryset
 
+    def _company_id(self):
+        company = getattr(self.request, 'company', None)
+        return company.pk if company is not None else None
+
+    @staticmethod
+    def _nombre(params, name, default=None, minimum=None, maximum=None):
+        """Paramètre numérique ; ValueError si absent (sans défaut) ou invalide"""
+        value = params.get(name)
+        if value in (None, ''):
+            if default is None:
+                raise ValueError(f'{name} requis')
+            return default
+        value = float(value)
+        if value != value or (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            raise ValueError(f'{name} invalide')
+        return value
+
+    @action(detail=False, methods=['get'])
+    def proches(self, request):
+        """Clients à moins de rayon_km du point (lat, lng), du plus proche au plus loin"""
+        from .spatial import bbox_around, clients_in_bbox, clients_within
+        params = request.query_params
+        try:
+            lat = self._nombre(params, 'lat', minimum=-90, maximum=90)
+            lng = self._nombre(params, 'lng', minimum=-180, maximum=180)
+            rayon = self._nombre(params, 'rayon_km', 1.0, minimum=0, maximum=50)
+            limit = int(min(self._nombre(params, 'limit', 100, minimum=1), 1000))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Clients visibles (clients assignés pour un livreur sans entreprise) avant limite et comptage
+        visibles = set(clients_in_bbox(self.get_queryset(), *bbox_around(lat, lng, rayon)).values_list('id', flat=True))
+        voisins = [(pk, distance) for pk, distance in clients_within(self._company_id(), lat, lng, rayon)
+                   if pk in visibles]
+        clients = self.get_queryset().in_bulk([pk for pk, _ in voisins[:limit]])
+        results = [{
+            'id': c.id, 'nom': c.nom, 'prenom': c.prenom, 'adresse': c.adresse, 'telephone': c.telephone,
+            'lat': float(c.lat), 'lng': float(c.lng), 'distance_km': round(distance, 3),
+        } for c, distance in ((clients.get(pk), distance) for pk, distance in voisins[:limit]) if c is not None]
+        return Response({'count': len(voisins), 'results': results})
+
+    @action(detail=False, methods=['get'])
+    def zone(self, request):
+        """Clients visibles dans l'emprise de la carte : ?bbox=sud,ouest,nord,est"""
+        from .spatial import clients_in_bbox
+        try:
+            south, west, north, east = (float(v) for v in request.query_params.get('bbox', '').split(','))
+            if south > north or west > east:
+                raise ValueError
+            limit = int(min(self._nombre(request.query_params, 'limit', 2000, minimum=1), 5000))
+        except ValueError:
+            return Response({'error': 'bbox invalide (sud,ouest,nord,est)'}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = list(clients_in_bbox(self.get_queryset(), south, west, north, east).order_by('id').values(
+            'id', 'nom', 'prenom', 'adresse', 'lat', 'lng')[:limit + 1])
+        for row in rows:
+            row['lat'], row['lng'] = float(row['lat']), float(row['lng'])
+        return Response({'tronque': len(rows) > limit, 'results': rows[:limit]})
+
+    @action(detail=True, methods=['get'])
+    def livreurs_proches(self, request, pk=None):
+        """k livreurs les plus proches du client (dernière position GPS connue)"""
+        from .spatial import nearest_livreurs
+        client = self.get_object()
+        if client.lat is None or client.lng is None:
+            return Response({'error': "Client sans coordonnées GPS"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            k = int(min(self._nombre(request.query_params, 'k', 5, minimum=1), 50))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(nearest_livreurs(self._company_id(), float(client.lat), float(client.lng), k))
+
 class FournisseurViewSet(TenantFilterMixin, viewsets.ModelViewSet):
     queryset = Fournisseur.objects.all().order_by('libelle')
     serializer_class = FournisseurSerializer
@@ -202,6 +293,26 @@ class ProduitViewSet(TenantFilterMixin, viewsets.ModelViewSet):
         'fournisseur': ['exact'],
         'prixU': ['gte', 'lte']
     }
+    # Actions qui sérialisent des listes de produits
+    LIST_ACTIONS = ('list', 'by_category', 'low_stock', 'critical_stock', 'out_of_stock', 'search')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = produit_list_queryset(queryset)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action in self.LIST_ACTIONS:
+            return ProduitListSerializer
+        return ProduitSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in self.LIST_ACTIONS:
+            context['categorie_paths'] = Categorie.full_path_map(getattr(self.request, 'company', None))
+        return context
+
     @action(detail=True, methods=['get'])
     def stock(self, request, pk=None):
         p = self.get_object()
@@ -220,7 +331,7 @@ class ProduitViewSet(TenantFilterMixin, viewsets.ModelViewSet):
         if category_id:
             try:
                 categorie = Categorie.objects.get(id=category_id, is_active=True)
-                products = self.queryset.filter(categorie=categorie)
+                products = produit_list_queryset(self.queryset).filter(categorie=categorie)
                 serializer = self.get_serializer(products, many=True)
                 return Response({
                     'categorie': CategorieSerializer(categorie).data,
@@ -233,7 +344,7 @@ class ProduitViewSet(TenantFilterMixin, viewsets.ModelViewSet):
         categories = Categorie.objects.filter(is_active=True, produits__is_active=True).distinct()
         result = []
         for cat in categories:
-            products = self.queryset.filter(categorie=cat)
+            products = produit_list_queryset(self.queryset).filter(categorie=cat)
             result.append({
                 'categorie': CategorieSerializer(cat).data,
                 'produits': self.get_serializer(products, many=True).data
@@ -243,21 +354,21 @@ class ProduitViewSet(TenantFilterMixin, viewsets.ModelViewSet):
     @action(detail=False)
     def low_stock(self, request):
         """Retourne les produits avec un stock faible"""
-        products = self.queryset.filter(quantite__lte=F('seuil_alerte'))
+        products = produit_list_queryset(self.queryset).filter(quantite__lte=F('seuil_alerte'))
         serializer = self.get_serializer(products, many=True)
         return Response(serializer.data)
     
     @action(detail=False)
     def critical_stock(self, request):
         """Retourne les produits avec un stock critique"""
-        products = self.queryset.filter(quantite__lte=F('seuil_critique'))
+        products = produit_list_queryset(self.queryset).filter(quantite__lte=F('seuil_critique'))
         serializer = self.get_serializer(products, many=True)
         return Response(serializer.data)
     
     @action(detail=False)
     def out_of_stock(self, request):
         """Retourne les produits en rupture de stock"""
-        products = self.queryset.filter(quantite__lte=0)
+        products = produit_list_queryset(self.queryset).filter(quantite__lte=0)
         serializer = self.get_serializer(products, many=True)
         return Response(serializer.data)
     
@@ -268,7 +379,7 @@ class ProduitViewSet(TenantFilterMixin, viewsets.ModelViewSet):
         if not query:
             return Response([])
         
-        products = self.queryset.filter(
+        products = produit_list_queryset(self.queryset).filter(
             Q(designation__icontains=query) |
             Q(reference__icontains=query) |
             Q(code_barre__icontains=query)
@@ -482,18 +593,6 @@ class FactureViewSet(TenantFilterMixin, viewsets.ModelViewSet):
             if not bl.client:
                 return Response({'detail': 'Le bon de livraison doit avoir un client associé'}, status=400)
 
-            # Numéro automatique si absent
-            if not numero:
-                # Générer un numéro unique en vérifiant les doublons
-                base = 'FA-'
-                n = Facture.objects.count() + 1
-                while True:
-                    candidate = f"{base}{n:05d}"
-                    if not Facture.objects.filter(numero=candidate).exists():
-                        numero = candidate
-                        break
-                    n += 1
-
             # Créer la facture avec une date (pas datetime)
             from datetime import date
 
@@ -504,27 +603,33 @@ class FactureViewSet(TenantFilterMixin, viewsets.ModelViewSet):
             elif bl.company:
                 company = bl.company
 
-            facture = Facture.objects.create(
-                company=company,
-                numero=numero,
-                date_emission=date.today(),  # Forcer une date, pas un datetime
-                client=bl.client,
-                bon_livraison=bl,
-                tva_rate=tva_rate,
-                statut='draft'
-            )
-
-            for l in bl.lignes.all():
-                LigneFacture.objects.create(
-                    facture=facture,
-                    produit=l.produit,
-                    designation=l.produit.designation,
-                    quantite=l.quantite,
-                    prixU_snapshot=l.prixU_snapshot,  # Utiliser le prix du BL, pas le prix actuel du produit
+            with transaction.atomic():
+                # Numéro automatique si absent (attribué dans la transaction de la facture)
+                if not numero:
+                    from .numbering import next_numero
+                    numero = next_numero('facture', company)
+
+                facture = Facture.objects.create(
+                    company=company,
+                    numero=numero,
+                    date_emission=date.today(),  # Forcer une date, pas un datetime
+                    client=bl.client,
+                    bon_livraison=bl,
+                    tva_rate=tva_rate,
+                    statut='draft'
                 )
 
-            facture.recompute_totals()
-            facture.save(update_fields=['total_ht', 'total_tva', 'total_ttc'])
+                for l in bl.lignes.all():
+                    LigneFacture.objects.create(
+                        facture=facture,
+                        produit=l.produit,
+                        designation=l.produit.designation,
+                        quantite=l.quantite,
+                        prixU_snapshot=l.prixU_snapshot,  # Utiliser le prix du BL, pas le prix actuel du produit
+                    )
+
+                facture.recompute_totals()
+                facture.save(update_fields=['total_ht', 'total_tva', 'total_ttc'])
 
             try:
                 log_event(self.request, 'facture.create_from_bl', target=facture, metadata={
@@ -630,37 +735,18 @@ class StockMoveViewSet(WarehouseRelatedTenantMixin, viewsets.ModelViewSet):
 
     filter_backends = [DjangoFilterBackend]
     filterset_class = StockMoveFilter
-    pagination_class = None
+    # Pages sur (date, id) : ?page_size= (borné) et ?cursor= pour la suite
+    pagination_class = KeysetPagination
+    cursor_field = 'date'
 
     def perform_create(self, serializer):
-        obj = serializer.save()
-        # Update stock per warehouse and aggregate product stock
-        if obj.warehouse is None:
-            # If warehouse not specified, try to allocate negative deltas across existing per-warehouse stocks
-            if obj.delta < 0:
-                remaining = -int(obj.delta)
-                # Consume from warehouses with highest quantity first
-                stocks = list(ProductStock.objects.filter(produit=obj.produit).select_related('warehouse').order_by('-quantity'))
-                for ps in stocks:
-                    if remaining <= 0:
-                        break
-                    take = min(ps.quantity, remaining)
-                    if take > 0:
-                        ps.quantity = ps.quantity - take
-                        ps.save(update_fields=['quantity'])
-                        remaining -= take
-                # Note: if remaining > 0 here, total product stock would go negative; keep per-warehouse at zero
-            else:
-                # Positive delta without warehouse: cannot attribute to a location; keep only product total in sync
-                pass
-        else:
-            ps, _ = ProductStock.objects.get_or_create(produit=obj.produit, warehouse=obj.warehouse, defaults={'quantity': 0})
-            ps.quantity = ps.quantity + obj.delta
-            ps.save(update_fields=['quantity'])
-        # keep Produit.quantite as sum across warehouses for backward compatibility
-        total = obj.produit.stocks.aggregate(total=Sum('quantity')).get('total') or 0
-        obj.produit.quantite = total
-        obj.produit.save(update_fields=['quantite'])
+        data = serializer.validated_data
+        # Sortie sans entrepôt : prélevée sur les entrepôts les mieux fournis ;
+        # Produit.quantite reste la somme des stocks par entrepôt
+        ledger = StockLedger(refresh='sum', allocate=True)
+        ledger.add(data['produit'], data.get('warehouse'), data['delta'], data.get('source', 'AUTRE'),
+                   data.get('ref_id', ''), data.get('note', ''), data.get('date'))
+        obj = serializer.instance = ledger.apply()[0]
         try:
             log_event(self.request, 'stockmove.create', target=obj, metadata={'id': obj.id, 'produit': obj.produit_id, 'warehouse': getattr(obj.warehouse, 'id', None), 'delta': obj.delta, 'source': obj.source, 'ref_id': obj.ref_id})
         except Exception:
@@ -709,29 +795,20 @@ class StockMoveViewSet(WarehouseRelatedTenantMixin, viewsets.ModelViewSet):
             w_to = Warehouse.objects.get(pk=int(to_wh))
         except (Produit.DoesNotExist, Warehouse.DoesNotExist):
             return Response({'detail': 'Produit ou Entrepôt introuvable'}, status=404)
-        # Check stock availability on source warehouse
-        src_stock, _ = ProductStock.objects.get_or_create(produit=p, warehouse=w_from, defaults={'quantity': 0})
-        if src_stock.quantity < qty:
-            return Response({'detail': 'Stock insuffisant dans l\'entrepôt source', 'stock': src_stock.quantity, 'demande': qty}, status=400)
-        # Perform transfer: decrement source, increment destination
-        src_stock.quantity -= qty
-        src_stock.save(update_fields=['quantity'])
-        dst_stock, _ = ProductStock.objects.get_or_create(produit=p, warehouse=w_to, defaults={'quantity': 0})
-        dst_stock.quantity += qty
-        dst_stock.save(update_fields=['quantity'])
-        # Create two moves with warehouses
+        out_note = f"Transfert sortie {w_from.code} -> {w_to.code}"
+        in_note = f"Transfert entrée {w_from.code} -> {w_to.code}"
+        ledger = StockLedger(check='warehouse', refresh='sum')
+        ledger.add(p, w_from, -qty, 'TRANS', note=out_note + (f" | {note}" if note else ''))
+        ledger.add(p, w_to, qty, 'TRANS', note=in_note + (f" | {note}" if note else ''))
+        try:
+            out_move, in_move = ledger.apply()
+        except StockInsuffisant as e:
+            ligne = e.lignes[0]
+            return Response({'detail': 'Stock insuffisant dans l\'entrepôt source', 'stock': ligne['stock'], 'demande': ligne['demande']}, status=400)
         try:
             log_event(self.request, 'stockmove.transfer', target=None, metadata={'produit': p.id, 'qty': qty, 'from': w_from.id, 'to': w_to.id, 'note': note})
         except Exception:
             pass
-        out_note = f"Transfert sortie {w_from.code} -> {w_to.code}"
-        in_note = f"Transfert entrée {w_from.code} -> {w_to.code}"
-        out_move = StockMove.objects.create(produit=p, warehouse=w_from, delta=-qty, source='TRANS', ref_id='', note=out_note + (f" | {note}" if note else ''))
-        in_move = StockMove.objects.create(produit=p, warehouse=w_to, delta=qty, source='TRANS', ref_id='', note=in_note + (f" | {note}" if note else ''))
-        # Aggregate total on product
-        total = p.stocks.aggregate(total=Sum('quantity')).get('total') or 0
-        p.quantite = total
-        p.save(update_fields=['quantite'])
         return Response({'detail': 'Transfert enregistré', 'out': StockMoveSerializer(out_move).data, 'in': StockMoveSerializer(in_move).data}, status=201)
 
     @action(detail=False, methods=['post'])
@@ -758,15 +835,10 @@ class StockMoveViewSet(WarehouseRelatedTenantMixin, viewsets.ModelViewSet):
             w = Warehouse.objects.get(pk=int(warehouse_id))
         except (Produit.DoesNotExist, Warehouse.DoesNotExist):
             return Response({'detail': 'Produit ou Entrepôt introuvable'}, status=404)
-        ps, _ = ProductStock.objects.get_or_create(produit=p, warehouse=w, defaults={'quantity': 0})
-        if ps.quantity < qty:
-            return Response({'detail': 'Stock insuffisant dans cet entrepôt', 'stock': ps.quantity, 'demande': qty}, status=400)
-        ps.quantity -= qty
-        ps.save(update_fields=['quantity'])
-        move = StockMove.objects.create(produit=p, warehouse=w, delta=-qty, source=move_type, ref_id='', note=note)
-        total = p.stocks.aggregate(total=Sum('quantity')).get('total') or 0
-        p.quantite = total
-        p.save(update_fields=['quantite'])
+        try:
+            move, = StockLedger(check='warehouse', refresh='sum').add(p, w, -qty, move_type, note=note).apply()
+        except StockInsuffisant as e:
+            return Response({'detail': 'Stock insuffisant dans cet entrepôt', 'stock': e.lignes[0]['stock'], 'demande': qty}, status=400)
         return Response({'detail': 'Sortie enregistrée', 'move': StockMoveSerializer(move).data}, status=201)
 
     @action(detail=False, methods=['post'])
@@ -794,15 +866,10 @@ class StockMoveViewSet(WarehouseRelatedTenantMixin, viewsets.ModelViewSet):
             w = Warehouse.objects.get(pk=int(warehouse_id))
         except (Produit.DoesNotExist, Warehouse.DoesNotExist):
             return Response({'detail': 'Produit ou Entrepôt introuvable'}, status=404)
-        ps, _ = ProductStock.objects.get_or_create(produit=p, warehouse=w, defaults={'quantity': 0})
-        if ps.quantity < qty:
-            return Response({'detail': 'Stock insuffisant dans cet entrepôt', 'stock': ps.quantity, 'demande': qty}, status=400)
-        ps.quantity -= qty
-        ps.save(update_fields=['quantity'])
-        move = StockMove.objects.create(produit=p, warehouse=w, delta=-qty, source=move_type, ref_id='', note=note)
-        total = p.stocks.aggregate(total=Sum('quantity')).get('total') or 0
-        p.quantite = total
-        p.save(update_fields=['quantite'])
+        try:
+            move, = StockLedger(check='warehouse', refresh='sum').add(p, w, -qty, move_type, note=note).apply()
+        except StockInsuffisant as e:
+            return Response({'detail': 'Stock insuffisant dans cet entrepôt', 'stock': e.lignes[0]['stock'], 'demande': qty}, status=400)
         return Response({'detail': 'Sortie enregistrée', 'move': StockMoveSerializer(move).data}, status=201)
 
     @action(detail=False, methods=['post'])
@@ -843,36 +910,19 @@ class StockMoveViewSet(WarehouseRelatedTenantMixin, viewsets.ModelViewSet):
         except Warehouse.DoesNotExist:
             return Response({'detail': 'Entrepôt introuvable'}, status=404)
 
-        # Vérifier le stock disponible
-        ps, _ = ProductStock.objects.get_or_create(produit=p, warehouse=w, defaults={'quantity': 0})
-        if ps.quantity < qty:
+        # Vérifier le stock disponible et le décrémenter sous verrou
+        ref_id = f'RETOUR-F{f.id}'
+        ledger = StockLedger(check='warehouse', refresh='sum')
+        ledger.add(p, w, -qty, 'RETOUR', ref_id, note, date_str or None)
+        try:
+            move, = ledger.apply()
+        except StockInsuffisant as e:
             return Response({
                 'detail': 'Stock insuffisant dans cet entrepôt',
-                'stock': ps.quantity,
+                'stock': e.lignes[0]['stock'],
                 'demande': qty
             }, status=400)
 
-        # Décrémenter le stock
-        ps.quantity -= qty
-        ps.save(update_fields=['quantity'])
-
-        # Créer le mouvement de stock
-        ref_id = f'RETOUR-F{f.id}'
-        move = StockMove.objects.create(
-            produit=p,
-            warehouse=w,
-            delta=-qty,
-            source='RETOUR',
-            ref_id=ref_id,
-            note=note,
-            date=date_str if date_str else timezone.now()
-        )
-
-        # Mettre à jour le stock agrégé
-        total = p.stocks.aggregate(total=Sum('quantity')).get('total') or 0
-        p.quantite = total
-        p.save(update_fields=['quantite'])
-
         try:
             log_event(request, 'mouvement.return', target=p, metadata={
                 'produit': p.id,
@@ -899,20 +949,13 @@ class InventorySessionViewSet(TenantFilterMixin, viewsets.ModelViewSet):
     def perform_create(self, serializer):
         # Numérotation automatique INV-<YEAR>-NNNN si absente
         from django.utils import timezone
-        from .models import InventorySession
+        from .numbering import next_numero
+        company = getattr(self.request, 'company', None)
         numero = serializer.validated_data.get('numero')
-        if not numero or not str(numero).strip():
-            year = timezone.now().year
-            prefix = f"INV-{year}-"
-            last = InventorySession.objects.filter(numero__startswith=prefix).order_by('-numero').first()
-            seq = 1
-            if last:
-                try:
-                    seq = int(str(last.numero).split('-')[-1]) + 1
-                except Exception:
-                    seq = 1
-            numero = f"{prefix}{seq:04d}"
-        obj = serializer.save(created_by=self.request.user, numero=numero)
+        with transaction.atomic():
+            if not numero or not str(numero).strip():
+                numero = next_numero('inventaire', company, timezone.now())
+            obj = serializer.save(created_by=self.request.user, numero=numero, company=company)
         try:
             log_event(self.request, 'inventorysession.create', target=obj, metadata={'id': obj.id, 'numero': obj.numero})
         except Exception:
@@ -947,21 +990,21 @@ class InventorySessionViewSet(TenantFilterMixin, viewsets.ModelViewSet):
                 'missing_products': session.missing_products_count
             }, status=400)
         
-        # pour chaque ligne, créer un mouvement d'écart et mettre à jour le stock produit
+        # pour chaque ligne, un mouvement d'écart ; appliqués en un seul lot
+        ledger = StockLedger()
         for l in session.lignes.select_related('produit'):
             if l.counted_qty is not None:
                 # book stock: utiliser le champ produit.quantite (source actuelle de vérité), sinon somme des mouvements
                 book = l.snapshot_qty if l.snapshot_qty is not None else l.produit.quantite
                 delta = l.counted_qty - book
                 if delta != 0:
-                    StockMove.objects.create(produit=l.produit, delta=delta, source='INV', ref_id=str(session.id), note=f'Inventaire {session.numero}')
-                    # maintenir la cohérence avec le champ quantite
-                    l.produit.quantite = l.produit.quantite + delta
-                    l.produit.save(update_fields=['quantite'])
-        
-        session.statut = 'validated'
-        session.validated_by = request.user
-        session.save(update_fields=['statut', 'validated_by'])
+                    ledger.add(l.produit, None, delta, 'INV', session.id, f'Inventaire {session.numero}')
+
+        with transaction.atomic():
+            ledger.apply()
+            session.statut = 'validated'
+            session.validated_by = request.user
+            session.save(update_fields=['statut', 'validated_by'])
         return Response({'detail': 'Inventaire validé'}, status=200)
 
     @action(detail=True, methods=['post'])
@@ -1137,130 +1180,103 @@ from .models import AuditLog
 from .serializers import AuditLogSerializer
 
 class AuditLogViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = AuditLog.objects.all()
+    queryset = AuditLog.objects.select_related('actor')
     serializer_class = AuditLogSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
+    pagination_class = KeysetPagination
+    cursor_field = 'created_at'
 
 class CountViewSet(APIView):
+    """
+    Compteurs du tableau de bord de l'entreprise courante.
+    Lecture d'un instantané matérialisé (DashboardSnapshot) tenu à jour par signaux.
+    """
     permission_classes = [permissions.AllowAny]
     def get(self, request, format=None):
         try:
-            from django.db.models import Sum, Count, Q
-            from django.utils import timezone
-            from datetime import timedelta, datetime
-            
-            # Compteurs de base
-            Produit_count = Produit.objects.filter(is_active=True).count()
-            Client_count = Client.objects.all().count()
-            Fournisseur_count = Fournisseur.objects.all().count()
-            Achat_count = Achat.objects.all().count()
-            Vente_count = Vente.objects.filter(statut='completed').count()
-            
-            # Statistiques de stock
-            produits_stock_bas = Produit.objects.filter(quantite__lte=F('seuil_alerte')).count()
-            produits_stock_critique = Produit.objects.filter(quantite__lte=F('seuil_critique')).count()
-            produits_rupture = Produit.objects.filter(quantite__lte=0).count()
-            
-            # Chiffre d'affaires
-            ca_total = Vente.objects.filter(statut='completed').aggregate(
-                total=Sum('total_ttc')
-            )['total'] or 0
-            
-            # CA ce mois
-            now = timezone.now()
-            debut_mois = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            ca_mois = Vente.objects.filter(
-                statut='completed',
-                date_vente__gte=debut_mois
-            ).aggregate(total=Sum('total_ttc'))['total'] or 0
-            
-            # Ventes aujourd'hui
-            aujourd_hui = now.date()
-            ventes_aujourd_hui = Vente.objects.filter(
-                statut='completed',
-                date_vente__date=aujourd_hui
-            ).count()
+            from .dashboard import COUNTER_FIELDS, get_snapshot, snapshot_to_dict
+
+            company = getattr(request, 'company', None)
+            if company is not None:
+                content = snapshot_to_dict(get_snapshot(company))
+            else:
+                # Pas d'entreprise : aucune donnée (comme TenantFilterMixin)
+                content = {field: 0 for field in COUNTER_FIELDS}
+                content['ca_total'] = 0.0
+                content['ca_mois'] = 0.0
 
             # Récupérer la devise par défaut
             default_currency = Currency.get_default()
-            currency_symbol = default_currency.symbol if default_currency else ''
-
-            content = {
-                'produits_count': Produit_count,
-                'clients_count': Client_count,
-                'fournisseurs_count': Fournisseur_count,
-                'achats_count': Achat_count,
-                'ventes_count': Vente_count,
-                'ventes_aujourd_hui': ventes_aujourd_hui,
-                'ca_total': float(ca_total),
-                'ca_mois': float(ca_mois),
-                'produits_stock_bas': produits_stock_bas,
-                'produits_stock_critique': produits_stock_critique,
-                'produits_rupture': produits_rupture,
-                'currency_symbol': currency_symbol
-            }
+            content['currency_symbol'] = default_currency.symbol if default_currency else ''
             return Response(content)
         except Exception as e:
             logger.exception('CountViewSet failed: %s', e)
             return Response({'error': str(e)}, status=500)
 
 class StatisticsChartsViewSet(APIView):
+    """
+    Données des graphiques du tableau de bord.
+    Paramètres optionnels: ?granularity=day|week|month et ?range=30d|8w|12m|2y
+    (par défaut ventes sur 12 mois, mouvements de stock sur 30 jours).
+    """
     permission_classes = [permissions.AllowAny]
     def get(self, request, format=None):
+        from .timeseries import parse_range
+
+        granularity = request.GET.get('granularity')
+        range_str = request.GET.get('range')
+        try:
+            ventes_periode = parse_range(granularity or 'month', range_str)
+            # Sans paramètre, les mouvements restent sur 30 jours en quotidien
+            mouvements_periode = parse_range(granularity or ('month' if range_str else 'day'), range_str)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
             from django.db.models import Sum, Count, Q
-            from django.utils import timezone
-            from datetime import timedelta, datetime
-            import calendar
-            
-            now = timezone.now()
-            
-            # Ventes par mois (12 derniers mois)
-            ventes_par_mois = []
-            mois_labels = []
-            for i in range(11, -1, -1):
-                date = now - timedelta(days=30*i)
-                debut_mois = date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-                if i == 0:
-                    fin_mois = now
-                else:
-                    fin_mois = (debut_mois + timedelta(days=32)).replace(day=1) - timedelta(seconds=1)
-                
-                ventes_mois = Vente.objects.filter(
-                    statut='completed',
-                    date_vente__gte=debut_mois,
-                    date_vente__lte=fin_mois
-                ).aggregate(
-                    count=Count('id'),
-                    total=Sum('total_ttc')
+            from .timeseries import aggregate_series
+
+            # Lecture des agrégats journaliers (API/rollups.py), jamais des lignes brutes
+            company = getattr(request, 'company', None)
+            if company is not None:
+                sales = DailySalesRollup.objects.filter(company=company)
+                products = DailyProductRollup.objects.filter(company=company)
+                produits = Produit.objects.filter(company=company, is_active=True)
+            else:
+                sales = DailySalesRollup.objects.none()
+                products = DailyProductRollup.objects.none()
+                produits = Produit.objects.none()
+
+            # Ventes par période (une seule requête groupée)
+            gran, debut, fin = ventes_periode
+            ventes_par_mois = [
+                {
+                    'mois': point['label'],
+                    'periode': point['periode'].isoformat(),
+                    'ventes': point['ventes'],
+                    'ca': float(point['ca']),
+                }
+                for point in aggregate_series(
+                    sales, 'jour', gran, debut, fin,
+                    ventes=Sum('nb_ventes'),
+                    ca=Sum('total_ttc'),
                 )
-                
-                ventes_par_mois.append({
-                    'mois': calendar.month_name[debut_mois.month][:3],
-                    'ventes': ventes_mois['count'] or 0,
-                    'ca': float(ventes_mois['total'] or 0)
-                })
-                mois_labels.append(calendar.month_name[debut_mois.month][:3])
-            
+            ]
+
             # Top 5 produits les plus vendus
-            from django.db.models import Sum
-            top_produits = LigneVente.objects.filter(
-                vente__statut='completed'
-            ).values(
+            top_produits = products.filter(qte_vendue__gt=0).values(
                 'produit__designation',
                 'produit__reference'
             ).annotate(
-                total_vendu=Sum('quantite')
+                total_vendu=Sum('qte_vendue')
             ).order_by('-total_vendu')[:5]
-            
+
             # Répartition des ventes par catégorie
-            ventes_par_categorie_qs = LigneVente.objects.filter(
-                vente__statut='completed'
-            ).values(
+            ventes_par_categorie_qs = products.filter(qte_vendue__gt=0).values(
                 'produit__categorie__nom'
             ).annotate(
-                total_ventes=Sum('quantite'),
-                ca_categorie=Sum('prixU_snapshot')
+                total_ventes=Sum('qte_vendue'),
+                ca_categorie=Sum('ca')
             ).order_by('-total_ventes')[:10]
             ventes_par_categorie = []
             for row in ventes_par_categorie_qs:
@@ -1269,55 +1285,34 @@ class StatisticsChartsViewSet(APIView):
                     'total_ventes': row.get('total_ventes') or 0,
                     'ca_categorie': float(row.get('ca_categorie') or 0)
                 })
-            
-            # Évolution du stock (mouvements des 30 derniers jours)
-            trente_jours = now - timedelta(days=30)
-            mouvements_stock = []
-            for i in range(30):
-                date = (now - timedelta(days=29-i)).date()
-                entrees = StockMove.objects.filter(
-                    date__date=date,
-                    delta__gt=0
-                ).aggregate(total=Sum('delta'))['total'] or 0
-                
-                sorties = abs(StockMove.objects.filter(
-                    date__date=date,
-                    delta__lt=0
-                ).aggregate(total=Sum('delta'))['total'] or 0)
-                
-                mouvements_stock.append({
-                    'date': date.strftime('%d/%m'),
-                    'entrees': entrees,
-                    'sorties': sorties
-                })
-            
-            # Statut des stocks
-            stock_status = {
-                'normal': Produit.objects.filter(
-                    quantite__gt=F('seuil_alerte'),
-                    is_active=True
-                ).count(),
-                'alerte': Produit.objects.filter(
-                    quantite__lte=F('seuil_alerte'),
-                    quantite__gt=F('seuil_critique'),
-                    is_active=True
-                ).count(),
-                'critique': Produit.objects.filter(
-                    quantite__lte=F('seuil_critique'),
-                    quantite__gt=0,
-                    is_active=True
-                ).count(),
-                'rupture': Produit.objects.filter(
-                    quantite__lte=0,
-                    is_active=True
-                ).count()
-            }
-            
+
+            # Évolution du stock (entrées/sorties en une seule requête)
+            gran, debut, fin = mouvements_periode
+            mouvements_stock = [
+                {
+                    'date': point['label'],
+                    'periode': point['periode'].isoformat(),
+                    'entrees': point['entrees'],
+                    'sorties': point['sorties'],
+                }
+                for point in aggregate_series(
+                    products, 'jour', gran, debut, fin,
+                    entrees=Sum('entrees'),
+                    sorties=Sum('sorties'),
+                )
+            ]
+
+            # Statut des stocks (comptages conditionnels en une requête)
+            stock_status = produits.aggregate(
+                normal=Count('id', filter=Q(quantite__gt=F('seuil_alerte'))),
+                alerte=Count('id', filter=Q(quantite__lte=F('seuil_alerte'), quantite__gt=F('seuil_critique'))),
+                critique=Count('id', filter=Q(quantite__lte=F('seuil_critique'), quantite__gt=0)),
+                rupture=Count('id', filter=Q(quantite__lte=0)),
+            )
+
             # Ventes par type de paiement
-            ventes_paiement_qs = Vente.objects.filter(
-                statut='completed'
-            ).values('type_paiement').annotate(
-                count=Count('id'),
+            ventes_paiement_qs = sales.values('type_paiement').annotate(
+                count=Sum('nb_ventes'),
                 total=Sum('total_ttc')
             ).order_by('-count')
             ventes_paiement = []
@@ -1407,6 +1402,8 @@ class LoginViewSet(APIView):
 class VenteViewSet(TenantFilterMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     queryset = Vente.objects.all().order_by('-date_vente')
+    pagination_class = KeysetPagination
+    cursor_field = 'date_vente'
     
     def perform_create(self, serializer):
         obj = serializer.save()
@@ -1453,73 +1450,14 @@ class VenteViewSet(TenantFilterMixin, viewsets.ModelViewSet):
         """Marquer une vente comme terminée"""
         vente = self.get_object()
         if vente.statut == 'draft':
-            # Vérifier les stocks
-            insuffisants = []
-            for ligne in vente.lignes.select_related('produit'):
-                if ligne.produit.quantite < ligne.quantite:
-                    insuffisants.append({
-                        'produit': ligne.produit.id, 
-                        'reference': ligne.produit.reference,
-                        'stock': ligne.produit.quantite, 
-                        'demande': ligne.quantite
-                    })
-            
-            if insuffisants:
-                return Response({'detail': 'Stock insuffisant', 'lignes': insuffisants}, status=400)
-            
-            vente.statut = 'completed'
-            vente.save()
-
-            # Décrémenter les stocks maintenant que la vente est finalisée (passe de draft à completed)
-            from .models import ProductStock, StockMove
-            for ligne in vente.lignes.select_related('produit'):
-                produit = ligne.produit
-                qty = int(ligne.quantite or 0)
-                if qty > 0:
-                    # décrément agrégé (back-compat)
-                    produit.quantite = produit.quantite - qty
-                    produit.save(update_fields=['quantite'])
-                    # décrément par entrepôt
-                    ps, _ = ProductStock.objects.get_or_create(
-                        produit=produit,
-                        warehouse=vente.warehouse,
-                        defaults={'quantity': 0}
-                    )
-                    ps.quantity = max(0, (ps.quantity or 0) - qty)
-                    ps.save(update_fields=['quantity'])
-                    # mouvement de sortie rattaché à l'entrepôt
-                    StockMove.objects.create(
-                        produit=produit,
-                        warehouse=vente.warehouse,
-                        delta=-(qty),
-                        source='VENTE',
-                        ref_id=str(vente.id),
-                        note=f"Vente {vente.numero} - finalisée"
-                    )
-
-            # Créer automatiquement un Bon de Livraison validé si absent
+            # Statut revérifié et stock décrémenté sous verrou, BL créé en lot
+            from .sale_completion import complete_vente, VenteNonBrouillon
             try:
-                if not vente.bon_livraison_id:
-                    from .serializers import BonLivraisonSerializer
-                    lignes_data = []
-                    for l in vente.lignes.select_related('produit'):
-                        lignes_data.append({
-                            'produit': l.produit.id,
-                            'quantite': int(l.quantite or 0),
-                            'prixU_snapshot': getattr(l, 'prixU_snapshot', getattr(l.produit, 'prixU', 0))
-                        })
-                    bl_payload = {
-                        'client': vente.client.id if vente.client_id else None,
-                        'statut': 'validated',
-                        'lignes': lignes_data,
-                    }
-                    bl_ser = BonLivraisonSerializer(data=bl_payload)
-                    bl_ser.is_valid(raise_exception=True)
-                    bl = bl_ser.save()
-                    vente.bon_livraison = bl
-                    vente.save(update_fields=['bon_livraison'])
-            except Exception as e:
-                logger.exception('Erreur creation BL lors de la finalisation de la vente: %s', e)
+                vente = complete_vente(vente)
+            except VenteNonBrouillon:
+                return Response({'error': 'Vente déjà terminée ou annulée'}, status=400)
+            except StockInsuffisant as e:
+                return Response({'detail': 'Stock insuffisant', 'lignes': e.lignes}, status=400)
 
             try:
                 log_event(self.request, 'vente.complete', target=vente, metadata={'id': vente.id, 'numero': getattr(vente, 'numero', None)})
@@ -1572,29 +1510,30 @@ class VenteViewSet(TenantFilterMixin, viewsets.ModelViewSet):
     
     @action(detail=False)
     def stats(self, request):
-        """Statistiques des ventes (filtrées par entreprise)"""
-        from django.db.models import Sum, Count
+        """Statistiques des ventes (filtrées par entreprise), lues dans les agrégats journaliers"""
+        from django.db.models import Sum, Q
         from django.utils import timezone
         from datetime import timedelta
 
-        now = timezone.now()
-        today = now.date()
+        today = timezone.localdate()
         week_ago = today - timedelta(days=7)
         month_ago = today - timedelta(days=30)
 
-        # Utiliser get_queryset() pour avoir le filtrage automatique par entreprise
-        base_qs = self.get_queryset()
-
-        stats = {
-            'total_ventes': base_qs.filter(statut='completed').count(),
-            'ventes_aujourd_hui': base_qs.filter(statut='completed', date_vente__date=today).count(),
-            'ventes_semaine': base_qs.filter(statut='completed', date_vente__date__gte=week_ago).count(),
-            'ventes_mois': base_qs.filter(statut='completed', date_vente__date__gte=month_ago).count(),
-            'ca_total': base_qs.filter(statut='completed').aggregate(total=Sum('total_ttc'))['total'] or 0,
-            'ca_aujourd_hui': base_qs.filter(statut='completed', date_vente__date=today).aggregate(total=Sum('total_ttc'))['total'] or 0,
-            'ca_semaine': base_qs.filter(statut='completed', date_vente__date__gte=week_ago).aggregate(total=Sum('total_ttc'))['total'] or 0,
-            'ca_mois': base_qs.filter(statut='completed', date_vente__date__gte=month_ago).aggregate(total=Sum('total_ttc'))['total'] or 0,
-        }
+        company = getattr(request, 'company', None)
+        rollups = DailySalesRollup.objects.filter(company=company) if company is not None \
+            else DailySalesRollup.objects.none()
+
+        totals = rollups.aggregate(
+            total_ventes=Sum('nb_ventes'),
+            ventes_aujourd_hui=Sum('nb_ventes', filter=Q(jour=today)),
+            ventes_semaine=Sum('nb_ventes', filter=Q(jour__gte=week_ago)),
+            ventes_mois=Sum('nb_ventes', filter=Q(jour__gte=month_ago)),
+            ca_total=Sum('total_ttc'),
+            ca_aujourd_hui=Sum('total_ttc', filter=Q(jour=today)),
+            ca_semaine=Sum('total_ttc', filter=Q(jour__gte=week_ago)),
+            ca_mois=Sum('total_ttc', filter=Q(jour__gte=month_ago)),
+        )
+        stats = {key: value or 0 for key, value in totals.items()}
 
         return Response(stats)
 
@@ -1894,7 +1833,7 @@ class SystemConfigView(APIView):
     def put(self, request):
         """Update system configuration"""
         try:
-            cfg = SystemConfig.get_solo()
+            cfg = SystemConfig.get_solo(cached=False)
             wid = request.data.get('default_warehouse')
 
             if wid:
@@ -2113,13 +2052,15 @@ class ExchangeRateViewSet(viewsets.ModelViewSet):
     @action(detail=False)
     def rates_matrix(self, request):
         """Obtenir une matrice des taux de change pour toutes les devises actives"""
-        currencies = Currency.objects.filter(is_active=True)
+        from .exchange_rates import rate_table
+        currencies = list(Currency.objects.filter(is_active=True))
+        table = rate_table()
         matrix = {}
         
         for from_curr in currencies:
             matrix[from_curr.code] = {}
             for to_curr in currencies:
-                rate = ExchangeRate.get_rate(from_curr, to_curr)
+                rate = table.rate(from_curr, to_curr)
                 matrix[from_curr.code][to_curr.code] = {
                     'rate': rate,
                     'symbol_from': from_curr.symbol,
@@ -2136,7 +2077,7 @@ class ExchangeRateViewSet(viewsets.ModelViewSet):
 # VUES POUR EXPORTS DE RAPPORTS (Excel & PDF)
 # ==============================================
 
-from django.http import HttpResponse
+from django.http import HttpResponse, FileResponse, StreamingHttpResponse
 from datetime import datetime
 from .reports import (
     generate_stock_valuation_excel,
@@ -2144,8 +2085,13 @@ from .reports import (
     generate_sales_report_excel,
     generate_sales_report_pdf,
     generate_inventory_report_excel,
-    generate_inventory_report_pdf
+    generate_inventory_report_pdf,
+    stream_stock_valuation_csv,
+    stream_sales_report_csv,
 )
+from .report_jobs import queue_report, wants_async
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
 
 
 @api_view(['GET'])
@@ -2154,26 +2100,37 @@ def export_stock_valuation(request):
     """
     Export du rapport de valorisation du stock
     Query params:
-        - format: excel ou pdf (défaut: excel)
+        - format: excel, csv ou pdf (défaut: excel)
         - warehouse: ID de l'entrepôt (optionnel)
+        - async: 1 pour générer le rapport en arrière-plan (réponse 202 + job)
+    Les formats excel et csv sont produits en flux (mémoire constante).
     """
     export_format = request.GET.get('format', 'excel').lower()
     warehouse_id = request.GET.get('warehouse', None)
+    company = getattr(request, 'company', None)
+
+    if wants_async(request.GET):
+        return Response(*queue_report(request, 'stock_valuation', export_format, {'warehouse': warehouse_id}))
 
     try:
         if export_format == 'pdf':
-            buffer = generate_stock_valuation_pdf(warehouse_id)
+            buffer = generate_stock_valuation_pdf(warehouse_id, company)
             response = HttpResponse(buffer, content_type='application/pdf')
             filename = f'valorisation_stock_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
             response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        else:
-            buffer = generate_stock_valuation_excel(warehouse_id)
-            response = HttpResponse(
-                buffer,
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        elif export_format == 'csv':
+            filename = f'valorisation_stock_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+            response = StreamingHttpResponse(
+                stream_stock_valuation_csv(warehouse_id, company),
+                content_type='text/csv; charset=utf-8'
             )
-            filename = f'valorisation_stock_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
             response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        else:
+            filename = f'valorisation_stock_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
+            response = FileResponse(
+                generate_stock_valuation_excel(warehouse_id, company),
+                as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE
+            )
 
         log_event(
             request=request,
@@ -2195,14 +2152,19 @@ def export_sales_report(request):
     """
     Export du rapport des ventes
     Query params:
-        - format: excel ou pdf (défaut: excel)
+        - format: excel, csv ou pdf (défaut: excel ; excel et csv produits en flux)
         - start_date: date de début (format YYYY-MM-DD)
         - end_date: date de fin (format YYYY-MM-DD)
+        - async: 1 pour générer le rapport en arrière-plan (réponse 202 + job)
     """
     export_format = request.GET.get('format', 'excel').lower()
     start_date_str = request.GET.get('start_date', None)
     end_date_str = request.GET.get('end_date', None)
 
+    if wants_async(request.GET):
+        return Response(*queue_report(request, 'sales', export_format,
+                                      {'start_date': start_date_str, 'end_date': end_date_str}))
+
     start_date = None
     end_date = None
 
@@ -2212,19 +2174,25 @@ def export_sales_report(request):
         if end_date_str:
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
 
+        company = getattr(request, 'company', None)
         if export_format == 'pdf':
-            buffer = generate_sales_report_pdf(start_date, end_date)
+            buffer = generate_sales_report_pdf(start_date, end_date, company=company)
             response = HttpResponse(buffer, content_type='application/pdf')
             filename = f'rapport_ventes_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
             response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        else:
-            buffer = generate_sales_report_excel(start_date, end_date)
-            response = HttpResponse(
-                buffer,
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        elif export_format == 'csv':
+            filename = f'rapport_ventes_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+            response = StreamingHttpResponse(
+                stream_sales_report_csv(start_date, end_date, company),
+                content_type='text/csv; charset=utf-8'
             )
-            filename = f'rapport_ventes_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
             response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        else:
+            filename = f'rapport_ventes_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
+            response = FileResponse(
+                generate_sales_report_excel(start_date, end_date, company=company),
+                as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE
+            )
 
         log_event(
             request=request,
@@ -2253,17 +2221,22 @@ def export_inventory_report(request):
     Export du rapport d'inventaire complet
     Query params:
         - format: excel ou pdf (défaut: excel)
+        - async: 1 pour générer le rapport en arrière-plan (réponse 202 + job)
     """
     export_format = request.GET.get('format', 'excel').lower()
+    company = getattr(request, 'company', None)
+
+    if wants_async(request.GET):
+        return Response(*queue_report(request, 'inventory', export_format, {}))
 
     try:
         if export_format == 'pdf':
-            buffer = generate_inventory_report_pdf()
+            buffer = generate_inventory_report_pdf(company)
             response = HttpResponse(buffer, content_type='application/pdf')
             filename = f'inventaire_complet_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
             response['Content-Disposition'] = f'attachment; filename="{filename}"'
         else:
-            buffer = generate_inventory_report_excel()
+            buffer = generate_inventory_report_excel(company)
             response = HttpResponse(
                 buffer,
                 content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
@@ -2285,6 +2258,39 @@ def export_inventory_report(request):
         return Response({'error': str(e)}, status=500)
 
 
+class ReportJobViewSet(TenantFilterMixin, viewsets.ModelViewSet):
+    """
+    Rapports différés : POST pour créer un job, GET pour suivre sa progression,
+    /download/ pour récupérer le fichier une fois terminé.
+    """
+    queryset = ReportJob.objects.all()
+    serializer_class = ReportJobSerializer
+    permission_classes = [IsAuthenticated]
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+
+    def perform_create(self, serializer):
+        serializer.save(company=getattr(self.request, 'company', None), created_by=self.request.user)
+
+    def perform_destroy(self, instance):
+        if instance.artifact:
+            instance.artifact.delete(save=False)
+        instance.delete()
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        from django.utils import timezone
+        job = self.get_object()
+        if job.statut != 'done' or not job.artifact:
+            return Response({'error': 'Rapport non disponible', 'statut': job.statut}, status=409)
+        if job.expires_at and job.expires_at < timezone.now():
+            return Response({'error': 'Rapport expiré'}, status=410)
+        try:
+            fileobj = job.artifact.open('rb')
+        except FileNotFoundError:
+            return Response({'error': 'Rapport expiré'}, status=410)
+        return FileResponse(fileobj, as_attachment=True, filename=job.filename)
+
+
 ####################
 # Codes de Prix API #
 ####################
@@ -8,9 +8,16 @@ from django.utils.decorators import method_decorator
 import pandas as pd
 import io
 import csv
-from decimal import Decimal
-from .models import Produit, Categorie, Fournisseur, Currency
+from .models import Categorie, Currency, ImportJob
+from .product_import import ProductImporter
+from .import_jobs import create_import_job, resume_import_job
+from .report_jobs import wants_async
+from .serializers import ImportJobSerializer
+from .mixins import TenantFilterMixin
 from django.db import transaction
+from django.http import FileResponse
+from rest_framework import viewsets
+from rest_framework.decorators import action
 
 
 class ImportPreviewView(APIView):
@@ -66,11 +73,20 @@ class ImportExecuteView(APIView):
             if not file:
                 return Response({'error': 'Aucun fichier fourni'}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Lire le fichier
+            # Mode job : import par blocs hors requête (run_import_worker)
+            if wants_async(request.POST) or wants_async(request.GET):
+                try:
+                    job = create_import_job(request, file, import_type)
+                except ValueError as e:
+                    return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+                serializer = ImportJobSerializer(job, context={'request': request})
+                return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+            # Lire le fichier (en texte : codes-barres et références gardés tels quels)
             if file.name.endswith('.csv'):
-                df = pd.read_csv(io.StringIO(file.read().decode('utf-8')))
+                df = pd.read_csv(io.StringIO(file.read().decode('utf-8')), dtype=str)
             elif file.name.endswith(('.xlsx', '.xls')):
-                df = pd.read_excel(file)
+                df = pd.read_excel(file, dtype=str)
             else:
                 return Response({'error': 'Format de fichier non supporté'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -79,7 +95,7 @@ class ImportExecuteView(APIView):
 
             # Traiter selon le type
             if import_type == 'products':
-                result = self.import_products(df, request.user)
+                result = self.import_products(df, request)
             elif import_type == 'categories':
                 result = self.import_categories(df, request.user)
             else:
@@ -90,118 +106,9 @@ class ImportExecuteView(APIView):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def import_products(self, df, user):
-        """Importer des produits"""
-        created = 0
-        updated = 0
-        skipped = 0
-        errors = []
-
-        with transaction.atomic():
-            for idx, row in df.iterrows():
-                try:
-                    # Vérifier les champs requis
-                    if not row.get('reference') or not str(row.get('reference')).strip():
-                        errors.append({'row': idx + 2, 'message': 'Référence manquante'})
-                        skipped += 1
-                        continue
-
-                    if not row.get('designation') or not str(row.get('designation')).strip():
-                        errors.append({'row': idx + 2, 'message': 'Désignation manquante'})
-                        skipped += 1
-                        continue
-
-                    if not row.get('prixU'):
-                        errors.append({'row': idx + 2, 'message': 'Prix manquant'})
-                        skipped += 1
-                        continue
-
-                    try:
-                        prix = Decimal(str(row['prixU']))
-                        if prix <= 0:
-                            raise ValueError('Le prix doit être positif')
-                    except (ValueError, Exception) as e:
-                        errors.append({'row': idx + 2, 'message': f'Prix invalide: {str(e)}'})
-                        skipped += 1
-                        continue
-
-                    # Préparer les données
-                    data = {
-                        'reference': str(row['reference']).strip(),
-                        'designation': str(row['designation']).strip(),
-                        'prixU': prix,
-                    }
-
-                    # Champs optionnels
-                    if row.get('code_barre'):
-                        data['code_barre'] = str(row['code_barre']).strip()
-
-                    if row.get('description'):
-                        data['description'] = str(row['description']).strip()
-
-                    if row.get('quantite'):
-                        try:
-                            data['quantite'] = int(float(row['quantite']))
-                        except:
-                            pass
-
-                    if row.get('stock_min'):
-                        try:
-                            data['stock_min'] = int(float(row['stock_min']))
-                        except:
-                            pass
-
-                    if row.get('stock_max'):
-                        try:
-                            data['stock_max'] = int(float(row['stock_max']))
-                        except:
-                            pass
-
-                    if row.get('unite_mesure'):
-                        data['unite_mesure'] = str(row['unite_mesure']).strip()
-
-                    # Gérer la catégorie
-                    if row.get('categorie'):
-                        cat_name = str(row['categorie']).strip()
-                        try:
-                            categorie = Categorie.objects.get(nom__iexact=cat_name)
-                            data['categorie'] = categorie
-                        except Categorie.DoesNotExist:
-                            errors.append({'row': idx + 2, 'message': f'Catégorie "{cat_name}" introuvable'})
-
-                    # Gérer le fournisseur
-                    if row.get('fournisseur'):
-                        fournisseur_name = str(row['fournisseur']).strip()
-                        try:
-                            fournisseur = Fournisseur.objects.get(libelle__iexact=fournisseur_name)
-                            data['fournisseur'] = fournisseur
-                        except Fournisseur.DoesNotExist:
-                            errors.append({'row': idx + 2, 'message': f'Fournisseur "{fournisseur_name}" introuvable'})
-
-                    # Créer ou mettre à jour le produit
-                    produit, is_created = Produit.objects.update_or_create(
-                        reference=data['reference'],
-                        defaults=data
-                    )
-
-                    if is_created:
-                        created += 1
-                    else:
-                        updated += 1
-
-                except Exception as e:
-                    errors.append({'row': idx + 2, 'message': str(e)})
-                    skipped += 1
-
-        return {
-            'stats': {
-                'created': created,
-                'updated': updated,
-                'skipped': skipped,
-                'total': len(df)
-            },
-            'errors': errors
-        }
+    def import_products(self, df, request):
+        """Importer des produits (validation vectorisée, écriture par lots)"""
+        return ProductImporter(getattr(request, 'company', None)).process(df).finish()
 
     def import_categories(self, df, user):
         """Importer des catégories"""
@@ -277,6 +184,52 @@ class ImportExecuteView(APIView):
         }
 
 
+class ImportJobViewSet(TenantFilterMixin, viewsets.ModelViewSet):
+    """
+    Imports par blocs : POST (multipart, champ source) pour créer un job,
+    GET pour suivre la progression, /errors/ pour le fichier d'erreurs,
+    /resume/ pour relancer un job en échec depuis son dernier bloc validé.
+    """
+    queryset = ImportJob.objects.all()
+    serializer_class = ImportJobSerializer
+    permission_classes = [IsAuthenticated]
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+
+    def perform_create(self, serializer):
+        source = serializer.validated_data['source']
+        serializer.save(
+            company=getattr(self.request, 'company', None),
+            created_by=self.request.user,
+            original_name=source.name[:200],
+        )
+
+    def perform_destroy(self, instance):
+        if instance.statut == 'running':
+            from rest_framework.exceptions import ValidationError
+            raise ValidationError({'error': 'Import en cours'})
+        if instance.source:
+            instance.source.delete(save=False)
+        if instance.errors_file:
+            instance.errors_file.delete(save=False)
+        instance.delete()
+
+    @action(detail=True, methods=['get'])
+    def errors(self, request, pk=None):
+        job = self.get_object()
+        if not job.errors_file:
+            return Response({'error': 'Aucun fichier d\'erreurs'}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(job.errors_file.open('rb'), as_attachment=True,
+                            filename=f'erreurs_import_{job.pk}.csv', content_type='text/csv; charset=utf-8')
+
+    @action(detail=True, methods=['post'])
+    def resume(self, request, pk=None):
+        job = self.get_object()
+        if not resume_import_job(job):
+            return Response({'error': 'Seul un import en échec peut être repris'}, status=status.HTTP_400_BAD_REQUEST)
+        job.refresh_from_db()
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
 class ImportTemplateView(APIView):
     """
     Télécharger un template d'import
@@ -1,6 +1,7 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import user_passes_test
 from API.models import AuditLog
+from API.pagination import keyset_page, parse_page_size
 
 
 def staff_required(view):
@@ -8,5 +9,12 @@ def staff_required(view):
 
 @staff_required
 def audit_list(request):
-    logs = AuditLog.objects.select_related('actor').all()[:500]
-    return render(request, 'frontoffice/audit_list.html', {'logs': logs})
+    # Pages de 500 lignes suivies par curseur (created_at, id), sans OFFSET
+    queryset = AuditLog.objects.select_related('actor')
+    size = parse_page_size(request.GET.get('page_size'), 500)
+    try:
+        logs, next_cursor = keyset_page(queryset, 'created_at', request.GET.get('cursor'), size)
+    except ValueError:
+        # Curseur invalide : première page
+        logs, next_cursor = keyset_page(queryset, 'created_at', None, size)
+    return render(request, 'frontoffice/audit_list.html', {'logs': logs, 'next_cursor': next_cursor})
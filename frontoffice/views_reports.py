@@ -1,7 +1,7 @@
 """
 Vues simplifiées pour l'export de rapports
 """
-from django.http import HttpResponse
+from django.http import HttpResponse, FileResponse, StreamingHttpResponse, JsonResponse
 from django.contrib.auth.decorators import login_required
 from datetime import datetime
 from API.reports import (
@@ -10,9 +10,18 @@ from API.reports import (
     generate_sales_report_excel,
     generate_sales_report_pdf,
     generate_inventory_report_excel,
-    generate_inventory_report_pdf
+    generate_inventory_report_pdf,
+    stream_stock_valuation_csv,
+    stream_sales_report_csv,
 )
 from API.audit import log_event
+from API.report_jobs import queue_report, wants_async
+
+
+def _queue_report(request, report_type, export_format, params):
+    """?async=1 : job traité par run_report_worker (202), comme l'API"""
+    data, status = queue_report(request, report_type, export_format, params)
+    return JsonResponse(data, status=status)
 
 
 @login_required
@@ -20,16 +29,27 @@ def export_stock_valuation(request):
     """Export du rapport de valorisation du stock"""
     export_format = request.GET.get('format', 'excel').lower()
     warehouse_id = request.GET.get('warehouse', None)
+    company = getattr(request, 'company', None)
+
+    if wants_async(request.GET):
+        return _queue_report(request, 'stock_valuation', export_format, {'warehouse': warehouse_id})
 
     try:
         if export_format == 'pdf':
-            buffer = generate_stock_valuation_pdf(warehouse_id)
+            buffer = generate_stock_valuation_pdf(warehouse_id, company)
             response = HttpResponse(buffer, content_type='application/pdf')
             filename = f'valorisation_stock_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+        elif export_format == 'csv':
+            # CSV envoyé en flux
+            response = StreamingHttpResponse(
+                stream_stock_valuation_csv(warehouse_id, company),
+                content_type='text/csv; charset=utf-8'
+            )
+            filename = f'valorisation_stock_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
         else:
-            buffer = generate_stock_valuation_excel(warehouse_id)
-            response = HttpResponse(
-                buffer,
+            # Classeur write-only dans un fichier temporaire, envoyé par blocs
+            response = FileResponse(
+                generate_stock_valuation_excel(warehouse_id, company),
                 content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
             )
             filename = f'valorisation_stock_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
@@ -56,6 +76,10 @@ def export_sales_report(request):
     start_date_str = request.GET.get('start_date', None)
     end_date_str = request.GET.get('end_date', None)
 
+    if wants_async(request.GET):
+        return _queue_report(request, 'sales', export_format,
+                             {'start_date': start_date_str, 'end_date': end_date_str})
+
     start_date = None
     end_date = None
 
@@ -65,14 +89,22 @@ def export_sales_report(request):
         if end_date_str:
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
 
+        company = getattr(request, 'company', None)
         if export_format == 'pdf':
-            buffer = generate_sales_report_pdf(start_date, end_date)
+            buffer = generate_sales_report_pdf(start_date, end_date, company=company)
             response = HttpResponse(buffer, content_type='application/pdf')
             filename = f'rapport_ventes_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+        elif export_format == 'csv':
+            # CSV envoyé en flux
+            response = StreamingHttpResponse(
+                stream_sales_report_csv(start_date, end_date, company),
+                content_type='text/csv; charset=utf-8'
+            )
+            filename = f'rapport_ventes_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
         else:
-            buffer = generate_sales_report_excel(start_date, end_date)
-            response = HttpResponse(
-                buffer,
+            # Classeur write-only dans un fichier temporaire, envoyé par blocs
+            response = FileResponse(
+                generate_sales_report_excel(start_date, end_date, company=company),
                 content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
             )
             filename = f'rapport_ventes_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
@@ -101,14 +133,18 @@ def export_sales_report(request):
 def export_inventory_report(request):
     """Export du rapport d'inventaire complet"""
     export_format = request.GET.get('format', 'excel').lower()
+    company = getattr(request, 'company', None)
+
+    if wants_async(request.GET):
+        return _queue_report(request, 'inventory', export_format, {})
 
     try:
         if export_format == 'pdf':
-            buffer = generate_inventory_report_pdf()
+            buffer = generate_inventory_report_pdf(company)
             response = HttpResponse(buffer, content_type='application/pdf')
             filename = f'inventaire_complet_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
         else:
-            buffer = generate_inventory_report_excel()
+            buffer = generate_inventory_report_excel(company)
             response = HttpResponse(
                 buffer,
                 content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
@@ -174,7 +174,8 @@
 
     // Charger les dernières ventes
     function loadRecentSales() {
-        $.get('/API/ventes/?ordering=-date_vente&limit=5', function(data) {
+        $.get('/API/ventes/?page_size=5', function(page) {
+            const data = page.results || page;
             const $container = $('#caisse_recent_sales');
             $container.empty();
             if (data && data.length > 0) {
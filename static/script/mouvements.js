@@ -80,7 +80,11 @@
 
     console.log('[Mouvements.js] Loading journal with params:', params);
 
-    return $.get(apiBase + '/mouvements/', params).then(function(rows){
+    // Liste paginée côté API : les 500 mouvements les plus récents
+    params.page_size = 500;
+
+    return $.get(apiBase + '/mouvements/', params).then(function(data){
+      const rows = data.results || data;
       console.log('[Mouvements.js] Loaded rows:', rows.length);
 
       let totalIn = 0, totalOut = 0;